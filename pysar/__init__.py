@@ -17,6 +17,7 @@ import multilook
 import view
 
 import add
+#import add_overviews
 import asc_desc
 import baseline_error
 import baseline_trop
@@ -53,6 +54,7 @@ import reconstruct_igrams
 #import remove_plane
 #import save_gmt
 #import save_kml
+#import save_mbtiles
 #import save_unw
 import save_unavco
 import seed_data
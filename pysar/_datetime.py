@@ -22,6 +22,8 @@ import h5py
 import numpy as np
 import matplotlib.dates as mdates
 
+import pysar._readfile as readfile
+
 
 ################################################################
 def yyyymmdd2years(dates):
@@ -93,10 +95,8 @@ def igram_date_list(igramFile):
     #print 'reading date list from '+k[0]
   
     dateList = []
-    ifgramList = h5file[k[0]].keys()
-    for ifgram in  ifgramList:
-        dates = h5file[k[0]][ifgram].attrs['DATE12'].split('-')
-        dates = yyyymmdd(dates)
+    for date12 in readfile.read_epoch_attribute(h5file, k[0], 'DATE12'):
+        dates = yyyymmdd(date12.split('-'))
         if not dates[0] in dateList: dateList.append(dates[0])
         if not dates[1] in dateList: dateList.append(dates[1])
     dateList.sort()
@@ -4,6 +4,7 @@
 # Copyright(c) 2016, Yunjun Zhang                          #
 # Author:  Yunjun Zhang                                    #
 ############################################################
+# Yunjun, Feb 2017: add get_triangles() and closure_matrix() with date-indexed adjacency
 # Recommended Usage:
 #   import pysar._network as pnet
 #
@@ -82,9 +83,8 @@ def read_igram_pairs(igramFile):
     dateList6 = ptime.yymmdd(dateList)
 
     pairs = []
-    igramList=h5file[k[0]].keys()
-    for igram in igramList:
-        date12 = h5file[k[0]][igram].attrs['DATE12'].split('-')
+    for date12 in readfile.read_epoch_attribute(h5file, k[0], 'DATE12'):
+        date12 = date12.split('-')
         pairs.append([dateList6.index(date12[0]),dateList6.index(date12[1])])
     h5file.close()
 
@@ -161,10 +161,7 @@ def get_date12_list(File):
     if ext == '.h5':
         k = readfile.read_attribute(File)['FILE_TYPE']
         h5 = h5py.File(File, 'r')
-        epochList = sorted(h5[k].keys())
-        for epoch in epochList:
-            date12 = h5[k][epoch].attrs['DATE12']
-            date12_list.append(date12)
+        date12_list = readfile.read_epoch_attribute(h5, k, 'DATE12')
         h5.close()
     else:
         date12_list = list(np.loadtxt(File, dtype=str))
@@ -179,10 +176,10 @@ def igram_perp_baseline_list(File):
     p_baseline_list = []
     k = readfile.read_attribute(File)['FILE_TYPE']
     h5 = h5py.File(File, 'r')
-    epochList = sorted(h5[k].keys())
-    for epoch in epochList:
-        p_baseline = (float(h5[k][epoch].attrs['P_BASELINE_BOTTOM_HDR'])+\
-                      float(h5[k][epoch].attrs['P_BASELINE_TOP_HDR']))/2
+    bottomList = readfile.read_epoch_attribute(h5, k, 'P_BASELINE_BOTTOM_HDR')
+    topList = readfile.read_epoch_attribute(h5, k, 'P_BASELINE_TOP_HDR')
+    for i in range(len(topList)):
+        p_baseline = (float(bottomList[i])+float(topList[i]))/2
         p_baseline_list.append(p_baseline)
     h5.close()
     return p_baseline_list
@@ -231,6 +228,52 @@ def threshold_temporal_baseline(igramIdxList,tempBaseList,tempBaseMax=365,season
     return igramIdxListOut
 
 
+def get_triangles(date12_list):
+    '''Find all triangles (closed loops of 3 pairs) of network, through date-indexed adjacency of pairs
+    Inputs:
+        date12_list - list of string, pairs in YYMMDD-YYMMDD or YYYYMMDD-YYYYMMDD format, with date1 < date2
+    Output:
+        triangles - 2D np.array of int in size of (numTriangle, 3), index of pair12, pair13 and pair23
+                    in date12_list of each triangle with date1 < date2 < date3, ordered by pair12
+    Example:
+        triangles = get_triangles(['070106-070310','070106-070512','070310-070512'])
+        C = closure_matrix(triangles, 3)
+    '''
+    pairList = [tuple(ptime.yyyymmdd(date12.split('-'))) for date12 in date12_list]
+    # date1 --> list of (date2, pair index), in order of input list
+    adjacency = dict()
+    pairIdx = dict()
+    for i in range(len(pairList)):
+        date1, date2 = pairList[i]
+        adjacency.setdefault(date1, []).append((date2, i))
+        pairIdx.setdefault(pairList[i], i)
+
+    triangles = []
+    for i12 in range(len(pairList)):
+        date1, date2 = pairList[i12]
+        for date3, i23 in adjacency.get(date2, []):
+            i13 = pairIdx.get((date1, date3), None)
+            if i13 is not None:
+                triangles.append([i12, i13, i23])
+    return np.array(triangles, dtype=int).reshape(-1,3)
+
+
+def closure_matrix(triangles, pair_num):
+    '''Triangle-pair matrix C, closure phase of triangles = C * phase of pairs = pair12 + pair23 - pair13
+    Inputs:
+        triangles - 2D np.array of int in size of (numTriangle, 3), from get_triangles()
+        pair_num  - int, number of pairs
+    Output:
+        C - 2D np.array in size of (numTriangle, pair_num)
+    '''
+    C = np.zeros((triangles.shape[0], pair_num))
+    idx = np.arange(triangles.shape[0])
+    C[idx, triangles[:,0]] = 1
+    C[idx, triangles[:,1]] = -1
+    C[idx, triangles[:,2]] = 1
+    return C
+
+
 def pair_sort(pairs):
     for idx in range(len(pairs)):
         if pairs[idx][0] > pairs[idx][1]:
@@ -0,0 +1,191 @@
+############################################################
+# Program is part of PySAR v1.0                            #
+# Copyright(c) 2017, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+# Batch extraction of point time-series / values
+# Yunjun, Feb 2017: add read_point_data(), read_point_timeseries()
+#
+# Recommend usage:
+#   import pysar._point as pt
+#
+
+
+import os
+import warnings
+
+import numpy as np
+
+import pysar._readfile as readfile
+import pysar._datetime as ptime
+
+
+##################################################################################
+def nearest_index(coord, coord_first, coord_step, num):
+    '''Index of nearest grid point of coordinates, for grid of coord_first + i*coord_step, i in [0, num)
+    Inputs:
+        coord       - float or np.array, coordinates, i.e. latitude of GPS stations
+        coord_first - float, coordinate of the first grid point, i.e. Y_FIRST
+        coord_step  - float, grid step, i.e. Y_STEP
+        num         - int, number of grid points, i.e. FILE_LENGTH
+    Output:
+        idx  - np.array of int, nearest index
+        flag - np.array of bool, True if coordinate is within one step of the nearest grid point
+    '''
+    coord = np.array(coord, np.float64)
+    idx = np.rint((coord - coord_first) / coord_step)
+    idx = np.clip(np.nan_to_num(idx), 0, num-1).astype(int)
+    flag = np.abs(coord - (coord_first + idx*coord_step)) <= np.abs(coord_step)
+    return idx, flag
+
+
+def coord_geo2yx(lat, lon, atr):
+    '''Convert latitude/longitude into row/column (nearest pixel) of geocoded file, vectorized
+    Example:
+        y, x = coord_geo2yx(gpsLat, gpsLon, atr)
+    '''
+    if 'X_FIRST' not in atr.keys():
+        raise ValueError('Support geocoded file only!')
+    y = np.rint((np.array(lat, np.float64) - float(atr['Y_FIRST'])) / float(atr['Y_STEP'])).astype(int)
+    x = np.rint((np.array(lon, np.float64) - float(atr['X_FIRST'])) / float(atr['X_STEP'])).astype(int)
+    return y, x
+
+
+def point_window(y, x, radius=0):
+    '''Window of points, as range of rows/columns [start, end] (inclusive)
+    Inputs:
+        y/x    - int / list / np.array of center pixel, or
+                 2D np.array in size of (num_point, 2), range of rows/columns of each point
+        radius - int, half size of window around center pixel
+    Output:
+        ysub/xsub - 2D np.array of int in size of (num_point, 2)
+    '''
+    def window(v):
+        v = np.array(v, dtype=int)
+        if v.ndim == 2:
+            return v
+        v = v.reshape(-1, 1)
+        return np.hstack((v-radius, v+radius))
+    return window(y), window(x)
+
+
+##################################################################################
+def read_point_data(File, y, x, radius=0, epochList=None, ref_date=None):
+    '''Read data of points within window for all epochs, with each epoch read once
+    The area covering all points is read for each epoch, and pixels of all points are gathered from it
+    with fancy indexing, thus time is proportional to number of epochs, not number of points.
+    Inputs:
+        File      - string, path of file, i.e. timeseries.h5, velocity.h5, geo_velocity.h5
+        y/x       - int / list / np.array, pixel of points, or range of rows/columns, see point_window()
+        radius    - int, half size of window around pixel
+        epochList - list of string, epochs to read, all epochs by default
+        ref_date  - string, reference date, i.e. 20070107, data of this date is subtracted
+    Output:
+        data - 3D np.array in float32 in size of (num_point, num_epoch, num_window_pixel),
+               NaN for pixels out of the window or the file
+    Example:
+        data = read_point_data('timeseries.h5', [300,400], [500,600], radius=2)
+        data = read_point_data('velocity.h5', ysub, xsub)[:,0,:]
+    '''
+    atr = readfile.read_attribute(File)
+    length = int(atr['FILE_LENGTH'])
+    width = int(atr['WIDTH'])
+    if epochList is None:
+        epochList = ['']
+        if os.path.splitext(File)[1] in ['.h5','.he5']:
+            epochList = readfile.get_reader(File).epochList or ['']
+
+    # Row/column of pixels of all points, in size of (num_point, num_window_pixel)
+    ysub, xsub = point_window(y, x, radius)
+    num_point = ysub.shape[0]
+    win_y = np.max(ysub[:,1] - ysub[:,0]) + 1
+    win_x = np.max(xsub[:,1] - xsub[:,0]) + 1
+    yy = ysub[:,0].reshape(-1,1,1) + np.arange(win_y).reshape(1,-1,1)
+    xx = xsub[:,0].reshape(-1,1,1) + np.arange(win_x).reshape(1,1,-1)
+    valid = (yy <= ysub[:,1].reshape(-1,1,1)) * (yy >= 0) * (yy < length) *\
+            (xx <= xsub[:,1].reshape(-1,1,1)) * (xx >= 0) * (xx < width)
+    yy = np.broadcast_to(yy, valid.shape)[valid]
+    xx = np.broadcast_to(xx, valid.shape)[valid]
+    valid = valid.reshape(num_point, -1)
+
+    data = np.zeros((num_point, len(epochList), valid.shape[1]), np.float32)
+    data[:] = np.nan
+    if yy.size == 0:
+        return data
+    box = (np.min(xx), np.min(yy), np.max(xx)+1, np.max(yy)+1)
+    yy -= box[1]
+    xx -= box[0]
+
+    for i in range(len(epochList)):
+        data[:,i,:][valid] = readfile.read(File, box, epochList[i])[0][yy, xx]
+
+    if ref_date:
+        if ref_date in epochList:
+            data -= data[:, [epochList.index(ref_date)], :]
+        else:
+            ref_data = np.zeros((num_point, 1, valid.shape[1]), np.float32)
+            ref_data[:] = np.nan
+            ref_data[:,0,:][valid] = readfile.read(File, box, ref_date)[0][yy, xx]
+            data -= ref_data
+    return data
+
+
+def point_statistics(data):
+    '''Mean and standard deviation of data within window of each point, ignoring NaN
+    Input : data - np.array in size of (..., num_window_pixel), i.e. from read_point_data()
+    Output: data_mean, data_std - np.array in size of (...)
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        data_mean = np.nanmean(data, axis=-1)
+        data_std = np.nanstd(data, axis=-1)
+    return data_mean, data_std
+
+
+def linear_velocity(dis, dateList):
+    '''Linear velocity of time-series of points, from least squares for all points at once
+    Inputs:
+        dis      - 2D np.array in size of (num_point, num_date), displacement
+        dateList - list of string, dates in YYYYMMDD
+    Output:
+        vel     - 1D np.array in size of (num_point), velocity in unit of displacement per year
+        vel_std - 1D np.array in size of (num_point), standard error of velocity, same as
+                  stderr of scipy.stats.linregress()
+    '''
+    dis = np.array(dis, np.float64).reshape(-1, len(dateList))
+    t = np.array(ptime.date_list2vector(dateList)[1])
+    t -= np.mean(t)
+    vel = np.dot(dis, t) / np.sum(t**2)
+    vel_std = np.zeros(vel.shape)
+    vel_std[:] = np.nan
+    if len(dateList) > 2:
+        residual = dis - np.mean(dis, axis=1).reshape(-1,1) - vel.reshape(-1,1)*t
+        vel_std = np.sqrt(np.sum(residual**2, axis=1) / (len(dateList)-2) / np.sum(t**2))
+    return vel, vel_std
+
+
+def read_point_timeseries(File, y, x, radius=0, epochList=None, ref_date=None):
+    '''Read time-series of points, averaged within window
+    Inputs: see read_point_data()
+    Output:
+        dis_mean - 2D np.array in size of (num_point, num_date), mean displacement within window
+        dis_std  - 2D np.array in size of (num_point, num_date), standard deviation within window
+        vel      - 1D np.array in size of (num_point), linear velocity of dis_mean per year
+        vel_std  - 1D np.array in size of (num_point), standard error of velocity
+    Example:
+        dis, dis_std, vel, vel_std = read_point_timeseries('timeseries.h5', y, x, radius=3)
+    '''
+    if epochList is None:
+        epochList = readfile.get_reader(File).epochList
+    data = read_point_data(File, y, x, radius, epochList, ref_date)
+    dis_mean, dis_std = point_statistics(data)
+    vel, vel_std = linear_velocity(dis_mean, epochList)
+    return dis_mean, dis_std, vel, vel_std
+
+
+def read_point_timeseries_lalo(File, lat, lon, radius=0, epochList=None, ref_date=None):
+    '''Read time-series of points in latitude/longitude from geocoded file, see read_point_timeseries()'''
+    atr = readfile.read_attribute(File)
+    y, x = coord_geo2yx(lat, lon, atr)
+    return read_point_timeseries(File, y, x, radius, epochList, ref_date)
+
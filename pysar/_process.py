@@ -0,0 +1,250 @@
+############################################################
+# Program is part of PySAR v1.0                            #
+# Copyright(c) 2017, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+# Block-wise processing engine of PySAR files
+# Yunjun, Feb 2017: add map_file()
+#
+# Recommend usage:
+#   import pysar._process as process
+#
+
+
+import os
+import time
+
+import h5py
+import numpy as np
+from joblib import Parallel, delayed
+
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+import pysar._pysar_utilities as ut
+from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file
+
+
+##################################################################################
+def split_blocks(box, num_byte, max_memory=1.0, row_step_multiple=1):
+    '''Split box into row blocks of at most max_memory (in GB) each
+    Inputs:
+        box      - 4-tuple of int, (x0, y0, x1, y1) of area to process
+        num_byte - int, memory in byte of each pixel held in one block, for input, output and
+                   intermediate matrices, i.e. 3*4 for float32 input/output plus 1 float32 layer
+        row_step_multiple - int, number of rows of each block is a multiple of it,
+                   i.e. number of looks in azimuth direction for multilooking
+    Output: list of 4-tuple of int
+    '''
+    width = box[2] - box[0]
+    length = box[3] - box[1]
+    row_step = int(max_memory * 1024**3 / (float(width) * num_byte))
+    row_step = max(row_step / row_step_multiple, 1) * row_step_multiple
+    row_step = min(row_step, length)
+    return [(box[0], y0, box[2], min(y0+row_step, box[3])) for y0 in range(box[1], box[3], row_step)]
+
+
+def update_raw_attribute(raw_atr, atr, out_atr):
+    '''Attributes to write into output file: raw attributes as saved in input file, with only the
+    changes from atr to out_atr applied, i.e. made by atr_func of map_file(), so that the original
+    values of input file (PROCESSOR, ...) are kept.
+    Inputs:
+        raw_atr - dict, attributes saved in input file, from readfile.read_h5_attribute(raw=True)
+        atr     - dict, attributes of input file, from readfile.read_attribute()
+        out_atr - dict, attributes of output file, updated from atr
+    Output:
+        dict, attributes to write
+    '''
+    out = dict(raw_atr)
+    for key, value in out_atr.iteritems():
+        if key not in atr.keys() or str(atr[key]) != str(value):
+            out[key] = value
+    for key in atr.keys():
+        if key not in out_atr.keys():
+            out.pop(key, None)
+    return out
+
+
+def map_block(File, epoch, box, func, args=()):
+    '''Read one block of epoch from File and apply func to it, to be run in worker processes.'''
+    data = readfile.read(File, box, epoch)[0]
+    return np.asarray(func(data, epoch, box, *args))
+
+
+def map_file(File, func, outFile, args=(), atr_func=None, epochList=None, box=None, by_block=False,
+             num_layer=3, max_memory=1.0, row_step_multiple=1, parallel=1, print_msg=True):
+    '''Apply func to each epoch (or each block of rows of each epoch) of File, and write result to outFile
+    in the same file type and layout, block by block with the storage policy of writefile.
+    Inputs:
+        File     - string, input file, PySAR HDF5 file (stack/cube layout) or other formats supported by
+                   readfile.read(); non-HDF5 output is held in memory and written by writefile.write()
+        func     - function, func(data, epoch, box, *args) returns 2D np.array of one epoch/block, with
+                   data  - 2D np.array of epoch within box
+                   epoch - string, epoch name, '' for single dataset file
+                   box   - 4-tuple of int, (x0, y0, x1, y1) of data in the input file
+                   func has to be defined at the module level for parallel processing.
+        outFile  - string, output file name
+        args     - tuple, extra arguments of func
+        atr_func - function, atr_func(atr) returns attributes of output file, from attributes of input
+                   file (of each epoch for multi_group file), i.e. with size changed by multilooking.
+                   Output size is read from FILE_LENGTH/WIDTH of returned attributes.
+        epochList - list of string, epochs to process, all epochs by default
+        box      - 4-tuple of int, area of input file to read, the whole area by default
+        by_block - bool, process epoch block by block of rows within max_memory, for pixel-wise func, or func
+                   with output rows from input rows only (i.e. multilooking with row_step_multiple=lks_y)
+        num_layer - int, number of 2D matrices in size of block held in memory by func, for block size
+        max_memory - float, maximum memory in GB for blocks in process at the same time
+        row_step_multiple - int, number of rows of each block is a multiple of it
+        parallel - int, number of processes
+    Output:
+        outFile - string
+    Example:
+        def rewrap(data, epoch, box):
+            return data - np.round(data/(2*np.pi)) * 2*np.pi
+        process.map_file('unwrapIfgram.h5', rewrap, 'rewrapIfgram.h5', by_block=True, parallel=4)
+        process.map_file('timeseries.h5', multilook_data, 'timeseries_mli.h5', args=(4,4),\
+                         atr_func=lambda atr: multilook_attribute(atr,4,4), by_block=True, row_step_multiple=4)
+    '''
+    atr = readfile.read_attribute(File)
+    k = atr['FILE_TYPE']
+    width = int(atr['WIDTH'])
+    length = int(atr['FILE_LENGTH'])
+    if not box:
+        box = (0, 0, width, length)
+    if atr_func is None:
+        atr_func = lambda atr: atr
+
+    # Input file structure
+    reader = None
+    if os.path.splitext(File)[1] in ['.h5','.he5']:
+        reader = readfile.get_reader(File)
+    if reader and k in multi_group_hdf5_file+multi_dataset_hdf5_file:
+        if epochList is None:
+            epochList = reader.epochList
+        cube = reader.cube
+    else:
+        epochList = ['']
+        cube = False
+
+    # Tasks: (epoch, box) of each block
+    if by_block:
+        item_size = 8
+        if reader:
+            item_size = max(reader.dataset(epochList[0])[0].dtype.itemsize, 4)
+            reader.close()
+        num_byte = num_layer * item_size
+        # blocks of all parallel processes and blocks waiting to be written
+        box_list = split_blocks(box, num_byte, max_memory/(2*max(parallel,1)), row_step_multiple)
+    else:
+        box_list = [box]
+    taskList = [(epoch, b) for epoch in epochList for b in box_list]
+    if print_msg:
+        print 'number of epochs: %d, blocks per epoch: %d' % (len(epochList), len(box_list))
+
+    # Output file, write into temporary file if overwriting input file
+    outFileTmp = outFile
+    if os.path.abspath(outFile) == os.path.abspath(File):
+        outFileTmp = os.path.splitext(outFile)[0]+'_tmp'+os.path.splitext(outFile)[1]
+    if print_msg:
+        print 'writing >>> '+outFile
+    if reader:
+        h5out = h5py.File(outFileTmp, 'w')
+        group = h5out.create_group(k)
+        if k not in multi_group_hdf5_file:
+            out_atr = update_raw_attribute(reader.attribute(raw=True), atr, atr_func(dict(atr)))
+            for key, value in out_atr.iteritems():
+                group.attrs[key] = value
+    outAtrDict = dict()
+    dsetDict = dict()
+    rowDict = dict()
+    dataList = []
+
+    def write_block(epoch, data):
+        '''Write one block into output, in the order of tasks'''
+        if epoch not in outAtrDict.keys():
+            if reader and k in multi_group_hdf5_file:
+                outAtrDict[epoch] = atr_func(reader.attribute(epoch))
+            else:
+                outAtrDict[epoch] = atr_func(dict(atr))
+            rowDict[epoch] = 0
+        out_atr = outAtrDict[epoch]
+        out_shape = (int(out_atr['FILE_LENGTH']), int(out_atr['WIDTH']))
+        if data.ndim == 1:
+            data = data.reshape(-1, out_shape[1])
+
+        if not reader:
+            dataList.append(data)
+            return
+        if epoch not in dsetDict.keys():
+            if cube:
+                if 'cube' not in dsetDict.keys():
+                    epochAtrList = None
+                    if k in multi_group_hdf5_file:
+                        epochAtrList = [update_raw_attribute(reader.attribute(e, raw=True), reader.attribute(e),\
+                                                             atr_func(reader.attribute(e))) for e in epochList]
+                        # common attributes: same value for all epochs
+                        for key, value in epochAtrList[0].iteritems():
+                            if all([str(i.get(key)) == str(value) for i in epochAtrList]):
+                                group.attrs[key] = value
+                    dsetDict['cube'] = writefile.create_cube(group, k, epochList, out_shape, data.dtype, epochAtrList)
+                dsetDict[epoch] = dsetDict['cube']
+            elif k in multi_group_hdf5_file:
+                gg = group.create_group(epoch)
+                dsetDict[epoch] = writefile.create_dataset(gg, epoch, shape=out_shape, dtype=data.dtype)
+                raw_atr = update_raw_attribute(reader.attribute(epoch, raw=True), reader.attribute(epoch), out_atr)
+                for key, value in raw_atr.iteritems():
+                    gg.attrs[key] = value
+            elif k in multi_dataset_hdf5_file:
+                dsetDict[epoch] = writefile.create_dataset(group, epoch, shape=out_shape, dtype=data.dtype)
+            else:
+                dsetDict[epoch] = writefile.create_dataset(group, k, shape=out_shape, dtype=data.dtype)
+
+        y0 = rowDict[epoch]
+        y1 = y0 + data.shape[0]
+        if cube:
+            dsetDict[epoch][epochList.index(epoch), y0:y1, :] = data
+        else:
+            dsetDict[epoch][y0:y1, :] = data
+        rowDict[epoch] = y1
+
+    # Loop - process in batches of tasks in parallel, write in order in the main process
+    parallel = max(int(parallel), 1)
+    if parallel > 1 and print_msg:
+        print 'parallel processing using %d cores ...' % (parallel)
+    step = parallel
+    start_time = time.time()
+    with Parallel(n_jobs=parallel) as pool:
+        for i in range(0, len(taskList), step):
+            subList = taskList[i:i+step]
+            if parallel > 1:
+                outList = pool(delayed(map_block)(File, epoch, b, func, args) for epoch, b in subList)
+            else:
+                outList = [map_block(File, epoch, b, func, args) for epoch, b in subList]
+            for j in range(len(subList)):
+                write_block(subList[j][0], outList[j])
+            del outList
+            if print_msg:
+                ut.print_progress(i+len(subList), len(taskList), prefix='processing:', suffix=subList[-1][0],\
+                                  elapsed_time=time.time()-start_time)
+
+    # Write
+    if reader:
+        # copy other groups in input file, i.e. mask in old interferograms file, if size is unchanged
+        if outAtrDict:
+            out_atr = outAtrDict.values()[0]
+        else:
+            out_atr = atr_func(dict(atr))
+        if (out_atr['FILE_LENGTH'], out_atr['WIDTH']) == (atr['FILE_LENGTH'], atr['WIDTH']):
+            h5 = h5py.File(File, 'r')
+            for key in h5.keys():
+                if key != k:
+                    h5.copy(key, h5out)
+            h5.close()
+        h5out.close()
+        if outFileTmp != outFile:
+            readfile.get_reader(File).close()
+            os.rename(outFileTmp, outFile)
+    else:
+        data = np.vstack(dataList)
+        writefile.write(data, outAtrDict[''], outFile)
+    return outFile
+
@@ -42,6 +42,9 @@
 # Yunjun, Jul 2016: add get_file_list() to support multiple files input
 # Yunjun, Aug 2016: add spatial_average()
 # Yunjun, Jan 2017: add temporal_average(), nonzero_mask()
+# Yunjun, Feb 2017: add StackStatistics and stack_statistics() for one pass per-pixel statistics
+#                   add look up table cache and its inverse index for glob2radar() and radar2glob()
+#                   add closure_statistics(), compute closure phase block by block on demand
 
 
 import os
@@ -54,6 +57,7 @@ import warnings
 
 import numpy as np
 import h5py
+from joblib import Parallel, delayed
 
 import pysar._readfile as readfile
 import pysar._writefile as writefile
@@ -162,28 +166,128 @@ def get_file_stack(File, maskFile=None):
     return stack
 
 
+class StackStatistics(object):
+    '''Per-pixel statistics of a stack of 2D matrices (interferograms, coherence, time series ...),
+    folded epoch by epoch, so that they are calculated while loading the data, or in one read pass
+    shared by all of them. Statistics are kept in compact data types:
+        nonzero - bool,    True for pixels non-zero (and not NaN) in all epochs
+        count   - uint16,  number of epochs with non-zero and non-NaN value
+        mean    - float32, sum of all epochs / number of epochs
+        min/max - float32, minimum/maximum of all epochs, ignoring NaN
+    Example:
+        stats = StackStatistics((length,width), ['nonzero','mean'])
+        for data in dataList:
+            stats.add(data)
+        mask = stats.nonzero
+        coh = stats.mean
+    '''
+    statList = ['nonzero','count','mean','min','max']
+
+    def __init__(self, shape=None, statList=['nonzero','mean']):
+        self.statList = [i for i in self.statList if i in statList]
+        self.num = 0
+        self.shape = None
+        self.nonzero = self.count = self.sum = self.min = self.max = None
+        if shape is not None:
+            self.allocate(shape)
+
+    def allocate(self, shape):
+        '''Allocate statistics matrices, on the first epoch if shape is not given while initiating'''
+        self.shape = tuple(shape)
+        if 'nonzero' in self.statList:  self.nonzero = np.ones(self.shape, np.bool_)
+        if 'count'   in self.statList:  self.count = np.zeros(self.shape, np.uint16)
+        if 'mean'    in self.statList:  self.sum = np.zeros(self.shape, np.float32)
+        if 'min'     in self.statList:  self.min = np.full(self.shape, np.nan, np.float32)
+        if 'max'     in self.statList:  self.max = np.full(self.shape, np.nan, np.float32)
+        return self
+
+    def add(self, data, nonzero=None):
+        '''Fold one epoch into statistics
+        Inputs:
+            data    - 2D np.array in size of shape
+            nonzero - 2D np.array of bool, non-zero pixels of this epoch, i.e. from amplitude of .unw file
+                      calculated from data if not given
+        '''
+        if self.shape is None:
+            self.allocate(data.shape)
+        if nonzero is None and (self.nonzero is not None or self.count is not None):
+            nonzero = ~np.isnan(data)
+            nonzero &= data != 0
+        if self.nonzero is not None:
+            self.nonzero &= nonzero
+        if self.count is not None:
+            self.count += nonzero
+        if self.sum is not None:
+            self.sum += data
+        if self.min is not None:
+            np.fmin(self.min, data, out=self.min)
+        if self.max is not None:
+            np.fmax(self.max, data, out=self.max)
+        self.num += 1
+        return self
+
+    def merge(self, other):
+        '''Fold statistics of another stack in the same shape, i.e. from parallel worker'''
+        if other.num == 0:
+            return self
+        if self.shape is None:
+            self.allocate(other.shape)
+        if self.nonzero is not None:  self.nonzero &= other.nonzero
+        if self.count   is not None:  self.count += other.count
+        if self.sum     is not None:  self.sum += other.sum
+        if self.min     is not None:  np.fmin(self.min, other.min, out=self.min)
+        if self.max     is not None:  np.fmax(self.max, other.max, out=self.max)
+        self.num += other.num
+        return self
+
+    @property
+    def mean(self):
+        if self.sum is None or self.num == 0:
+            return None
+        return self.sum / np.float32(self.num)
+
+
+def stack_statistics(File, statList=['nonzero','mean'], epochList=None):
+    '''Calculate statistics of all epochs of multi-group/dataset hdf5 file in one read pass
+    Example:
+        stats = stack_statistics('unwrapIfgram.h5', ['nonzero'])
+        stats = stack_statistics('coherence.h5', ['mean','min','max'])
+    '''
+    with readfile.Reader(File) as f:
+        atr = f.attribute()
+        if epochList is None:
+            epochList = f.epochList
+        stats = StackStatistics((int(atr['FILE_LENGTH']), int(atr['WIDTH'])), statList=statList)
+        print 'calculating '+str(stats.statList)+' of '+str(len(epochList))+' epochs in file: '+File
+        for i, (epoch, data) in enumerate(f.iter_epochs(epochList=epochList)):
+            stats.add(data)
+            print_progress(i+1, len(epochList), suffix=epoch)
+    return stats
+
+
+def write_stack_statistics(data, atr, outFile, k='mask'):
+    '''Write one statistic of stack (i.e. stats.nonzero, stats.mean) into single dataset hdf5 file
+    Boolean mask is saved as uint8.
+    '''
+    if data.dtype == np.bool_:
+        data = np.array(data, np.uint8)
+    atr = dict(atr)
+    atr['FILE_TYPE'] = k
+    print 'writing >>> '+outFile
+    h5 = h5py.File(outFile, 'w')
+    group = h5.create_group(k)
+    dset = writefile.create_dataset(group, k, data=data)
+    for key,value in atr.iteritems():
+        group.attrs[key] = value
+    h5.close()
+    return outFile
+
+
 def nonzero_mask(File, outFile='Mask.h5'):
     '''Generate mask file for non-zero value of input multi-group hdf5 file'''
     atr = readfile.read_attribute(File)
-    k = atr['FILE_TYPE']
-    width = int(atr['WIDTH'])
-    length = int(atr['FILE_LENGTH'])
-    
-    mask = np.ones([length, width])
-    
-    h5 = h5py.File(File,'r')
-    igramList = sorted(h5[k].keys())
-    for i in range(len(igramList)):
-        igram = igramList[i]
-        data = h5[k][igram].get(igram)[:]
-        
-        mask[data==0] = 0
-        print_progress(i+1, len(igramList))
-
-    atr['FILE_TYPE'] = 'mask'
-    writefile.write(mask, atr, outFile)
-    
-    return outFile
+    stats = stack_statistics(File, ['nonzero'])
+    return write_stack_statistics(stats.nonzero, atr, outFile)
 
 
 ######################################################################################################
@@ -216,20 +320,14 @@ def spatial_average(File, mask=None, box=None, saveList=False):
 
     # Calculate mean coherence list
     if k in multi_group_hdf5_file+multi_dataset_hdf5_file:
-        h5file = h5py.File(File,'r')
-        epochList = sorted(h5file[k].keys())
+        h5reader = readfile.get_reader(File).open()
+        epochList = h5reader.epochList
         epochNum  = len(epochList)
 
         meanList   = []
         for i in range(epochNum):
             epoch = epochList[i]
-            if k in multi_group_hdf5_file:
-                dset = h5file[k][epoch].get(epoch)
-            elif k in multi_dataset_hdf5_file:
-                dset = h5file[k].get(epoch)
-            else:  print 'Unrecognized group type: '+k
-            
-            data = dset[box[1]:box[3],box[0]:box[2]]
+            data = h5reader.read(epoch, box)
             if not mask is None:
                 data[mask==0] = np.nan
             ## supress warning 
@@ -239,7 +337,7 @@ def spatial_average(File, mask=None, box=None, saveList=False):
                 meanList.append(np.nanmean(data))
             print_progress(i+1, epochNum, suffix=epoch)
         del data
-        h5file.close()
+        h5reader.close()
     else:
         data,atr = readfile.read(File, box)
         if not mask is None:
@@ -272,43 +370,16 @@ def spatial_average(File, mask=None, box=None, saveList=False):
 
 def temporal_average(File, outFile=None):
     '''Calculate temporal average.'''
-    # Input File Info
     atr = readfile.read_attribute(File)
     k = atr['FILE_TYPE']
-    width = int(atr['WIDTH'])
-    length = int(atr['FILE_LENGTH'])
-
-    h5file = h5py.File(File)
-    epochList = sorted(h5file[k].keys())
-    epochNum = len(epochList)
-
-    # Calculation
-    dMean = np.zeros((length,width))
-    for i in range(epochNum):
-        epoch = epochList[i]
-        if k in multi_group_hdf5_file:
-            d = h5file[k][epoch].get(epoch)[:]
-        elif k in ['timeseries']:
-            d = h5file[k].get(epoch)[:]
-        else: print k+' type is not supported currently.'; sys.exit(1)
-        dMean += d
-        print_progress(i+1, epochNum, suffix=epoch)
-    dMean /= float(len(epochList))
-    del d
-    h5file.close()
+    if k not in multi_group_hdf5_file+multi_dataset_hdf5_file:
+        print k+' type is not supported currently.'; sys.exit(1)
+    stats = stack_statistics(File, ['mean'])
 
     # Output
     if not outFile:
         outFile = os.path.splitext(File)[0]+'_tempAverage.h5'
-    print 'writing >>> '+outFile
-    h5mean = h5py.File(outFile, 'w')
-    group  = h5mean.create_group('mask')
-    dset = group.create_dataset(os.path.basename('mask'), data=dMean, compression='gzip')
-    for key,value in atr.iteritems():
-        group.attrs[key] = value
-    h5mean.close()
-
-    return outFile
+    return write_stack_statistics(stats.mean, atr, outFile)
 
 
 ######################################################################################################
@@ -381,6 +452,79 @@ def azimuth_resolution(atr):
 
 
 #########################################################################
+##### Look up table cache of geomap*.trans file
+# Look up table and its inverse index in radar coord are kept in memory while the file is unchanged,
+# the inverse index is also persisted next to the look up table file for later runs.
+_lookup_table_cache = dict()
+
+def read_lookup_table(transFile):
+    '''Read range/azimuth coord of geo pixels from look up table file once, memoized in memory'''
+    key = os.path.abspath(transFile)
+    stamp = readfile.get_file_stamp(transFile)
+    lut = _lookup_table_cache.get(key, None)
+    if lut is None or lut['stamp'] != stamp:
+        print 'reading file: '+transFile
+        lut = dict()
+        lut['stamp'] = stamp
+        lut['rg'], lut['atr'] = readfile.read(transFile, (), 'range')
+        lut['az'] = readfile.read(transFile, (), 'azimuth')[0]
+        _lookup_table_cache[key] = lut
+    return lut
+
+
+def get_radar2geo_index(transFile):
+    '''Inverse index of look up table in radar coord, for radar2glob()
+    Geo pixels are binned into the nearest radar pixel, with number of geo pixels and sum of their row/col
+    number in each radar pixel saved in <transFile>.rdr2geo.npz, and their summed-area table kept in memory,
+    so that the mean geo row/col of any window in radar coord is found with 4 look ups.
+    Output:
+        index - dict, with count/row/col: 2D np.array in float64, summed-area table in size of (length+1, width+1)
+    '''
+    lut = read_lookup_table(transFile)
+    if 'rdr2geo' in lut.keys():
+        return lut['rdr2geo']
+
+    idxFile = transFile+'.rdr2geo.npz'
+    stamp = np.array(lut['stamp'], np.float64)
+    count = None
+    try:
+        npz = np.load(idxFile)
+        if np.array_equal(npz['stamp'], stamp):
+            count, row_sum, col_sum = npz['count'], npz['row'], npz['col']
+        else:
+            print 'inverse index file does not match look up table, ignore it: '+idxFile
+    except:
+        pass
+
+    if count is None:
+        print 'build inverse index of look up table in radar coord'
+        rg = lut['rg'].flatten()
+        az = lut['az'].flatten()
+        valid = np.flatnonzero(np.multiply(rg != 0., az != 0.))
+        trans_row, trans_col = np.divmod(valid, lut['rg'].shape[1])
+        rdr_rg = np.rint(rg[valid]).astype(np.int64)
+        rdr_az = np.rint(az[valid]).astype(np.int64)
+        shape = (np.max(rdr_az)+1, np.max(rdr_rg)+1)
+        bins = rdr_az * shape[1] + rdr_rg
+        count   = np.bincount(bins, minlength=shape[0]*shape[1]).reshape(shape).astype(np.int32)
+        row_sum = np.bincount(bins, weights=trans_row, minlength=shape[0]*shape[1]).reshape(shape)
+        col_sum = np.bincount(bins, weights=trans_col, minlength=shape[0]*shape[1]).reshape(shape)
+        try:
+            np.savez(idxFile, stamp=stamp, count=count, row=row_sum, col=col_sum)
+            print 'save inverse index to file: '+idxFile
+        except:
+            pass
+
+    # summed-area table, with zero in the first row/column
+    index = dict()
+    for name, data in zip(['count','row','col'], [count, row_sum, col_sum]):
+        table = np.zeros((data.shape[0]+1, data.shape[1]+1))
+        table[1:,1:] = np.cumsum(np.cumsum(data, axis=0), axis=1)
+        index[name] = table
+    lut['rdr2geo'] = index
+    return index
+
+
 def glob2radar(lat, lon, transFile='geomap*.trans', atr_rdr=dict()):
     '''Convert geo coordinates into radar coordinates.
     Inputs:
@@ -399,9 +543,8 @@ def glob2radar(lat, lon, transFile='geomap*.trans', atr_rdr=dict()):
     if transFile:
         # Get lat/lon resolution/step in meter
         earth_radius = 6371.0e3;    # in meter
-        print 'reading file: '+transFile
-        trans_rg, trans_atr = readfile.read(transFile, (), 'range')
-        trans_az = readfile.read(transFile, (), 'azimuth')[0]
+        lut = read_lookup_table(transFile)
+        trans_rg, trans_az, trans_atr = lut['rg'], lut['az'], lut['atr']
         lat_first = float(trans_atr['Y_FIRST'])
         lon_first = float(trans_atr['X_FIRST'])
         lat_center = lat_first + float(trans_atr['Y_STEP'])*float(trans_atr['FILE_LENGTH'])/2
@@ -492,17 +635,15 @@ def radar2glob(az, rg, transFile='geomap*.trans', atr_rdr=dict()):
     try:    transFile = glob.glob(transFile)[0]
     except: transFile = None
 
-    lon = np.zeros(rg.shape)
-    lat = np.zeros(rg.shape)    
+    az = np.array(az)
+    rg = np.array(rg)
 
     ##### Use geomap*.trans file for precious (pixel-level) coord conversion
     ## by searching pixels in trans file with value falling buffer lat/lon value
     if transFile:
         # Get lat/lon resolution/step in meter
         earth_radius = 6371.0e3;    # in meter
-        print 'reading file: '+transFile
-        trans_rg, trans_atr = readfile.read(transFile, (), 'range')
-        trans_az = readfile.read(transFile, (), 'azimuth')[0]
+        trans_atr = read_lookup_table(transFile)['atr']
         lat_first = float(trans_atr['Y_FIRST'])
         lon_first = float(trans_atr['X_FIRST'])
         lat_center = lat_first + float(trans_atr['Y_STEP'])*float(trans_atr['FILE_LENGTH'])/2
@@ -518,18 +659,32 @@ def radar2glob(az, rg, transFile='geomap*.trans', atr_rdr=dict()):
         
             x_factor = np.ceil(abs(lon_step)/rg_step)
             y_factor = np.ceil(abs(lat_step)/az_step)
+            try:    az0 = int(atr_rdr['subset_y0'])
+            except: az0 = 0
+            try:    rg0 = int(atr_rdr['subset_x0'])
+            except: rg0 = 0
         else:
             x_factor = 10
             y_factor = 10
-        
-        for i in range(len(rg)):
-            mask_rg = np.multiply(trans_rg>=max(rg[i]-x_factor,0.5), trans_rg<=rg[i]+x_factor)
-            mask_az = np.multiply(trans_az>=max(az[i]-y_factor,0.5), trans_az<=az[i]+y_factor)
-            idx = np.where(np.multiply(mask_rg, mask_az))
-            trans_row, trans_col = np.mean(idx,1)
-            
-            lat[i] = trans_row*lat_step_deg + lat_first
-            lon[i] = trans_col*lon_step_deg + lon_first
+            az0 = 0
+            rg0 = 0
+
+        # mean row/col of geo pixels within the window of each point in radar coord, from summed-area table
+        index = get_radar2geo_index(transFile)
+        num_row, num_col = index['count'].shape
+        y0 = np.clip(np.rint(az + az0 - y_factor).astype(int),   0, num_row-1)
+        y1 = np.clip(np.rint(az + az0 + y_factor).astype(int)+1, 0, num_row-1)
+        x0 = np.clip(np.rint(rg + rg0 - x_factor).astype(int),   0, num_col-1)
+        x1 = np.clip(np.rint(rg + rg0 + x_factor).astype(int)+1, 0, num_col-1)
+        window_sum = lambda table: table[y1,x1] - table[y0,x1] - table[y1,x0] + table[y0,x0]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            count = window_sum(index['count'])
+            trans_row = window_sum(index['row']) / count
+            trans_col = window_sum(index['col']) / count
+
+        lat = trans_row*lat_step_deg + lat_first
+        lon = trans_col*lon_step_deg + lon_first
         
         lat_resid = y_factor*lat_step_deg
         lon_resid = x_factor*lon_step_deg
@@ -569,10 +724,10 @@ def radar2glob(az, rg, transFile='geomap*.trans', atr_rdr=dict()):
         print 'Residul - lat: '+str(lat_resid)+', lon: '+str(lon_resid)
         
         ### calculate geo coordinate of inputs
-        N = len(rg)
+        N = rg.size
         A = np.hstack([rg.reshape(N,1), az.reshape(N,1), np.ones((N,1))])
-        lat = np.dot(A, affine_par[:,0])
-        lon = np.dot(A, affine_par[:,1])
+        lat = np.dot(A, affine_par[:,0]).reshape(rg.shape)
+        lon = np.dot(A, affine_par[:,1]).reshape(rg.shape)
         
     else:
         print 'No geomap*.trans or radar coord file found!'
@@ -611,10 +766,8 @@ def date_list(h5file):
     k = h5file.keys()
     if 'interferograms' in k: k[0] = 'interferograms'
     elif 'coherence'    in k: k[0] = 'coherence'
-    ifgramList = sorted(h5file[k[0]].keys())
-    for ifgram in  ifgramList:
-        dates = h5file[k[0]][ifgram].attrs['DATE12'].split('-')
-        dates1= h5file[k[0]][ifgram].attrs['DATE12'].split('-')
+    for date12 in readfile.read_epoch_attribute(h5file, k[0], 'DATE12'):
+        dates = date12.split('-')
         if dates[0][0] == '9':      dates[0] = '19'+dates[0]
         else:                       dates[0] = '20'+dates[0]
         if dates[1][0] == '9':      dates[1] = '19'+dates[1]
@@ -650,9 +803,9 @@ def design_matrix(h5file):
     k=h5file.keys()
     if 'interferograms' in k: k[0] = 'interferograms'
     elif 'coherence'    in k: k[0] = 'coherence'
-    ifgramList = h5file[k[0]].keys()
+    date12List = readfile.read_epoch_attribute(h5file, k[0], 'DATE12')
     numDates = len(dateDict)
-    numIfgrams = len(ifgramList)
+    numIfgrams = len(date12List)
     A = np.zeros((numIfgrams,numDates))
     B = np.zeros(np.shape(A))
     daysList = []
@@ -661,7 +814,7 @@ def design_matrix(h5file):
     tbase = np.array(tbase)
     t = np.zeros((numIfgrams,2))
     for ni in range(numIfgrams):
-        date = h5file[k[0]][ifgramList[ni]].attrs['DATE12'].split('-')
+        date = date12List[ni].split('-')
         if date[0][0] == '9':      date[0] = '19'+date[0]
         else:                      date[0] = '20'+date[0]
         if date[1][0] == '9':      date[1] = '19'+date[1]
@@ -677,18 +830,304 @@ def design_matrix(h5file):
     return A,B
 
 ######################################
-def timeseries_inversion(igramsFile, timeseriesFile):
+def split_row_boxes(length, width, num_layer, max_memory=4.0, min_box_num=1, print_msg=True):
+    '''Split the whole area into row blocks/boxes to limit the memory usage
+    Inputs:
+        length/width - int, size of the whole area
+        num_layer    - int, number of 2D float32 layers held in memory for each pixel,
+                       i.e. number of interferograms + epochs + intermediate matrices
+        max_memory   - float, maximum memory to use in GB
+        min_box_num  - int, minimum number of boxes, i.e. number of parallel workers
+    Output:
+        box_list - list of 4-tuple of int, defined in (x0, y0, x1, y1) as box in readfile.read()
+    Example:
+        box_list = split_row_boxes(5000, 6000, 300+3*100, max_memory=4)
+        box_list = split_row_boxes(5000, 6000, 300+3*100, max_memory=4, min_box_num=8)
+    '''
+    row_memory = float(width) * num_layer * 4    # in byte, for float32
+    row_step = int(max_memory * 1024**3 / row_memory)
+    row_step = min(row_step, int(np.ceil(float(length)/min_box_num)))
+    row_step = min(max(row_step, 1), length)
+
+    box_list = []
+    for y0 in range(0, length, row_step):
+        box_list.append((0, y0, width, min(y0+row_step, length)))
+    if print_msg:
+        print 'maximum memory: %.1f GB, split into %d blocks of %d rows' % (max_memory, len(box_list), row_step)
+    return box_list
+
+
+def read_ifgram_box(h5file, ifgramList, box):
+    '''Read interferograms/coherences within box into 2D matrix in size of (numIfgram, numPixel)
+    Inputs:
+        h5file     - h5py.File object, opened interferograms/coherence file, in stack or cube layout
+        ifgramList - list of string, interferograms/coherences to read
+        box        - 4-tuple of int, area to read, defined in (x0, y0, x1, y1)
+    '''
+    k = [i for i in h5file.keys() if i in multi_group_hdf5_file][0]
+    numPixel = (box[2]-box[0]) * (box[3]-box[1])
+    data = np.zeros((len(ifgramList), numPixel), np.float32)
+    if readfile.is_cube(h5file, k):
+        dset = h5file[k].get(k)
+        epochList = [str(i) for i in h5file[k]['epoch'][:]]
+        for j in range(len(ifgramList)):
+            data[j] = dset[epochList.index(ifgramList[j]), box[1]:box[3], box[0]:box[2]].flatten()
+    else:
+        for j in range(len(ifgramList)):
+            ifgram = ifgramList[j]
+            d = h5file[k][ifgram].get(ifgram)[box[1]:box[3],box[0]:box[2]]
+            data[j] = d.flatten()
+    return data
+
+
+def read_timeseries_box(h5file, dateList, box):
+    '''Read time series within box into 2D matrix in size of (numDate, numPixel)
+    Inputs:
+        h5file   - h5py.File object, opened timeseries file, in stack or cube layout
+        dateList - list of string, dates to read
+        box      - 4-tuple of int, area to read, defined in (x0, y0, x1, y1)
+    '''
+    k = 'timeseries'
+    numPixel = (box[2]-box[0]) * (box[3]-box[1])
+    data = np.zeros((len(dateList), numPixel), np.float32)
+    if readfile.is_cube(h5file, k):
+        dset = h5file[k].get(k)
+        epochList = [str(i) for i in h5file[k]['epoch'][:]]
+        for j in range(len(dateList)):
+            data[j] = dset[epochList.index(dateList[j]), box[1]:box[3], box[0]:box[2]].flatten()
+    else:
+        for j in range(len(dateList)):
+            data[j] = h5file[k].get(dateList[j])[box[1]:box[3],box[0]:box[2]].flatten()
+    return data
+
+
+def ts_inverse(B1, dt, dataLine):
+    '''Invert interferograms (numIfgram, numPixel) into time series (numDate, numPixel)
+    with the pseudo inverse of velocity design matrix B1.
+    '''
+    tmp_rate = np.dot(B1, dataLine)
+    defo1 = tmp_rate * dt.reshape(-1,1)
+    defo0 = np.zeros((1, dataLine.shape[1]), np.float32)
+    defo  = np.vstack((defo0, np.cumsum(defo1, axis=0)))
+    return defo
+
+
+def group_pixel_by_pattern(valid):
+    '''Group pixels sharing the same pattern of valid observations
+    Input : valid - 2D np.array of bool in size of (numObs, numPixel)
+    Output: groupList - list of 1D np.array of int, column index of pixels in each group
+    Example:
+        for pixIdx in group_pixel_by_pattern(data != 0.):
+            fin = data[:,pixIdx[0]] != 0.
+    '''
+    if valid.shape[1] == 0:
+        return []
+    # pack bool pattern into bytes, then view each pixel's pattern as one void element
+    pattern = np.ascontiguousarray(np.packbits(valid, axis=0).T)
+    pattern = pattern.view(np.dtype((np.void, pattern.shape[1]))).flatten()
+    inverse = np.unique(pattern, return_inverse=True)[1]
+    order = np.argsort(inverse, kind='mergesort')
+    splitIdx = np.nonzero(np.diff(inverse[order]))[0]+1
+    return np.split(order, splitIdx)
+
+
+def ts_inverse_masked(B, B1, dt, data, min_group_size=64, max_memory=1.0):
+    '''Invert interferograms into time series, excluding zero value (no data) for each pixel.
+    Pixels with all interferograms valid are inverted with B1 at once; the others are grouped
+    by their pattern of valid interferograms. Large groups are solved with the pseudo inverse
+    of design matrix with valid interferograms only, applied to all pixels of the group; pixels
+    of small groups (i.e. scattered zero values) are solved together with the normal equations,
+    using valid/invalid interferograms as 1/0 weight.
+    Inputs:
+        B    - 2D np.array, velocity design matrix in size of (numIfgram, numDate-1)
+        B1   - 2D np.array, pseudo inverse of B
+        dt   - 1D np.array, temporal spacing between dates in days
+        data - 2D np.array in size of (numIfgram, numPixel)
+        min_group_size - int, minimum number of pixels of group to solve with pseudo inverse
+        max_memory - float, maximum memory in GB for the stacked normal equations
+    Output: defo - 2D np.array in size of (numDate, numPixel)
+    '''
+    numPixel = data.shape[1]
+    defo = np.zeros((B.shape[1]+1, numPixel), np.float32)
+    valid = data != 0.
+    numValid = np.sum(valid, axis=0)
+
+    pixIdx = numValid == data.shape[0]
+    if np.any(pixIdx):
+        defo[:,pixIdx] = ts_inverse(B1, dt, data[:,pixIdx])
+
+    # pixels with partial valid interferograms; pixels with none remain zero
+    pixIdxPart = np.nonzero(np.multiply(numValid > 0, ~pixIdx))[0]
+    pixIdxSmall = []
+    for groupIdx in group_pixel_by_pattern(valid[:,pixIdxPart]):
+        pixIdx = pixIdxPart[groupIdx]
+        if pixIdx.size < min_group_size:
+            pixIdxSmall.append(pixIdx)
+            continue
+        fin_ndx = np.nonzero(valid[:,pixIdx[0]])[0]
+        B1tmp = np.array(np.linalg.pinv(B[fin_ndx,:]), np.float32)
+        defo[:,pixIdx] = ts_inverse(B1tmp, dt, data[np.ix_(fin_ndx,pixIdx)])
+
+    if pixIdxSmall:
+        pixIdx = np.sort(np.hstack(pixIdxSmall))
+        defo[:,pixIdx] = ts_inverse_weighted(B, dt, data[:,pixIdx], valid[:,pixIdx], max_memory)
+    return defo
+
+
+def coherence2weight(coh, weight_func='variance', L=1):
+    '''Convert spatial coherence into weight for the network inversion
+    Inputs:
+        coh         - np.array, spatial coherence
+        weight_func - string, coherence - coherence as weight
+                              variance  - inverse of phase variance from Cramer-Rao bound
+                                          var = (1 - coh^2) / (2 * L * coh^2)
+        L           - int, number of independent looks, for variance only
+    Output: weight - np.array in float32
+    Reference:
+        Rodriguez, E., and J. M. Martin (1992), Theory and design of interferometric synthetic
+        aperture radars, IEE Proceedings-F, 139(2), 147-159.
+    '''
+    coh = np.clip(coh, 1e-3, 0.999)
+    if weight_func == 'coherence':
+        weight = coh
+    elif weight_func in ['variance','var']:
+        weight = 2.0*L*coh**2 / (1.0-coh**2)
+    else:
+        print 'Un-recognized weight function: '+weight_func; sys.exit(1)
+    return np.array(weight, np.float32)
+
+
+def ts_inverse_weighted(B, dt, data, weight, max_memory=1.0):
+    '''Invert interferograms into time series with weighted least squares, pixel by pixel.
+    The weighted normal equations (B^T W B) x = B^T W d of all pixels are formed with matrix
+    products and solved at once in stacked matrices, in steps of pixels within max_memory.
+    Pixels with singular normal equations (disconnected network or no data) are solved with
+    the minimum norm solution.
+    Zero value in interferograms is considered as no data, with zero weight.
+    Inputs:
+        B      - 2D np.array, velocity design matrix in size of (numIfgram, numDate-1)
+        dt     - 1D np.array, temporal spacing between dates in days
+        data   - 2D np.array in size of (numIfgram, numPixel)
+        weight - 2D np.array in size of (numIfgram, numPixel)
+        max_memory - float, maximum memory in GB for the stacked normal equations
+    Output: defo - 2D np.array in size of (numDate, numPixel)
+    '''
+    numIfgram, numParam = B.shape
+    numPixel = data.shape[1]
+    defo = np.zeros((numParam+1, numPixel), np.float32)
+    weight = np.multiply(weight, data != 0.)
+
+    # outer product of each row of B, so that B^T W B = w^T * BB for all pixels
+    BB = (B[:,:,np.newaxis] * B[:,np.newaxis,:]).reshape(numIfgram, -1)
+    # memory per pixel in float64: B^T W B, its scaled and LU copy, weight and weighted data
+    num_pixel_step = int(max_memory * 1024**3 / ((3*numParam**2 + 2*numIfgram + 7*numParam) * 8))
+    num_pixel_step = max(num_pixel_step, 1)
+    for i in range(0, numPixel, num_pixel_step):
+        p0, p1 = i, min(i+num_pixel_step, numPixel)
+        w = np.array(weight[:,p0:p1], np.float64)
+        BTWB = np.dot(w.T, BB).reshape(-1, numParam, numParam)
+        BTWd = np.dot((w*data[:,p0:p1]).T, B)
+
+        # solve normal equations scaled to unit diagonal, with a tiny damping so that none is singular;
+        # a random right hand side is solved as well, whose solution blows up for singular pixels
+        scale = np.sqrt(np.einsum('pii->pi', BTWB))
+        scale[scale == 0.] = 1.
+        BTWB_s = BTWB / scale[:,:,np.newaxis] / scale[:,np.newaxis,:]
+        BTWB_s += np.eye(numParam) * 1e-10
+        rhs = np.dstack((BTWd / scale, np.random.RandomState(0).rand(BTWd.shape[0], numParam)))
+        sol = np.linalg.solve(BTWB_s, rhs)
+        rate = sol[:,:,0] / scale
+        singular = np.max(np.abs(sol[:,:,1]), axis=1) > 1e6
+        if np.any(singular):
+            rate[singular] = np.einsum('pjk,pk->pj', np.linalg.pinv(BTWB[singular], rcond=1e-10),\
+                                       BTWd[singular])
+        defo[1:,p0:p1] = np.cumsum(rate.T * dt.reshape(-1,1), axis=0)
+    return defo
+
+
+def temporal_coherence(A, ts, data):
+    '''Temporal coherence of time series with respect to the interferograms, in complex64
+    Inputs:
+        A    - 2D np.array, design matrix in size of (numIfgram, numDate), linking ts to data
+        ts   - 2D np.array in size of (numDate, numPixel), phase time series in radian
+        data - 2D np.array in size of (numIfgram, numPixel), interferometric phase in radian
+    Output: tcoh - 1D np.array in size of (numPixel,), in float32
+    Reference: Tizzani et al. (2007), RSE, eq. (2)
+    '''
+    diff = data - np.dot(np.array(A, np.float32), ts)
+    tcoh = np.abs(np.sum(np.exp(1j*diff), axis=0, dtype=np.complex64)) / data.shape[0]
+    return np.array(tcoh, np.float32)
+
+
+def timeseries_inversion_box(igramsFile, ifgramList, box, B, B1, dt, phase2range,\
+                             coherenceFile=None, cohList=None, weight_func='no', L=1, A=None, max_memory=1.0):
+    '''Invert time series for pixels within box.
+    Interferograms (and coherences if weighted) are read from file inside this function, so
+    that it can be run in parallel processes without passing large arrays between them.
+    With design matrix A given, temporal coherence is calculated from the same data as well.
+    max_memory is the memory in GB for the stacked normal equations of weighted/masked inversion.
+    Output: 2D np.array in size of (numDate, numPixel), in meter
+            1D np.array in size of (numPixel,), temporal coherence, if A is given
+    '''
+    h5flat = h5py.File(igramsFile,'r')
+    data = read_ifgram_box(h5flat, ifgramList, box)
+    h5flat.close()
+
+    if weight_func in ['no','sbas']:
+        defo = ts_inverse_masked(B, B1, dt, data, max_memory=max_memory)
+    else:
+        h5coh = h5py.File(coherenceFile,'r')
+        weight = coherence2weight(read_ifgram_box(h5coh, cohList, box), weight_func, L)
+        h5coh.close()
+        defo = ts_inverse_weighted(B, dt, data, weight, max_memory)
+
+    if A is not None:
+        tcoh = temporal_coherence(A, defo[1:], data)
+        return defo * phase2range, tcoh
+    return defo * phase2range
+
+
+def get_coherence_list(h5flat, h5coh, ifgramList):
+    '''Get list of coherence in the same order as ifgramList, matched by DATE12'''
+    cohDict = dict(zip(readfile.read_epoch_attribute(h5coh, 'coherence', 'DATE12'),\
+                       readfile.get_epoch_list(h5coh, 'coherence')))
+    cohList = []
+    date12List = readfile.read_epoch_attribute(h5flat, 'interferograms', 'DATE12', ifgramList)
+    for ifgram, date12 in zip(ifgramList, date12List):
+        try:    cohList.append(cohDict[date12])
+        except: print 'ERROR: No coherence found for interferogram: '+ifgram; sys.exit(1)
+    return cohList
+
+
+def timeseries_inversion(igramsFile, timeseriesFile, max_memory=4.0, parallel=1,\
+                         coherenceFile=None, weight_func='no', tempCohFile=None):
     '''Implementation of the SBAS algorithm.
     modified from sbas.py written by scott baker, 2012 
-    
+
+    Interferograms are read, inverted and written block by block in rows,
+    so that the peak memory usage depends on max_memory, not the scene size.
+    Zero value in interferograms is considered as no data and excluded from the inversion.
+    With parallel > 1, blocks are inverted by a pool of processes, each reading its own
+    block from igramsFile, and max_memory is shared among them.
+    With weight_func of coherence/variance, weighted least squares is used, with weight
+    calculated from the spatial coherence in coherenceFile.
+    With tempCohFile, temporal coherence is calculated in the same pass, without reading
+    the interferograms again.
+
     Usage:
-    timeseries_inversion(h5flat,h5timeseries)
-      h5flat: hdf5 file with the interferograms 
-      h5timeseries: hdf5 file with the output from the inversion
+    timeseries_inversion(igramsFile, timeseriesFile, max_memory=4, parallel=1)
+    timeseries_inversion(igramsFile, timeseriesFile, coherenceFile='coherence.h5', weight_func='variance')
+    timeseries_inversion(igramsFile, timeseriesFile, tempCohFile='temporal_coherence.h5')
+      igramsFile     : hdf5 file with the interferograms 
+      timeseriesFile : hdf5 file with the output from the inversion
+      max_memory     : float, maximum memory to use in GB
+      parallel       : int, number of processes to use
+      coherenceFile  : hdf5 file with the spatial coherence, for weighted inversion
+      weight_func    : string, no (default), coherence or variance, see coherence2weight()
+      tempCohFile    : hdf5 file with the output temporal coherence
     '''
     total = time.time()
-  
-    global B1, dt, numDates
+
     h5flat = h5py.File(igramsFile,'r')
     A,B = design_matrix(h5flat)
     tbase,dateList,dateDict,dateDict2 = date_list(h5flat)
@@ -696,88 +1135,85 @@ def timeseries_inversion(igramsFile, timeseriesFile):
     B1 = np.linalg.pinv(B)
     B1 = np.array(B1,np.float32)
     numDates = len(dateList)
-  
+
     ##### Basic Info
-    ifgramList = h5flat['interferograms'].keys()
+    ifgramList = readfile.get_epoch_list(h5flat, 'interferograms')
     numIfgrams = len(ifgramList)
     atr = readfile.read_attribute(igramsFile)
     length = int(atr['FILE_LENGTH'])
     width  = int(atr['WIDTH'])
     numPixels = length * width
+    phase2range = -1*float(atr['WAVELENGTH'])/(4.*np.pi)
     print 'number of interferograms: '+str(numIfgrams)
     print 'number of pixels        : '+str(numPixels)
-    #numPixels_step = int(numPixels/10)
 
-    ##### Inversion Function
-    def ts_inverse_point(dataPoint):
-        nan_ndx = dataPoint == 0.
-        fin_ndx = dataPoint != 0.
-        nan_fin = dataPoint.copy()
-        nan_fin[nan_ndx] = 1
-        if not nan_fin.sum() == len(nan_fin):
-            B1tmp = np.dot(B1,np.diag(fin_ndx))
-            tmp_rate = np.dot(B1tmp,dataPoint)
-            zero = np.array([0.],np.float32)
-            defo = np.concatenate((zero,np.cumsum([tmp_rate*dt])))
-        else: defo = np.zeros((modelDimension+1,1),np.float32)
-        return defo
-  
-    def ts_inverse(dataLine):
-        numPoint = dataLine.shape[1]
-        tmp_rate = np.dot(B1,dataLine)
-        defo1 = tmp_rate * np.tile(dt.reshape((numDates-1,1)),(1,numPoint))
-        defo0 = np.array([0.]*numPoint,np.float32)
-        defo  = np.vstack((defo0, np.cumsum(defo1,axis=0)))
-        return defo
-  
-    ##### Read Interferograms
-    print 'Reading interferograms ...'
-    data = np.zeros((numIfgrams,numPixels),np.float32)
-    for j in range(numIfgrams):
-        ifgram = ifgramList[j]
-        print_progress(j+1, numIfgrams, prefix='loading: ', suffix=ifgram)
-        d = h5flat['interferograms'][ifgramList[j]].get(ifgramList[j])[:]
-        data[j] = d.flatten(1)
+    ##### Weight
+    cohList = None
+    L = 1
+    num_layer = numIfgrams+3*numDates
+    if weight_func not in ['no','sbas']:
+        if not coherenceFile:
+            print 'ERROR: coherence file is required for weight function: '+weight_func; sys.exit(1)
+        print 'weighted least squares inversion with weight function: '+weight_func
+        print 'reading coherence from file: '+coherenceFile
+        h5coh = h5py.File(coherenceFile,'r')
+        cohList = get_coherence_list(h5flat, h5coh, ifgramList)
+        h5coh.close()
+        try:    L = int(atr['ALOOKS'])*int(atr['RLOOKS'])
+        except: L = 1
+        num_layer += 2*numIfgrams
     h5flat.close()
 
-    ##### Inversion
-    print 'Inversing time series ...'
-    dataPoint = np.zeros((numIfgrams,1),np.float32)
-    dataLine  = np.zeros((numIfgrams,width),np.float32)
-    modelDimension  = np.shape(B)[1]
-    tempDeformation = np.zeros((modelDimension+1,numPixels),np.float32)
-    for i in range(length):
-        dataLine = data[:,i*width:(i+1)*width]
-        defoLine = ts_inverse(dataLine)
-        tempDeformation[:,i*width:(i+1)*width] = defoLine
-  
-        #for j in range(width):
-        #    dataPoint = data[:,j]
-        #    try: tempDeformation[:,i*length+j] = point_inverse(dataPoint)
-        #    except: pass
-  
-        print_progress(i+1,length,prefix='calculating:')
-    del data
-  
-    ##### Time Series Data Preparation
-    print 'converting phase to range'
-    timeseries = np.zeros((modelDimension+1,length,width),np.float32)
-    phase2range = -1*float(atr['WAVELENGTH'])/(4.*np.pi)
-    for ni in range(modelDimension+1):
-        timeseries[ni] = tempDeformation[ni].reshape(width,length).T
-        timeseries[ni] = timeseries[ni]*phase2range
-    del tempDeformation
-  
     ##### Output Time Series File
     print 'writing >>> '+timeseriesFile
     print 'number of dates: '+str(numDates)
     h5timeseries = h5py.File(timeseriesFile,'w')
     group = h5timeseries.create_group('timeseries')
-    #dateIndex = ptime.date_index(dateList)
-    for i in range(numDates):
-        date = dateList[i]
-        print_progress(i+1, numDates, suffix=date)
-        dset = group.create_dataset(date, data=timeseries[i], compression='gzip')
+    dsetList = []
+    for date in dateList:
+        dset = writefile.create_dataset(group, date, shape=(length,width), dtype=np.float32)
+        dsetList.append(dset)
+
+    if tempCohFile:
+        print 'writing >>> '+tempCohFile
+        h5tcoh = h5py.File(tempCohFile,'w')
+        group_tcoh = h5tcoh.create_group('temporal_coherence')
+        dset_tcoh = writefile.create_dataset(group_tcoh, 'temporal_coherence', shape=(length,width), dtype=np.float32)
+        # difference and its complex exponential of all interferograms
+        num_layer += 3*numIfgrams
+        A_tcoh = A
+    else:
+        A_tcoh = None
+
+    ##### Inversion, block by block
+    print 'Inversing time series ...'
+    parallel = max(int(parallel), 1)
+    # memory held per pixel: interferograms, (coherence, weight,) rate, cumulative rate and time series
+    # half of memory is left for the stacked normal equations of pixels, of weighted inversion, or
+    # of pixels with scattered zero values in masked inversion
+    box_memory = float(max_memory)/parallel/2.
+    box_list = split_row_boxes(length, width, num_layer, box_memory, min_box_num=parallel)
+    if parallel > 1:
+        print 'parallel processing using %d cores ...' % (parallel)
+    with Parallel(n_jobs=parallel) as pool:
+        for i in range(0, len(box_list), parallel):
+            boxes = box_list[i:i+parallel]
+            defoList = pool(delayed(timeseries_inversion_box)(igramsFile, ifgramList, box, B, B1, dt, phase2range,\
+                                                              coherenceFile, cohList, weight_func, L, A_tcoh,\
+                                                              box_memory)\
+                            for box in boxes)
+
+            # stitch blocks into output file
+            for box, defo in zip(boxes, defoList):
+                boxShape = (box[3]-box[1], box[2]-box[0])
+                if tempCohFile:
+                    defo, tcoh = defo
+                    dset_tcoh[box[1]:box[3],box[0]:box[2]] = tcoh.reshape(boxShape)
+                for j in range(numDates):
+                    dsetList[j][box[1]:box[3],box[0]:box[2]] = defo[j].reshape(boxShape)
+            del defoList
+            print_progress(i+len(boxes), len(box_list), prefix='calculating:', suffix='rows %d-%d'%(boxes[0][1],boxes[-1][3]),\
+                           elapsed_time=time.time()-total)
 
     ## Attributes
     print 'calculating perpendicular baseline timeseries'
@@ -787,20 +1223,31 @@ def timeseries_inversion(igramsFile, timeseriesFile):
     atr['ref_date'] = dateList[0]
     for key,value in atr.iteritems():   group.attrs[key] = value
     h5timeseries.close()
-  
+
+    if tempCohFile:
+        atr['FILE_TYPE'] = 'temporal_coherence'
+        atr['UNIT'] = '1'
+        for key,value in atr.iteritems():   group_tcoh.attrs[key] = value
+        h5tcoh.close()
+
     print 'Done.\nTime series inversion took ' + str(time.time()-total) +' secs'
-    
+    return timeseriesFile
+
 ###################################################
-def timeseries_inversion_FGLS(h5flat,h5timeseries):
-    '''Implementation of the SBAS algorithm.
+def timeseries_inversion_FGLS(h5flat,h5timeseries,h5coherence=None,weight_func='variance'):
+    '''Implementation of the SBAS algorithm, weighted by spatial coherence if given.
     
     Usage:
-    timeseries_inversion(h5flat,h5timeseries)
+    timeseries_inversion_FGLS(h5flat,h5timeseries)
+    timeseries_inversion_FGLS(h5flat,h5timeseries,h5coherence)
       h5flat: hdf5 file with the interferograms 
       h5timeseries: hdf5 file with the output from the inversion
+      h5coherence: hdf5 file with the spatial coherence, for weight of each interferogram
+      weight_func: string, coherence or variance, see coherence2weight()
     ##################################################'''
   
     total = time.time()
+    readfile.check_stack_layout(h5flat, 'interferograms')
     A,B = design_matrix(h5flat)
     tbase,dateList,dateDict,dateDict2 = date_list(h5flat)
     dt = np.diff(tbase)
@@ -808,50 +1255,28 @@ def timeseries_inversion_FGLS(h5flat,h5timeseries):
     B1 = np.array(B1,np.float32)
     ifgramList = h5flat['interferograms'].keys()
     numIfgrams = len(ifgramList)
-    #dset = h5flat[ifgramList[0]].get(h5flat[ifgramList[0]].keys()[0])
-    #data = dset[0:dset.shape[0],0:dset.shape[1]]
-    dset=h5flat['interferograms'][ifgramList[0]].get(ifgramList[0])
-    data = dset[0:dset.shape[0],0:dset.shape[1]] 
-    numPixels = np.shape(data)[0]*np.shape(data)[1]
+    dset = h5flat['interferograms'][ifgramList[0]].get(ifgramList[0])
+    length, width = dset.shape
+    numPixels = length*width
     print 'Reading in the interferograms'
-    #print numIfgrams,numPixels
     print 'number of interferograms: '+str(numIfgrams)
     print 'number of pixels: '+str(numPixels)
-    numPixels_step = int(numPixels/10)
-  
-    data = np.zeros((numIfgrams,numPixels),np.float32)
-    for ni in range(numIfgrams):
-        dset=h5flat['interferograms'][ifgramList[ni]].get(ifgramList[ni])
-        #dset = h5flat[ifgramList[ni]].get(h5flat[ifgramList[ni]].keys()[0])
-        d = dset[0:dset.shape[0],0:dset.shape[1]]
-        #print np.shape(d)
+    data = read_ifgram_box(h5flat, ifgramList, (0,0,width,length))
 
-    del d
-    dataPoint = np.zeros((numIfgrams,1),np.float32)
-    modelDimension = np.shape(B)[1]
-    tempDeformation = np.zeros((modelDimension+1,numPixels),np.float32)
-    for ni in range(numPixels):
-        dataPoint = data[:,ni]
-        nan_ndx = dataPoint == 0.
-        fin_ndx = dataPoint != 0.
-        nan_fin = dataPoint.copy()
-        nan_fin[nan_ndx] = 1
-        if not nan_fin.sum() == len(nan_fin):
-            B1tmp = np.dot(B1,np.diag(fin_ndx))
-            tmpe_ratea = np.dot(B1tmp,dataPoint)
-            zero = np.array([0.],np.float32)
-            defo = np.concatenate((zero,np.cumsum([tmpe_ratea*dt])))
-            tempDeformation[:,ni] = defo
-        #if not np.remainder(ni,10000): print 'Processing point: %7d of %7d ' % (ni,numPixels)
-        if not np.remainder(ni,numPixels_step):
-            print 'Processing point: %8d of %8d, %3d' % (ni,numPixels,(10*ni/numPixels_step))+'%'
-    del data
-    timeseries = np.zeros((modelDimension+1,np.shape(dset)[0],np.shape(dset)[1]),np.float32)
+    print 'Inversing time series ...'
     factor = -1*float(h5flat['interferograms'][ifgramList[0]].attrs['WAVELENGTH'])/(4.*np.pi)
-    for ni in range(modelDimension+1):
-        timeseries[ni] = tempDeformation[ni].reshape(np.shape(dset)[1],np.shape(dset)[0]).T
-        timeseries[ni] = timeseries[ni]*factor
-    del tempDeformation
+    if h5coherence:
+        print 'weighted least squares inversion with weight function: '+weight_func
+        cohList = get_coherence_list(h5flat, h5coherence, ifgramList)
+        atr = h5flat['interferograms'][ifgramList[0]].attrs
+        try:    L = int(atr['ALOOKS'])*int(atr['RLOOKS'])
+        except: L = 1
+        weight = coherence2weight(read_ifgram_box(h5coherence, cohList, (0,0,width,length)), weight_func, L)
+        timeseries = ts_inverse_weighted(B, dt, data, weight) * factor
+        del weight
+    else:
+        timeseries = ts_inverse_masked(B, B1, dt, data) * factor
+    del data
     timeseriesDict = {}
     for key, value in h5flat['interferograms'][ifgramList[0]].attrs.iteritems():
         timeseriesDict[key] = value 
@@ -863,14 +1288,14 @@ def timeseries_inversion_FGLS(h5flat,h5timeseries):
         group = h5timeseries.create_group('timeseries')
         for key,value in timeseriesDict.iteritems():
             group.attrs[key] = value
+    group = h5timeseries['timeseries']
     
     for date in dateList:
         if not date in h5timeseries['timeseries']:
-            dset = group.create_dataset(date, data=timeseries[dateIndex[date]], compression='gzip')
+            dset = writefile.create_dataset(group, date, data=timeseries[dateIndex[date]].reshape(length,width))
     print 'Time series inversion took ' + str(time.time()-total) +' secs'
 
 
-
 def timeseries_inversion_L1(h5flat,h5timeseries):
     try:
         from l1 import l1
@@ -884,6 +1309,7 @@ def timeseries_inversion_L1(h5flat,h5timeseries):
   
     
     total = time.time()
+    readfile.check_stack_layout(h5flat, 'interferograms')
     A,B = design_matrix(h5flat)
     tbase,dateList,dateDict,dateDict2 = date_list(h5flat)
     dt = np.diff(tbase)
@@ -962,11 +1388,11 @@ def timeseries_inversion_L1(h5flat,h5timeseries):
   
     for date in dateList:
         if not date in h5timeseries['timeseries']:
-            dset = group.create_dataset(date, data=timeseries[dateIndex[date]], compression='gzip')
+            dset = writefile.create_dataset(group, date, data=timeseries[dateIndex[date]])
     print 'Time series inversion took ' + str(time.time()-total) +' secs'
     L1orL2h5=h5py.File('L1orL2.h5','w')
     gr=L1orL2h5.create_group('mask') 
-    dset=gr.create_dataset('mask',data=L1ORL2,compression='gzip')
+    dset=writefile.create_dataset(gr, 'mask',data=L1ORL2)
     L1orL2h5.close()
 
 def Baseline_timeseries(igramsFile):
@@ -974,11 +1400,10 @@ def Baseline_timeseries(igramsFile):
     k=h5file.keys()
     if 'interferograms' in k: k[0] = 'interferograms'
     elif 'coherence'    in k: k[0] = 'coherence'
-    igramList = h5file[k[0]].keys()
     Bp_igram=[]
-    for igram in igramList:
-        Bp_igram.append((float(h5file[k[0]][igram].attrs['P_BASELINE_BOTTOM_HDR'])+\
-                         float(h5file[k[0]][igram].attrs['P_BASELINE_TOP_HDR']))/2)
+    for Bp_bottom, Bp_top in zip(readfile.read_epoch_attribute(h5file, k[0], 'P_BASELINE_BOTTOM_HDR'),\
+                                 readfile.read_epoch_attribute(h5file, k[0], 'P_BASELINE_TOP_HDR')):
+        Bp_igram.append((float(Bp_bottom)+float(Bp_top))/2)
     
     A,B=design_matrix(h5file)
     dateList       = ptime.igram_date_list(igramsFile)
@@ -998,12 +1423,8 @@ def dBh_dBv_timeseries(igramsFile):
     k=h5file.keys()
     if 'interferograms' in k: k[0] = 'interferograms'
     elif 'coherence'    in k: k[0] = 'coherence'
-    igramList = h5file[k[0]].keys()
-    dBh_igram=[]
-    dBv_igram=[]
-    for igram in igramList:
-        dBh_igram.append(float(h5file[k[0]][igram].attrs['H_BASELINE_RATE_HDR']))
-        dBv_igram.append(float(h5file[k[0]][igram].attrs['V_BASELINE_RATE_HDR']))
+    dBh_igram = [float(i) for i in readfile.read_epoch_attribute(h5file, k[0], 'H_BASELINE_RATE_HDR')]
+    dBv_igram = [float(i) for i in readfile.read_epoch_attribute(h5file, k[0], 'V_BASELINE_RATE_HDR')]
     
   
     A,B=design_matrix(h5file)
@@ -1027,12 +1448,8 @@ def Bh_Bv_timeseries(igramsFile):
     k=h5file.keys()
     if 'interferograms' in k: k[0] = 'interferograms'
     elif 'coherence'    in k: k[0] = 'coherence'
-    igramList = h5file[k[0]].keys()
-    Bh_igram=[]
-    Bv_igram=[]
-    for igram in igramList:
-        Bh_igram.append(float(h5file[k[0]][igram].attrs['H_BASELINE_TOP_HDR']))
-        Bv_igram.append(float(h5file[k[0]][igram].attrs['V_BASELINE_TOP_HDR']))
+    Bh_igram = [float(i) for i in readfile.read_epoch_attribute(h5file, k[0], 'H_BASELINE_TOP_HDR')]
+    Bv_igram = [float(i) for i in readfile.read_epoch_attribute(h5file, k[0], 'V_BASELINE_TOP_HDR')]
   
   
     A,B=design_matrix(h5file)
@@ -1066,16 +1483,13 @@ def stacking(File):
     stack  = np.zeros([length,width])
     if k in ['timeseries','interferograms','wrapped','coherence']:
         ##### Input File Info
-        h5file = h5py.File(File,'r')
-        epochList = sorted(h5file[k].keys())
+        reader = readfile.Reader(File).open()
+        epochList = reader.epochList
         epochNum  = len(epochList)
         for i in range(epochNum):
-            epoch = epochList[i]
-            if k == 'timeseries':  data = h5file[k].get(epoch)[:]
-            else:                  data = h5file[k][epoch].get(epoch)[:]
-            stack += data
+            stack += reader.read(epochList[i])
             print_progress(i+1,epochNum)
-        h5file.close()
+        reader.close()
 
     else:
         try: stack, atrStack = readfile.read(File)
@@ -1108,94 +1522,115 @@ def yymmdd(dates):
     return datesOut
 
 
-def make_triangle(dates12,igram1,igram2,igram3):
-    dates=[]
-    dates.append(igram1.split('-')[0])
-    dates.append(igram1.split('-')[1])
-    dates.append(igram2.split('-')[1])
-    datesyy=[]
-    for d in dates:
-        datesyy.append(yymmdd2YYYYMMDD(d))
-  
-    datesyy.sort()
-    Igramtriangle=[]
-    Igramtriangle.append(datesyy[0][2:]+'-'+datesyy[1][2:])
-    Igramtriangle.append(datesyy[0][2:]+'-'+datesyy[2][2:])
-    Igramtriangle.append(datesyy[1][2:]+'-'+datesyy[2][2:])
-  
-    IgramtriangleIndexes=[dates12.index(Igramtriangle[0]),dates12.index(Igramtriangle[1]),dates12.index(Igramtriangle[2])]
-    return Igramtriangle,IgramtriangleIndexes
-
 def get_triangles(h5file):
-    k=h5file.keys()
-    igramList=h5file[k[0]].keys()
-   
-    dates12=[]
-    for igram in igramList:
-        dates12.append(h5file[k[0]][igram].attrs['DATE12'])
-    Triangles=[]
-    Triangles_indexes=[]
-    for igram1 in dates12:
-        igram1_date1=igram1.split('-')[0]
-        igram1_date2=igram1.split('-')[1]
-  
-        igram2=[]
-        igram2_date2=[]
-        for d in dates12:
-            if igram1_date2==d.split('-')[0]:
-                igram2.append(d)
-                igram2_date2.append(d.split('-')[1])
-    
-        igram3=[]
-        igram3_date2=[]
-        for d in dates12:
-            if igram1_date1==d.split('-')[0] and d != igram1:
-                igram3.append(d)
-                igram3_date2.append(d.split('-')[1])
-  
-        for date in  igram2_date2:
-            if date in igram3_date2:
-                Igramtriangle,IgramtriangleIndexes = make_triangle(dates12,igram1,igram2[igram2_date2.index(date)],\
-                                                                                  igram3[igram3_date2.index(date)])
-                if not Igramtriangle in Triangles:
-                    Triangles.append(Igramtriangle)
-                    Triangles_indexes.append(IgramtriangleIndexes)
-  
-    numTriangles = np.shape(Triangles_indexes)[0]
-    curls=np.zeros([numTriangles,3],dtype=np.int)
-    for i in range(numTriangles):
-        curls[i][:]=Triangles_indexes[i]
- 
-    numIgrams=len(igramList)
-    C=np.zeros([numTriangles,numIgrams])
-    for ni in range(numTriangles):
-        C[ni][curls[ni][0]]=1
-        C[ni][curls[ni][1]]=-1
-        C[ni][curls[ni][2]]=1
- 
-    return curls,Triangles,C
-
-
-def generate_curls(curlfile,h5file,Triangles,curls):
-    ifgramList = h5file['interferograms'].keys()
-    h5curlfile=h5py.File(curlfile,'w')
-    gg = h5curlfile.create_group('interferograms')
-    lcurls=np.shape(curls)[0]
-    for i in range(lcurls):
-        d1=h5file['interferograms'][ifgramList[curls[i,0]]].get(ifgramList[curls[i,0]])
-        d2=h5file['interferograms'][ifgramList[curls[i,1]]].get(ifgramList[curls[i,1]])
-        d3=h5file['interferograms'][ifgramList[curls[i,2]]].get(ifgramList[curls[i,2]])
-        data1=d1[0:d1.shape[0],0:d1.shape[1]]
-        data2=d2[0:d2.shape[0],0:d2.shape[1]]
-        data3=d3[0:d3.shape[0],0:d3.shape[1]]
- 
-        print i
-        group = gg.create_group(Triangles[i][0]+'_'+Triangles[i][1]+'_'+Triangles[i][2])
-        dset = group.create_dataset(Triangles[i][0]+'_'+Triangles[i][1]+'_'+Triangles[i][2],\
-                                    data=data1+data3-data2, compression='gzip')
-        for key, value in h5file['interferograms'][ifgramList[curls[i,0]]].attrs.iteritems():
+    '''Triangles of interferograms in opened interferograms file
+    Output:
+        curls     - 2D np.array of int in size of (numTriangle, 3), index of interferograms of each triangle
+        Triangles - list of list of 3 string, DATE12 of interferograms of each triangle
+        C         - 2D np.array in size of (numTriangle, numIfgram), closure phase = C * interferograms
+    '''
+    k = [i for i in h5file.keys() if i in multi_group_hdf5_file][0]
+    dates12 = readfile.read_epoch_attribute(h5file, k, 'DATE12')
+    curls = pnet.get_triangles(dates12)
+    Triangles = [[dates12[i] for i in curl] for curl in curls]
+    C = pnet.closure_matrix(curls, len(dates12))
+    return curls, Triangles, C
+
+
+def closure_phase(data, curls):
+    '''Closure phase of triangles, pair12 + pair23 - pair13, with NaN in one pair affecting its triangles only
+    Inputs:
+        data  - 2D np.array in size of (numIfgram, numPixel), interferograms
+        curls - 2D np.array of int in size of (numTriangle, 3), from get_triangles()
+    Output: 2D np.array in size of (numTriangle, numPixel)
+    '''
+    return data[curls[:,0]] - data[curls[:,1]] + data[curls[:,2]]
+
+
+def closure_phase_box(File, ifgramList, box, curls):
+    '''Closure phase of all triangles within box, computed from interferograms on demand
+    Output: 2D np.array in float32 in size of (numTriangle, numPixel)
+    '''
+    h5 = h5py.File(File, 'r')
+    data = read_ifgram_box(h5, ifgramList, box)
+    h5.close()
+    return closure_phase(data, curls)
+
+
+def closure_statistics_box(File, ifgramList, box, curls):
+    '''Number of triangles with non-zero integer ambiguity of closure phase for each pixel within box'''
+    closure = closure_phase_box(File, ifgramList, box, curls)
+    with np.errstate(invalid='ignore'):
+        num = np.sum(np.abs(np.round(closure/(2.*np.pi))) > 0, axis=0)
+    return num.astype(np.int16)
+
+
+def closure_statistics(File, outFile='numNonzeroClosure.h5', max_memory=4.0, parallel=1):
+    '''Count triangles with non-zero integer ambiguity of closure phase, for each pixel, for network QA
+    Closure phase is computed block by block from interferograms, without writing curls file.
+    Output file is saved as mask type, with the number of triangles as value.
+    Example:
+        closure_statistics('unwrapIfgram.h5', 'numNonzeroClosure.h5', parallel=4)
+    '''
+    total = time.time()
+    atr = readfile.read_attribute(File)
+    length = int(atr['FILE_LENGTH'])
+    width = int(atr['WIDTH'])
+    h5 = h5py.File(File, 'r')
+    ifgramList = readfile.get_epoch_list(h5, 'interferograms')
+    curls = get_triangles(h5)[0]
+    h5.close()
+    print 'number of interferograms: '+str(len(ifgramList))
+    print 'number of triangles     : '+str(len(curls))
+
+    atr['FILE_TYPE'] = 'mask'
+    atr['UNIT'] = '1'
+    print 'writing >>> '+outFile
+    h5out = h5py.File(outFile, 'w')
+    group = h5out.create_group('mask')
+    dset = writefile.create_dataset(group, 'mask', shape=(length,width), dtype=np.int16)
+    for key, value in atr.iteritems():
+        group.attrs[key] = value
+
+    parallel = max(int(parallel), 1)
+    box_list = split_row_boxes(length, width, len(ifgramList)+3*len(curls), float(max_memory)/parallel,\
+                               min_box_num=parallel)
+    with Parallel(n_jobs=parallel) as pool:
+        for i in range(0, len(box_list), parallel):
+            boxes = box_list[i:i+parallel]
+            numList = pool(delayed(closure_statistics_box)(File, ifgramList, box, curls) for box in boxes)
+            for box, num in zip(boxes, numList):
+                dset[box[1]:box[3],box[0]:box[2]] = num.reshape(box[3]-box[1], box[2]-box[0])
+            print_progress(i+len(boxes), len(box_list), prefix='calculating:',\
+                           suffix='rows %d-%d'%(boxes[0][1],boxes[-1][3]), elapsed_time=time.time()-total)
+    h5out.close()
+    return outFile
+
+
+def generate_curls(curlfile, h5file, Triangles, curls, max_memory=4.0):
+    '''Write closure phase of all triangles into curls file, block by block'''
+    k = 'interferograms'
+    ifgramList = readfile.get_epoch_list(h5file, k)
+    atr = readfile.read_h5_attribute(h5file, k, ifgramList[0])
+    length, width = int(atr['FILE_LENGTH']), int(atr['WIDTH'])
+    curls = np.array(curls)
+
+    print 'writing >>> '+curlfile
+    h5curlfile = h5py.File(curlfile,'w')
+    gg = h5curlfile.create_group(k)
+    dsetList = []
+    for i in range(len(curls)):
+        name = Triangles[i][0]+'_'+Triangles[i][1]+'_'+Triangles[i][2]
+        group = gg.create_group(name)
+        dsetList.append(writefile.create_dataset(group, name, shape=(length,width), dtype=np.float32))
+        for key, value in readfile.read_h5_attribute(h5file, k, ifgramList[curls[i][0]], raw=True).iteritems():
             group.attrs[key] = value
- 
+
+    for box in split_row_boxes(length, width, len(ifgramList)+3*len(curls), max_memory):
+        closure = closure_phase(read_ifgram_box(h5file, ifgramList, box), curls)
+        for i in range(len(curls)):
+            dsetList[i][box[1]:box[3],box[0]:box[2]] = closure[i].reshape(box[3]-box[1], box[2]-box[0])
     h5curlfile.close()
 
 
+
@@ -32,10 +32,12 @@
 # Heresh, Nov 2015: Add ISCE xml reader
 # Yunjun, Jan 2016: Add read()
 # Yunjun, May 2016: Add read_attribute() and 'PROCESSOR','FILE_TYPE','UNIT' attributes
+# Yunjun, Feb 2017: Add get_overview_looks() and read_overview()
 
 
 import os
 import sys
+import collections
 
 import h5py
 import numpy as np
@@ -56,6 +58,212 @@ multi_group_hdf5_file=['interferograms','coherence','wrapped','snaphu_connect_co
 multi_dataset_hdf5_file=['timeseries']
 single_dataset_hdf5_file=['dem','mask','rmse','temporal_coherence', 'velocity']
 
+'''Two layouts of multi_group/multi_dataset HDF5 files
+stack: one 2D dataset per epoch, i.e. timeseries/20100102, interferograms/<ifgram>/<ifgram>
+cube : one 3D dataset of all epochs in size of (num_epoch, length, width), i.e. timeseries/timeseries
+       with index dataset of epoch name: <k>/epoch, and date: <k>/date or date12: <k>/date12
+       and per-epoch attributes as side tables (multi_group only): <k>/epoch_attrs/<attribute_name>
+       See _writefile.create_cube() and convert2cube.py
+'''
+
+
+#########################################################################
+def is_cube(h5file, k):
+    '''Check if epochs of group k in opened h5py.File are stored in one 3D dataset (cube layout)'''
+    return k in h5file[k].keys() and isinstance(h5file[k][k], h5py.Dataset) and h5file[k][k].ndim == 3
+
+
+def get_epoch_list(h5file, k):
+    '''Get sorted list of epochs for group k in opened h5py.File, in stack or cube layout'''
+    if is_cube(h5file, k):
+        return sorted([str(i) for i in h5file[k]['epoch'][:]])
+    return sorted(h5file[k].keys())
+
+
+def read_epoch_attribute(h5file, k, key, epochList=None):
+    '''Read attribute key of epochs of multi_group file in opened h5py.File, in stack or cube layout
+    Inputs:
+        h5file    - h5py.File object
+        k         - string, group name, i.e. interferograms, coherence
+        key       - string, attribute name, i.e. DATE12, P_BASELINE_TOP_HDR
+        epochList - list of string, epochs to read, all epochs from get_epoch_list() by default
+    Output: list of string, attribute value of each epoch
+    Example:
+        date12List = read_epoch_attribute(h5file, 'interferograms', 'DATE12')
+    '''
+    if epochList is None:
+        epochList = get_epoch_list(h5file, k)
+    if is_cube(h5file, k):
+        valueDict = dict(zip([str(i) for i in h5file[k]['epoch'][:]],\
+                             [str(i) for i in h5file[k]['epoch_attrs'][key][:]]))
+        return [valueDict[epoch] for epoch in epochList]
+    return [str(h5file[k][epoch].attrs[key]) for epoch in epochList]
+
+
+def check_stack_layout(h5file, k):
+    '''Exit with error message if group k of opened h5py.File is in cube layout,
+    for tools reading epochs from stack layout only.
+    '''
+    if k in multi_group_hdf5_file+multi_dataset_hdf5_file and is_cube(h5file, k):
+        print 'ERROR: '+h5file.filename+' is in cube layout, which is not supported by this tool.'
+        print 'Convert it into stack layout with: convert2cube.py '+h5file.filename+' --stack'
+        sys.exit(1)
+    return
+
+
+#########################################################################
+def get_file_type(h5file):
+    '''Get PySAR file type, i.e. the main group name, of opened h5py.File'''
+    k = h5file.keys()
+    if   'interferograms' in k: k[0] = 'interferograms'
+    elif 'coherence'      in k: k[0] = 'coherence'
+    elif 'timeseries'     in k: k[0] = 'timeseries'
+    return str(k[0])
+
+
+def get_file_stamp(File):
+    '''Identity of file content on disk: inode, size and modification time'''
+    st = os.stat(File)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+class Reader(object):
+    '''Reader of PySAR HDF5 file, with file type, epoch list and attributes read once and cached.
+    HDF5 file is opened once within the with statement, for reading many epochs/boxes.
+    Inputs:
+        File : string, path of PySAR HDF5 file, in stack or cube layout
+    Example:
+        with Reader('timeseries.h5') as f:
+            atr  = f.attribute()
+            data = f.read('20101120', box=(100,1100,500,2500))
+            data = f['20101120', 1100:2500, 100:500]
+            for epoch, data in f.iter_epochs(box=(100,1100,500,2500)):
+                print epoch, np.nanmean(data)
+        data = Reader('velocity.h5').open()[:]
+    '''
+    def __init__(self, File):
+        self.file  = File
+        self.stamp = get_file_stamp(File)
+        self.h5    = None
+        self._atr  = dict()
+
+        h5file = h5py.File(File,'r')
+        self.k = get_file_type(h5file)
+        self.cube = False
+        self.epochList = []
+        self._epochIndex = dict()
+        if self.k in multi_group_hdf5_file+multi_dataset_hdf5_file:
+            self.cube = is_cube(h5file, self.k)
+            if self.cube:
+                epochList = [str(i) for i in h5file[self.k]['epoch'][:]]
+                self._epochIndex = dict([(epochList[i], i) for i in range(len(epochList))])
+            self.epochList = get_epoch_list(h5file, self.k)
+        h5file.close()
+
+    def open(self):
+        if self.h5 is None:
+            self.h5 = h5py.File(self.file,'r')
+        return self
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attribute(self, epoch='', raw=False):
+        '''Attributes of file (of epoch for multi_group file), same as read_attribute(),
+        or as saved in file with raw=True.
+        '''
+        if self.k in multi_group_hdf5_file:
+            if not epoch:
+                epoch = self.epochList[0]
+        else:
+            epoch = ''
+        if (epoch, raw) not in self._atr.keys():
+            close = self.h5 is None
+            self.open()
+            self._atr[(epoch, raw)] = read_h5_attribute(self.h5, self.k, epoch, raw)
+            if close:
+                self.close()
+        return dict(self._atr[(epoch, raw)])
+
+    def dataset(self, epoch=''):
+        '''Get h5py.Dataset of epoch and its index in the 1st dimension (None for 2D dataset)'''
+        self.open()
+        k = self.k
+        if k in single_dataset_hdf5_file:
+            return self.h5[k].get(k), None
+        elif k not in multi_group_hdf5_file+multi_dataset_hdf5_file:
+            print 'Unrecognized h5 file type: '+k
+            return None, None
+
+        if not epoch in self.epochList:
+            print 'input epoch is not included in file: '+self.file
+            print 'input epoch: '+epoch
+            print 'epoch in file '+self.file
+            print self.epochList
+        if self.cube:
+            return self.h5[k].get(k), self._epochIndex[epoch]
+        elif k in multi_dataset_hdf5_file:
+            return self.h5[k].get(epoch), None
+        else:
+            return self.h5[k][epoch].get(epoch), None
+
+    def read(self, epoch='', box=()):
+        '''Read 2D matrix of epoch within box, defined in (x0, y0, x1, y1)'''
+        dset, idx = self.dataset(epoch)
+        if not box:
+            box = (0, 0, dset.shape[-1], dset.shape[-2])
+        if idx is not None:
+            return dset[idx, box[1]:box[3], box[0]:box[2]]
+        return dset[box[1]:box[3], box[0]:box[2]]
+
+    def iter_epochs(self, box=(), epochList=None):
+        '''Iterate over (epoch, 2D matrix within box) of all/input epochs'''
+        if epochList is None:
+            epochList = self.epochList
+        for epoch in epochList:
+            yield epoch, self.read(epoch, box)
+
+    def __getitem__(self, key):
+        '''Slicing: f[epoch], f[epoch, y0:y1, x0:x1] for multi-dataset file, f[y0:y1, x0:x1] for single'''
+        if self.k in single_dataset_hdf5_file:
+            return self.dataset()[0][key]
+        if not isinstance(key, tuple):
+            key = (key,)
+        dset, idx = self.dataset(key[0])
+        if idx is not None:
+            return dset[(idx,)+key[1:]]
+        return dset[key[1:]] if len(key) > 1 else dset[:]
+
+
+##### Pool of readers for module-level read() and read_attribute()
+# Readers are kept in a least-recently-used pool and reused while the file is unchanged on disk,
+# with their HDF5 handle closed between calls: HDF5 refuses to open a file for writing while it
+# is still open for reading in the same process, which PySAR scripts often do after reading.
+reader_pool_size = 8
+_reader_pool = collections.OrderedDict()
+
+def get_reader(File):
+    '''Get Reader object of File from the pool, reuse it if file is unchanged.'''
+    key = os.path.abspath(File)
+    stamp = get_file_stamp(File)
+    reader = _reader_pool.pop(key, None)
+    if reader is None or reader.stamp != stamp:
+        if reader is not None:
+            reader.close()
+        reader = Reader(File)
+    _reader_pool[key] = reader
+    while len(_reader_pool) > reader_pool_size:
+        _reader_pool.popitem(last=False)[1].close()
+    return reader
+
 
 #########################################################################
 def read(File, box=(), epoch=''):
@@ -92,6 +300,15 @@ def read(File, box=(), epoch=''):
 
     # Basic Info
     ext = os.path.splitext(File)[1].lower()
+
+    ##### HDF5
+    if ext in ['.h5','.he5']:
+        reader = get_reader(File)
+        with reader:
+            atr  = reader.attribute(epoch)
+            data = reader.read(epoch, box)
+        return data, atr
+
     atr = read_attribute(File, epoch)
     processor = atr['PROCESSOR']
 
@@ -102,41 +319,8 @@ def read(File, box=(), epoch=''):
     #    if (box[2]-box[0])*(box[3]-box[1]) < width*length:
     #        atr = subset_attribute(atr, box)
 
-    ##### HDF5
-    if ext in ['.h5','.he5']:
-        h5file = h5py.File(File,'r')
-        k = atr['FILE_TYPE']
-
-        # Read Dataset
-        if k in multi_group_hdf5_file+multi_dataset_hdf5_file:
-            epochList = sorted(h5file[k].keys())
-
-            if not epoch in epochList:
-                print 'input epoch is not included in file: '+File
-                print 'input epoch: '+epoch
-                print 'epoch in file '+File
-                print epochList
-
-            if k in multi_dataset_hdf5_file:
-                dset = h5file[k].get(epoch)
-            else:
-                dset = h5file[k][epoch].get(epoch)
-
-        elif k in single_dataset_hdf5_file:
-            dset = h5file[k].get(k)
-        else: print 'Unrecognized h5 file type: '+k
-
-        # Crop
-        if box:
-            data = dset[box[1]:box[3],box[0]:box[2]]
-        else:
-            data = dset[:,:]
-
-        h5file.close()
-        return data, atr
-
     ##### Image
-    elif ext in ['.jpeg','.jpg','.png','.ras','.bmp']:
+    if ext in ['.jpeg','.jpg','.png','.ras','.bmp']:
         atr = read_roipac_rsc(File+'.rsc')
         data  = Image.open(File)
         if box:  data = data.crop(box)
@@ -145,17 +329,15 @@ def read(File, box=(), epoch=''):
     ##### ISCE
     elif processor == 'isce':
         if   ext in ['.flat']:
-            amp, data, atr = read_complex_float32(File)
+            amp, data, atr = read_complex_float32(File, box=box)
         elif ext in ['.cor']:
-            data, atr = read_real_float32(File)
+            data, atr = read_real_float32(File, box)
         elif ext in ['.slc']:
-            data, pha, atr = read_complex_float32(File)
+            data, pha, atr = read_complex_float32(File, box=box)
             #ind = np.nonzero(data)
             #data[ind] = np.log10(data[ind])     # dB
             #atr['UNIT'] = 'dB'
         else: print 'Un-supported '+processfor+' file format: '+ext
-  
-        if box:  data = data[box[1]:box[3],box[0]:box[2]]
         return data, atr
 
     ##### ROI_PAC
@@ -168,20 +350,16 @@ def read(File, box=(), epoch=''):
             return pha, atr
 
         elif ext in ['.dem']:
-            dem,atr = read_real_int16(File)
-            if box:  dem = dem[box[1]:box[3],box[0]:box[2]]
+            dem,atr = read_real_int16(File, box)
             return dem, atr
   
         elif ext in ['.int']:
-            amp, pha, atr = read_complex_float32(File)
-            if box:
-                pha = pha[box[1]:box[3],box[0]:box[2]]
+            amp, pha, atr = read_complex_float32(File, box=box)
             return pha, atr
         elif ext in ['.amp']:
-            masterAmplitude, slaveAmplitude, atr = read_complex_float32(File, real_imag=True)
-            if box:
-                masterAmplitude = masterAmplitude[box[1]:box[3],box[0]:box[2]]
-                slaveAmplitude = slaveAmplitude[box[1]:box[3],box[0]:box[2]]
+            data, atr = read_complex_float32(File, real_imag=True, box=box)
+            masterAmplitude = data.real
+            slaveAmplitude  = data.imag
             return masterAmplitude, slaveAmplitude, atr
         elif ext in ['.flg', '.byt']:
             flag, atr = read_flag(File)
@@ -206,8 +384,7 @@ def read(File, box=(), epoch=''):
         ##### Gamma
         #elif processor == 'gamma':
         elif ext == '.mli':
-            data,atr = read_real_float32(File)
-            if box: data = data[box[1]:box[3],box[0]:box[2]]
+            data,atr = read_real_float32(File, box)
             return data, atr
 
         elif ext == '.slc':
@@ -222,6 +399,81 @@ def read(File, box=(), epoch=''):
     else: print 'Unrecognized file format: '+ext; return 0
 
 
+##### Overviews - averaged datasets at 2x, 4x, 8x ... looks for display, built by add_overviews.py
+# stored in a side file <File>.ovr, as /<looks>/<epoch> datasets, valid while File is unchanged on disk
+def get_overview_file(File):
+    '''Path of overview file of input file'''
+    return File+'.ovr'
+
+
+def get_overview_looks(File, max_looks, box=(), divide=False):
+    '''Largest number of looks of valid overviews of File not exceeding max_looks, 1 if none
+    Inputs:
+        File      - string, path of file
+        max_looks - int, maximum number of looks
+        box       - 4-tuple of int, area to read, (x0, y0, x1, y1) in pixel of File; only overviews
+                    with box offset in multiple of looks are used, as read_overview() requires.
+        divide    - bool, only use overviews with looks dividing max_looks, i.e. for further multilooking
+    Example:
+        looks = get_overview_looks('timeseries.h5', 8)
+        looks = get_overview_looks('timeseries.h5', 6, box=(100,200,1100,1700), divide=True)
+    '''
+    ovrFile = get_overview_file(File)
+    if max_looks < 2 or not os.path.isfile(ovrFile):
+        return 1
+    h5 = h5py.File(ovrFile, 'r')
+    looks_list = [int(i) for i in h5.keys()]
+    stamp = h5.attrs.get('SOURCE_STAMP')
+    h5.close()
+    if stamp != str(get_file_stamp(File)):
+        print 'WARNING: '+File+' changed after its overviews are built, ignore '+ovrFile
+        return 1
+    looks_list = [i for i in looks_list if i <= max_looks]
+    if divide:
+        looks_list = [i for i in looks_list if max_looks % i == 0]
+    if box:
+        looks_list = [i for i in looks_list if box[0] % i == 0 and box[1] % i == 0]
+    if not looks_list:
+        return 1
+    return max(looks_list)
+
+
+def read_overview(File, looks, box=(), epoch=''):
+    '''Read epoch within box from overview of File with looks.
+    Inputs:
+        File  - string, path of file
+        looks - int, number of looks of overview, from get_overview_looks()
+        box   - 4-tuple of int, area to read, (x0, y0, x1, y1) in pixel of File,
+                with x0/y0 in multiple of looks
+        epoch - string, epoch to read, i.e. 20070107 for timeseries
+    Output:
+        data - 2D np.array in size of ((y1-y0)/looks, (x1-x0)/looks), the same as
+               multilook_matrix(data_of_box, looks, looks), NaN for pixels out of file
+    Example:
+        data = read_overview('timeseries.h5', 4, (0,0,1000,1500), '20070107')
+    '''
+    atr = read_attribute(File)
+    if not box:
+        box = (0, 0, int(atr['WIDTH']), int(atr['FILE_LENGTH']))
+    if not epoch:
+        epoch = atr['FILE_TYPE']
+    if box[0] % looks or box[1] % looks:
+        raise ValueError('box offset '+str(box[0:2])+' is not a multiple of overview looks: '+str(looks))
+    x0 = box[0]/looks
+    y0 = box[1]/looks
+    shape = ((box[3]-box[1])/looks, (box[2]-box[0])/looks)
+
+    h5 = h5py.File(get_overview_file(File), 'r')
+    dset = h5[str(looks)].get(epoch)
+    x1 = min(x0+shape[1], dset.shape[1])
+    y1 = min(y0+shape[0], dset.shape[0])
+    data = np.zeros(shape, dset.dtype)
+    data[:] = np.nan
+    data[0:y1-y0, 0:x1-x0] = dset[y0:y1, x0:x1]
+    h5.close()
+    return data
+
+
 #########################################################################
 def read_attribute(File, epoch=''):
     '''Read attributes of input file into a dictionary
@@ -236,31 +488,9 @@ def read_attribute(File, epoch=''):
 
     ##### PySAR
     if ext in ['.h5','.he5']:
-        h5f = h5py.File(File,'r')
-        k = h5f.keys()
-        if   'interferograms' in k: k[0] = 'interferograms'
-        elif 'coherence'      in k: k[0] = 'coherence'
-        elif 'timeseries'     in k: k[0] = 'timeseries'
-        if   k[0] in multi_group_hdf5_file:
-            if epoch:
-                attrs  = h5f[k[0]][epoch].attrs
-            else:
-                attrs  = h5f[k[0]][h5f[k[0]].keys()[0]].attrs
-        elif k[0] in multi_dataset_hdf5_file+single_dataset_hdf5_file:
-            attrs  = h5f[k[0]].attrs
-        else: print 'Unrecognized h5 file key: '+k[0]
-
-        atr = dict()
-        for key, value in attrs.iteritems():  atr[key] = str(value)
-        atr['PROCESSOR'] = 'pysar'
-        atr['FILE_TYPE'] = str(k[0])
-
-        if k[0] == 'timeseries':
-            try: atr['ref_date']
-            except: atr['ref_date'] = sorted(h5f[k[0]].keys())[0]
-
-        h5f.close()
+        return get_reader(File).attribute(epoch)
     
+    ##### ROI_PAC, GAMMA, ISCE
     else:
         # attribute file list
         try:
@@ -288,6 +518,45 @@ def read_attribute(File, epoch=''):
     
         else: print 'Unrecognized file extension: '+ext; sys.exit(1)
 
+    atr = update_unit_attribute(atr)
+    return atr
+
+
+def read_h5_attribute(h5f, k, epoch='', raw=False):
+    '''Read attributes of group k (and epoch for multi_group file) in opened h5py.File
+    With raw=True, attributes are returned as saved in file, without PROCESSOR/FILE_TYPE/UNIT... added.
+    '''
+    if   k in multi_group_hdf5_file and is_cube(h5f, k):
+        attrs  = dict(h5f[k].attrs)
+        epochList = [str(i) for i in h5f[k]['epoch'][:]]
+        if epoch:  idx = epochList.index(epoch)
+        else:      idx = epochList.index(sorted(epochList)[0])
+        for key in h5f[k]['epoch_attrs'].keys():
+            attrs[key] = h5f[k]['epoch_attrs'][key][idx]
+    elif k in multi_group_hdf5_file:
+        if epoch:
+            attrs  = h5f[k][epoch].attrs
+        else:
+            attrs  = h5f[k][h5f[k].keys()[0]].attrs
+    elif k in multi_dataset_hdf5_file+single_dataset_hdf5_file:
+        attrs  = h5f[k].attrs
+    else: print 'Unrecognized h5 file key: '+k
+
+    if raw:
+        return dict(attrs)
+    atr = dict()
+    for key, value in attrs.iteritems():  atr[key] = str(value)
+    atr['PROCESSOR'] = 'pysar'
+    atr['FILE_TYPE'] = k
+
+    if k == 'timeseries':
+        try: atr['ref_date']
+        except: atr['ref_date'] = get_epoch_list(h5f, k)[0]
+    return update_unit_attribute(atr)
+
+
+def update_unit_attribute(atr):
+    '''Add UNIT attribute based on FILE_TYPE'''
     # Unit - str
     #if 'UNIT' not in atr.keys():
     if atr['FILE_TYPE'] in ['interferograms','wrapped','.unw','.int','.flat']:
@@ -397,6 +666,19 @@ def merge_attribute(atr1,atr2):
 
 
 #########################################################################
+def read_binary_memmap(File, dtype, shape):
+    '''Map binary file into memory in copy-on-write mode, without reading it.
+    Only the pages of the returned slices/views are read from disk when accessed, and
+    changes to them are kept in memory, never written back to File.
+    Inputs:
+        File  - string, path of binary file
+        dtype - data type, i.e. np.float32, np.complex64, np.int16
+        shape - tuple of int, (length, width) of the binary matrix in number of dtype
+    Output: np.memmap object
+    '''
+    return np.memmap(File, dtype=dtype, mode='c', shape=shape)
+
+
 def read_float32(File, box=None):
     '''Reads roi_pac data (RMG format, interleaved line by line)
     should rename it to read_rmg_float32()
@@ -414,6 +696,8 @@ def read_float32(File, box=None):
     magnitude, magnitude, magnitude, ...,phase, phase, phase, ...
     ......
     
+    File is memory mapped, amplitude and phase are returned as views of the box,
+    only rows within box are read from disk.
        box  : 4-tuple defining the left, upper, right, and lower pixel coordinate.
     Example:
        a,p,r = read_float32('100102-100403.unw')
@@ -426,19 +710,13 @@ def read_float32(File, box=None):
     if not box:
         box = [0,0,width,length]
 
-    data = np.fromfile(File,np.float32,box[3]*2*width).reshape(box[3],2*width)
+    data = read_binary_memmap(File, np.float32, (length, 2*width))
     amplitude = data[box[1]:box[3],box[0]:box[2]]
     phase     = data[box[1]:box[3],width+box[0]:width+box[2]]
-
-    #oddindices = np.where(np.arange(length*2)&1)[0]
-    #data = np.fromfile(File,np.float32,length*2*width).reshape(length*2,width)
-    #amplitude = np.array([data.take(oddindices-1,axis=0)]).reshape(length,width)
-    #phase     = np.array([data.take(oddindices,  axis=0)]).reshape(length,width)
-
     return amplitude, phase, atr
 
 
-def read_complex_float32(File, real_imag=False):
+def read_complex_float32(File, real_imag=False, box=None):
     '''Read complex float 32 data matrix, i.e. roi_pac int or slc data.
     old name: read_complex64()
     
@@ -454,34 +732,41 @@ def read_complex_float32(File, real_imag=False):
         real_imag : flag for output format, 
                     0 for amplitude and phase [by default], 
                     non-0 : for real and imagery
+        box  : 4-tuple defining the left, upper, right, and lower pixel coordinate.
+               only rows within box are read from the memory mapped file.
     
     Example:
         amp, phase, atr = read_complex_float32('geo_070603-070721_0048_00018.int')
         data, atr       = read_complex_float32('150707.slc', 1)
+        data, atr       = read_complex_float32('150707.slc', 1, (100,1200,500,1500))
     '''
 
     atr = read_attribute(File)
     width = int(float(atr['WIDTH']))
     length = int(float(atr['FILE_LENGTH']))
-    ##data = np.fromfile(File,np.complex64,length*2*width).reshape(length,width)
-    data = np.fromfile(File,np.complex64,length*width).reshape(length,width)
+    if not box:
+        box = [0,0,width,length]
+    data = read_binary_memmap(File, np.complex64, (length, width))[box[1]:box[3],box[0]:box[2]]
 
     if not real_imag:
-        amplitude = np.array([np.hypot(  data.real,data.imag)]).reshape(length,width)
-        phase     = np.array([np.arctan2(data.imag,data.real)]).reshape(length,width)
+        amplitude = np.hypot(  data.real,data.imag)
+        phase     = np.arctan2(data.imag,data.real)
         return amplitude, phase, atr
     else:
         return data, atr
 
 
-def read_real_float32(File):
+def read_real_float32(File, box=None):
     '''Read real float 32 data matrix, i.e. GAMMA .mli file
     Usage:  data, atr = read_real_float32('20070603.mli')
+            data, atr = read_real_float32('20070603.mli', (100,1200,500,1500))
     '''
     atr = read_attribute(File)
     width = int(float(atr['WIDTH']))
     length = int(float(atr['FILE_LENGTH']))
-    data = np.fromfile(File,dtype=np.float32).reshape(length,width)
+    if not box:
+        box = [0,0,width,length]
+    data = read_binary_memmap(File, np.float32, (length, width))[box[1]:box[3],box[0]:box[2]]
     return data, atr
 
 
@@ -493,6 +778,7 @@ def read_complex_int16(File, box=None, real_imag=False):
     Inputs:
        file: complex data matrix (cpx_int16)
        box: 4-tuple defining the left, upper, right, and lower pixel coordinate.
+    File is memory mapped, real and imaginary parts are returned as strided views of the box.
     Example:
        data,rsc = read_complex_int16('100102.slc')
        data,rsc = read_complex_int16('100102.slc',(100,1200,500,1500))
@@ -504,47 +790,35 @@ def read_complex_int16(File, box=None, real_imag=False):
     if not box:
         box = [0,0,width,length]
 
-    data = np.fromfile(File,np.int16,box[3]*2*width).reshape(box[3],2*width)
-    data = data[box[1]:box[3],2*box[0]:2*box[2]].flatten()
-    odd_idx = np.arange(1, len(data), 2)
-    real = data[odd_idx-1].reshape(box[3]-box[1],box[2]-box[0])
-    imag = data[odd_idx].reshape(box[3]-box[1],box[2]-box[0])
+    data = read_binary_memmap(File, np.int16, (length, 2*width))
+    data = data[box[1]:box[3],2*box[0]:2*box[2]]
+    real = data[:,0::2]
+    imag = data[:,1::2]
 
     if real_imag:
         return real, imag, atr
     else:
-        amplitude = np.array([np.hypot(imag,real)]).reshape(length,width)
-        phase = np.array([np.arctan2(imag,real)]).reshape(length,width)
+        amplitude = np.hypot(imag,real)
+        phase = np.arctan2(imag,real)
         return amplitude, phase, atr
 
-    #data = np.fromfile(File,np.int16,length*2*width).reshape(length*2,width)
-    #oddindices = np.where(np.arange(length*2)&1)[0]
-    #real = np.array([data.take(oddindices-1,axis=0)]).reshape(length,width)
-    #imag = np.array([data.take(oddindices,  axis=0)]).reshape(length,width)
-
-    #amplitude = np.array([np.hypot(  real,imag)]).reshape(length,width)
-    #phase     = np.array([np.arctan2(imag,real)]).reshape(length,width)
-    #return amplitude, phase, parContents
-
 
-def read_dem(File):
+def read_dem(File, box=None):
     '''Read real int 16 data matrix, i.e. ROI_PAC .dem file.
     Input:  roi_pac format dem file
     Usage:  dem, atr = read_real_int16('gsi10m_30m.dem')
     '''
-    atr = read_attribute(File)
-    width = int(float(atr['WIDTH']))
-    length = int(float(atr['FILE_LENGTH'])) 
-    dem = np.fromfile(File, dtype=np.int16).reshape(length, width)
-    return dem, atr
+    return read_real_int16(File, box)
 
 
-def read_real_int16(File):
-    '''Same as read_dem() above'''
+def read_real_int16(File, box=None):
+    '''Read real int 16 data matrix, i.e. ROI_PAC .dem file, within box.'''
     atr = read_attribute(File)
     width = int(float(atr['WIDTH']))
     length = int(float(atr['FILE_LENGTH'])) 
-    dem = np.fromfile(File, dtype=np.int16).reshape(length, width)
+    if not box:
+        box = [0,0,width,length]
+    dem = read_binary_memmap(File, np.int16, (length, width))[box[1]:box[3],box[0]:box[2]]
     return dem, atr
 
 
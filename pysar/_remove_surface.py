@@ -7,65 +7,163 @@
 # Yunjun, Jun 2016: merge functions for interferograms, timeseries
 #                   into one, and use read() for all the others
 # Yunjun, Aug 2016: add remove*multiple_surface()
+# Yunjun, Feb 2017: use process.map_file()
+#                   add surface_factor() to factorize design matrix once for all epochs
+#                   add get_surface_factor() to cache factor once per process
 
 
 import os
 import time
 
 import numpy as np
-import h5py
 
 import pysar._readfile as readfile
-import pysar._writefile as writefile
+import pysar._process as process
 
 
 ##################################################################
-def remove_data_surface(data, mask, surf_type='plane'):
-    '''Remove surface from input data matrix based on pixel marked by mask'''
-    mask[np.isnan(data)] = 0
-    mask = mask.flatten(1) 
-    z = data.flatten(1)
-    ndx= mask !=0
-    x = range(0,np.shape(data)[1])
-    y = range(0,np.shape(data)[0])
-    x1,y1 = np.meshgrid(x,y)
-    points = np.vstack((y1.flatten(1),x1.flatten(1))).T
-    if surf_type=='quadratic':
-        G = np.array([points[:,0]**2,points[:,1]**2,points[:,0],points[:,1],points[:,0]*points[:,1],\
-                     np.ones(np.shape(points)[0])],np.float32).T
-    elif surf_type=='plane':
-        G = np.array([points[:,0],points[:,1],\
-                     np.ones(np.shape(points)[0])],np.float32).T
-    elif surf_type == 'quadratic_range':
-        G = np.array([points[:,1]**2,points[:,1],\
-                     np.ones(np.shape(points)[0])],np.float32).T
-    elif surf_type == 'quadratic_azimuth':
-        G = np.array([points[:,0]**2,points[:,0],\
-                     np.ones(np.shape(points)[0])],np.float32).T
-    elif surf_type=='plane_range':
-        G = np.array([points[:,1],\
-                     np.ones(np.shape(points)[0])],np.float32).T
-    elif surf_type=='plane_azimuth':
-        G = np.array([points[:,0],\
-                     np.ones(np.shape(points)[0])],np.float32).T
-  
-    z = z[ndx]
-    G = G[ndx]
-    G1=np.linalg.pinv(G)
-    plane = np.dot(G1,z)
-  
+def get_design_matrix(y, x, surf_type='plane'):
+    '''Design matrix of surface for pixels at y/x
+    Inputs:
+        y/x       - 1D np.array, row/column number of pixels
+        surf_type - string, plane, quadratic, plane_range, plane_azimuth, quadratic_range, quadratic_azimuth
+    Output:
+        G - 2D np.array in float64, in size of (pixel number, surface parameter number)
+    '''
+    y = np.array(y, np.float64)
+    x = np.array(x, np.float64)
+    ones = np.ones(y.shape)
+    if   surf_type == 'quadratic':          G = [y**2, x**2, y, x, y*x, ones]
+    elif surf_type == 'plane':              G = [y, x, ones]
+    elif surf_type == 'quadratic_range':    G = [x**2, x, ones]
+    elif surf_type == 'quadratic_azimuth':  G = [y**2, y, ones]
+    elif surf_type == 'plane_range':        G = [x, ones]
+    elif surf_type == 'plane_azimuth':      G = [y, ones]
+    else:
+        raise ValueError('Un-recognized surface type: '+surf_type)
+    return np.vstack(G).T
+
+
+def design_matrix_product(y, x, surf_type='plane', z=None, step=2**20):
+    '''Normal matrix G^T*G, or G^T*z, of design matrix G of pixels at y/x,
+    formed in steps of pixels, without the whole design matrix in memory.
+    Inputs:
+        y/x       - 1D np.array, row/column number of pixels
+        surf_type - string, surface type
+        z         - 1D np.array, data of pixels, to calculate G^T*z instead of G^T*G
+    Output:
+        2D np.array in size of (parameter number, parameter number) for G^T*G, or
+        1D np.array in size of (parameter number,) for G^T*z
+    '''
+    out = None
+    for i in range(0, y.size, step):
+        G = get_design_matrix(y[i:i+step], x[i:i+step], surf_type)
+        if z is None:
+            prod = np.dot(G.T, G)
+        else:
+            prod = np.dot(G.T, np.array(z[i:i+step], np.float64))
+        if out is None:  out = prod
+        else:            out += prod
+    if out is None:
+        num_param = get_design_matrix([0], [0], surf_type).shape[1]
+        out = np.zeros((num_param, num_param) if z is None else num_param)
+    return out
+
+
+def normal_matrix_inverse(GTG):
+    '''Pseudo-inverse of normal matrix G^T*G, with columns of G scaled to unit norm,
+    as G^T*G of quadratic surface in pixel coordinates is poorly conditioned.
+    '''
+    scale = np.sqrt(np.diag(GTG))
+    scale[scale == 0.] = 1.
+    return np.linalg.pinv(GTG / np.outer(scale, scale)) / np.outer(scale, scale)
+
+
+def surface_factor(mask, surf_type='plane'):
+    '''Pre-compute the inverse of normal matrix of design matrix of pixels marked by mask, once for all epochs
+    Surface parameters of each epoch are then (G^T*G)^-1 * G^T*z, with G^T*z formed from the
+    row/column number of pixels, so that the factor is small to share between processes.
+    Inputs:
+        mask      - 2D np.array, pixels with non-zero value are used for surface estimation
+        surf_type - string, surface type
+    Output:
+        factor - dict, with the following items:
+                 surf_type - string
+                 shape     - tuple of 2 int, size of mask
+                 index     - 1D np.array of int, 1D index of marked pixels
+                 y/x       - 1D np.array of int, row/column number of marked pixels
+                 GTG_inv   - 2D np.array in size of (surface parameter number, surface parameter number)
+    Example:
+        factor = surface_factor(mask, 'quadratic')
+        for data in dataList:
+            data_n, ramp = remove_data_surface(data, mask, factor=factor)
+    '''
+    index = np.flatnonzero(mask != 0)
+    y, x = np.divmod(index, mask.shape[1])
+    factor = dict()
+    factor['surf_type'] = surf_type
+    factor['shape'] = mask.shape
+    factor['index'] = index
+    factor['y'] = y
+    factor['x'] = x
+    factor['GTG_inv'] = normal_matrix_inverse(design_matrix_product(y, x, surf_type))
+    return factor
+
+
+def estimate_surface(data, factor):
+    '''Estimate surface parameters of data with pre-computed factor from surface_factor()
+    Pixels with NaN value are excluded, with the normal matrix re-computed for this data only.
+    '''
+    z = data.ravel()[factor['index']]
+    nan = np.isnan(z)
+    y, x = factor['y'], factor['x']
+    if not np.any(nan):
+        return np.dot(factor['GTG_inv'], design_matrix_product(y, x, factor['surf_type'], z))
+
+    y, x, z = y[~nan], x[~nan], z[~nan]
+    GTG_inv = normal_matrix_inverse(design_matrix_product(y, x, factor['surf_type']))
+    return np.dot(GTG_inv, design_matrix_product(y, x, factor['surf_type'], z))
+
+
+def evaluate_surface(plane, surf_type, shape, box=None):
+    '''Surface in size of shape (or box) from its parameters, without full-size meshgrid
+    Inputs:
+        plane     - 1D np.array, surface parameters, from estimate_surface()
+        surf_type - string, surface type
+        shape     - tuple of 2 int, size of data
+        box       - 4-tuple of int, (x0, y0, x1, y1), area of data to evaluate, optional
+    Output:
+        zplane - 2D np.array in float64
+    '''
+    if not box:
+        box = (0, 0, shape[1], shape[0])
+    y = np.arange(box[1], box[3], dtype=np.float64).reshape(-1,1)
+    x = np.arange(box[0], box[2], dtype=np.float64).reshape(1,-1)
     if   surf_type == 'quadratic':
-        zplane = plane[0]*y1**2 + plane[1]*x1**2 + plane[2]*y1 + plane[3]*x1 + plane[4]*y1*x1 + plane[5]
-    elif surf_type =='plane':
-        zplane = plane[0]*y1 + plane[1]*x1 + plane[2]
-    elif surf_type == 'quadratic_range':
-        zplane = plane[0]*x1**2  + plane[1]*x1 + plane[2]
-    elif surf_type == 'quadratic_azimuth':
-        zplane = plane[0]*y1**2  + plane[1]*y1 + plane[2]
-    elif surf_type == 'plane_range':
-        zplane = plane[0]*x1 + plane[1]
-    elif surf_type == 'plane_azimuth':
-        zplane = plane[0]*y1 + plane[1]
+        zplane = (plane[0]*y**2 + plane[2]*y + plane[5]) + (plane[1]*x**2 + plane[3]*x) + plane[4]*y*x
+    elif surf_type == 'plane':              zplane = (plane[0]*y + plane[2]) + plane[1]*x
+    elif surf_type == 'quadratic_range':    zplane = plane[0]*x**2 + plane[1]*x + plane[2] + 0*y
+    elif surf_type == 'quadratic_azimuth':  zplane = plane[0]*y**2 + plane[1]*y + plane[2] + 0*x
+    elif surf_type == 'plane_range':        zplane = plane[0]*x + plane[1] + 0*y
+    elif surf_type == 'plane_azimuth':      zplane = plane[0]*y + plane[1] + 0*x
+    return zplane
+
+
+def remove_data_surface(data, mask, surf_type='plane', factor=None):
+    '''Remove surface from input data matrix based on pixel marked by mask
+    Inputs:
+        data      - 2D np.array
+        mask      - 2D np.array, pixels with non-zero value are used for surface estimation
+        surf_type - string, surface type
+        factor    - dict, pre-computed from surface_factor(mask, surf_type), to share for all epochs
+    Outputs:
+        data_n - 2D np.array, data with surface removed
+        zplane - 2D np.array, surface
+    '''
+    if factor is None:
+        factor = surface_factor(mask, surf_type)
+    plane = estimate_surface(data, factor)
+    zplane = evaluate_surface(plane, factor['surf_type'], data.shape)
 
     '''
     ## Some notes from _pysar_utilities.py remove_surface_velocity()
@@ -85,40 +183,46 @@ def remove_data_surface(data, mask, surf_type='plane'):
        h5flat['velocity'].attrs['Azimuth_Gradient'] = str(1000*plane[0][0]) + '   mm/yr/pixel'
        h5flat['velocity'].attrs['Azimuth_Ramp'] = str(MaxRamp) +'   mm/yr'
        print 'Maximum ramp in azimuth direction = '+ str(MaxRamp) + ' mm/yr'
-    print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
+    print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
     '''
-  
+
     data_n = data - zplane
     data_n[data == 0.] = 0.
     data_n = np.array(data_n,data.dtype)
     zplane = np.array(zplane,data.dtype)
-  
+
     return data_n, zplane
 
 
 ##################################################################
-def remove_data_multiple_surface(data, mask, surf_type, ysub):
+def multiple_surface_factor(mask, surf_type, ysub):
+    '''Pre-computed factor of surface_factor() for each subset in rows of ysub'''
+    factorList = []
+    for i in range(len(ysub)/2):
+        mask_i = np.zeros(mask.shape, mask.dtype)
+        mask_i[ysub[2*i]:ysub[2*i+1],:] = mask[ysub[2*i]:ysub[2*i+1],:]
+        factorList.append(surface_factor(mask_i, surf_type))
+    return factorList
+
+
+def remove_data_multiple_surface(data, mask, surf_type, ysub, factorList=None):
     ## ysub = [0,2400,2000,6800]
     dataOut = np.zeros(data.shape,data.dtype)
     dataOut[:] = np.nan
+    if factorList is None:
+        factorList = multiple_surface_factor(mask, surf_type, ysub)
 
     surfaceNum = len(ysub)/2
     ## 1st Mask
     print 'removing 1st surface ...'
     i = 0
-    mask_i = np.zeros(data.shape,data.dtype)
-    mask_i[ysub[2*i]:ysub[2*i+1],:] = mask[ysub[2*i]:ysub[2*i+1],:]
-
-    dataOut_i,ramp_i = remove_data_surface(data,mask_i,surf_type)
+    dataOut_i,ramp_i = remove_data_surface(data, None, surf_type, factorList[i])
     dataOut[ysub[2*i]:ysub[2*i+1],:] = dataOut_i[ysub[2*i]:ysub[2*i+1],:]
 
     ## 2 - last Masks
     for i in range(1,surfaceNum):
         print 'removing '+str(i+1)+'th surface ...'
-        mask_i = np.zeros(data.shape,data.dtype)
-        mask_i[ysub[2*i]:ysub[2*i+1],:] = mask[ysub[2*i]:ysub[2*i+1],:]
-
-        dataOut_i,ramp_i = remove_data_surface(data,mask_i,surf_type)
+        dataOut_i,ramp_i = remove_data_surface(data, None, surf_type, factorList[i])
 
         if ysub[2*i] < ysub[2*i-1]:
             dataOut[ysub[2*i]:ysub[2*i-1],:]  += dataOut_i[ysub[2*i]:ysub[2*i-1],:]
@@ -130,8 +234,49 @@ def remove_data_multiple_surface(data, mask, surf_type, ysub):
     return dataOut
 
 
+# factor(s) of the last mask used in this process, see get_surface_factor()
+_factor_cache = dict()
+
+def get_surface_factor(maskFile, surf_type, shape, ysub=None):
+    '''Pre-computed factor(s) of surface_factor() for mask file, computed once per process and cached,
+    so that only the mask file name is sent to worker processes of process.map_file(), instead of
+    the index and row/column number of all marked pixels for every epoch.
+    Inputs:
+        maskFile  - string, mask file, None for all pixels
+        surf_type - string, surface type
+        shape     - tuple of 2 int, size of data
+        ysub      - list of int, row subsets for multiple surfaces
+    Output:
+        dict for single surface, or list of dict for multiple surfaces
+    '''
+    key = (maskFile, surf_type, tuple(shape), tuple(ysub or []))
+    if maskFile:
+        key += (os.path.getmtime(maskFile),)
+    if key not in _factor_cache.keys():
+        _factor_cache.clear()
+        if maskFile:
+            mask = readfile.read(maskFile)[0]
+        else:
+            mask = np.ones(shape, np.bool_)
+        if not ysub:
+            _factor_cache[key] = surface_factor(mask, surf_type)
+        else:
+            _factor_cache[key] = multiple_surface_factor(mask, surf_type, ysub)
+    return _factor_cache[key]
+
+
+def remove_surface_block(data, epoch, box, maskFile, surf_type, ysub=None):
+    '''Remove surface from one epoch with factor(s) of mask file, for process.map_file()'''
+    factor = get_surface_factor(maskFile, surf_type, data.shape, ysub)
+    if not ysub:
+        data_n = remove_data_surface(data, None, factor['surf_type'], factor)[0]
+    else:
+        data_n = remove_data_multiple_surface(data, None, factor[0]['surf_type'], ysub, factor)
+    return data_n
+
+
 ##################################################################
-def remove_surface(File, surf_type, maskFile=None, outFile=None, ysub=None):
+def remove_surface(File, surf_type, maskFile=None, outFile=None, ysub=None, parallel=1):
     start = time.time()
     atr = readfile.read_attribute(File)
     
@@ -139,72 +284,14 @@ def remove_surface(File, surf_type, maskFile=None, outFile=None, ysub=None):
     if not outFile:
         outFile = os.path.splitext(File)[0]+'_'+surf_type+os.path.splitext(File)[1]
     
-    if maskFile:
-        Mask = readfile.read(maskFile)[0]
-    else:
-        Mask = np.ones((int(atr['FILE_LENGTH']), int(atr['WIDTH'])))
-    
     ##### Input File Info
-    atr = readfile.read_attribute(File)
     k = atr['FILE_TYPE']
     print 'Input file is '+k
-    
-    ## Multiple Datasets File
-    if k in ['interferograms','coherence','wrapped','timeseries']:
-        h5file = h5py.File(File,'r')
-        ifgramList = sorted(h5file[k].keys())
-        print 'number of epochs: '+str(len(ifgramList))
-  
-        h5flat = h5py.File(outFile,'w')
-        group  = h5flat.create_group(k)
-        print 'writing >>> '+outFile
-  
-    if k in ['timeseries']:
-        for ifgram in ifgramList:
-            print "Removing " + surf_type  +" from " + ifgram
-            data = h5file[k].get(ifgram)[:]
-            
-            if not ysub:
-                data_n,ramp = remove_data_surface(data, Mask, surf_type) 
-            else:
-                data_n = remove_data_multiple_surface(data, Mask, surf_type, ysub)
-  
-            dset = group.create_dataset(ifgram, data=data_n, compression='gzip')
-        for key,value in h5file[k].attrs.iteritems():
-            group.attrs[key] = value
-  
-    elif k in ['interferograms','wrapped','coherence']:
-        for ifgram in ifgramList:
-            print "Removing " + surf_type  +" from " + ifgram
-            data = h5file[k][ifgram].get(ifgram)[:]
-            
-            if not ysub:
-                data_n,ramp = remove_data_surface(data,Mask,surf_type)
-            else:
-                data_n = remove_data_multiple_surface(data, Mask, surf_type, ysub)
-  
-            gg   = group.create_group(ifgram)
-            dset = gg.create_dataset(ifgram, data=data_n, compression='gzip')
-            for key,value in h5file[k][ifgram].attrs.iteritems():
-                 gg.attrs[key] = value
+    print 'Removing '+surf_type+' from '+File
 
-    ## Single Dataset File
-    else:
-        data,atr = readfile.read(File)
-        print 'Removing '+surf_type+' from '+k
-  
-        if not ysub:
-            data_n,ramp = remove_data_surface(data, Mask, surf_type)
-        else:
-            data_n = remove_data_multiple_surface(data, Mask, surf_type, ysub)
-        
-        print 'writing >>> '+outFile
-        writefile.write(data_n,atr,outFile)
-  
-    try:
-        h5file.close()
-        h5flat.close()
-    except: pass
+    # Design matrix of masked pixels is the same for all epochs, factorize it once per process
+    get_surface_factor(maskFile, surf_type, (int(atr['FILE_LENGTH']), int(atr['WIDTH'])), ysub)
+    process.map_file(File, remove_surface_block, outFile, args=(maskFile, surf_type, ysub), parallel=parallel)
   
     print 'Remove '+surf_type+' took ' + str(time.time()-start) +' secs'
     return outFile
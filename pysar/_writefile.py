@@ -10,12 +10,215 @@
 
 
 import os
+import zlib
 
 import h5py
 import numpy as np
 from PIL import Image
 
 
+#########################################################################
+'''Storage policy for all HDF5 datasets written by PySAR
+compression : no    - no compression
+              lzf   - fast compression with moderate ratio, h5py only
+              gzip  - gzip with default level of 4, readable by any HDF5 library
+              gzip1 ... gzip9 - gzip with specified level
+shuffle     : byte shuffle filter before compression, better ratio for float data
+chunk       : 2D datasets are chunked in blocks of full rows of about chunk_size bytes,
+              so that reading a block of rows only decompresses the chunks it covers.
+
+The default compression can be set with environment variable PYSAR_COMPRESSION,
+i.e. by pysar.compression option in template file for pysarApp.py, or set_compression().
+Recommend usage:
+    import pysar._writefile as writefile
+    dset = writefile.create_dataset(group, '20100102', data=data)
+    dset = writefile.create_dataset(group, '20100102', shape=(length,width), dtype=np.float32)
+'''
+chunk_size = 1024**2    # in byte
+storage = dict()
+
+
+def set_compression(compression='gzip'):
+    '''Set compression for all HDF5 datasets written afterwards
+    Input: compression - string, no, lzf, gzip, or gzip1 ... gzip9
+    Example:
+        set_compression('lzf')
+        set_compression('gzip1')
+    '''
+    compression = str(compression).lower()
+    if compression in ['no','none','false','']:
+        storage['compression'] = None
+        storage['compression_opts'] = None
+        storage['shuffle'] = False
+    elif compression == 'lzf':
+        storage['compression'] = 'lzf'
+        storage['compression_opts'] = None
+        storage['shuffle'] = True
+    elif compression.startswith('gzip'):
+        storage['compression'] = 'gzip'
+        try:    storage['compression_opts'] = int(compression[4:])
+        except: storage['compression_opts'] = 4
+        storage['shuffle'] = True
+    else:
+        print 'Un-recognized compression: '+compression+', use gzip instead.'
+        set_compression('gzip')
+    return storage
+
+set_compression(os.getenv('PYSAR_COMPRESSION', 'gzip'))
+
+
+def get_chunk_shape(shape, dtype=np.float32):
+    '''Get chunk shape of dataset for row-block access
+    Input : shape - tuple of int, shape of dataset
+            dtype - data type of dataset
+    Output: tuple of int, chunk shape; None for scalar and empty dataset
+    '''
+    if len(shape) == 0 or np.prod(shape) == 0:
+        return None
+    item_size = np.dtype(dtype).itemsize
+    width = int(shape[-1])
+    num_row = max(1, int(chunk_size / (width*item_size)))
+    if len(shape) == 1:
+        return (min(width, max(1, int(chunk_size/item_size))),)
+    return tuple([1]*(len(shape)-2) + [min(int(shape[-2]), num_row), width])
+
+
+def get_cube_chunk_shape(shape, dtype=np.float32, depth=8):
+    '''Get chunk shape of 3D dataset (num_epoch, length, width) in cube layout
+    Each chunk covers a square tile of depth epochs, of about chunk_size bytes, so that
+    reading one epoch reads depth times of its size, and reading the time series of one
+    pixel reads num_epoch/depth chunks.
+    '''
+    item_size = np.dtype(dtype).itemsize
+    depth = max(1, min(int(shape[0]), depth))
+    tile = max(1, int(np.sqrt(chunk_size / (depth*item_size))))
+    return (depth, min(int(shape[1]), tile), min(int(shape[2]), tile))
+
+
+def create_cube(group, name, epochList, shape, dtype=np.float32, epochAtrList=None):
+    '''Create empty 3D dataset of all epochs (cube layout) and its index datasets in HDF5 group
+    Inputs:
+        group     - h5py.Group object, i.e. h5file.create_group('timeseries')
+        name      - string, dataset name, same as group name, i.e. timeseries, interferograms
+        epochList - list of string, epoch names, i.e. dates for timeseries, or ifgram names
+        shape     - tuple of 2 int, (length, width) of each epoch
+        epochAtrList - list of dict, attributes of each epoch, saved as side tables,
+                       for multi_group file (interferograms, coherence, ...)
+    Output: h5py.Dataset object, write epoch i as dset[i,:,:] = data
+    Example:
+        dset = create_cube(group, 'timeseries', dateList, (length,width))
+        dset = create_cube(group, 'interferograms', ifgramList, (length,width), epochAtrList=atrList)
+    '''
+    shape = (len(epochList), shape[0], shape[1])
+    dset = group.create_dataset(name, shape=shape, dtype=dtype, chunks=get_cube_chunk_shape(shape, dtype),\
+                                compression=storage['compression'],\
+                                compression_opts=storage['compression_opts'],\
+                                shuffle=storage['shuffle'])
+    group.create_dataset('epoch', data=np.array(epochList, dtype=np.string_))
+    if epochAtrList:
+        group.create_dataset('date12', data=np.array([str(atr.get('DATE12','')) for atr in epochAtrList], dtype=np.string_))
+        group_atr = group.create_group('epoch_attrs')
+        keyList = sorted(set([key for atr in epochAtrList for key in atr.keys()]))
+        for key in keyList:
+            group_atr.create_dataset(key, data=np.array([str(atr.get(key,'')) for atr in epochAtrList], dtype=np.string_))
+    else:
+        group.create_dataset('date', data=np.array(epochList, dtype=np.string_))
+    return dset
+
+
+def create_dataset(group, name, data=None, shape=None, dtype=None):
+    '''Create HDF5 dataset with the storage policy above (chunk, compression and shuffle)
+    Inputs:
+        group - h5py.Group or h5py.File object
+        name  - string, dataset name
+        data  - np.array, data to write
+        shape/dtype - shape and data type of empty dataset, if data is not given
+    Output: h5py.Dataset object
+    Example:
+        dset = create_dataset(group, 'velocity', data=velocity)
+        dset = create_dataset(group, '20100102', shape=(length,width), dtype=np.float32)
+    '''
+    if data is not None:
+        data = np.asarray(data)
+        shape = data.shape
+        if dtype is None:
+            dtype = data.dtype
+    if dtype is None:
+        dtype = np.float32
+
+    chunks = get_chunk_shape(shape, dtype)
+    if chunks:
+        dset = group.create_dataset(name, data=data, shape=shape, dtype=dtype, chunks=chunks,\
+                                    compression=storage['compression'],\
+                                    compression_opts=storage['compression_opts'],\
+                                    shuffle=storage['shuffle'])
+    else:
+        dset = group.create_dataset(name, data=data, shape=shape, dtype=dtype)
+    return dset
+
+
+def encode_chunks(data, policy=None):
+    '''Split 2D matrix into chunks and filter them (shuffle and gzip) as HDF5 would do with the storage
+    policy, so that compression can be done in worker processes, and the raw chunks written by
+    write_chunks() into dataset from create_dataset() with the same shape and dtype.
+    The storage policy of the writer process should be passed to worker processes explicitly, as the
+    module-level storage of a worker depends on its own environment.
+    Inputs:
+        data   - 2D np.array
+        policy - dict, storage policy of the writer process, i.e. dict(storage), storage by default
+    Output: list of (offset, bytes) of each chunk, None if compression (lzf) is not supported.
+    Example:
+        policy = dict(storage)                               # in writer process
+        chunkList = encode_chunks(data, policy)              # in worker process
+        dset = create_dataset(group, name, shape=data.shape, dtype=data.dtype)
+        write_chunks(dset, chunkList, policy)                # in writer process
+    '''
+    if policy is None:
+        policy = storage
+    if policy['compression'] not in [None, 'gzip']:
+        return None
+    data = np.asarray(data)
+    chunks = get_chunk_shape(data.shape, data.dtype)
+    if not chunks or data.ndim != 2 or chunks[1] != data.shape[1]:
+        return None
+
+    item_size = data.dtype.itemsize
+    chunkList = []
+    for y0 in range(0, data.shape[0], chunks[0]):
+        block = np.zeros(chunks, data.dtype)
+        block[0:min(chunks[0], data.shape[0]-y0),:] = data[y0:y0+chunks[0],:]
+        buf = block.tostring()
+        if policy['shuffle']:
+            buf = np.frombuffer(buf, np.uint8).reshape(-1, item_size).T.tostring()
+        if policy['compression'] == 'gzip':
+            buf = zlib.compress(buf, policy['compression_opts'])
+        chunkList.append(((y0, 0), buf))
+    return chunkList
+
+
+def write_chunks(dset, chunkList, policy=None):
+    '''Write filtered chunks from encode_chunks() into dataset directly, without filtering again.
+    Chunk cache of HDF5 is bypassed, read the dataset after file is closed and re-opened.
+    Inputs:
+        dset      - h5py.Dataset, from create_dataset()
+        chunkList - list of (offset, bytes), from encode_chunks()
+        policy    - dict, storage policy used in encode_chunks(), storage by default
+    Raise ValueError if filters or chunk shape of dataset do not match the policy, to not write
+    chunks that can not be decoded.
+    '''
+    if policy is None:
+        policy = storage
+    if (dset.compression != policy['compression'] or bool(dset.shuffle) != bool(policy['shuffle'])
+            or (policy['compression'] and dset.compression_opts != policy['compression_opts'])
+            or dset.chunks != get_chunk_shape(dset.shape, dset.dtype)):
+        raise ValueError('storage of dataset %s (%s, %s, shuffle=%s, chunks=%s) does not match the chunks '
+                         'encoded with %s' % (dset.name, dset.compression, dset.compression_opts, dset.shuffle,\
+                                               dset.chunks, policy))
+    for offset, buf in chunkList:
+        dset.id.write_direct_chunk(offset, buf)
+    return dset
+
+
 def write(*args):
     '''Write one dataset, i.e. interferogram, coherence, velocity, dem ...
         Return 0 if failed.
@@ -64,7 +267,7 @@ def write(*args):
             return 0;
         h5file = h5py.File(outname,'w')
         group = h5file.create_group(k)
-        dset = group.create_dataset(k, data=data, compression='gzip')
+        dset = create_dataset(group, k, data=data)
         for key , value in atr.iteritems():
             group.attrs[key]=value
         h5file.close()
@@ -8,17 +8,17 @@
 #                   support coherence/wrapped
 #                   nan + value = value for ROI_PAC product
 # Yunjun, Jun 2016: support multiple input files
+# Yunjun, Feb 2017: use process.map_file(), add block by block
 
 
 import sys
 import os
 import getopt
 
-import h5py
 import numpy as np
 
 import pysar._readfile as readfile
-import pysar._writefile as writefile
+import pysar._process as process
 
 
 def add(data1,data2):
@@ -29,6 +29,17 @@ def add(data1,data2):
     return data
 
 
+def add_block(data, epoch, box, fileList):
+    '''Sum of one block of epoch in all files, for process.map_file()
+    data is the block of the first file in fileList.
+    '''
+    data = add(np.zeros(data.shape, data.dtype), data)
+    for File in fileList[1:]:
+        d = readfile.read(File, box, epoch)[0]
+        data = add(data, d)
+    return data
+
+
 def usage():
     print '''
 ***************************************************************
@@ -79,7 +90,7 @@ def main(argv):
   
     ext = os.path.splitext(fileList[0])[1].lower()
     try:     outName
-    except:  outName = File1.split('.')[0]+'_plus_'+File2.split('.')[0]+ext
+    except:  outName = fileList[0].split('.')[0]+'_plus_'+fileList[1].split('.')[0]+ext
   
   
     ##### Read File Info / Attributes
@@ -95,58 +106,9 @@ def main(argv):
             if not r['FILE_TYPE'] == k:
                 print 'Input file type is not the same: '+r['FILE_TYPE']
                 sys.exit(1)
-  
-        h5out = h5py.File(outName,'w')
-        group = h5out.create_group(k)
-  
-        h5in  = h5py.File(fileList[0])
-        epochList = sorted(h5in[k].keys())
-
-    ########################### Add file by file ########################
-    if k in ['timeseries']:
-        for epoch in epochList:
-            print epoch
-            data = np.zeros((int(atr['FILE_LENGTH']),int(atr['WIDTH'])))
-            for File in fileList:
-                print File
-                h5file = h5py.File(File,'r')
-                d = h5file[k].get(epoch)[:]
-  
-                data = add(data,d)
-  
-            dset = group.create_dataset(epoch, data=data, compression='gzip')
-        for key,value in atr.iteritems():   group.attrs[key] = value
-  
-        h5out.close()
-        h5in.close()
-  
-    elif k in ['timeseries','interferograms','coherence','wrapped']:
-        for epoch in epochList:
-            print epoch
-            data = np.zeros((int(atr['FILE_LENGTH']),int(atr['WIDTH'])))
-            for File in fileList:
-                print File
-                h5file = h5py.File(File,'r')
-                d = h5file[k][epoch].get(epoch)[:]
-  
-                data = add(data,d)
-  
-            gg = group.create_group(epoch)
-            dset = gg.create_dataset(epoch, data=data, compression='gzip')
-            for key, value in h5in[k][epoch].attrs.iteritems():
-                gg.attrs[key] = value
-  
-        h5out.close()
-        h5in.close()
-  
-    ## All the other file types
-    else:
-        data = np.zeros((int(atr['FILE_LENGTH']),int(atr['WIDTH'])))
-        for File in fileList:
-            print 'loading '+File
-            d,r = readfile.read(File)
-            data = add(data,d)
-        writefile.write(data,atr,outName)
+
+    ########################### Add file by file, block by block ########################
+    process.map_file(fileList[0], add_block, outName, args=(fileList,), by_block=True, num_layer=2+len(fileList))
 
 
 ################################################################################
@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+############################################################
+# Program is part of PySAR v1.0                            #
+# Copyright(c) 2017, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+# Yunjun, Feb 2017: build overviews for fast display in view.py and tsviewer.py
+
+
+import os
+import sys
+import argparse
+import time
+import fractions
+
+import h5py
+import numpy as np
+
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+import pysar._pysar_utilities as ut
+import pysar._process as process
+from pysar.multilook import multilook_matrix
+from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file
+
+
+############################################################
+def get_looks_list(length, width, min_size=256):
+    '''Default number of looks of overviews: 2, 4, 8 ... until the overview is smaller than min_size'''
+    looks_list = []
+    looks = 2
+    while min(length, width) / looks >= min_size:
+        looks_list.append(looks)
+        looks *= 2
+    return looks_list
+
+
+def add_overviews(File, looks_list=None, max_memory=1.0):
+    '''Build overviews of all epochs of File, averaged with nanmean, into File.ovr
+    Each epoch is read once block by block, with all overviews computed from the full resolution block.
+    Wrapped phase is averaged in complex value, as in multilook.py.
+    Inputs:
+        File       - string, PySAR HDF5 file
+        looks_list - list of int, number of looks of overviews, i.e. [2,4,8,16]
+        max_memory - float, maximum memory in GB for each block
+    Output:
+        ovrFile - string, path of overview file
+    Example:
+        add_overviews('timeseries.h5')
+        add_overviews('unwrapIfgram.h5', [4,16])
+    '''
+    atr = readfile.read_attribute(File)
+    k = atr['FILE_TYPE']
+    length = int(atr['FILE_LENGTH'])
+    width = int(atr['WIDTH'])
+    if not looks_list:
+        looks_list = get_looks_list(length, width)
+    looks_list = sorted(set([int(i) for i in looks_list if int(i) > 1]))
+    if not looks_list:
+        print 'No overview to build for '+File+' in size of '+str((length, width))
+        return None
+    print 'number of looks of overviews: '+str(looks_list)
+
+    reader = readfile.Reader(File)
+    epochList = reader.epochList
+    if k not in multi_group_hdf5_file+multi_dataset_hdf5_file:
+        epochList = ['']
+
+    # Rows of each block are a multiple of all looks (their least common multiple),
+    # so blocks are multilooked independently
+    row_step_multiple = reduce(lambda a, b: a*b/fractions.gcd(a, b), looks_list)
+    wrapped = k in ['wrapped','.int']
+    num_byte = 3*8 if wrapped else 3*4
+    box_list = process.split_blocks((0, 0, width, length), num_byte, max_memory, row_step_multiple=row_step_multiple)
+
+    ovrFile = readfile.get_overview_file(File)
+    print 'writing >>> '+ovrFile
+    h5 = h5py.File(ovrFile, 'w')
+    h5.attrs['SOURCE_FILE'] = os.path.basename(File)
+    h5.attrs['SOURCE_STAMP'] = str(readfile.get_file_stamp(File))
+    groupDict = dict([(looks, h5.create_group(str(looks))) for looks in looks_list])
+
+    start_time = time.time()
+    for i in range(len(epochList)):
+        epoch = epochList[i]
+        dsetDict = dict()
+        for looks in looks_list:
+            dsetDict[looks] = writefile.create_dataset(groupDict[looks], epoch or k, shape=(length/looks, width/looks),\
+                                                       dtype=np.float32)
+        for box in box_list:
+            data = reader.read(epoch, box)
+            if wrapped:
+                data = np.exp(1j*data)
+            for looks in looks_list:
+                y0 = box[1]/looks
+                data_mli = multilook_matrix(data, looks, looks, method='nanmean')
+                if np.iscomplexobj(data_mli):
+                    data_mli = np.angle(data_mli)
+                dsetDict[looks][y0:y0+data_mli.shape[0], :] = data_mli
+        ut.print_progress(i+1, len(epochList), prefix='building overviews:', suffix=epoch or k,\
+                          elapsed_time=time.time()-start_time)
+    reader.close()
+    h5.close()
+    return ovrFile
+
+
+############################################################
+EXAMPLE='''example:
+  add_overviews.py  timeseries_ECMWF_demCor.h5
+  add_overviews.py  unwrapIfgram.h5  -l 4 16
+  add_overviews.py  geo_velocity.h5
+'''
+
+def cmdLineParse():
+    parser = argparse.ArgumentParser(description='Build overviews (averaged datasets at 2x, 4x, 8x ... looks) of file,\n'+\
+                                     'for fast display in view.py and tsviewer.py. Overviews are saved in <file>.ovr\n'+\
+                                     'and used as long as the file is not changed.',\
+                                     formatter_class=argparse.RawTextHelpFormatter,\
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('file', nargs='+', help='PySAR HDF5 file(s) to build overviews')
+    parser.add_argument('-l','--looks', dest='looks_list', type=int, nargs='*',\
+                        help='number of looks of overviews, default: 2, 4, 8 ... until overview is smaller than 256')
+    parser.add_argument('--memory', dest='max_memory', type=float, default=1.0,\
+                        help='maximum memory to use in GB, default: 1')
+
+    inps = parser.parse_args()
+    return inps
+
+
+############################################################
+def main(argv):
+    inps = cmdLineParse()
+    for File in inps.file:
+        add_overviews(File, inps.looks_list, inps.max_memory)
+    print 'Done.'
+    return
+
+
+############################################################
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
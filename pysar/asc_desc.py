@@ -14,6 +14,9 @@ import h5py
 import numpy as np
 import matplotlib.pyplot as plt
 
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+
 
 def usage():
     print'''
@@ -91,6 +94,7 @@ def get_lat_lon(h5file):
  
     if 'interferograms' in k:
  
+        readfile.check_stack_layout(h5file, 'interferograms')
         ifgramList = h5file['interferograms'].keys()
         Width=float(h5file['interferograms'][ifgramList[0]].attrs['WIDTH'])
         Length= float(h5file['interferograms'][ifgramList[0]].attrs['FILE_LENGTH'])
@@ -229,7 +233,7 @@ def main(argv):
     print 'writing '+outName
     h5velocity = h5py.File(outName,'w')
     group=h5velocity.create_group('velocity')
-    dset = group.create_dataset('velocity', data=np.reshape(Luh[0,:],(LENGTH,WIDTH)), compression='gzip')
+    dset = writefile.create_dataset(group, 'velocity', data=np.reshape(Luh[0,:],(LENGTH,WIDTH)))
     
     for key , value in h5V1[k[0]].attrs.iteritems():
         group.attrs[key]=value
@@ -248,7 +252,7 @@ def main(argv):
     print 'writing '+outName
     h5velocity = h5py.File(outName,'w')
     group=h5velocity.create_group('velocity')
-    dset = group.create_dataset('velocity', data=np.reshape(Luh[1,:],(LENGTH,WIDTH)), compression='gzip')
+    dset = writefile.create_dataset(group, 'velocity', data=np.reshape(Luh[1,:],(LENGTH,WIDTH)))
  
     for key , value in h5V1[k[0]].attrs.iteritems():
         group.attrs[key]=value
@@ -17,6 +17,7 @@ from matplotlib.ticker import FuncFormatter
 from scipy.linalg import pinv as pinv
 
 import pysar._readfile as readfile
+import pysar._writefile as writefile
 
 
 def to_percent(y, position):
@@ -60,6 +61,7 @@ def main(argv):
   
     ##################################
     h5file = h5py.File(File)
+    readfile.check_stack_layout(h5file, 'timeseries')
     dateList = h5file['timeseries'].keys()
     ##################################
   
@@ -185,7 +187,7 @@ def main(argv):
     for i in range(len(dateList)):
         dset1 = h5file['timeseries'].get(dateList[i])
         data = dset1[0:dset1.shape[0],0:dset1.shape[1]] - orbEffect[i,:,:]
-        dset = group.create_dataset(dateList[i], data=data, compression='gzip')      
+        dset = writefile.create_dataset(group, dateList[i], data=data)      
   
     for key,value in h5file['timeseries'].attrs.iteritems():
         group.attrs[key] = value
@@ -193,7 +195,7 @@ def main(argv):
     try:
         dset1 = h5file['mask'].get('mask')
         group=h5orbCor.create_group('mask')
-        dset = group.create_dataset('mask', data=dset1, compression='gzip')
+        dset = writefile.create_dataset(group, 'mask', data=dset1)
     except: pass
   
     h5file.close()
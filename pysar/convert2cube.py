@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+############################################################
+# Program is part of PySAR v1.2                            #
+# Copyright(c) 2017, Yunjun Zhang                          #
+# Author:  Yunjun Zhang                                    #
+############################################################
+
+
+import os
+import sys
+import time
+import argparse
+
+import h5py
+
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+import pysar._pysar_utilities as ut
+from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file
+
+
+############################################################
+def stack2cube(File, outFile=None):
+    '''Convert multi-group/multi-dataset file from stack layout into cube layout'''
+    atr = readfile.read_attribute(File)
+    k = atr['FILE_TYPE']
+    length = int(atr['FILE_LENGTH'])
+    width = int(atr['WIDTH'])
+    if not outFile:
+        outFile = os.path.splitext(File)[0]+'_cube.h5'
+
+    h5 = h5py.File(File,'r')
+    if readfile.is_cube(h5, k):
+        print File+' is already in cube layout.';  h5.close()
+        return File
+    epochList = readfile.get_epoch_list(h5, k)
+    epochNum = len(epochList)
+    print 'number of epochs: '+str(epochNum)
+
+    print 'writing >>> '+outFile
+    h5out = h5py.File(outFile,'w')
+    group = h5out.create_group(k)
+    if k in multi_group_hdf5_file:
+        epochAtrList = [dict(h5[k][epoch].attrs) for epoch in epochList]
+        dtype = h5[k][epochList[0]].get(epochList[0]).dtype
+        dset = writefile.create_cube(group, k, epochList, (length,width), dtype, epochAtrList)
+        # common attributes: same value for all epochs
+        for key, value in epochAtrList[0].iteritems():
+            if all([str(i.get(key)) == str(value) for i in epochAtrList]):
+                group.attrs[key] = value
+    else:
+        dtype = h5[k].get(epochList[0]).dtype
+        dset = writefile.create_cube(group, k, epochList, (length,width), dtype)
+        for key, value in h5[k].attrs.iteritems():
+            group.attrs[key] = value
+
+    start_time = time.time()
+    for i in range(epochNum):
+        epoch = epochList[i]
+        if k in multi_group_hdf5_file:
+            dset[i,:,:] = h5[k][epoch].get(epoch)[:]
+        else:
+            dset[i,:,:] = h5[k].get(epoch)[:]
+        ut.print_progress(i+1, epochNum, suffix=epoch, elapsed_time=time.time()-start_time)
+    h5.close()
+    h5out.close()
+    return outFile
+
+
+def cube2stack(File, outFile=None):
+    '''Convert multi-group/multi-dataset file from cube layout into stack layout'''
+    atr = readfile.read_attribute(File)
+    k = atr['FILE_TYPE']
+    if not outFile:
+        outFile = os.path.splitext(File)[0]+'_stack.h5'
+
+    h5 = h5py.File(File,'r')
+    if not readfile.is_cube(h5, k):
+        print File+' is already in stack layout.';  h5.close()
+        return File
+    epochList = [str(i) for i in h5[k]['epoch'][:]]
+    epochNum = len(epochList)
+    print 'number of epochs: '+str(epochNum)
+
+    print 'writing >>> '+outFile
+    h5out = h5py.File(outFile,'w')
+    group = h5out.create_group(k)
+    if k in multi_dataset_hdf5_file:
+        for key, value in h5[k].attrs.iteritems():
+            group.attrs[key] = value
+
+    start_time = time.time()
+    dset = h5[k].get(k)
+    for i in sorted(range(epochNum), key=lambda i: epochList[i]):
+        epoch = epochList[i]
+        if k in multi_group_hdf5_file:
+            gg = group.create_group(epoch)
+            writefile.create_dataset(gg, epoch, data=dset[i,:,:])
+            for key, value in readfile.read_h5_attribute(h5, k, epoch, raw=True).iteritems():
+                gg.attrs[key] = value
+        else:
+            writefile.create_dataset(group, epoch, data=dset[i,:,:])
+        ut.print_progress(i+1, epochNum, suffix=epoch, elapsed_time=time.time()-start_time)
+    h5.close()
+    h5out.close()
+    return outFile
+
+
+############################################################
+EXAMPLE='''example:
+  convert2cube.py  timeseries.h5
+  convert2cube.py  unwrapIfgram.h5  -o unwrapIfgram_cube.h5
+  convert2cube.py  timeseries_cube.h5  --stack
+'''
+
+LAYOUT='''
+stack layout: one 2D dataset per epoch, default PySAR layout
+cube  layout: one 3D dataset (num_epoch, length, width) for all epochs, chunked in tiles of
+              several epochs, so that both reading one epoch and reading the time series
+              of one pixel only touch a small part of the file.
+'''
+
+def cmdLineParse():
+    parser = argparse.ArgumentParser(description='Convert timeseries/interferograms/coherence file '+\
+                                                 'between stack and cube layout.'+LAYOUT,\
+                                     formatter_class=argparse.RawTextHelpFormatter,\
+                                     epilog=EXAMPLE)
+    parser.add_argument('file', help='timeseries / interferograms / coherence file to convert')
+    parser.add_argument('-o','--output', dest='outfile', help='output file name')
+    parser.add_argument('--stack', dest='to_stack', action='store_true',\
+                        help='convert from cube layout to stack layout')
+    inps = parser.parse_args()
+    return inps
+
+
+############################################################
+def main(argv):
+    inps = cmdLineParse()
+    atr = readfile.read_attribute(inps.file)
+    if atr['FILE_TYPE'] not in multi_group_hdf5_file+multi_dataset_hdf5_file:
+        sys.exit('ERROR: only multi-epoch file is supported, input file type: '+atr['FILE_TYPE'])
+
+    if inps.to_stack:
+        inps.outfile = cube2stack(inps.file, inps.outfile)
+    else:
+        inps.outfile = stack2cube(inps.file, inps.outfile)
+    print 'Done.'
+    return inps.outfile
+
+
+############################################################
+if __name__ == '__main__':
+    main(sys.argv[1:])
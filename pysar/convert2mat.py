@@ -17,6 +17,8 @@ import scipy.io as sio
 import datetime
 import time
 
+import pysar._readfile as readfile
+
 def usage():
     print '''
 ****************************************************************
@@ -121,6 +123,7 @@ def main(argv):
 
     elif 'timeseries' in k:
     
+        readfile.check_stack_layout(h5file, 'timeseries')
         epochList=h5file['timeseries'].keys()
         data_dict={}
         
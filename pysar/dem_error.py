@@ -11,11 +11,11 @@
 #
 # Yunjun, Jun 2016: Add phase velocity approach from the paper.
 #                   Use different range and look angle for each column
+# Yunjun, Oct 2016: Solve all pixels at once in closed form, read/write block by block
 #
 
 
 import sys
-import os
 import getopt
 import time
 import datetime
@@ -26,6 +26,7 @@ import numpy as np
 import pysar._datetime as ptime
 import pysar._pysar_utilities as ut
 import pysar._readfile as readfile
+import pysar._writefile as writefile
 
 
 ######################################
@@ -48,6 +49,7 @@ def usage():
                             phase history approach.
       --no-timeseries-update: calculate DEM error file only and do not
                               update the timeseries file.
+      --memory : maximum memory to use in GB, default: 4
 
 
   Example:
@@ -59,15 +61,55 @@ def usage():
 **********************************************************
     '''
 
+######################################
+def topographic_residual_inverse(ts, M, Bp, tbase, phase_velocity=False):
+    '''Estimate DEM error of all pixels at once, with design matrix C = [M, Bp/(r*sin(look_angle))]
+    The design matrix varies among pixels only through the scale of its last column, so the
+    DEM error is solved in closed form by projecting the temporal deformation model M out of
+    both the baseline and the observation (Frisch-Waugh), shared by all pixels.
+    Inputs:
+        ts    - 2D np.array in size of (numDate, numPixel), phase history of each pixel
+        M     - 2D np.array, temporal deformation model, in size of (numDate, 3) for phase history
+                or (numDate-1, 3) for phase velocity history
+        Bp    - 2D np.array in size of (numDate, 1), perpendicular baseline time series
+        tbase - 2D np.array in size of (numDate, 1), temporal baseline in days
+        phase_velocity - bool, use phase velocity history approach instead of phase history
+    Output:
+        dz_scaled - 1D np.array in size of (numPixel,), DEM error / (r*sin(look_angle))
+                    time series correction is np.dot(Bp, dz_scaled)
+    Example:
+        dz_scaled = topographic_residual_inverse(ts, M, Bp, tbase)
+        dz = dz_scaled * range_x * np.sin(look_angle_x)
+        ts -= np.dot(Bp, dz_scaled.reshape(1,-1))
+    '''
+    if phase_velocity:
+        dt = tbase[1:] - tbase[:-1]
+        b = (Bp[1:] - Bp[:-1]) / dt
+        y = (ts[1:,:] - ts[:-1,:]) / dt
+    else:
+        b = Bp
+        y = ts
+
+    # baseline residual after removing temporal deformation model: P*b, P = I - M*pinv(M)
+    Pb = b - np.dot(M, np.dot(np.linalg.pinv(M), b))
+    bPb = np.sum(Pb**2)
+    if bPb <= 1e-10 * np.sum(b**2):
+        print 'WARNING: baseline is in the span of temporal deformation model, DEM error is not resolvable.'
+        return np.zeros(ts.shape[1], np.float32)
+    dz_scaled = np.dot(Pb.T, y).flatten() / bPb
+    return np.array(dz_scaled, np.float32)
+
+
 ######################################
 def main(argv):
 
     ## Default value
     phase_velocity    = 'no'        # 'no' means use 'phase history'
     update_timeseries = 'yes'
+    max_memory        = 4.0         # in GB
 
     if len(sys.argv)>2:
-        try:   opts, args = getopt.getopt(argv,'h:f:F:o:v:',['phase-velocity','no-timeseries-update'])
+        try:   opts, args = getopt.getopt(argv,'h:f:F:o:v:',['phase-velocity','no-timeseries-update','memory='])
         except getopt.GetoptError:
             print 'Error in reading input options!';  usage() ; sys.exit(1)
   
@@ -78,6 +120,7 @@ def main(argv):
             elif opt == '-o':    outname        = arg
             elif opt == '--phase-velocity'      :  phase_velocity = 'yes'
             elif opt == '--no-timeseries-update':  update_timeseries = 'no'
+            elif opt == '--memory'              :  max_memory = float(arg)
 
     elif len(sys.argv)==2:
         if argv[0] in ['-h','--help']:  usage(); sys.exit(1)
@@ -87,29 +130,17 @@ def main(argv):
     try:    outname
     except: outname = timeSeriesFile.replace('.h5','')+'_demCor.h5'
 
-    ##### Read Time Series
+    ##### Time Series Info
     #print '\n*************** Topographic Error Correction ****************'
-    print "Loading time series: " + timeSeriesFile
+    print "time series file: " + timeSeriesFile
     atr = readfile.read_attribute(timeSeriesFile)
-    h5timeseries = h5py.File(timeSeriesFile)
-    dateList = sorted(h5timeseries['timeseries'].keys())
+    h5timeseries = h5py.File(timeSeriesFile,'r')
+    dateList = readfile.get_epoch_list(h5timeseries, 'timeseries')
     lt = len(dateList)
     print 'number of epochs: '+str(lt)
 
-    dateIndex={}
-    for ni in range(len(dateList)):   dateIndex[dateList[ni]]=ni
-
     nrows = int(atr['FILE_LENGTH'])
     ncols = int(atr['WIDTH'])
-    timeseries = np.zeros((len(dateList),nrows*ncols),np.float32)
-    for i in range(lt):
-        date = dateList[i]
-        ut.print_progress(i+1, lt, prefix='loading:', suffix=date)
-        d = h5timeseries['timeseries'].get(date)[:]
-        timeseries[dateIndex[date]][:]=d.flatten('F')
-    del d
-    h5timeseries.close()   
-    print '**************************************'
 
     ##### Temporal Baseline
     print 'read temporal baseline'
@@ -129,7 +160,6 @@ def main(argv):
         except:
             print 'Error in calculating baseline time series!'
             sys.exit(1)
-    Bp_v = (Bp[1:lt] - Bp[0:lt-1]) / (tbase[1:lt] - tbase[0:lt-1])
 
     ##### Cubic Temporal Deformation Model
     ## Formula (10) in (Fattahi and Amelung, 2013, TGRS)
@@ -143,13 +173,6 @@ def main(argv):
         print 'using phase history'
         M  = np.hstack((.5*tbase**2,tbase,np.ones((lt,1))))
 
-    ## Testing
-    #teta = (tetaN+tetaF)/2
-    #r = (rN+rF)/2
-    #teta=19.658799999999999*np.pi/180
-    #r=846848.2
-    #Bperp=1000*np.random.random((lt,1))
-
     ##### Range and Look Angle
     near_range = float(atr['STARTING_RANGE1'])
     dR         = float(atr['RANGE_PIXEL_SIZE'])
@@ -169,81 +192,54 @@ def main(argv):
         center_look_angle = np.pi-np.arccos((r**2+center_range**2-(r+H)**2)/(2*r*center_range))
         range_x      = np.tile(center_range,     ncols)
         look_angle_x = np.tile(center_look_angle,ncols)
-    #C1_v = Bp_v / (center_range * np.sin(center_look_angle))
-    #C1   = Bp   / (center_range * np.sin(center_look_angle))
-    #timeseries_v = (timeseries[1:lt,:] - timeseries[0:lt-1,:]) / (tbase[1:lt] - tbase[0:lt-1])
-
-    ##### Inversion column by column
-    print 'inversing using L2-norm minimization (unweighted least squares)...'
-    dz = np.zeros([1,nrows*ncols])
-
-    for i in range(ncols):
-        ## Design Matrix Inversion
-        C1_v = Bp_v / (range_x[i] * np.sin(look_angle_x[i]))
-        C1   = Bp   / (range_x[i] * np.sin(look_angle_x[i]))
-        if phase_velocity == 'yes':  C = np.hstack((M,C1_v))
-        else:                        C = np.hstack((M,C1))
-
-        #print '    rank of the design matrix : '+str(np.linalg.matrix_rank(C))
-        #if np.linalg.matrix_rank(C) == 4:  print '    design matrix has full rank'
-        Cinv = np.linalg.pinv(C)
-
-        ## (Phase) Velocity History
-        ts_x  = timeseries[:,i*nrows:(i+1)*nrows]
-        ts_xv = (ts_x[1:lt,:] - ts_x[0:lt-1,:]) / (tbase[1:lt] - tbase[0:lt-1])
-
-        ## DEM error
-        if phase_velocity == 'yes':    par  = np.dot(Cinv,ts_xv)
-        else:                          par  = np.dot(Cinv,ts_x)
-        dz_x = par[3].reshape((1,nrows))
-
-        ## Update DEM error matrix and timeseries matrix
-        dz[0][i*nrows:(i+1)*nrows]         = dz_x
-        timeseries[:,i*nrows:(i+1)*nrows] -= np.dot(C1,dz_x)
-
-        ut.print_progress(i+1,ncols)
-
-    #dz[0][:] = par[3][:]
-    dz = np.reshape(dz,[nrows,ncols],order='F')
-
-    ########## Output - DEM error #######################
-    #print '**************************************'
-    #print 'writing DEM_error.hgt'
-    #writefile.write_float32(dz,'DEM_error.hgt')
-    #f = open('DEM_error.hgt.rsc','w')
-    #f.write('FILE_LENGTH       '+str(int(nrows))+'\n')
-    #f.write('WIDTH             '+str(int(ncols))+'\n')  
-    #print '**************************************'
+    range_sin_x = range_x * np.sin(look_angle_x)
 
+    ##### Output files, pre-allocated and written block by block
     h5fileDEM = 'DEM_error.h5'
     print 'writing >>> '+h5fileDEM
-    h5rmse = h5py.File(h5fileDEM,'w')
-    group=h5rmse.create_group('dem')
-    dset = group.create_dataset(os.path.basename('dem'), data=dz, compression='gzip')
+    h5dem = h5py.File(h5fileDEM,'w')
+    group = h5dem.create_group('dem')
+    dset_dem = writefile.create_dataset(group, 'dem', shape=(nrows,ncols), dtype=np.float32)
     for key , value in atr.iteritems():
         group.attrs[key]=value
     group.attrs['UNIT']='m'
-    print '**************************************'
 
-    ########### Output - Corrected Time Series ##########
     if update_timeseries == 'yes':
         print 'writing >>> '+outname
         print 'number of dates: '+str(len(dateList))
-
         h5timeseriesDEMcor = h5py.File(outname,'w')
         group = h5timeseriesDEMcor.create_group('timeseries')
-        for i in range(lt):
-            date = dateList[i]
-            ut.print_progress(i+1, lt, prefix='writing:', suffix=date)
-            d = np.reshape(timeseries[i][:],[nrows,ncols],order='F')
-            dset = group.create_dataset(date, data=d, compression='gzip')
-        #for date in dateList:
-        #    print date
-        #    if not date in h5timeseriesDEMcor['timeseries']:
-        #        d = np.reshape(timeseries[dateIndex[date]][:],[nrows,ncols],order='F')
-        #        dset = group.create_dataset(date, data=d, compression='gzip') 
+        dsetList = []
+        for date in dateList:
+            dsetList.append(writefile.create_dataset(group, date, shape=(nrows,ncols), dtype=np.float32))
         for key,value in atr.iteritems():  group.attrs[key] = value
+
+    ##### Inversion block by block
+    print 'inversing using L2-norm minimization (unweighted least squares)...'
+    box_list = ut.split_row_boxes(nrows, ncols, 3*lt, max_memory)
+    start_time = time.time()
+    for i in range(len(box_list)):
+        box = box_list[i]
+        boxShape = (box[3]-box[1], box[2]-box[0])
+        timeseries = ut.read_timeseries_box(h5timeseries, dateList, box)
+        dz_scaled = topographic_residual_inverse(timeseries, M, Bp, tbase, phase_velocity=(phase_velocity == 'yes'))
+
+        dz = dz_scaled.reshape(boxShape) * range_sin_x[box[0]:box[2]]
+        dset_dem[box[1]:box[3],box[0]:box[2]] = dz
+
+        if update_timeseries == 'yes':
+            timeseries -= np.dot(Bp, dz_scaled.reshape(1,-1))
+            for j in range(lt):
+                dsetList[j][box[1]:box[3],box[0]:box[2]] = timeseries[j].reshape(boxShape)
+        ut.print_progress(i+1, len(box_list), prefix='calculating:', suffix='rows %d-%d'%(box[1],box[3]),\
+                          elapsed_time=time.time()-start_time)
+
+    h5timeseries.close()
+    h5dem.close()
+    if update_timeseries == 'yes':
         h5timeseriesDEMcor.close()
+    print '**************************************'
+    return outname
 
 ################################################################################
 if __name__ == '__main__':
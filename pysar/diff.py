@@ -6,7 +6,7 @@
 ############################################################
 #
 # Yunjun, Mar 2016: add diff()
-#
+# Yunjun, Feb 2017: use process.map_file(), diff block by block
 #
 
 import sys
@@ -14,10 +14,9 @@ import os
 import getopt
 
 import numpy as np
-import h5py
 
 import pysar._readfile as readfile
-import pysar._writefile as writefile
+import pysar._process as process
 
 
 #####################################################################################
@@ -28,6 +27,16 @@ def diff(data1,data2):
   
     return data
 
+def diff_block(data, epoch, box, fileList):
+    '''Difference of one block of epoch between the first file and the others, for process.map_file()
+    data is the block of the first file in fileList.
+    '''
+    for File in fileList[1:]:
+        d = readfile.read(File, box, epoch)[0]
+        data = diff(data, d)
+    return data
+
+
 def usage():
     print '''
 ***************************************************************
@@ -89,60 +98,9 @@ def main(argv):
             if not r['FILE_TYPE'] == k:
                 print 'Input file type is not the same: '+r['FILE_TYPE']
                 sys.exit(1)
-  
-        h5out = h5py.File(outName,'w')
-        group = h5out.create_group(k)
-        print 'writing >>> '+outName
-  
-        h5in  = h5py.File(fileList[0])
-        epochList = h5in[k].keys()
-        print 'number of epochs: '+str(len(epochList))
-
-    ########################### Diff file by file ########################
-    if k in ['timeseries']:
-        for epoch in epochList:
-            print epoch
-            data = h5in[k].get(epoch)[:]
-            for i in range(1,len(fileList)):
-                #print fileList[i]
-                h5file = h5py.File(fileList[i],'r')
-                d = h5file[k].get(epoch)[:]
-  
-                data = diff(data,d)
-  
-            dset = group.create_dataset(epoch, data=data, compression='gzip')
-        for key,value in atr.iteritems():   group.attrs[key] = value
-  
-        h5out.close()
-        h5in.close()
-  
-    elif k in ['interferograms','coherence','wrapped']:
-        for epoch in epochList:
-            print epoch
-            data = h5in[k][epoch].get(epoch)[:]
-            for i in range(1,len(fileList)):
-                #print fileList[i]
-                h5file = h5py.File(fileList[i],'r')
-                d = h5file[k][epoch].get(epoch)[:]
-  
-                data = diff(data,d)
-  
-            gg = group.create_group(epoch)
-            dset = gg.create_dataset(epoch, data=data, compression='gzip')
-            for key, value in h5in[k][epoch].attrs.iteritems():
-                gg.attrs[key] = value
-  
-        h5out.close()
-        h5in.close()
-  
-    ## All the other file types
-    else:
-        data,atr = readfile.read(fileList[0])
-        for i in range(1,len(fileList)):
-            #print fileList[i]
-            d,r = readfile.read(fileList[i])
-            data = diff(data,d)
-        writefile.write(data,atr,outName)
+
+    ########################### Diff file by file, block by block ########################
+    process.map_file(fileList[0], diff_block, outName, args=(fileList,), by_block=True, num_layer=2+len(fileList))
 
 
 #####################################################################################
@@ -4,6 +4,7 @@
 # Copyright(c) 2013, Heresh Fattahi                        #
 # Author:  Heresh Fattahi                                  #
 ############################################################
+# Yunjun, Feb 2017: use multilook_matrix() from multilook.py for multilook()
 
 
 import sys
@@ -17,6 +18,7 @@ from scipy import ndimage
 
 import pysar._readfile as readfile
 import pysar._writefile as writefile
+from pysar.multilook import multilook_matrix
 
 try:    from skimage.filters import roberts,sobel,canny,gaussian
 except:
@@ -84,19 +86,8 @@ def filter(data,filtType,par):
     return filt_data
 
 def multilook(ifg,lksy,lksx):
-    rows,cols=ifg.shape
-    rows_lowres=np.floor(rows/lksy)
-    cols_lowres=np.floor(cols/lksx)    
-    thr = np.floor(lksx*lksy/2)
-    
-    ifg_Clowres=np.zeros((rows,cols_lowres))
-    ifg_lowres =np.zeros((rows_lowres,cols_lowres))
-    
-    for c in range(int(cols_lowres)):   ifg_Clowres[:,c]=np.sum(ifg[:,(c)*lksx:(c+1)*lksx],1)
-    for r in range(int(rows_lowres)):   ifg_lowres[r,:]=np.sum(ifg_Clowres[(r)*lksy:(r+1)*lksy,:],0)
-    
-    ifg_lowres=ifg_lowres/(lksy*lksx) 
-    return ifg_lowres
+    '''Multilook with mean of each window, NaN propagated. Use multilook.multilook_matrix()'''
+    return multilook_matrix(ifg, lksy, lksx, method='mean')
 
 def main(argv):
 
@@ -228,6 +219,7 @@ def main(argv):
         if 'interferograms' in h5file.keys():
             print 'Filtering the interferograms in space'
             gg = h5file_lks.create_group('interferograms')
+            readfile.check_stack_layout(h5file, 'interferograms')
             igramList=h5file['interferograms'].keys()
             for igram in igramList:
                 print igram
@@ -235,18 +227,19 @@ def main(argv):
                 unw=unwSet[0:unwSet.shape[0],0:unwSet.shape[1]]
                 unw=filter(unw,filtType,par)
                 group = gg.create_group(igram)
-                dset = group.create_dataset(igram, data=unw, compression='gzip')
+                dset = writefile.create_dataset(group, igram, data=unw)
                 for key, value in h5file['interferograms'][igram].attrs.iteritems():
                     group.attrs[key] = value
     
             dset1=h5file['mask'].get('mask')
             mask=dset1[0:dset1.shape[0],0:dset1.shape[1]]
             group=h5file_lks.create_group('mask')
-            dset = group.create_dataset('mask', data=mask, compression='gzip')
+            dset = writefile.create_dataset(group, 'mask', data=mask)
     
         elif 'timeseries' in h5file.keys():
             print 'Filtering the time-series'
             group = h5file_lks.create_group('timeseries')
+            readfile.check_stack_layout(h5file, 'timeseries')
             dateList=h5file['timeseries'].keys()
             for d in dateList:
                 print d
@@ -254,7 +247,7 @@ def main(argv):
                 data=dset1[0:dset1.shape[0],0:dset1.shape[1]]
                 data=filter(data,filtType,par)
                 
-                dset = group.create_dataset(d, data=data, compression='gzip')      
+                dset = writefile.create_dataset(group, d, data=data)      
       
             for key,value in h5file['timeseries'].attrs.iteritems():
                 group.attrs[key] = value
@@ -265,7 +258,7 @@ def main(argv):
                 Mask = dset1[0:dset1.shape[0],0:dset1.shape[1]]
                 # Masklks=multilook(Mask,alks,rlks)
                 group=h5file_lks.create_group('mask')
-                dset = group.create_dataset('mask', data=Mask, compression='gzip')
+                dset = writefile.create_dataset(group, 'mask', data=Mask)
             except:
                 print 'Filterd file does not include the maske'
     
@@ -278,7 +271,7 @@ def main(argv):
             dset1 = h5file[k[0]].get(k[0])
             data = dset1[0:dset1.shape[0],0:dset1.shape[1]]
             data = filter(data,filtType,par)
-            dset = group.create_dataset(k[0], data=data, compression='gzip')
+            dset = writefile.create_dataset(group, k[0], data=data)
             for key , value in h5file[k[0]].attrs.iteritems():
                 group.attrs[key]=value
     
@@ -14,10 +14,14 @@ import datetime
 import h5py
 import numpy as np
 
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+
 ######################################
 
 def get_data(h5timeseries):
 
+    readfile.check_stack_layout(h5timeseries, 'timeseries')
     dateList = h5timeseries['timeseries'].keys()
   
     dateIndex={}
@@ -120,7 +124,7 @@ def main(argv):
     for date in dateList: 
         i=i+1   
         print date
-        dset = group.create_dataset(date, data=np.reshape(timeseries_filt[i,:],[nrows,ncols]), compression='gzip') 
+        dset = writefile.create_dataset(group, date, data=np.reshape(timeseries_filt[i,:],[nrows,ncols])) 
   
     #  group = h5timeseriesDEMcor.create_group('timeseries')
     for key,value in h5File['timeseries'].attrs.iteritems():
@@ -7,6 +7,7 @@
 # Yunjun, Jan 2016: support ROI_PAC files
 # Yunjun, Jun 2016: use readfile.read()
 #                   Add nonzero method, equivalent to Mask.h5
+# Yunjun, Feb 2017: use ut.stack_statistics() for nonzero mask of multi-dataset file
 
 
 import sys
@@ -14,10 +15,10 @@ import os
 import getopt
 
 import numpy as np
-import h5py
 
 import pysar._readfile as readfile
 import pysar._writefile as writefile
+import pysar._pysar_utilities as ut
 
 def usage():
     print '''
@@ -99,18 +100,7 @@ def main(argv):
   
         ext = os.path.splitext(File)[1].lower()
         if ext == '.h5' and k in ['interferograms','coherence','wrapped','timeseries']:
-            h5file = h5py.File(File,'r')
-            epochList = h5file[k].keys()
-  
-            for epoch in epochList:
-                print epoch
-                if k in ['interferograms','coherence','wrapped']:
-                    data = h5file[k][epoch].get(epoch)[:]
-                elif k in ['timeseries']:
-                    data = h5file[k].get(epoch)
-                MaskZero *= data
-                MaskZero[np.isnan(data)] = 0
-            h5file.close()
+            MaskZero = ut.stack_statistics(File, ['nonzero']).nonzero
   
         else:
             data,atr = readfile.read(File)
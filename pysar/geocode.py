@@ -13,6 +13,9 @@
 #                   Add support for subsetted radar coded files
 # Yunjun, Jun 2016: Add geocode_attribute(), use read() and write() for file IO
 # Yunjun, Jan 2017: add geocode_file_roipac(), parallel and cmdLineParse()
+# Yunjun, Feb 2017: replace geocode.pl with get_lookup_table() and geocode_data(),
+#                   nearest and bilinear interpolation, no roi_pac needed
+#                   cache look up table once per process
 
 
 import os
@@ -20,6 +23,7 @@ import sys
 import argparse
 
 import h5py
+import numpy as np
 from joblib import Parallel, delayed
 import multiprocessing
 
@@ -28,50 +32,100 @@ import pysar._writefile as writefile
 import pysar._pysar_utilities as ut
 
 
-def geomap4subset_radar_file(radar_atr, geomap_file):
-    ''' Add offset value to geomap file if input radar file has been subsetted.'''
+######################  Look up table  ########################
+def get_lookup_table(lookup_file, radar_atr=dict(), interp_method='nearest'):
+    '''Read look up table file once and pre-compute the index/weight map from radar to geo coord
+    Inputs:
+        lookup_file   - string, geomap*.trans file, with range/azimuth coord of each geo pixel
+        radar_atr     - dict, attributes of file in radar coord, for its size and subset offset
+        interp_method - string, nearest or bilinear
+    Output:
+        lut - dict, with the following items:
+              index  - 2D np.array of int in size of (numNeighbor, numValidGeoPixel), 1D index in radar coord
+              weight - 2D np.array of float32 in the same size of index, for bilinear only
+              valid  - 1D np.array of bool in size of geo pixels, geo pixels covered by radar file
+              shape  - tuple of 2 int, size in geo coord
+              atr    - dict, attributes of look up table file
+    Example:
+        lut = get_lookup_table('geomap_4rlks.trans', atr, 'bilinear')
+        geo_data = geocode_data(data, lut)
+    '''
+    print 'reading look up table file: '+lookup_file
+    rg, lut_atr = readfile.read(lookup_file, (), 'range')
+    az = readfile.read(lookup_file, (), 'azimuth')[0]
+    geo_shape = rg.shape
+    rg = rg.flatten()
+    az = az.flatten()
+
+    # zero value in look up table: not covered by radar data
+    valid = np.multiply(rg != 0., az != 0.)
+
+    # offset for previously subsetted radar coord file
     if 'subset_x0' in radar_atr.keys():
-        x0 = float(radar_atr['subset_x0'])
-        y0 = float(radar_atr['subset_y0'])
-        print '\nInput radar coord file has been subsetted.\n    creating temporary geomap file for it...'
+        print 'input radar coord file has been subsetted, apply offset to look up table.'
+        rg -= float(radar_atr['subset_x0'])
+        az -= float(radar_atr['subset_y0'])
+
+    try:
+        length = int(radar_atr['FILE_LENGTH'])
+        width  = int(radar_atr['WIDTH'])
+    except:
+        length = int(np.ceil(np.max(az[valid]))) + 1
+        width  = int(np.ceil(np.max(rg[valid]))) + 1
+
+    lut = dict()
+    if interp_method == 'nearest':
+        row = np.rint(az).astype(np.int64)
+        col = np.rint(rg).astype(np.int64)
+        valid *= (row >= 0) * (row < length) * (col >= 0) * (col < width)
+        lut['index']  = (row[valid]*width + col[valid]).reshape(1,-1)
+        lut['weight'] = None
+    elif interp_method == 'bilinear':
+        row = np.floor(az).astype(np.int64)
+        col = np.floor(rg).astype(np.int64)
+        valid *= (row >= 0) * (row < length-1) * (col >= 0) * (col < width-1)
+        row, col = row[valid], col[valid]
+        dy = np.array(az[valid] - row, np.float32)
+        dx = np.array(rg[valid] - col, np.float32)
+        idx = row*width + col
+        lut['index']  = np.vstack((idx, idx+1, idx+width, idx+width+1))
+        lut['weight'] = np.vstack(((1-dy)*(1-dx), (1-dy)*dx, dy*(1-dx), dy*dx))
+    else:
+        print 'Un-recognized interpolation method: '+interp_method; sys.exit(1)
+    lut['valid'] = valid
+    lut['shape'] = geo_shape
+    lut['atr'] = lut_atr
+    print 'interpolation method: %s, %d pixels in geo coord covered by radar coord file' % (interp_method, np.sum(valid))
+    return lut
+
 
-        rg,az,rsc = readfile.read_float32(geomap_file)
-        rg = rg - x0
-        az = az - y0
+# look up tables read in this process, see get_lookup_table_cached()
+_lut_cache = dict()
 
-        geomap_file = 'temp_'+geomap_file
-        print '    writing >>> '+geomap_file+'\n'
-        writefile.write_float32(rg, az, geomap_file)
-        f = open(geomap_file+'.rsc','w')
-        for key in rsc.keys():
-            f.write(key+'    '+rsc[key]+'\n')
-        f.close()
-    return geomap_file
+def get_lookup_table_cached(lookup_file, radar_atr=dict(), interp_method='nearest'):
+    '''Look up table from get_lookup_table(), read once per process for all files with the same
+    size and subset in radar coord, so that only the look up file name is sent to worker processes,
+    instead of the index/weight map.
+    '''
+    key = (lookup_file, os.path.getmtime(lookup_file), interp_method)
+    key += tuple([radar_atr.get(i,'0') for i in ['WIDTH','FILE_LENGTH','subset_x0','subset_y0']])
+    if key not in _lut_cache.keys():
+        _lut_cache[key] = get_lookup_table(lookup_file, radar_atr, interp_method)
+    return _lut_cache[key]
 
 
 ######################  Geocode one data  ########################
-def geocode_data_roipac(data,geomapFile,outname):
-
-    print 'writing to roi_pac unw file format'
-    writefile.write_float32(data, outname)
-    f = open(outname+'.rsc','w')
-    f.write('FILE_LENGTH       '+str(data.shape[0])+'\n')
-    f.write('WIDTH             '+str(data.shape[1])+'\n')
-    f.close()
- 
-    geoCmd='geocode.pl '+geomapFile+' '+outname+' geo_'+outname
-    print geoCmd
-    os.system(geoCmd)
- 
-    print 'reading geocoded file...'
-    amp,unw,unwrsc = readfile.read_float32('geo_'+outname)
- 
-    rmCmd='rm '+outname;                 os.system(rmCmd);       print rmCmd
-    rmCmd='rm '+outname+'.rsc';          os.system(rmCmd);       print rmCmd
-    rmCmd='rm geo_'+outname;             os.system(rmCmd);       print rmCmd
-    rmCmd='rm geo_'+outname+'.rsc';      os.system(rmCmd);       print rmCmd
- 
-    return amp, unw, unwrsc
+def geocode_data(data, lut):
+    '''Geocode one 2D matrix in radar coord with look up table from get_lookup_table()
+    Geo pixels not covered by radar data are filled with zero, as geocode.pl of roi_pac.
+    '''
+    data = data.flatten()
+    geo_data = np.zeros(lut['valid'].shape, data.dtype)
+    if lut['weight'] is None:
+        geo_data[lut['valid']] = data[lut['index'][0]]
+    else:
+        geo_data[lut['valid']] = np.sum(data[lut['index']] * lut['weight'], axis=0)
+    return geo_data.reshape(lut['shape'])
 
 
 ######################################################################################
@@ -94,26 +148,20 @@ def geocode_attribute(atr_rdr, atr_geo, transFile=None):
     return atr
 
 
-def geocode_file_roipac(infile, geomap_file, outfile=None):
-    '''Geocode one file'''
+def geocode_file(infile, lut, outfile=None):
+    '''Geocode one file with look up table from get_lookup_table()'''
     # Input file info
     atr = readfile.read_attribute(infile)
     k = atr['FILE_TYPE']
     print 'geocoding '+k+' file: '+infile+' ...'
+    if k == 'wrapped' and lut['weight'] is not None:
+        print 'WARNING: bilinear interpolation of wrapped phase is meaningless, use nearest for '+infile
+        # nearest neighbor is the one with the largest bilinear weight
+        near = np.argmax(lut['weight'], axis=0)
+        lut = dict(lut)
+        lut['index'] = lut['index'][near, np.arange(near.size)].reshape(1,-1)
+        lut['weight'] = None
 
-    # roipac outfile name info - intermediate product
-    ext = os.path.splitext(infile)[1]
-    infile_base = os.path.basename(infile).split(ext)[0]
-    if k == 'coherence':  roipac_ext = '.cor'
-    elif k == 'wrapped':  roipac_ext = '.int'
-    else:  roipac_ext = '.unw'
-     
-    # temporary geomap file - needed for parallel processing
-    geomap_file_orig = geomap_file
-    geomap_file = geomap_file_orig.split('.trans')[0]+'4'+infile_base+'.trans'
-    cpCmd='cp '+geomap_file_orig+' '+geomap_file;              os.system(cpCmd);  print cpCmd
-    cpCmd='cp '+geomap_file_orig+'.rsc '+geomap_file+'.rsc';   os.system(cpCmd);  print cpCmd
-    
     # Output file name
     if not outfile:
         outfile = 'geo_'+infile
@@ -122,70 +170,65 @@ def geocode_file_roipac(infile, geomap_file, outfile=None):
     # Multi-dataset file
     if k in ['timeseries','interferograms','coherence','wrapped']:
         h5 = h5py.File(infile, 'r')
-        epochList = sorted(h5[k].keys())
+        epochList = readfile.get_epoch_list(h5, k)
+        h5.close()
         print 'number of epochs: '+str(len(epochList))
         
         h5out = h5py.File(outfile, 'w')
         group = h5out.create_group(k)
         
         if k in ['interferograms','coherence','wrapped']:
-            for epoch in epochList:
-                print epoch
-                data = h5[k][epoch].get(epoch)[:]
-                atr = h5[k][epoch].attrs
-                
-                roipac_outname = infile_base+'_'+epoch+roipac_ext
-                geo_amp, geo_data, geo_rsc = geocode_data_roipac(data, geomap_file, roipac_outname)
-                geo_atr = geocode_attribute(atr, geo_rsc)
+            for i in range(len(epochList)):
+                epoch = epochList[i]
+                data, atr = readfile.read(infile, (), epoch)
+                geo_data = geocode_data(data, lut)
+                geo_atr = geocode_attribute(atr, lut['atr'])
                 
                 gg = group.create_group('geo_'+epoch)
-                dset = gg.create_dataset('geo_'+epoch, data=geo_data, compression='gzip')
+                dset = writefile.create_dataset(gg, 'geo_'+epoch, data=geo_data)
                 for key, value in geo_atr.iteritems():
                     gg.attrs[key] = value
+                ut.print_progress(i+1, len(epochList), prefix='geocoding:', suffix=epoch)
 
         elif k in ['timeseries']:
-            for epoch in epochList:
-                print epoch
-                data = h5[k].get(epoch)[:]
-                
-                roipac_outname = infile_base+'_'+epoch+roipac_ext
-                geo_amp, geo_data, geo_rsc = geocode_data_roipac(data, geomap_file, roipac_outname)
-                
-                dset = group.create_dataset(epoch, data=geo_data, compression='gzip')
-            geo_atr = geocode_attribute(atr, geo_rsc)
+            for i in range(len(epochList)):
+                epoch = epochList[i]
+                data = readfile.read(infile, (), epoch)[0]
+                geo_data = geocode_data(data, lut)
+                dset = writefile.create_dataset(group, epoch, data=geo_data)
+                ut.print_progress(i+1, len(epochList), prefix='geocoding:', suffix=epoch)
+            geo_atr = geocode_attribute(atr, lut['atr'])
             for key, value in geo_atr.iteritems():
                 group.attrs[key] = value
-                
-        h5.close()
         h5out.close()
                 
     # Single-dataset file
     else:
         data, atr = readfile.read(infile)
-        roipac_outname = infile_base+roipac_ext
-        
-        geo_amp, geo_data, geo_rsc = geocode_data_roipac(data, geomap_file, roipac_outname)
-        geo_atr = geocode_attribute(atr, geo_rsc)
-        
+        geo_data = geocode_data(data, lut)
+        geo_atr = geocode_attribute(atr, lut['atr'])
         writefile.write(geo_data, geo_atr, outfile)
 
-    # delete temporary geomap file
-    rmCmd='rm '+geomap_file;         os.system(rmCmd);   print rmCmd
-    rmCmd='rm '+geomap_file+'.rsc';  os.system(rmCmd);   print rmCmd
-
     return outfile
 
 
+def geocode_file_with_lookup_file(infile, lookup_file, interp_method='nearest', outfile=None):
+    '''Geocode one file with look up table file, for parallel processing'''
+    lut = get_lookup_table_cached(lookup_file, readfile.read_attribute(infile), interp_method)
+    return geocode_file(infile, lut, outfile)
+
+
 ######################################################################################
 EXAMPLE='''example:
   geocode.py  geomap_8rlks.trans  velocity.py
   geocode.py  geomap_8rlks.trans  *velocity*h5
   geocode.py  geomap_8rlks.trans  timeseries_ECMWF_demCor.h5 velocity_ex.h5
+  geocode.py  geomap_8rlks.trans  velocity.h5 -i bilinear
 '''
 
 
 def cmdLineParse():
-    parser = argparse.ArgumentParser(description='Geocode PySAR products using roi_pac geocoding function',\
+    parser = argparse.ArgumentParser(description='Geocode PySAR products using look up table from roi_pac',\
                                      formatter_class=argparse.RawTextHelpFormatter,\
                                      epilog=EXAMPLE)
 
@@ -194,6 +237,9 @@ def cmdLineParse():
                              'i.e. geomap_*rlks.trans for roi_pac product')
     parser.add_argument('file', nargs='+', help='File(s) to be geocoded')
     parser.add_argument('-o','--outfile', help='Output file name. Disabled when more than 1 input files')
+    parser.add_argument('-i','--interpolate', dest='interp_method', default='nearest', choices={'nearest','bilinear'},\
+                        help='interpolation method, default: nearest.\n'+\
+                             'nearest is always used for wrapped interferograms.')
     parser.add_argument('--no-parallel',dest='parallel',action='store_false',default=True,\
                         help='Disable parallel processing. Diabled auto for 1 input file.')
     
@@ -206,14 +252,11 @@ def main(argv):
     inps = cmdLineParse()
     inps.file = ut.get_file_list(inps.file)
     
-    if not ut.which('geocode.pl'):
-        sys.exit("\nERROR: Can not find geocode.pl, it's needed for geocoding.\n")
-    
     #print '\n***************** Geocoding *******************'
     if not inps.lookup_file.endswith('.trans'):
         print 'ERROR: Input lookup file is not .trans file: '+inps.lookup_file+'\n'
         sys.exit(1)
-    print 'number of file to mask: '+str(len(inps.file))
+    print 'number of file to geocode: '+str(len(inps.file))
     print inps.file
     
     # check outfile and parallel option
@@ -223,25 +266,16 @@ def main(argv):
         inps.parallel =  False
         print 'parallel processing is diabled for one input file'
 
-    # Check geomap file for previously subsetted radar coord file
-    atr = readfile.read_attribute(inps.file[0])
-    if 'subset_x0' in atr.keys():
-        inps.lookup_file = geomap4subset_radar_file(atr, inps.lookup_file)
-
-    # Geocoding
+    # Look up table, read once per process for all files with the same size and subset in radar coord
     if inps.parallel:
         num_cores = multiprocessing.cpu_count()
         print 'parallel processing using %d cores ...'%(num_cores)
-        Parallel(n_jobs=num_cores)(delayed(geocode_file_roipac)(file, inps.lookup_file) for file in inps.file)
+        Parallel(n_jobs=num_cores)(delayed(geocode_file_with_lookup_file)(File, inps.lookup_file, inps.interp_method)\
+                                   for File in inps.file)
     else:
         for File in inps.file:
             print '----------------------------------------------------'
-            geocode_file_roipac(File, inps.lookup_file, inps.outfile)
-
-    # clean temporary geomap file for previously subsetted radar coord file
-    if 'subset_x0' in atr.keys():
-        rmCmd='rm '+inps.lookup_file;            os.system(rmCmd);       print rmCmd
-        rmCmd='rm '+inps.lookup_file+'.rsc';     os.system(rmCmd);       print rmCmd
+            geocode_file_with_lookup_file(File, inps.lookup_file, inps.interp_method, inps.outfile)
 
     print 'Done.'
     return
@@ -1,40 +1,73 @@
 #! /usr/bin/env python
+# Yunjun, Feb 2017: add closure statistics by default, computed block by block
+#                   write curls file only with --curls option, or the 2nd argument as before
+
 
 import sys
 import os
-import re
+import argparse
+import multiprocessing
+
 import h5py
-import getopt
+
 import pysar._pysar_utilities as ut
 
 
-def usage():
-    print '''
-*******************************************************************
+##################################################################################################
+EXAMPLE='''example:
+  igram_closure.py  Seeded_unwrapIfgram.h5
+  igram_closure.py  Seeded_unwrapIfgram.h5  -o numNonzeroClosure.h5  --parallel
+  igram_closure.py  Seeded_unwrapIfgram.h5  --curls curls.h5
+  igram_closure.py  Seeded_unwrapIfgram.h5  curls.h5
+'''
+
+def cmdLineParse(argv):
+    parser = argparse.ArgumentParser(description='Phase closure of interferogram triangles, for network QA.\n'+\
+                                     'Count triangles with non-zero integer ambiguity of closure phase for each pixel.',\
+                                     formatter_class=argparse.RawTextHelpFormatter,\
+                                     epilog=EXAMPLE)
 
-  igram_closure.py Seeded_unwrapIfgram.h5
+    parser.add_argument('file', help='unwrapped interferograms file')
+    parser.add_argument('curl_file_pos', nargs='?', metavar='curl_file',\
+                        help='write closure phase of all triangles into file, same as --curls option')
+    parser.add_argument('-o','--outfile', default='numNonzeroClosure.h5',\
+                        help='output file of closure statistics, default: numNonzeroClosure.h5')
+    parser.add_argument('--curls', dest='curl_file', nargs='?', const='curls.h5',\
+                        help='write closure phase of all triangles into file, default: curls.h5.\n'+\
+                             'It is in the size of number of triangles times the scene, skipped by default.')
+    parser.add_argument('--memory', dest='max_memory', type=float, default=4.0,\
+                        help='maximum memory to use in GB, default: 4')
+    parser.add_argument('--parallel', action='store_true', help='calculate blocks in parallel using all cores')
 
-*******************************************************************
-    '''
+    inps = parser.parse_args(argv)
+    if inps.curl_file_pos:
+        inps.curl_file = inps.curl_file_pos
+    return inps
 
+
+##################################################################################################
 def main(argv):
+    inps = cmdLineParse(argv)
+
+    if inps.curl_file:
+        if os.path.isfile(inps.curl_file):
+            print inps.curl_file+' already exists!'
+        else:
+            h5file = h5py.File(inps.file, 'r')
+            curls, Triangles, C = ut.get_triangles(h5file)
+            ut.generate_curls(inps.curl_file, h5file, Triangles, curls, inps.max_memory)
+            h5file.close()
+        return
 
-    try:  file=argv[0]
-    except:  usage();sys.exit(1)
- 
-    h5file=h5py.File(file)
-    curls,Triangles,C=ut.get_triangles(h5file)
- 
-    try:     curlfile=argv[1]
-    except:  curlfile='curls.h5'
- 
-    if not os.path.isfile(curlfile):
-        ut.generate_curls(curlfile,h5file,Triangles,curls)
-    else:
-        print curlfile + " already exists!"
+    num_cores = 1
+    if inps.parallel:
+        num_cores = multiprocessing.cpu_count()
+    ut.closure_statistics(inps.file, inps.outfile, inps.max_memory, num_cores)
+    print 'Done.'
+    return
 
 
+##################################################################################################
 if __name__ == '__main__':
     main(sys.argv[1:])
 
-
@@ -7,116 +7,115 @@
 
 
 import sys
-import os
-import getopt
-
-import h5py
+import argparse
 
 import pysar._pysar_utilities as ut
 import pysar._readfile as readfile
 
 
 ######################################
-def usage():
-    print '''
-********************************************************************************
-  Inversion of interferograms using L1 or L2 norm minimization (Default is L2)
-  
-  Usage:
-      igram_inversion.py interferograms_file
-      igram_inversion.py -f interferograms_file [ -l method -o timeseries_file]
-  
-      -f: stacked interferograms file
-      -l: inverse method, L2 (default) or L1
-      -o: output timeseries file name
-  
-  Example:
-      igram_inversion.py Seeded_unwrapIfgram.h5
-      igram_inversion.py -f Seeded_unwrapIfgram.h5 -l L1
-
-********************************************************************************
-    '''
+EXAMPLE='''example:
+  igram_inversion.py  Seeded_unwrapIfgram.h5
+  igram_inversion.py  Seeded_unwrapIfgram.h5 -l L1
+  igram_inversion.py  Seeded_unwrapIfgram.h5 -o timeseries.h5 --memory 16
+  igram_inversion.py  Seeded_unwrapIfgram.h5 --parallel 8
+  igram_inversion.py  Seeded_unwrapIfgram.h5 -w variance --coherence coherence.h5
+  igram_inversion.py  Seeded_unwrapIfgram.h5 --temp-coh temporal_coherence.h5
+  igram_inversion.py  -f Seeded_unwrapIfgram.h5 -l L1
+'''
+
+TEMPLATE='''
+pysar.networkInversion.maxMemory = 4    #[float in GB], auto for 4
+pysar.networkInversion.numWorker = 8    #[int], number of processes, auto for 1
+pysar.networkInversion.weightFunc = variance   #[coherence / no], auto for no
+'''
+
+def weight_function_name(name):
+    '''Standard name of weight function, case insensitive, with aliases: var, coh and sbas'''
+    name = name.lower()
+    aliasDict = {'var':'variance', 'coh':'coherence', 'sbas':'no'}
+    return aliasDict.get(name, name)
+
+
+def cmdLineParse(argv):
+    parser = argparse.ArgumentParser(description='Inversion of interferograms using L1 or L2 norm minimization',\
+                                     formatter_class=argparse.RawTextHelpFormatter,\
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('ifgram_file', nargs='?', help='stacked interferograms file')
+    parser.add_argument('-f', dest='ifgram_file2', help='stacked interferograms file')
+    parser.add_argument('-l', dest='method', default='L2', help='inverse method, L2 (default) or L1')
+    parser.add_argument('-o', dest='timeseries_file', default='timeseries.h5', help='output timeseries file name')
+    parser.add_argument('-t','--template', dest='template_file',\
+                        help='template file with the following items:'+TEMPLATE)
+    parser.add_argument('-w','--weight-function', dest='weight_func', default='no',\
+                        type=weight_function_name, choices={'no','coherence','variance'},\
+                        help='function of spatial coherence as weight of each interferogram, default: no\n'+\
+                             'no        - no weight, least squares (SBAS)\n'+\
+                             'coherence - weighted least squares using coherence\n'+\
+                             'variance  - weighted least squares using inverse of phase variance\n'+\
+                             '            from Cramer-Rao bound')
+    parser.add_argument('--coherence', dest='coherence_file', default='coherence.h5',\
+                        help='spatial coherence file for weighted inversion, default: coherence.h5')
+    parser.add_argument('--memory', dest='max_memory', type=float, default=4.0,\
+                        help='maximum memory to use in GB, default: 4.\n'+\
+                             'Interferograms are read/inverted/written in row blocks within this limit.')
+    parser.add_argument('--parallel', dest='num_worker', type=int, default=1,\
+                        help='number of processes to invert row blocks in parallel, default: 1.\n'+\
+                             'Each process reads its own block from the interferograms file.')
+    parser.add_argument('--temp-coh', dest='temp_coh_file',\
+                        help='output temporal coherence file, calculated in the same pass as the inversion,\n'+\
+                             'without reading interferograms again. Not supported for L1 norm.')
+
+    inps = parser.parse_args(argv)
+    if inps.ifgram_file2:
+        inps.ifgram_file = inps.ifgram_file2
+    if not inps.ifgram_file:
+        parser.print_usage();  sys.exit(1)
+    inps.method = inps.method.lower()
+    return inps
+
+
+def update_inps_from_template(inps, template_file):
+    '''Update inps with pysar.networkInversion.* options in template file'''
+    tmpl = readfile.read_template(template_file)
+    key = 'pysar.networkInversion.maxMemory'
+    if key in tmpl.keys() and tmpl[key].lower() not in ['auto','no']:
+        inps.max_memory = float(tmpl[key])
+    key = 'pysar.networkInversion.numWorker'
+    if key in tmpl.keys() and tmpl[key].lower() not in ['auto','no']:
+        inps.num_worker = int(tmpl[key])
+    key = 'pysar.networkInversion.weightFunc'
+    if key in tmpl.keys() and tmpl[key].lower() not in ['auto']:
+        inps.weight_func = weight_function_name(tmpl[key])
+    return inps
+
 
 ######################################
 def main(argv):
+    inps = cmdLineParse(argv)
+    if inps.template_file:
+        inps = update_inps_from_template(inps, inps.template_file)
 
-    inversion_method = 'l2'
-    #maskFile = 'Mask.h5'
-  
-    if len(sys.argv)>2:
-        try:   opts, args = getopt.getopt(argv,"h:f:l:o:")
-        except getopt.GetoptError:
-            usage() ; sys.exit(1)
-  
-        for opt,arg in opts:
-            if opt in ("-h","--help"):  usage();   sys.exit()
-            elif opt == '-f':           igramsFile        = arg
-            elif opt == '-l':           inversion_method  = arg.lower()
-            elif opt == '-o':           timeseriesFile    = arg
-  
-    elif len(sys.argv)==2:
-        if os.path.isfile(argv[0]):     igramsFile = argv[0]
-        else:  usage(); sys.exit(1)
-    else:  usage(); sys.exit(1)
-    
-    #try:     igramsFile = argv[0]
-    #except:  usage() ; sys.exit(1)
-    #try:     inversion_method = argv[1]
-    #except:  inversion_method = 'L2'
-  
-    try:    timeseriesFile
-    except: timeseriesFile = 'timeseries.h5'
-  
-    #h5file = h5py.File(igramsFile,'r')
-    atr = readfile.read_attribute(igramsFile)
+    atr = readfile.read_attribute(inps.ifgram_file)
     if not atr['FILE_TYPE'] == 'interferograms':
         print '**********************************************************************'
         print 'ERROR:'
-        print '       '+igramsFile+ '  was not found or the file is not readable!'
+        print '       '+inps.ifgram_file+ '  was not found or the file is not readable!'
         print '**********************************************************************'
-        usage();sys.exit(1)
-
-    #numIfgrams = len(h5file['interferograms'].keys())
-    #if numIfgrams == 0.:
-    #    print "load interferograms first by running: load_data.py TEMPLATEFILE"
-    #    sys.exit(1)
-    #h5timeseries = h5py.File(timeseriesFile,'w')
-  
+        sys.exit(1)
+
     print '\n************** Inverse Time Series ****************'
-    if not inversion_method == 'l1':
+    if not inps.method == 'l1':
         print 'Inverse time series using L2 norm minimization'
-        ut.timeseries_inversion(igramsFile,timeseriesFile)
+        ut.timeseries_inversion(inps.ifgram_file, inps.timeseries_file, inps.max_memory, inps.num_worker,\
+                                inps.coherence_file, inps.weight_func, inps.temp_coh_file)
     else:
         print 'Inverse time series using L1 norm minimization'
-        ut.timeseries_inversion_L1(igramsFile,timeseriesFile)
-  
-    ## generate 'mask' for timeseries.h5
-    #print 'Generate mask group in timeseries file.'
-    #try:
-    #    maskFile
-    #    h5filem = h5py.File(maskFile,'r'); kM = h5filem.keys()
-    #    dset1 = h5filem[kM[0]].get(kM[0])
-    #    Mask = dset1[0:dset1.shape[0],0:dset1.shape[1]]
-    #    group=h5timeseries.create_group('mask')
-    #    dset = group.create_dataset('mask', data=Mask, compression='gzip')
-    #    h5filem.close()
-    #    print 'mask: '+maskFile
-    #except:
-    #    try:
-    #        dset1 = h5file['mask'].get('mask')
-    #        Mask = dset1[0:dset1.shape[0],0:dset1.shape[1]] 
-    #        group=h5timeseries.create_group('mask')
-    #        dset = group.create_dataset('mask', data=Mask, compression='gzip')
-    #        print 'mask: mask group in '+igramsFile
-    #    except:
-    #        print 'No mask found, cannot inverse timeseries without mask!'
-    #        sys.exit(1)
-  
-    #h5file.close()
-    #h5timeseries.close()
-    #h5flat.close()
+        ut.timeseries_inversion_L1(inps.ifgram_file, inps.timeseries_file)
+    return inps.timeseries_file
+
 
 ######################################
 if __name__ == '__main__':
     main(sys.argv[1:])
-
@@ -4,16 +4,17 @@
 # Copyright(c) 2015, Yunjun Zhang                          #
 # Author:  Yunjun Zhang                                    #
 ############################################################
+# Yunjun, Feb 2017: use process.map_file() for HDF5 file
 
 
 import sys
 import os
 
-import h5py
 import numpy as np
 
 import pysar._readfile as readfile
 import pysar._writefile as writefile
+import pysar._process as process
 
 
 ########################  Sub Functions  #########################
@@ -27,6 +28,11 @@ def operation(data,operator,operand):
   
     return data2
 
+def operation_block(data, epoch, box, operator, operand):
+    '''Operation on one block of epoch, for process.map_file()'''
+    return operation(data, operator, operand)
+
+
 #####################  Image Add  ####################
 def add(data1,data2):
     data = data1 + data2;
@@ -109,70 +115,9 @@ def main(argv):
     ########### Read - Calculate - Write  ###########
     ##### PySAR HDF5 files ######
     if ext in ['.h5','.he5']:
-        try: h5file=h5py.File(file,'r')
-        except: print 'ERROR: can not open file: '+file; sys.exit(1)
-        k=h5file.keys()
-        if 'interferograms' in k: k[0] = 'interferograms'
-        elif 'coherence'    in k: k[0] = 'coherence'
-        elif 'timeseries'   in k: k[0] = 'timeseries'
-        print 'Input file is '+k[0]
-      
-        h5fileOut = h5py.File(outName,'w'); print 'writing >>> '+outName
-        group = h5fileOut.create_group(k[0])
-   
-        if k[0] in ('velocity','temporal_coherence','rmse','mask','dem'):
-            dset = h5file[k[0]].get(k[0])
-            data = dset[0:dset.shape[0],0:dset.shape[1]]
-       
-            dataOut = operation(data,operator,operand)
-       
-            dset = group.create_dataset(k[0], data=dataOut, compression='gzip')
-            for key , value in h5file[k[0]].attrs.iteritems():
-                group.attrs[key]=value
-   
-        elif k[0] == 'timeseries':
-            dateList = h5file[k[0]].keys();  print 'number of dates: '+str(len(dateList))
-            for date in dateList:
-                print date
-                dset = h5file[k[0]].get(date)
-                data = dset[0:dset.shape[0],0:dset.shape[1]]
-       
-                dataOut = operation(data,operator,operand)
-       
-                dset = group.create_dataset(date, data=dataOut, compression='gzip')
-            for key,value in h5file[k[0]].attrs.iteritems():
-                group.attrs[key] = value
-   
-        elif k[0] in ['interferograms','coherence','wrapped']:
-            ifgramList = h5file[k[0]].keys();  print 'number of epochs: '+str(len(ifgramList))
-            for igram in ifgramList:
-                print igram
-                dset = h5file[k[0]][igram].get(igram)
-                data = dset[0:dset.shape[0],0:dset.shape[1]]
-        
-                dataOut = operation(data,operator,operand)
-        
-                group2 = group.create_group(igram)
-                dset = group2.create_dataset(igram, data=dataOut, compression='gzip')
-                for key, value in h5file[k[0]][igram].attrs.iteritems():
-                    group2.attrs[key] = value
-       
-            try:
-                mask = h5file['mask'].get('mask')
-                gm = h5fileOut.create_group('mask')
-                dset = gm.create_dataset('mask', data=mask, compression='gzip')
-            except:  print 'No group for mask found in the file.'
-       
-            try:
-                Cset = h5file['meanCoherence'].get('meanCoherence')
-                gm = h5fileOut.create_group('meanCoherence')
-                dset = gm.create_dataset('meanCoherence', data=Cset, compression='gzip')
-            except:  print 'No group for meanCoherence found in the file'
-
-        else: print 'ERROR: Unrecognized HDF5 file type: '+k[0]; sys.exit(1)
-   
-        h5file.close()
-        h5fileOut.close()
+        k = readfile.read_attribute(file)['FILE_TYPE']
+        print 'Input file is '+k
+        process.map_file(file, operation_block, outName, args=(operator,operand), by_block=True)
 
     ##### ROI_PAC files #######
     elif ext in ['.unw','.cor','.hgt','.dem','.trans']:
@@ -127,7 +127,7 @@ def main(argv):
 
         ##### DateList / IgramList
         if k in ['interferograms','coherence','wrapped','timeseries']:
-            epochList = sorted(h5file[k].keys())
+            epochList = readfile.get_epoch_list(h5file, k)
 
     if k == 'timeseries':
         try: print_timseries_date_info(epochList)
@@ -140,7 +140,7 @@ def main(argv):
         ##### Plot Attributes of One Epoch
         try: 
             epochNum = int(argv[1])
-            epochAtr = h5file[k][epochList[epochNum-1]].attrs
+            epochAtr = readfile.read_h5_attribute(h5file, k, epochList[epochNum-1])
             print '*****************************************'
             print epochList[epochNum-1]
             print '*************** Attributes **************'
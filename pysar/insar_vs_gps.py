@@ -14,6 +14,8 @@ import h5py
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
 
+import pysar._point as pt
+
 def readGPSfile(gpsFile,gps_source):
    if gps_source in ['cmm4','CMM4']:
 
@@ -89,11 +91,11 @@ def find_row_column(Lon,Lat,lon,lat,lon_step,lat_step):
    ################################################
   # finding row and column numbers of the GPS point
 
-  idx= nearest(Lon, lon, lon_step)
-  idy= nearest(Lat, lat, lat_step)
-  if idx !=[] and idy != []:
-     IDX=np.where(idx==True)[0][0]
-     IDY=np.where(idy==True)[0][0]
+  IDX,flagx = pt.nearest_index(Lon, lon[0], lon_step, len(lon))
+  IDY,flagy = pt.nearest_index(Lat, lat[0], lat_step, len(lat))
+  if flagx and flagy:
+     IDX=int(IDX)
+     IDY=int(IDY)
   else:
      IDX=np.nan
      IDY=np.nan
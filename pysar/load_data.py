@@ -9,20 +9,25 @@
 # Yunjun, Jan 2017: Add auto_path_miami(), copy_roipac_file()
 #                   Add load_roipac2multi_group_h5()
 #                   Add r+ mode loading of multi_group hdf5 file
+# Yunjun, Feb 2017: Read/compress files in parallel, re-load new/changed files only with manifest
+#                   Calculate mask and average coherence while loading
 
 
 import os
 import sys
 import glob
 import time
+import json
 import argparse
 
 import h5py
 import numpy as np
+from joblib import Parallel, delayed
 
 import pysar
 import pysar._readfile as readfile
 import pysar._pysar_utilities as ut
+import pysar._writefile as writefile
 
 
 ############################ Sub Functions ###################################
@@ -114,8 +119,50 @@ def check_file_size(fileList, mode_width=None, mode_length=None):
     return fileListOut, mode_width, mode_length
 
 
+def get_manifest_file(hdf5File):
+    '''Manifest file of HDF5 file, recording size and mtime of loaded ROI_PAC files'''
+    return os.path.splitext(hdf5File)[0]+'.manifest.json'
+
+
+def get_file_stamp(File):
+    '''Size and modification time of ROI_PAC file and its .rsc file'''
+    stamp = dict()
+    for fname, key in [(File, ''), (File+'.rsc', 'rsc_')]:
+        if os.path.isfile(fname):
+            st = os.stat(fname)
+            stamp[key+'size']  = st.st_size
+            stamp[key+'mtime'] = st.st_mtime
+    return stamp
+
+
+def read_manifest(hdf5File):
+    '''Read manifest of HDF5 file into dict of {epoch: {path, size, mtime, rsc_size, rsc_mtime}}'''
+    manifestFile = get_manifest_file(hdf5File)
+    if not os.path.isfile(hdf5File) or not os.path.isfile(manifestFile):
+        return dict()
+    try:
+        with open(manifestFile, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        print 'WARNING: can not read manifest file: '+manifestFile+', ignore it.'
+        return dict()
+
+
+def write_manifest(hdf5File, manifest):
+    '''Write manifest dict of HDF5 file into json file, replaced at once'''
+    manifestFile = get_manifest_file(hdf5File)
+    with open(manifestFile+'.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(manifestFile+'.tmp', manifestFile)
+    return manifestFile
+
+
 def check_existed_hdf5_file(roipacFileList, hdf5File):
-    '''Check file list with existed hdf5 file'''
+    '''Check file list with existed hdf5 file
+    Files already loaded and unchanged since, based on their size and mtime recorded in manifest
+    file, are removed from the list. Without manifest (file loaded by previous version), file with
+    epoch name existed in hdf5 file is considered as loaded.
+    '''
     # If input file list is empty
     outFileList = list(roipacFileList)
     if not outFileList:
@@ -127,37 +174,100 @@ def check_existed_hdf5_file(roipacFileList, hdf5File):
         atr = readfile.read_attribute(hdf5File)
         k = atr['FILE_TYPE']
         h5 = h5py.File(hdf5File, 'r')
+        readfile.check_stack_layout(h5, k)
         epochList = sorted(h5[k].keys())
         h5.close()
+        manifest = read_manifest(hdf5File)
         
-        # Remove file/epoch that already existed
-        for epoch in epochList:
-            for file in roipacFileList:
-                if epoch in file:
+        # Remove file/epoch that already existed and unchanged
+        for file in roipacFileList:
+            epoch = os.path.basename(file)
+            if epoch in manifest.keys():
+                stamp = dict(manifest[epoch])
+                stamp.pop('path', None)
+                if epoch in epochList and stamp == get_file_stamp(file):
                     outFileList.remove(file)
+                else:
+                    print 'changed since last loading: '+file
+            elif [e for e in epochList if e in file]:
+                outFileList.remove(file)
 
-        # Check mode length/width with existed hdf5 file
+        # Check length/width with existed hdf5 file
         if outFileList:
-            ext = os.path.splitext(outFileList[0])[1]
-            outFileList, mode_width, mode_length = check_file_size(outFileList)
-            if mode_width != atr['WIDTH'] or mode_length != atr['FILE_LENGTH']:
+            outFileList = check_file_size(outFileList, atr['WIDTH'], atr['FILE_LENGTH'])[0]
+            if not outFileList:
                 print 'WARNING: input ROI_PAC files have different size than existed hdf5 file:'
-                print 'ROI_PAC file size: '+mode_length+', '+mode_width
                 print 'HDF5    file size: '+atr['FILE_LENGTH']+', '+atr['WIDTH']
-                print 'Continue WITHOUT loading '+ext+' file'
+                print 'Continue WITHOUT loading them'
                 print 'To enforse loading, change/remove existed HDF5 filename and re-run loading script'
                 outFileList = None
     
     return outFileList
 
 
-def load_roipac2multi_group_h5(fileType, fileList, hdf5File='unwrapIfgram.h5', pysar_meta_dict=None):
+def read_roipac_file(File, project_name=None, stats=None, storage=None):
+    '''Read ROI_PAC file with its attributes (.rsc and *_baseline.rsc), and compress its data into
+    HDF5 chunks with writefile.encode_chunks() and storage policy of the writer process, to be run
+    in worker processes of loading.
+    Data is folded into per-pixel statistics of stats (ut.StackStatistics object) on the way, with
+    non-zero mask from amplitude for .unw file.
+    Output: dict with epoch, data or chunks, shape, dtype, atr and stamp
+    '''
+    data, rsc = readfile.read(File)
+    if stats is not None:
+        nonzero = None
+        if os.path.splitext(File)[1] == '.unw':
+            nonzero = readfile.read_float32(File)[0] != 0.
+        stats.add(data, nonzero)
+    atr = dict(rsc)
+    # Attribute - *baseline.rsc
+    d1, d2 = rsc['DATE12'].split('-')
+    baseline_file = os.path.dirname(File)+'/'+d1+'_'+d2+'_baseline.rsc'
+    baseline_rsc = readfile.read_roipac_rsc(baseline_file)
+    for key,value in baseline_rsc.iteritems():
+        atr[key] = value
+    # Attribute - PySAR
+    if project_name:
+        atr['PROJECT_NAME'] = project_name
+
+    out = dict()
+    out['epoch'] = os.path.basename(File)
+    out['shape'] = data.shape
+    out['dtype'] = data.dtype
+    out['chunks'] = writefile.encode_chunks(data, storage)
+    out['data'] = None if out['chunks'] is not None else np.array(data)
+    out['atr'] = atr
+    out['stamp'] = get_file_stamp(File)
+    out['stamp']['path'] = os.path.abspath(File)
+    return out
+
+
+def read_roipac_files(fileList, project_name=None, statList=None, storage=None):
+    '''Read a batch of ROI_PAC files with read_roipac_file() in one worker process, with statistics
+    of all files folded into one ut.StackStatistics object, so that only one set of scene-sized
+    statistics is passed back to the writer process for each batch.
+    Output: outList - list of dict, from read_roipac_file()
+            stats   - ut.StackStatistics object, None if statList is not given
+    '''
+    stats = None
+    if statList:
+        stats = ut.StackStatistics(statList=statList)
+    outList = [read_roipac_file(File, project_name, stats, storage) for File in fileList]
+    return outList, stats
+
+
+def load_roipac2multi_group_h5(fileType, fileList, hdf5File='unwrapIfgram.h5', pysar_meta_dict=None, parallel=1, stats=None):
     '''Load multiple ROI_PAC product into (Multi-group, one dataset and one attribute dict per group) HDF5 file.
+    Files are read and compressed by a pool of parallel processes, and written into HDF5 file by the main
+    process. A manifest file of size and mtime of loaded files is saved along the HDF5 file, so that
+    re-run only loads new or changed files.
     Inputs:
         fileType : string, i.e. interferograms, coherence, snaphu_connect_component, etc.
         fileList : list of path, ROI_PAC .unw/.cor/.int/.byt file
         hdf5File : string, file name/path of the multi-group hdf5 PySAR file
         pysar_meta_dict : dict, extra attribute dictionary 
+        parallel : int, number of processes to read/compress files
+        stats    : ut.StackStatistics object, to fold per-pixel statistics of loaded files into
     Outputs:
         hdf5File
 
@@ -176,18 +286,19 @@ def load_roipac2multi_group_h5(fileType, fileList, hdf5File='unwrapIfgram.h5', p
     fileList2 = check_existed_hdf5_file(fileList, hdf5File)
     
     # Open(Create) HDF5 file with r+/w mode based on fileList2
-    
-    if fileList2 == fileList:
+    if not os.path.isfile(hdf5File):
         # Create and open new hdf5 file with w mode
         print 'number of '+ext+' to add: '+str(len(fileList))
         print 'open '+hdf5File+' with w mode'
         h5file = h5py.File(hdf5File, 'w')
+        manifest = dict()
     elif fileList2:
         # Open existed hdf5 file with r+ mode
-        print 'Continue by adding the following new epochs ...'
-        print 'number of '+ext+' to add: '+str(len(fileList))
+        print 'Continue by adding the following new/changed epochs ...'
+        print 'number of '+ext+' to add: '+str(len(fileList2))
         print 'open '+hdf5File+' with r+ mode'
         h5file = h5py.File(hdf5File, 'r+')
+        manifest = read_manifest(hdf5File)
         fileList = list(fileList2)
     else:
         print 'All input '+ext+' are included, no need to re-load.'
@@ -200,28 +311,62 @@ def load_roipac2multi_group_h5(fileType, fileList, hdf5File='unwrapIfgram.h5', p
             gg = h5file.create_group(fileType)     # new hdf5 file
         else:
             gg = h5file[fileType]                  # existing hdf5 file
-        
+
+        project_name = None
+        if pysar_meta_dict:
+            project_name = pysar_meta_dict['project_name']
+
+        parallel = max(int(parallel), 1)
+        if parallel > 1:
+            print 'parallel processing using %d cores ...' % (parallel)
+        # number of files read by each worker in one batch, and held in memory at once
+        num_file = 4
+        step = num_file*parallel
+        statList = None
+        if stats is not None:
+            statList = stats.statList
+        # storage policy of this writer process, for chunks compressed in worker processes
+        storage = dict(writefile.storage)
+
+        # invalidate manifest of files to load, so that they are re-loaded if loading is interrupted
         for file in fileList:
-            print 'Adding ' + file
-            data, rsc = readfile.read(file)
-            
-            # Dataset
-            group = gg.create_group(os.path.basename(file))
-            dset = group.create_dataset(os.path.basename(file), data=data, compression='gzip')
-            
-            # Attribute - *.unw.rsc
-            for key,value in rsc.iteritems():
-                group.attrs[key] = value
-            # Attribute - *baseline.rsc
-            d1, d2 = rsc['DATE12'].split('-')
-            baseline_file = os.path.dirname(file)+'/'+d1+'_'+d2+'_baseline.rsc'
-            baseline_rsc = readfile.read_roipac_rsc(baseline_file)
-            for key,value in baseline_rsc.iteritems():
-                group.attrs[key] = value
-            # Attribute - PySAR
-            if pysar_meta_dict:
-                group.attrs['PROJECT_NAME'] = pysar_meta_dict['project_name']
-        
+            manifest[os.path.basename(file)] = dict()
+        write_manifest(hdf5File, manifest)
+
+        start_time = time.time()
+        with Parallel(n_jobs=parallel) as pool:
+            for i in range(0, len(fileList), step):
+                batchList = pool(delayed(read_roipac_files)(fileList[j:min(j+num_file, i+step)], project_name,\
+                                                            statList, storage)\
+                                 for j in range(i, min(i+step, len(fileList)), num_file))
+                outList = [out for batch in batchList for out in batch[0]]
+                for out in outList:
+                    epoch = out['epoch']
+                    if epoch in gg.keys():
+                        del gg[epoch]
+                    
+                    # Dataset
+                    group = gg.create_group(epoch)
+                    if out['chunks'] is not None:
+                        dset = writefile.create_dataset(group, epoch, shape=out['shape'], dtype=out['dtype'])
+                        writefile.write_chunks(dset, out['chunks'], storage)
+                    else:
+                        dset = writefile.create_dataset(group, epoch, data=out['data'])
+                    
+                    # Attribute - *.unw.rsc, *baseline.rsc and PySAR
+                    for key,value in out['atr'].iteritems():
+                        group.attrs[key] = value
+                    manifest[epoch] = out['stamp']
+                if stats is not None:
+                    for batch in batchList:
+                        stats.merge(batch[1])
+                del outList, batchList
+                h5file.flush()
+                write_manifest(hdf5File, manifest)
+                ut.print_progress(min(i+step, len(fileList)), len(fileList), prefix='loading:',\
+                                  suffix=os.path.basename(fileList[min(i+step, len(fileList))-1]),\
+                                  elapsed_time=time.time()-start_time)
+
         # End of Loop
         h5file.close()
         print 'finished writing to '+hdf5File
@@ -229,49 +374,57 @@ def load_roipac2multi_group_h5(fileType, fileList, hdf5File='unwrapIfgram.h5', p
     return hdf5File, fileList
 
 
-def roipac_nonzero_mask(unwFileList, maskFile='Mask.h5'):
-    '''Generate mask for non-zero amplitude pixel of ROI_PAC .unw file list.'''
+def roipac_nonzero_mask(unwFileList, maskFile='Mask.h5', stats=None, hdf5File=None, replaced=False):
+    '''Generate mask for non-zero amplitude pixel of ROI_PAC .unw file list.
+    Inputs:
+        unwFileList - list of string, ROI_PAC .unw files
+        maskFile    - string, output mask file
+        stats       - ut.StackStatistics object with nonzero mask folded while loading unwFileList,
+                      amplitude of .unw files are read if not given.
+        hdf5File    - string, multi-group hdf5 file of .unw files, for attributes and to check
+                      whether stats covers all of its epochs. If not, existing mask file is updated
+                      with the mask of unwFileList; or, if replaced or without mask file, the mask of
+                      the other epochs is re-calculated from the data stored in hdf5File.
+        replaced    - bool, whether unwFileList replaced existing epochs of hdf5File, so that the
+                      existing mask file is out of date.
+    '''
     unwFileList, width, length = check_file_size(unwFileList)
-    if unwFileList:
-        # Initial mask value
-        if os.path.isfile(maskFile):
-            maskZero, atr = readfile.read(maskFile)
+    if not unwFileList:
+        return maskFile, unwFileList
+
+    # Non-zero mask of input .unw file list
+    if stats is None or stats.num == 0:
+        print 'calculate non-zero mask from amplitude of '+str(len(unwFileList))+' .unw files'
+        stats = ut.StackStatistics((int(length), int(width)), statList=['nonzero'])
+        for i in range(len(unwFileList)):
+            amp = readfile.read_float32(unwFileList[i])[0]
+            stats.add(amp)
+            ut.print_progress(i+1, len(unwFileList), prefix='reading', suffix=os.path.basename(unwFileList[i]))
+    mask = stats.nonzero
+
+    # Attribute
+    if hdf5File:
+        atr = readfile.read_attribute(hdf5File)
+        epochNum = len(readfile.get_reader(hdf5File).epochList)
+    else:
+        atr = readfile.read_attribute(unwFileList[-1])
+        epochNum = len(unwFileList)
+
+    # Update existing mask file, if input does not cover all interferograms
+    if stats.num < epochNum:
+        maskOld = None
+        if not replaced and os.path.isfile(maskFile):
+            maskOld, atrOld = readfile.read(maskFile)
+        if maskOld is not None and maskOld.shape == mask.shape:
             print 'update existing mask file: '+maskFile
+            mask = mask & (maskOld != 0)
+            for key, value in atrOld.iteritems():
+                atr[key] = value
         else:
-            maskZero = np.ones([int(length), int(width)])
-            atr = None
-            print 'create initial mask matrix'
-
-        # Update mask from input .unw file list
-        fileNum = len(unwFileList)
-        for i in range(fileNum):
-            file = unwFileList[i]
-            amp, unw, rsc = readfile.read_float32(file)
-            
-            maskZero *= amp
-            ut.print_progress(i+1, fileNum, prefix='loading', suffix=os.path.basename(file))
-        mask = np.ones([int(length), int(width)])
-        mask[maskZero==0] = 0
-        
-        # write mask hdf5 file
-        print 'writing >>> '+maskFile
-        h5 = h5py.File(maskFile,'w')
-        group = h5.create_group('mask')
-        dset = group.create_dataset('mask', data=mask, compression='gzip')
-        # Attribute - *.unw.rsc
-        for key,value in rsc.iteritems():
-            group.attrs[key] = value
-        # Attribute - *baseline.rsc
-        d1, d2 = rsc['DATE12'].split('-')
-        baseline_file = os.path.dirname(file)+'/'+d1+'_'+d2+'_baseline.rsc'
-        baseline_rsc = readfile.read_roipac_rsc(baseline_file)
-        for key,value in baseline_rsc.iteritems():
-            group.attrs[key] = value
-        # Attribute - existed file
-        if atr:
-            for key, value in atr.iteritems():
-                group.attrs[key] = value
-
+            epochList = [os.path.basename(i) for i in unwFileList]
+            epochList = [i for i in readfile.get_reader(hdf5File).epochList if i not in epochList]
+            mask = mask & ut.stack_statistics(hdf5File, ['nonzero'], epochList).nonzero
+    ut.write_stack_statistics(mask, atr, maskFile)
     return maskFile, unwFileList
 
 
@@ -289,6 +442,7 @@ def copy_roipac_file(targetFile, destDir):
 EXAMPLE='''example:
   load_data_roipac.py  $TE/SanAndreasT356EnvD.template
   load_data_roipac.py  $TE/SanAndreasT356EnvD.template  --dir $SC/SanAndreasT356EnvD/PYSAR
+  load_data_roipac.py  $TE/SanAndreasT356EnvD.template  --parallel 8
 '''
 
 TEMPLATE='''template:
@@ -298,6 +452,7 @@ TEMPLATE='''template:
   pysar.geomap         = $SC/SanAndreasT356EnvD/PROCESS/GEO/*050102-070809*/geomap*.trans
   pysar.dem.radarCoord = $SC/SanAndreasT356EnvD/PROCESS/DONE/*050102-070809*/radar*.hgt
   pysar.dem.geoCoord   = $SC/SanAndreasT356EnvD/DEM/srtm1_30m.dem                                     #optional
+  pysar.load.numWorker = 4     #optional, number of processes to read/compress ROI_PAC files, default: 1
 '''
 
 def cmdLineParse():
@@ -310,6 +465,9 @@ def cmdLineParse():
                                                         'Use current directory if not assigned.')
     parser.add_argument('--nomiami', dest='auto_path_miami', action='store_false',\
                         help='Disable updating file path based on University of Miami processing structure.')
+    parser.add_argument('--parallel', dest='num_worker', type=int,\
+                        help='number of processes to read/compress ROI_PAC files, default: 1.\n'\
+                             'Files are written into HDF5 file by the main process.')
 
     infile_group = parser.add_argument_group('Manually input file path')
     infile_group.add_argument('--unw', nargs='*', help='ROI_PAC unwrapped interferogram files (.unw)')
@@ -345,6 +503,8 @@ def main(argv):
     if not inps.geomap    and 'pysar.geomap'    in keyList:   inps.geomap    = template_dict['pysar.geomap']
     if not inps.dem_radar and 'pysar.dem.radarCoord' in keyList:   inps.dem_radar = template_dict['pysar.dem.radarCoord']
     if not inps.dem_geo   and 'pysar.dem.geoCoord'   in keyList:   inps.dem_geo   = template_dict['pysar.dem.geoCoord']
+    if not inps.num_worker and 'pysar.load.numWorker' in keyList:  inps.num_worker = int(template_dict['pysar.load.numWorker'])
+    if not inps.num_worker:  inps.num_worker = 1
 
     # Auto Setting for Geodesy Lab - University of Miami 
     if pysar.miami_path and 'SCRATCHDIR' in os.environ:
@@ -397,11 +557,17 @@ def main(argv):
     # 2.1 multi_group_hdf5_file
     # Unwrapped Interferograms
     if inps.unw:
-        unwList = load_roipac2multi_group_h5('interferograms', inps.unw, inps.ifgram_file, vars(inps))[1]
+        epochList = []
+        if os.path.isfile(inps.ifgram_file):
+            epochList = readfile.get_reader(inps.ifgram_file).epochList
+        unwStats = ut.StackStatistics(statList=['nonzero'])
+        unwList = load_roipac2multi_group_h5('interferograms', inps.unw, inps.ifgram_file, vars(inps), inps.num_worker,\
+                                             unwStats)[1]
         # Update mask only when update unwrapIfgram.h5
         if unwList:
             print 'Generate mask from amplitude of interferograms'
-            roipac_nonzero_mask(inps.unw, inps.mask_file)
+            replaced = any([os.path.basename(i) in epochList for i in unwList])
+            roipac_nonzero_mask(unwList, inps.mask_file, unwStats, inps.ifgram_file, replaced)
     elif os.path.isfile(inps.ifgram_file):
         print os.path.basename(inps.ifgram_file)+' already exists, no need to re-load.'
     else:
@@ -409,15 +575,20 @@ def main(argv):
 
     # Optional
     if inps.snap_connect:
-        load_roipac2multi_group_h5('snaphu_connect_component', inps.snap_connect, inps.snap_connect_file, vars(inps))
+        load_roipac2multi_group_h5('snaphu_connect_component', inps.snap_connect, inps.snap_connect_file, vars(inps), inps.num_worker)
 
     # Coherence
     if inps.cor:
-        cohFile,corList = load_roipac2multi_group_h5('coherence', inps.cor, inps.coherence_file, vars(inps))
+        cohStats = ut.StackStatistics(statList=['mean'])
+        cohFile,corList = load_roipac2multi_group_h5('coherence', inps.cor, inps.coherence_file, vars(inps), inps.num_worker,\
+                                                     cohStats)
         if corList:
-            meanCohCmd = 'temporal_average.py '+cohFile+' '+inps.spatial_coherence_file
-            print meanCohCmd
-            os.system(meanCohCmd)
+            # average of loaded files if they are all epochs of coherence file, re-read the file otherwise
+            if cohStats.num == len(readfile.get_reader(cohFile).epochList):
+                print 'Generate average spatial coherence from loaded coherence files'
+                ut.write_stack_statistics(cohStats.mean, readfile.read_attribute(cohFile), inps.spatial_coherence_file)
+            else:
+                ut.temporal_average(cohFile, inps.spatial_coherence_file)
     elif os.path.isfile(inps.coherence_file):
         print os.path.basename(inps.coherence_file)+' already exists, no need to re-load.'
     else:
@@ -425,7 +596,7 @@ def main(argv):
 
     # Wrapped Interferograms
     if inps.int:
-        load_roipac2multi_group_h5('wrapped', inps.int, inps.wrapIfgram_file, vars(inps))
+        load_roipac2multi_group_h5('wrapped', inps.int, inps.wrapIfgram_file, vars(inps), inps.num_worker)
     elif os.path.isfile(inps.wrapIfgram_file):
         print os.path.basename(inps.wrapIfgram_file)+' already exists, no need to re-load.'
     else:
@@ -12,6 +12,7 @@
 #                                                                                       #
 #########################################################################################
 # Yunjun, Jan 2017: using pysar._readfile/_writefile/_datetime
+# Yunjun, Feb 2017: use process.map_file(), correct block by block
 
 
 import os
@@ -19,16 +20,21 @@ import sys
 import time
 import datetime
 
-import h5py
 import numpy as np
 
 import pysar._readfile as readfile
-import pysar._writefile as writefile
 import pysar._datetime as ptime
+import pysar._process as process
 from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file, single_dataset_hdf5_file
 
 
-def correct_lod_file(File, outFile=None):
+def correct_lod_block(data, epoch, box, Ramp, scaleDict):
+    '''Correct LOD ramp of one block of epoch, for process.map_file()'''
+    data -= Ramp[box[1]:box[3],box[0]:box[2]] * scaleDict[epoch]
+    return data
+
+
+def correct_lod_file(File, outFile=None, parallel=1):
     # Check Sensor Type
     print 'input file: '+File
     atr = readfile.read_attribute(File)
@@ -57,57 +63,31 @@ def correct_lod_file(File, outFile=None):
     xref=int(atr['ref_x'])
     Ramp -= Ramp[yref][xref]
 
-    # Correct LOD Ramp for Input File
+    # Scale of LOD Ramp for each epoch of Input File
     if k in multi_group_hdf5_file+multi_dataset_hdf5_file:
-        h5 = h5py.File(File,'r')
-        epochList = sorted(h5[k].keys())
+        reader = readfile.get_reader(File)
+        epochList = reader.epochList
         print 'number of epochs/interferograms: '+str(len(epochList))
-        
-        h5out = h5py.File(outFile,'w')
-        group = h5out.create_group(k)
 
         if k in ['interferograms','wrapped']:
             wvl = float(atr['WAVELENGTH'])
             Ramp *= -4*np.pi/wvl
+            scaleDict = dict()
             for epoch in epochList:
-                print epoch
-                data = h5[k][epoch].get(epoch)[:]
-                atr = h5[k][epoch].attrs
-                
-                dates = ptime.yyyymmdd(atr['DATE12'].split('-'))
+                dates = ptime.yyyymmdd(reader.attribute(epoch)['DATE12'].split('-'))
                 dates = ptime.yyyymmdd2years(dates)
-                dt = date[1] - date[0]
-                data -= Ramp*dt
-                 
-                gg = group.create_group(epoch)
-                dset = gg.create_dataset(epoch, data=data, compression='gzip')
-                for key, value in atr.iteritems():
-                    gg.attrs[key] = value
+                scaleDict[epoch] = dates[1] - dates[0]
 
         elif k == 'timeseries':
             tbase = [float(dy)/365.25 for dy in ptime.date_list2tbase(epochList)[0]]
-            for i in range(len(epochList)):
-                epoch = epochList[i]
-                print epoch
-                data = h5[k].get(epoch)[:]
-                
-                data -= Ramp*tbase[i]
-                
-                dset = group.create_dataset(epoch, data=data, compression='gzip')
-            for key, value in atr.iteritems():
-                group.attrs[key] = value
+            scaleDict = dict(zip(epochList, tbase))
         else:
             print 'No need to correct for LOD for '+k+' file'
             sys.exit(1)
-
-        h5.close()
-        h5out.close()
-
     else:
-        data, atr = readfile.read(File)
-        data -= Ramp
-        writefile.write(data, atr, outFile)
+        scaleDict = {'': 1.0}
 
+    process.map_file(File, correct_lod_block, outFile, args=(Ramp, scaleDict), by_block=True, parallel=parallel)
     return outFile
 
 
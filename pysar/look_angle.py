@@ -11,6 +11,8 @@ import numpy as np
 import getopt
 import h5py
 
+import pysar._writefile as writefile
+
 
 def usage():
     print '''
@@ -53,7 +55,7 @@ def main(argv):
     
         h5file2 = h5py.File('look_angle.h5','w')
         group=h5file2.create_group('mask')
-        dset = group.create_dataset('mask', data=look_angle, compression='gzip')
+        dset = writefile.create_dataset(group, 'mask', data=look_angle)
     
         for key, value in h5file['velocity'].attrs.iteritems():
               group.attrs[key] = value
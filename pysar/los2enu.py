@@ -11,6 +11,8 @@ from  numpy import shape,pi,cos, sin
 import getopt
 import h5py 
 
+import pysar._writefile as writefile
+
 
 def usage():
     print ''' 
@@ -125,7 +127,7 @@ def main(argv):
     print 'writing '+outName    
     h5file2 = h5py.File(outName,'w')
     group=h5file2.create_group(k[0])
-    dset = group.create_dataset(k[0], data=P, compression='gzip')
+    dset = writefile.create_dataset(group, k[0], data=P)
     
     for key, value in h5file[k[0]].attrs.iteritems():
             group.attrs[key] = value
@@ -7,20 +7,20 @@
 # Yunjun, Oct 2015: add support for ROI_PAC product
 # Yunjun, Jul 2016: add mask_matrix(), mask_file()
 #                   add parallel processing using joblib
+# Yunjun, Feb 2017: use process.map_file(), mask block by block
 
 
 import os
 import sys
 import argparse
 
-import h5py
 import numpy as np
 import multiprocessing
 from joblib import Parallel, delayed
 
 import pysar._readfile as readfile
-import pysar._writefile as writefile
 import pysar._pysar_utilities as ut
+import pysar._process as process
 from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file, single_dataset_hdf5_file
 
 
@@ -39,28 +39,55 @@ def mask_matrix(data_mat,mask_mat):
 
 
 ############################################################
-def update_mask(mask, inps_dict=None):
-    '''Update mask matrix from input options: subset_x/y and threshold'''
+def print_update_mask_info(inps_dict):
+    '''Print how mask is updated from input options: subset_x/y and threshold'''
     if inps_dict['subset_x']:
-        mask[:,inps_dict['subset_x'][0]:inps_dict['subset_x'][1]] = 0
         print 'mask out area not in x: '+str(inps_dict['subset_x'])
     if inps_dict['subset_y']:
-        mask[inps_dict['subset_y'][0]:inps_dict['subset_y'][1],:] = 0
         print 'mask out area not in y: '+str(inps_dict['subset_y'])
     if inps_dict['thr']:
-        mask[mask<inps_dict['thr']] = 0
         print 'mask out pixels < '+str(inps_dict['thr'])+' in mask file'
+    return
+
+
+def update_mask(mask, inps_dict=None, box=None, print_msg=True):
+    '''Update mask matrix from input options: subset_x/y and threshold
+    box - 4-tuple of int, (x0, y0, x1, y1) of input mask matrix in the whole area, for mask of a block
+    '''
+    if not box:
+        box = (0, 0, mask.shape[1], mask.shape[0])
+    if inps_dict['subset_x']:
+        x0 = min(max(inps_dict['subset_x'][0]-box[0], 0), mask.shape[1])
+        x1 = min(max(inps_dict['subset_x'][1]-box[0], 0), mask.shape[1])
+        mask[:,x0:x1] = 0
+    if inps_dict['subset_y']:
+        y0 = min(max(inps_dict['subset_y'][0]-box[1], 0), mask.shape[0])
+        y1 = min(max(inps_dict['subset_y'][1]-box[1], 0), mask.shape[0])
+        mask[y0:y1,:] = 0
+    if inps_dict['thr']:
+        mask[mask<inps_dict['thr']] = 0
+    if print_msg:
+        print_update_mask_info(inps_dict)
     return mask
 
 
+def mask_block(data, epoch, box, maskFile, maskEpochDict=dict(), inps_dict=None):
+    '''Mask one block of data with the same block of mask file, for process.map_file()'''
+    mask = readfile.read(maskFile, box, maskEpochDict.get(epoch, ''))[0]
+    if inps_dict:
+        mask = update_mask(mask, inps_dict, box, print_msg=False)
+    return mask_matrix(data, mask)
+
+
 ############################################################
-def mask_file(File, maskFile, outFile=None, inps_dict=None):
+def mask_file(File, maskFile, outFile=None, inps_dict=None, parallel=1):
     ''' Mask input File with maskFile
     Inputs:
         File/maskFile - string, 
         inps_dict - dictionary including the following options:
                     subset_x/y - list of 2 ints, subset in x/y direction
                     thr - float, threshold/minValue to generate mask
+        parallel - int, number of processes
     Output:
         outFile - string
     '''
@@ -69,82 +96,27 @@ def mask_file(File, maskFile, outFile=None, inps_dict=None):
     k = atr['FILE_TYPE']
     print 'masking '+k+' file: '+File+' ...'
 
-    # Read maskFile
+    # Mask file: single dataset, or coherence file with the same number of interferograms
     atrm = readfile.read_attribute(maskFile)
     km = atrm['FILE_TYPE']
-    if km not in multi_group_hdf5_file+multi_dataset_hdf5_file:
-        print 'reading mask file: '+maskFile
-        mask = readfile.read(maskFile)[0]
-        if inps_dict:
-            mask = update_mask(mask, inps_dict)
+    print 'mask file: '+maskFile
+    maskEpochDict = dict()
+    if km in multi_group_hdf5_file+multi_dataset_hdf5_file:
+        epochList = readfile.get_reader(File).epochList
+        cohList = readfile.get_reader(maskFile).epochList
+        if km != 'coherence' or k not in multi_group_hdf5_file:
+            sys.exit('ERROR: multi-dataset mask file is only supported for coherence file with interferograms.')
+        if len(cohList) != len(epochList):
+            sys.exit('ERROR: coherence mask file has different number of interferograms than input file!')
+        maskEpochDict = dict(zip(epochList, cohList))
+    if inps_dict:
+        print_update_mask_info(inps_dict)
     
     if not outFile:
         outFile = os.path.splitext(File)[0]+'_masked'+os.path.splitext(File)[1]
 
-    if k in ['timeseries','interferograms','wrapped','coherence']:
-        h5file = h5py.File(File,'r')
-        epochList = sorted(h5file[k].keys())
-
-        h5out = h5py.File(outFile,'w')
-        print 'writing >>> '+outFile
-
-    ##### Multiple Dataset File
-    if k == 'timeseries':
-        print 'number of acquisitions: '+str(len(epochList))
-        group = h5out.create_group(k)
-        for d in epochList:
-            print d
-            unw = h5file[k].get(d)[:]
-
-            unw = mask_matrix(unw,mask)
-
-            dset = group.create_dataset(d, data=unw, compression='gzip')
-        for key,value in atr.iteritems():   group.attrs[key] = value
-
-    elif k in ['interferograms','wrapped','coherence']:
-        print 'number of interferograms: '+str(len(epochList))
-        gg = h5out.create_group(k)
-        
-        # Mask multi group file with multi group coherence file
-        if km == 'coherence':
-            h5mask = h5py.File(maskFile, 'r')
-            cohList = sorted(h5mask[km].keys())
-            if len(cohList) != len(epochList):
-                sys.exit('ERROR: cohERROR: erence mask file has different\
-                number of interferograms than input file!')
-        
-        for i in range(len(epochList)):
-            igram = epochList[i]
-            print igram
-            unw = h5file[k][igram].get(igram)[:]
-            
-            if km == 'coherence':
-                coh = cohList[i]
-                print coh
-                mask = h5mask[km][coh].get(coh)[:]
-                if not inps_dict:
-                    mask = update_mask(mask, inps_dict)                
-            
-            unw = mask_matrix(unw,mask)
-
-            group = gg.create_group(igram)
-            dset = group.create_dataset(igram, data=unw, compression='gzip')
-            for key, value in h5file[k][igram].attrs.iteritems():
-                group.attrs[key] = value
-
-    ##### Single Dataset File
-    else:
-        unw,atr = readfile.read(File)
-        unw     = mask_matrix(unw,mask)
-        print 'writing >>> '+outFile
-        writefile.write(unw,atr,outFile)
-
-    try: h5file.close()
-    except: pass
-    try: h5out.close()
-    except: pass
-    try: h5mask.close()
-    except: pass
+    process.map_file(File, mask_block, outFile, args=(maskFile, maskEpochDict, inps_dict),\
+                     by_block=True, parallel=parallel)
     return outFile
     
 
@@ -170,7 +142,7 @@ def cmdLineParse():
     parser.add_argument('-y', dest='subset_y', type=int, nargs=2, help='subset range in y/along-track/row direction')
     parser.add_argument('-o','--outfile', help='Output file name. Disabled when more than 1 input files')
     parser.add_argument('--no-parallel', dest='parallel', action='store_false', default=True,\
-                        help='Disable parallel processing. Diabled auto for 1 input file.')
+                        help='Disable parallel processing, over files, or over blocks for 1 input file.')
 
     inps = parser.parse_args()
     return inps
@@ -187,19 +159,16 @@ def main(argv):
     # check outfile and parallel option
     if len(inps.file) > 1:
         inps.outfile = None
-    elif len(inps.file) == 1 and inps.parallel:
-        inps.parallel =  False
-        print 'parallel processing is diabled for one input file'
 
-    # masking
-    if inps.parallel:
-        num_cores = multiprocessing.cpu_count()
+    # masking, in parallel over files, or over blocks of one file
+    num_cores = multiprocessing.cpu_count()
+    if inps.parallel and len(inps.file) > 1:
         print 'parallel processing using %d cores ...'%(num_cores)
         Parallel(n_jobs=num_cores)(delayed(mask_file)(File, inps.mask_file, inps_dict=vars(inps)) for File in inps.file)
     else:
         for File in inps.file:
             print '-------------------------------------------'
-            mask_file(File, inps.mask_file, inps.outfile, vars(inps))
+            mask_file(File, inps.mask_file, inps.outfile, vars(inps), parallel=num_cores if inps.parallel else 1)
 
     print 'Done.'
     return
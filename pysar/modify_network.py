@@ -28,6 +28,7 @@ import pysar._network as pnet
 import pysar._pysar_utilities as ut
 import pysar._readfile as readfile
 from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file, single_dataset_hdf5_file
+import pysar._writefile as writefile
 
 
 ###########################  Sub Function  #############################
@@ -148,6 +149,7 @@ def modify_file_date12_list(File, date12_to_rmv, outFile=None):
     gg = h5out.create_group(k)
     
     h5 = h5py.File(File, 'r')
+    readfile.check_stack_layout(h5, k)
     igramList = sorted(h5[k].keys())
     for i in range(date12Num):
         date12 = date12_to_write[i]
@@ -157,7 +159,7 @@ def modify_file_date12_list(File, date12_to_rmv, outFile=None):
 
         data = h5[k][igram].get(igram)[:]
         group = gg.create_group(igram)
-        dset = group.create_dataset(igram, data=data, compression='gzip')
+        dset = writefile.create_dataset(group, igram, data=data)
         for key, value in h5[k][igram].attrs.iteritems():
             group.attrs[key] = value
     h5.close()
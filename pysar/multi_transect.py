@@ -14,6 +14,8 @@ import sys
 import os
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
 
+import pysar._point as pt
+
 def usage():
     print '''
 *****************************************************************************************
@@ -233,11 +235,11 @@ def find_row_column(Lon,Lat,lon,lat,lon_step,lat_step):
    ################################################
   # finding row and column numbers of the GPS point
 
-  idx= nearest(Lon, lon, lon_step)
-  idy= nearest(Lat, lat, lat_step)
-  if idx !=[] and idy != []:
-     IDX=np.where(idx==True)[0][0]
-     IDY=np.where(idy==True)[0][0]
+  IDX,flagx = pt.nearest_index(Lon, lon[0], lon_step, len(lon))
+  IDY,flagy = pt.nearest_index(Lat, lat[0], lat_step, len(lat))
+  if flagx and flagy:
+     IDX=int(IDX)
+     IDY=int(IDY)
   else:
      IDX=np.nan
      IDY=np.nan
@@ -10,6 +10,8 @@
 # Yunjun, May 2015: add multilook() and multilook_attribute()
 # Yunjun, Dec 2016: add multilook_file(), cmdLineParse() and parallel option
 #                   rename multi_looking.py to multilook.py
+# Yunjun, Feb 2017: use process.map_file(), multilook block by block
+#                   vectorize multilook_matrix() with reshape, add nanmedian/sum and weighted mean
 
 
 import sys
@@ -17,39 +19,89 @@ import os
 import argparse
 import warnings
 
-import h5py
 import numpy as np
 from joblib import Parallel, delayed
 import multiprocessing
 
 import pysar._readfile as readfile
 import pysar._writefile as writefile
+import pysar._process as process
 from pysar._pysar_utilities import get_file_list
 
 
 ######################################## Sub Functions ############################################
-def multilook_matrix(matrix,lks_y,lks_x):
-    rows,cols = matrix.shape
-    lks_x = int(lks_x)
+def multilook_matrix(matrix, lks_y, lks_x, method='nanmean', weight=None):
+    '''Multilook 2D matrix by block reduction of lks_y by lks_x pixels, vectorized with reshape
+    Inputs:
+        matrix - 2D np.array, float/complex/int/bool
+        lks_y/x - int, number of looks in y/x direction
+        method - string, reduction of each block: nanmean, mean, nansum, sum, nanmedian, median
+                 mean/sum/median propagate NaN; nan* ignore NaN, i.e. nanmean is NaN for all-NaN block only
+        weight - 2D np.array in the same size of matrix, optional, i.e. coherence.
+                 Weighted average sum(weight*matrix)/sum(weight) of each block, for nanmean/mean only,
+                 i.e. coherence-weighted complex averaging of interferogram
+    Output:
+        matrix_mli - 2D np.array in size of (rows/lks_y, cols/lks_x), with the same dtype as input for
+                     float/complex matrix, float32 for int/bool matrix
+    Example:
+        data_mli = multilook_matrix(data, 4, 4)
+        ifg_mli  = multilook_matrix(ifg, 20, 4, weight=coh)
+        dem_mli  = multilook_matrix(dem, 10, 10, method='median')
+    '''
     lks_y = int(lks_y)
-    rows_mli=int(np.floor(rows/lks_y))
-    cols_mli=int(np.floor(cols/lks_x))
-    #thr = np.floor(lks_x*lks_y/2)
-    matrix_Cmli=np.zeros((rows,    cols_mli))
-    matrix_mli =np.zeros((rows_mli,cols_mli))
-  
-    #for c in range(lks_x):   matrix_Cmli = matrix_Cmli + matrix[:,range(c,cols_mli*lks_x,lks_x)]
-    #for r in range(lks_y):   matrix_mli  = matrix_mli  + matrix_Cmli[  range(r,rows_mli*lks_y,lks_y),:]
-    #for c in range(int(cols_mli)):  matrix_Cmli[:,c]=np.nansum(matrix[:,(c)*lks_x:(c+1)*lks_x],1)
-    #for r in range(int(rows_mli)):  matrix_mli[r,:] =np.nansum(matrix_Cmli[(r)*lks_y:(r+1)*lks_y,:],0)
-    #matrix_mli=matrix_mli/(lks_y*lks_x)
-    
+    lks_x = int(lks_x)
+    rows, cols = matrix.shape
+    rows_mli = rows / lks_y
+    cols_mli = cols / lks_x
+    dtype = matrix.dtype
+    if not np.issubdtype(dtype, np.inexact):
+        dtype = np.dtype(np.float32)
+    if lks_y == 1 and lks_x == 1 and weight is None:
+        return np.asarray(matrix, dtype=dtype)
+
+    # 4D view/copy with looks in the 2nd and 4th axis, without padding rows/cols at the end
+    def blocks(data):
+        data = data[0:rows_mli*lks_y, 0:cols_mli*lks_x]
+        return data.reshape(rows_mli, lks_y, cols_mli, lks_x)
+
+    data = blocks(matrix).astype(dtype, copy=False)
     with warnings.catch_warnings():
         warnings.simplefilter("ignore", category=RuntimeWarning)
-        for c in range(cols_mli):  matrix_Cmli[:,c] = np.nanmean(matrix[:,(c)*lks_x:(c+1)*lks_x],1)
-        for r in range(rows_mli):  matrix_mli[r,:]  = np.nanmean(matrix_Cmli[(r)*lks_y:(r+1)*lks_y,:],0)
-  
-    return matrix_mli
+        if weight is not None:
+            weight = blocks(weight).astype(np.float32)
+            if method.startswith('nan'):
+                nan = np.isnan(data) + np.isnan(weight)
+                weight[nan] = 0.
+                data = np.where(nan, 0, data)
+            matrix_mli = np.sum(data*weight, axis=(1,3)) / np.sum(weight, axis=(1,3))
+
+        elif method in ['mean','sum']:
+            matrix_mli = np.sum(data, axis=(1,3), dtype=dtype)
+            if method == 'mean':
+                matrix_mli /= lks_y*lks_x
+
+        elif method in ['nanmean','nansum']:
+            nan = np.isnan(data)
+            if not np.any(nan):
+                matrix_mli = np.sum(data, axis=(1,3), dtype=dtype)
+                if method == 'nanmean':
+                    matrix_mli /= lks_y*lks_x
+            else:
+                matrix_mli = np.sum(np.where(nan, 0, data), axis=(1,3), dtype=dtype)
+                if method == 'nanmean':
+                    matrix_mli /= np.sum(~nan, axis=(1,3), dtype=np.float32)
+
+        elif method in ['median','nanmedian']:
+            data = data.transpose(0,2,1,3).reshape(rows_mli, cols_mli, -1)
+            if method == 'median':
+                matrix_mli = np.median(data, axis=2)
+            else:
+                matrix_mli = np.nanmedian(data, axis=2)
+
+        else:
+            print 'Un-recognized multilook method: '+method; sys.exit(1)
+
+    return np.asarray(matrix_mli, dtype=dtype)
 
 
 def multilook_attribute(atr_dict,lks_y,lks_x):
@@ -89,7 +141,16 @@ def multilook_attribute(atr_dict,lks_y,lks_x):
     return atr
 
 
-def multilook_file(infile,lks_y,lks_x,outfile=None):
+def multilook_block(data, epoch, box, lks_y, lks_x, method='nanmean', wrapped=False):
+    '''Multilook one block of epoch, for process.map_file()
+    Wrapped phase is multilooked by averaging its complex value, and converted back to phase.
+    '''
+    if wrapped:
+        return np.angle(multilook_matrix(np.exp(1j*data), lks_y, lks_x, method))
+    return multilook_matrix(data, lks_y, lks_x, method)
+
+
+def multilook_file(infile,lks_y,lks_x,outfile=None,method='nanmean',parallel=1):
     lks_y = int(lks_y)
     lks_x = int(lks_x)
 
@@ -105,57 +166,20 @@ def multilook_file(infile,lks_y,lks_x,outfile=None):
     print 'writing >>> '+outfile
 
     ###############################################################################
-    ## Read/Write multi-dataset files
-    if k in ['interferograms','coherence','wrapped','timeseries']:
-        h5 = h5py.File(infile,'r')
-        epochList = sorted(h5[k].keys())
-        print 'number of epochs: '+str(len(epochList))
-
-        h5out = h5py.File(outfile,'w')
-        group = h5out.create_group(k)
-
-        if k in ['interferograms','coherence','wrapped']:
-            for epoch in epochList:
-                print epoch
-                data = h5[k][epoch].get(epoch)[:]
-                atr = h5[k][epoch].attrs
-
-                data_mli = multilook_matrix(data,lks_y,lks_x)
-                atr_mli = multilook_attribute(atr,lks_y,lks_x)
-
-                gg = group.create_group(epoch)
-                dset = gg.create_dataset(epoch, data=data_mli, compression='gzip')
-                for key, value in atr_mli.iteritems():
-                    gg.attrs[key] = value
-
-        elif k == 'timeseries':
-            for epoch in epochList:
-                print epoch
-                data = h5[k].get(epoch)[:]
-
-                data_mli = multilook_matrix(data,lks_y,lks_x)
-                
-                dset = group.create_dataset(epoch, data=data_mli, compression='gzip')
-            atr = h5[k].attrs
-            atr_mli = multilook_attribute(atr,lks_y,lks_x)
-            for key, value in atr_mli.iteritems():
-                group.attrs[key] = value
-
-        h5.close()
-        h5out.close()
-
-    ## Read/Write single-dataset files
-    elif k == '.trans':        
+    ## Read/Write .trans file
+    if k == '.trans':        
         rg,az,atr = readfile.read(infile)
-        rgmli = multilook_matrix(rg,lks_y,lks_x);
-        azmli = multilook_matrix(az,lks_y,lks_x);
+        rgmli = multilook_matrix(rg,lks_y,lks_x,method);
+        azmli = multilook_matrix(az,lks_y,lks_x,method);
         atr = multilook_attribute(atr,lks_y,lks_x)
         writefile.write(rgmli,azmli,atr,outfile)
+
+    ## Read/Write multi/single-dataset files, block by block of rows in multiple of lks_y
     else:
-        data,atr = readfile.read(infile)
-        data_mli = multilook_matrix(data,lks_y,lks_x)
-        atr = multilook_attribute(atr,lks_y,lks_x)
-        writefile.write(data_mli,atr,outfile)
+        wrapped = k in ['wrapped','.int']
+        process.map_file(infile, multilook_block, outfile, args=(lks_y,lks_x,method,wrapped),\
+                         atr_func=lambda atr: multilook_attribute(atr,lks_y,lks_x),\
+                         by_block=True, row_step_multiple=lks_y, parallel=parallel, print_msg=False)
 
     return outfile
 
@@ -176,8 +200,12 @@ def cmdLineParse():
     parser.add_argument('lks_x', type=int, help='number of multilooking in azimuth/y direction')
     parser.add_argument('lks_y', type=int, help='number of multilooking in range  /x direction')
     parser.add_argument('-o','--outfile', help='Output file name. Disabled when more than 1 input files')
+    parser.add_argument('-m','--method', default='nanmean',\
+                        choices={'nanmean','mean','nansum','sum','nanmedian','median'},\
+                        help='method to reduce pixels within each multilook window, default: nanmean.\n'+\
+                             'Wrapped phase is always averaged in complex value.')
     parser.add_argument('--no-parallel',dest='parallel',action='store_false',default=True,\
-                        help='Disable parallel processing. Diabled auto for 1 input file.')
+                        help='Disable parallel processing, over files, or over blocks for 1 input file.')
 
     inps = parser.parse_args()
     return inps
@@ -193,19 +221,18 @@ def main(argv):
     # check outfile and parallel option
     if len(inps.file) > 1:
         inps.outfile = None
-    elif len(inps.file) == 1 and inps.parallel:
-        inps.parallel =  False
-        print 'parallel processing is diabled for one input file'
 
-    # multilooking
-    if inps.parallel:
-        num_cores = multiprocessing.cpu_count()
+    # multilooking, in parallel over files, or over blocks of one file
+    num_cores = multiprocessing.cpu_count()
+    if inps.parallel and len(fileList) > 1:
         print 'parallel processing using %d cores ...'%(num_cores)
-        Parallel(n_jobs=num_cores)(delayed(multilook_file)(file,inps.lks_y,inps.lks_x) for file in fileList)
+        Parallel(n_jobs=num_cores)(delayed(multilook_file)(file,inps.lks_y,inps.lks_x,None,inps.method)\
+                                   for file in fileList)
     else:
-        for File in inps.file:
+        for File in fileList:
             print '-------------------------------------------'
-            multilook_file(File,inps.lks_y,inps.lks_x,inps.outfile)
+            multilook_file(File,inps.lks_y,inps.lks_x,inps.outfile,inps.method,\
+                           parallel=num_cores if inps.parallel else 1)
 
     print 'Done.'
     return
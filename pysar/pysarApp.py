@@ -49,6 +49,7 @@ import numpy as np
 import pysar
 import pysar._pysar_utilities as ut
 import pysar._readfile as readfile
+import pysar._writefile as writefile
 import pysar.subset as subset
 
 
@@ -212,6 +213,7 @@ pysar.wrapFiles      = /SanAndreasT356EnvD/PROCESS/DONE/IFG*/filt*rlks.int     #
 pysar.geomap         = /SanAndreasT356EnvD/PROCESS/GEO/*050102-070809*/geomap*.trans
 pysar.dem.radarCoord = /SanAndreasT356EnvD/PROCESS/DONE/*050102-070809*/radar*.hgt
 pysar.dem.geoCoord   = /SanAndreasT356EnvD/DEM/srtm1_30m.dem                   #optional
+pysar.load.numWorker = 4                                                       #optional, default: 1
 
 pysar.network.reference       = date12.list         #optional
 pysar.network.coherenceBase   = yes                 #optional, auto for yes
@@ -223,6 +225,10 @@ pysar.reference.yx       = 257 , 151                #optional, auto for max cohe
 pysar.reference.lalo     = 31.8, 130.8              #optional, auto for max coherence selection
 pysar.reference.date     = 20090120                 #optional, auto for the first date
  
+pysar.networkInversion.maxMemory = 4     #optional, max memory in GB for inversion, auto for 4
+pysar.networkInversion.numWorker = 8     #optional, number of processes for inversion, auto for 1
+pysar.networkInversion.weightFunc = variance  #optional, [coherence / no], auto for no
+
 pysar.troposphericDelay.method        = pyaps   #[height_correlation], auto for no tropospheric correction
 pysar.troposphericDelay.polyOrder     = 1       #for height_correlation method
 pysar.troposphericDelay.weatherModel  = ECMWF   #[ERA, MERRA, NARR], for pyaps method
@@ -230,6 +236,8 @@ pysar.troposphericDelay.weatherModel  = ECMWF   #[ERA, MERRA, NARR], for pyaps m
 pysar.topoError = yes               #[no], auto for yes
 pysar.deramp    = plane             #[plane, quadratic, baseline_cor, base_trop_cor], auto for no
 pysar.geocode   = yes               #[no], auto for yes
+
+pysar.compression = lzf             #[gzip, gzip1-9, no], auto for gzip, compression of output HDF5 files
 '''
 
 EXAMPLE='''example:
@@ -263,6 +271,9 @@ def cmdLineParse():
                              './ - current directory\n'+\
                              '    To set this as your default permanetly,'+\
                              ' change miami_path value to False in pysar/__init__.py')
+    parser.add_argument('--compression', dest='compression',\
+                        help='compression of all output HDF5 files: lzf, gzip, gzip1-9 or no\n'+\
+                             'overwrite pysar.compression in template file. Default: gzip')
     parser.add_argument('-v','--version', action='version', version='%(prog)s 2.0')
 
     inps = parser.parse_args()
@@ -293,6 +304,14 @@ def main(argv):
     if 'pysar.troposphericDelay.method' in template.keys():
         template['pysar.troposphericDelay.method'] = template['pysar.troposphericDelay.method'].lower().replace('-','_')
 
+    # HDF5 storage policy, passed to all sub-processes via environment variable
+    if not inps.compression and 'pysar.compression' in template.keys() and template['pysar.compression'] != 'auto':
+        inps.compression = template['pysar.compression']
+    if inps.compression:
+        os.environ['PYSAR_COMPRESSION'] = inps.compression
+        writefile.set_compression(inps.compression)
+        print 'HDF5 compression: '+inps.compression
+
     # work directory
     if not inps.work_dir:
         if pysar.miami_path and 'SCRATCHDIR' in os.environ:
@@ -332,7 +351,7 @@ def main(argv):
     except:  inps.mask_file = None
     if not inps.mask_file:
         print 'No mask file found. Creating one using non-zero pixels in file: '+inps.ifgram_file
-        inps.mask_file = ut.nonzero_mask(inps.ifgram_file, inps.mask_file)
+        inps.mask_file = ut.nonzero_mask(inps.ifgram_file, 'Mask.h5')
     print 'Mask: '+inps.mask_file
 
     ## Find initial files name/path - recommended files (None if not found)
@@ -347,8 +366,9 @@ def main(argv):
     inps.spatial_coherence_file = 'average_spatial_coherence.h5'
     try:    inps.spatial_coherence_file = glob.glob(inps.work_dir+'/'+inps.spatial_coherence_file)[0]
     except: inps.spatial_coherence_file = None
-    if not inps.coherence_file:
-        inps.spatial_coherence_file = ut.temporal_average(inps.coherence_file, inps.spatial_coherence_file)
+    if inps.coherence_file and not inps.spatial_coherence_file:
+        print 'No average spatial coherence found. Creating one from file: '+inps.coherence_file
+        inps.spatial_coherence_file = ut.temporal_average(inps.coherence_file, 'average_spatial_coherence.h5')
 
     # 5. DEM in geo coord
     try:    inps.dem_geo_file = os.path.basename(template['pysar.dem.geoCoord'])
@@ -477,6 +497,21 @@ def main(argv):
         print inps.timeseries_file+' already exists, inversion is not needed.'
     else:
         invertCmd = 'igram_inversion.py '+inps.ifgram_file
+        if 'pysar.networkInversion.maxMemory' in template.keys() and\
+           template['pysar.networkInversion.maxMemory'] not in ['auto','no']:
+            invertCmd += ' --memory '+template['pysar.networkInversion.maxMemory']
+        if 'pysar.networkInversion.numWorker' in template.keys() and\
+           template['pysar.networkInversion.numWorker'] not in ['auto','no']:
+            invertCmd += ' --parallel '+template['pysar.networkInversion.numWorker']
+        if 'pysar.networkInversion.weightFunc' in template.keys() and\
+           template['pysar.networkInversion.weightFunc'].lower() not in ['auto','no','sbas']:
+            if inps.coherence_file:
+                invertCmd += ' -w '+template['pysar.networkInversion.weightFunc'].lower()+' --coherence '+inps.coherence_file
+            else:
+                print 'WARNING: No coherence file found, continue with un-weighted inversion.'
+        # temporal coherence in the same pass, if not existed yet
+        if not check_isfile('temporal_coherence.h5'):
+            invertCmd += ' --temp-coh temporal_coherence.h5'
         print invertCmd
         os.system(invertCmd)
 
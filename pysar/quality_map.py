@@ -14,6 +14,9 @@ import matplotlib.pyplot as plt
 #from scipy.sparse.csgraph import laplacian
 from scipy.ndimage.filters import laplace
 
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+
 
 ##############################################################################
 def usage():
@@ -40,6 +43,7 @@ def main(argv):
   
     h5file=h5py.File(file,'r')
     kh5=h5file.keys()
+    readfile.check_stack_layout(h5file, 'interferograms')
     ifgramList=h5file['interferograms'].keys()
   
     try:    OutName=argv[1]
@@ -54,18 +58,18 @@ def main(argv):
         unw=dset[0:dset.shape[0],0:dset.shape[1]]
         Lunw=laplace(unw)
         g=group.create_group(ifgram)
-        g.create_dataset(ifgram,data=Lunw,compression='gzip')
+        writefile.create_dataset(g, ifgram,data=Lunw)
         for key, value in h5file['interferograms'][ifgram].attrs.iteritems():
             g.attrs[key] = value
   
     gm = h5laplace.create_group('mask')
     mask = h5file['mask'].get('mask')
-    dset = gm.create_dataset('mask', data=mask, compression='gzip')
+    dset = writefile.create_dataset(gm, 'mask', data=mask)
   
     try:
         meanCoherence = h5file['meanCoherence'].get('meanCoherence')
         gc = h5laplace.create_group('meanCoherence')
-        dset = gc.create_dataset('meanCoherence', data=meanCoherence, compression='gzip')
+        dset = writefile.create_dataset(gc, 'meanCoherence', data=meanCoherence)
     except:
         print ''   
   
@@ -15,11 +15,14 @@ from numpy import shape,zeros,ones,hstack,dot,float32,reshape
 import h5py
 
 import pysar._pysar_utilities as ut
+import pysar._readfile as readfile
+import pysar._writefile as writefile
 
 
 #####################################################################################
 def reconstruct_igrams_from_timeseries(h5timeseries,h5igrams):
 
+    readfile.check_stack_layout(h5timeseries, 'timeseries')
     dateList = h5timeseries['timeseries'].keys()
   
     dateIndex={}
@@ -91,13 +94,14 @@ def main(argv):
     estData,nrows,ncols=reconstruct_igrams_from_timeseries(h5timeseries,h5igrams)
     
     h5estIgram=h5py.File(outName,'w')
+    readfile.check_stack_layout(h5igrams, 'interferograms')
     igramList=h5igrams['interferograms'].keys()
     gg = h5estIgram.create_group('interferograms')
     for i in range(len(igramList)):
         print igramList[i]
         data=reshape(estData[i,:],(nrows,ncols))
         group = gg.create_group(igramList[i])
-        dset = group.create_dataset(igramList[i], data=data, compression='gzip')
+        dset = writefile.create_dataset(group, igramList[i], data=data)
         for key, value in h5igrams['interferograms'][igramList[i]].attrs.iteritems():
             group.attrs[key] = value     
     
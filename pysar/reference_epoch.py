@@ -10,6 +10,8 @@ import os
 
 import h5py
 import pysar._datetime as ptime
+import pysar._readfile as readfile
+import pysar._writefile as writefile
 
 
 ##################################################################
@@ -56,6 +58,7 @@ def main(argv):
     #except:  outName = timeSeriesFile.split('.h5')[0]+'_ref'+refDate+'.h5'
 
     h5t=h5py.File(timeSeriesFile)
+    readfile.check_stack_layout(h5t, 'timeseries')
     dateList = sorted(h5t['timeseries'].keys())
   
     if not refDate in dateList:
@@ -77,7 +80,7 @@ def main(argv):
         print d
         ds=h5t['timeseries'].get(d)
         data=ds[0:ds.shape[0],0:ds.shape[1]]
-        dset = group.create_dataset(d, data=data-refData, compression='gzip')
+        dset = writefile.create_dataset(group, d, data=data-refData)
 
     ## Attributes
     for key,value in h5t['timeseries'].attrs.iteritems():
@@ -90,7 +93,7 @@ def main(argv):
         dset1 = h5t['mask'].get('mask')
         Mask = dset1[0:dset1.shape[0],0:dset1.shape[1]]
         group=h5t2.create_group('mask')
-        dset = group.create_dataset('mask', data=Mask, compression='gzip')
+        dset = writefile.create_dataset(group, 'mask', data=Mask)
     except:
         print 'no mask in the file.'
 
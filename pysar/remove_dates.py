@@ -12,6 +12,9 @@
 import h5py
 import sys
 
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+
 
 def usage():
     print '''
@@ -38,6 +41,7 @@ def main(argv):
     if not 'timeseries' in k:
         sys.exit(1)
   
+    readfile.check_stack_layout(h5file, 'timeseries')
     dateList = h5file['timeseries'].keys()
     
     h5modified=h5py.File('modified_'+tsFile,'w')
@@ -45,7 +49,7 @@ def main(argv):
     for d in dateList:
         if not d in dates2rmv:
             dataSet=h5file['timeseries'].get(d)
-            dset = group.create_dataset(d, data=dataSet, compression='gzip')
+            dset = writefile.create_dataset(group, d, data=dataSet)
         else:
             print 'removing '+ d
   
@@ -55,7 +59,7 @@ def main(argv):
     try:
         dataSet=h5file['mask'].get('mask')
         group=h5modified.create_group('mask')
-        dset = group.create_dataset('mask', data=dataSet, compression='gzip')
+        dset = writefile.create_dataset(group, 'mask', data=dataSet)
     except:
         print 'mask not found!'
 
@@ -47,7 +47,7 @@ def cmdLineParse():
                              '0,2400,2000,6843')
     parser.add_argument('-o','--outfile', help='Output file name. Disabled when more than 1 input files')
     parser.add_argument('--no-parallel',dest='parallel',action='store_false',default=True,\
-                        help='Disable parallel processing. Diabled auto for 1 input file.')
+                        help='Disable parallel processing, over files, or over epochs for 1 input file.')
 
     inps = parser.parse_args()
     if inps.ysub and not len(inps.ysub)%2 == 0:
@@ -71,9 +71,6 @@ def main(argv):
     # check outfile and parallel option
     if len(inps.file) > 1:
         inps.outfile = None
-    elif len(inps.file) == 1 and inps.parallel:
-        inps.parallel =  False
-        print 'parallel processing is diabled for one input file'
 
     # Update mask for multiple surfaces
     if inps.ysub:
@@ -108,15 +105,17 @@ def main(argv):
         print 'saved mask to '+outFile
 
     ############################## Removing Phase Ramp #######################################
-    if inps.parallel:
-        num_cores = multiprocessing.cpu_count()
+    # in parallel over files, or over epochs of one file
+    num_cores = multiprocessing.cpu_count()
+    if inps.parallel and len(inps.file) > 1:
         print 'parallel processing using %d cores ...'%(num_cores)
         Parallel(n_jobs=num_cores)(delayed(rm.remove_surface)(file, inps.surface_type, inps.mask_file, ysub=inps.ysub)\
                                    for file in inps.file)
     else:
         for File in inps.file:
             print '------------------------------------------'
-            rm.remove_surface(inps.file[0], inps.surface_type, inps.mask_file, inps.outfile, inps.ysub)
+            rm.remove_surface(File, inps.surface_type, inps.mask_file, inps.outfile, inps.ysub,\
+                              parallel=num_cores if inps.parallel else 1)
     
     print 'Done.'
     return
@@ -67,6 +67,7 @@ def main(argv):
         elif 'coherence'    in k: k[0] = 'coherence'
         elif 'timeseries'   in k: k[0] = 'timeseries'
         if k[0] in ('interferograms','coherence','wrapped'):
+            readfile.check_stack_layout(h5, k[0])
             atr  = h5[k[0]][h5[k[0]].keys()[0]].attrs
         elif k[0] in ('dem','velocity','mask','temporal_coherence','rmse','timeseries'):
             atr  = h5[k[0]].attrs
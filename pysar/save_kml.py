@@ -139,6 +139,7 @@ def main(argv):
         outName=File.split('.')[0]
 
         if k in ('interferograms','wrapped','coherence'):
+            readfile.check_stack_layout(h5file, k)
             ifgramList=h5file[k].keys()
             for i in range(len(ifgramList)):
                 if epoch_date in ifgramList[i]:
@@ -157,6 +158,7 @@ def main(argv):
                 Vmax = np.pi
 
         elif 'timeseries' in k:
+            readfile.check_stack_layout(h5file, 'timeseries')
             epochList=h5file['timeseries'].keys()
             for i in range(len(epochList)):
                 if epoch_date in epochList[i]:
@@ -0,0 +1,325 @@
+#! /usr/bin/env python
+############################################################
+# Program is part of PySAR v1.0                            #
+# Copyright(c) 2017, Zhang Yunjun                          #
+# Author:  Zhang Yunjun                                    #
+############################################################
+# Yunjun, Feb 2017: export geocoded timeseries / velocity into
+#                   multi-resolution tile pyramid in MBTiles
+
+
+import os
+import sys
+import argparse
+import sqlite3
+import time
+import zlib
+import json
+
+import numpy as np
+
+import pysar._readfile as readfile
+import pysar._pysar_utilities as ut
+from pysar.multilook import multilook_matrix
+
+
+############################################################
+def lonlat2tile(lon, lat, zoom):
+    '''Tile index in XYZ scheme (origin at top-left, spherical mercator) of point at zoom level'''
+    n = 2**zoom
+    lat = np.clip(lat, -85.0511, 85.0511)
+    x = int(np.floor((lon + 180.) / 360. * n))
+    y = int(np.floor((1. - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2. * n))
+    return min(max(x, 0), n-1), min(max(y, 0), n-1)
+
+
+def tile_pixel_lonlat(x, y, zoom, tile_size=256):
+    '''Longitude of pixel columns and latitude of pixel rows (pixel center) of tile (x, y) at zoom level'''
+    num_pixel = float(tile_size * 2**zoom)
+    px = x*tile_size + np.arange(tile_size) + 0.5
+    py = y*tile_size + np.arange(tile_size) + 0.5
+    lon = px / num_pixel * 360. - 180.
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1. - 2.*py/num_pixel))))
+    return lon, lat
+
+
+def get_zoom_range(atr, tile_size=256):
+    '''Default zoom levels: max zoom with tile pixel size close to data pixel size,
+    min zoom with data covered by one tile.
+    '''
+    west, north, east, south = get_bounds(atr)
+    max_zoom = int(np.ceil(np.log2(360. / (tile_size * abs(float(atr['X_STEP']))))))
+    max_zoom = min(max(max_zoom, 0), 22)
+    min_zoom = max_zoom
+    while min_zoom > 0 and lonlat2tile(west, north, min_zoom) != lonlat2tile(east, south, min_zoom):
+        min_zoom -= 1
+    return min_zoom, max_zoom
+
+
+def get_bounds(atr):
+    '''Bounds of geocoded file in (west, north, east, south)'''
+    west = float(atr['X_FIRST'])
+    north = float(atr['Y_FIRST'])
+    east = west + int(atr['WIDTH']) * float(atr['X_STEP'])
+    south = north + int(atr['FILE_LENGTH']) * float(atr['Y_STEP'])
+    return west, north, east, south
+
+
+############################################################
+def encode_tile(data):
+    '''Compress 3D np.array in float32 into bytes of tile_data'''
+    return sqlite3.Binary(zlib.compress(np.ascontiguousarray(data, np.float32).tostring()))
+
+
+def decode_tile(tile_data, num_layer, tile_size=256):
+    '''Decompress bytes of tile_data into 3D np.array in size of (num_layer, tile_size, tile_size)'''
+    data = np.fromstring(zlib.decompress(bytes(tile_data)), dtype=np.float32)
+    return data.reshape(num_layer, tile_size, tile_size)
+
+
+def write_tiles(cursor, zoom, tileList):
+    '''Write list of (x, y, data) tiles in XYZ scheme into tiles table, with tile_row in TMS scheme'''
+    n = 2**zoom
+    cursor.executemany('INSERT OR REPLACE INTO tiles VALUES (?,?,?,?)',\
+                       [(zoom, x, n-1-y, encode_tile(data)) for x, y, data in tileList])
+
+
+def read_tiles(cursor, zoom, x0, x1, y0, y1, num_layer, tile_size=256):
+    '''Read tiles within column [x0, x1] and row [y0, y1] in XYZ scheme, as dict of {(x, y): data}'''
+    n = 2**zoom
+    cursor.execute('SELECT tile_column, tile_row, tile_data FROM tiles WHERE zoom_level=? AND '+\
+                   'tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?', (zoom, x0, x1, n-1-y1, n-1-y0))
+    return dict([((x, n-1-row), decode_tile(tile_data, num_layer, tile_size)) for x, row, tile_data in cursor])
+
+
+############################################################
+def sample_tile_row(data, box, atr, zoom, y, x0, x1, tile_size=256):
+    '''Sample data by nearest neighbor into tiles of row y and column [x0, x1] at zoom level
+    Inputs:
+        data - 3D np.array in size of (num_layer, rows, cols) within box of geocoded file
+        box  - 4-tuple of int, (x0, y0, x1, y1) of data in the geocoded file
+        atr  - dict, attributes of geocoded file
+    Output: list of (x, y, data) of tiles with valid pixels
+    '''
+    lat = tile_pixel_lonlat(0, y, zoom, tile_size)[1]
+    rows = np.floor((lat - float(atr['Y_FIRST'])) / float(atr['Y_STEP'])).astype(int) - box[1]
+    row_flag = (rows >= 0) * (rows < data.shape[1])
+    if not np.any(row_flag):
+        return []
+
+    tileList = []
+    for x in range(x0, x1+1):
+        lon = tile_pixel_lonlat(x, y, zoom, tile_size)[0]
+        cols = np.floor((lon - float(atr['X_FIRST'])) / float(atr['X_STEP'])).astype(int) - box[0]
+        col_flag = (cols >= 0) * (cols < data.shape[2])
+        if not np.any(col_flag):
+            continue
+        tile = np.zeros((data.shape[0], tile_size, tile_size), np.float32)
+        tile[:] = np.nan
+        ti = np.where(row_flag)[0].reshape(-1, 1)
+        tj = np.where(col_flag)[0].reshape(1, -1)
+        tile[:, ti, tj] = data[:, rows[ti], cols[tj]]
+        if not np.all(np.isnan(tile)):
+            tileList.append((x, y, tile))
+    return tileList
+
+
+def merge_child_tiles(childDict, x, y, num_layer, tile_size=256):
+    '''Average 4 child tiles at zoom+1 into tile (x, y) at zoom by 2 by 2 nanmean, layer by layer'''
+    tile = np.zeros((num_layer, tile_size, tile_size), np.float32)
+    data = np.zeros((2*tile_size, 2*tile_size), np.float32)
+    for n in range(num_layer):
+        data[:] = np.nan
+        for i in range(2):
+            for j in range(2):
+                child = childDict.get((2*x+j, 2*y+i))
+                if child is not None:
+                    data[i*tile_size:(i+1)*tile_size, j*tile_size:(j+1)*tile_size] = child[n]
+        tile[n] = multilook_matrix(data, 2, 2, method='nanmean')
+    return tile
+
+
+############################################################
+def save_mbtiles(File, outFile=None, velocityFile=None, zoom_range=None, tile_size=256, max_memory=1.0):
+    '''Export geocoded timeseries (and velocity) into tile pyramid in MBTiles (SQLite) file
+    Each tile stores block of all layers in size of (num_layer, tile_size, tile_size) in float32,
+    compressed by zlib, with layers of [velocity, date1, date2, ...], NaN for no data.
+    Tiles of max zoom level are sampled from the file with nearest neighbor, row by row of tiles,
+    in blocks of tile columns within max_memory; tiles of lower zoom levels are averaged from
+    4 child tiles of the upper level, thus time is proportional to the number of tiles.
+
+    Inputs:
+        File         - string, geocoded timeseries file, or other geocoded file, i.e. velocity
+        outFile      - string, output MBTiles file, <File>.mbtiles by default
+        velocityFile - string, geocoded velocity file in the same grid as File, optional
+        zoom_range   - list of 2 int, [min_zoom, max_zoom], auto by default
+        tile_size    - int, number of pixels of tile in each direction
+        max_memory   - float, maximum memory in GB for data and tiles of one block at max zoom level
+    Output:
+        outFile - string
+    Example:
+        save_mbtiles('geo_timeseries_ECMWF_demCor.h5', velocityFile='geo_velocity.h5')
+    '''
+    atr = readfile.read_attribute(File)
+    k = atr['FILE_TYPE']
+    if 'X_FIRST' not in atr.keys():
+        print 'ERROR: input file is not geocoded: '+File
+        sys.exit(1)
+    if not outFile:
+        outFile = os.path.splitext(os.path.basename(File))[0]+'.mbtiles'
+    length = int(atr['FILE_LENGTH'])
+    width = int(atr['WIDTH'])
+
+    # Layers
+    reader = readfile.Reader(File)
+    epochList = reader.epochList
+    if not epochList:
+        epochList = ['']
+    layerList = list(epochList)
+    if layerList == ['']:
+        layerList = [k]
+    vel_reader = None
+    if velocityFile:
+        vel_atr = readfile.read_attribute(velocityFile)
+        if (vel_atr['FILE_LENGTH'], vel_atr['WIDTH']) != (atr['FILE_LENGTH'], atr['WIDTH']):
+            print 'ERROR: velocity file is not in the same grid as '+File
+            sys.exit(1)
+        vel_reader = readfile.Reader(velocityFile)
+        layerList = ['velocity'] + layerList
+    num_layer = len(layerList)
+
+    if not zoom_range:
+        zoom_range = get_zoom_range(atr, tile_size)
+    min_zoom, max_zoom = zoom_range
+    west, north, east, south = get_bounds(atr)
+    print 'number of layers: %d' % (num_layer)
+    print 'zoom levels: %d - %d' % (min_zoom, max_zoom)
+
+    # Output file
+    if os.path.isfile(outFile):
+        print 'delete existing file: '+outFile
+        os.remove(outFile)
+    print 'writing >>> '+outFile
+    con = sqlite3.connect(outFile)
+    cur = con.cursor()
+    cur.execute('CREATE TABLE metadata (name text, value text);')
+    cur.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);')
+    cur.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);')
+    metaDict = {'name'     : os.path.splitext(os.path.basename(File))[0],
+                'type'     : 'overlay',
+                'version'  : '1.0',
+                'format'   : 'float32-zlib',
+                'bounds'   : '%f,%f,%f,%f' % (west, south, east, north),
+                'center'   : '%f,%f,%d' % ((west+east)/2., (south+north)/2., min_zoom),
+                'minzoom'  : str(min_zoom),
+                'maxzoom'  : str(max_zoom),
+                'tile_size': str(tile_size),
+                'layers'   : json.dumps(layerList),
+                'unit'     : atr.get('UNIT', ''),
+                'description': 'PySAR '+k+', tile block of '+str(num_layer)+' layers in float32 compressed by zlib'}
+    cur.executemany('INSERT INTO metadata VALUES (?,?)', metaDict.items())
+
+    # Max zoom level - sample data row by row of tiles, in blocks of tile columns
+    start_time = time.time()
+    x0, y0 = lonlat2tile(west, north, max_zoom)
+    x1, y1 = lonlat2tile(east, south, max_zoom)
+    num_tile = 0
+    for y in range(y0, y1+1):
+        lat = tile_pixel_lonlat(0, y, max_zoom, tile_size)[1]
+        rows = np.floor((lat - north) / float(atr['Y_STEP'])).astype(int)
+        row0, row1 = max(np.min(rows), 0), min(np.max(rows)+1, length)
+        if row1 > row0:
+            # number of tile columns per block, with data and tiles of block within max_memory
+            col_num = tile_size * 360. / 2**max_zoom / abs(float(atr['X_STEP'])) + 1
+            tile_byte = num_layer * 4 * ((row1-row0) * col_num + tile_size**2)
+            x_step = max(int(max_memory * 1024**3 / tile_byte), 1)
+            for xs in range(x0, x1+1, x_step):
+                xe = min(xs+x_step-1, x1)
+                lon0 = tile_pixel_lonlat(xs, y, max_zoom, tile_size)[0][0]
+                lon1 = tile_pixel_lonlat(xe, y, max_zoom, tile_size)[0][-1]
+                col0 = max(int(np.floor((lon0 - west) / float(atr['X_STEP']))), 0)
+                col1 = min(int(np.floor((lon1 - west) / float(atr['X_STEP'])))+1, width)
+                if col1 <= col0:
+                    continue
+                box = (col0, row0, col1, row1)
+                data = np.zeros((num_layer, box[3]-box[1], box[2]-box[0]), np.float32)
+                i = 0
+                if vel_reader:
+                    data[0] = vel_reader.read(box=box)
+                    i = 1
+                for epoch in epochList:
+                    data[i] = reader.read(epoch, box)
+                    i += 1
+                tileList = sample_tile_row(data, box, atr, max_zoom, y, xs, xe, tile_size)
+                del data
+                write_tiles(cur, max_zoom, tileList)
+                num_tile += len(tileList)
+                del tileList
+        ut.print_progress(y-y0+1, y1-y0+1, prefix='zoom level %d:' % (max_zoom), elapsed_time=time.time()-start_time)
+    con.commit()
+    reader.close()
+    if vel_reader:
+        vel_reader.close()
+    print 'zoom level %d: %d tiles' % (max_zoom, num_tile)
+
+    # Lower zoom levels - average from 4 child tiles, tile by tile
+    for zoom in range(max_zoom-1, min_zoom-1, -1):
+        x0, y0 = lonlat2tile(west, north, zoom)
+        x1, y1 = lonlat2tile(east, south, zoom)
+        num_tile = 0
+        for y in range(y0, y1+1):
+            for x in range(x0, x1+1):
+                childDict = read_tiles(cur, zoom+1, 2*x, 2*x+1, 2*y, 2*y+1, num_layer, tile_size)
+                if childDict:
+                    write_tiles(cur, zoom, [(x, y, merge_child_tiles(childDict, x, y, num_layer, tile_size))])
+                    num_tile += 1
+        con.commit()
+        print 'zoom level %d: %d tiles' % (zoom, num_tile)
+
+    con.close()
+    print 'Done.'
+    return outFile
+
+
+############################################################
+EXAMPLE='''example:
+  save_mbtiles.py  geo_timeseries_ECMWF_demCor.h5
+  save_mbtiles.py  geo_timeseries_ECMWF_demCor.h5  -v geo_velocity.h5  -o KyushuT424.mbtiles
+  save_mbtiles.py  geo_timeseries_ECMWF_demCor.h5  -v geo_velocity.h5  -z 6 12
+  save_mbtiles.py  geo_velocity.h5
+'''
+
+def cmdLineParse():
+    parser = argparse.ArgumentParser(description='Export geocoded timeseries/velocity into tile pyramid in MBTiles.\n'+\
+                                     'Each tile stores time-series block of all layers in float32 compressed by zlib;\n'+\
+                                     'tiles of lower zoom levels are averaged from those of upper levels.',\
+                                     formatter_class=argparse.RawTextHelpFormatter,\
+                                     epilog=EXAMPLE)
+
+    parser.add_argument('file', help='geocoded timeseries file, or other geocoded file')
+    parser.add_argument('-v','--velocity', dest='velocity_file',\
+                        help='geocoded velocity file to store as the 1st layer of tiles')
+    parser.add_argument('-o','--output', dest='outfile', help='output MBTiles file, default: <file>.mbtiles')
+    parser.add_argument('-z','--zoom', dest='zoom_range', type=int, nargs=2, metavar=('MIN','MAX'),\
+                        help='min and max zoom level, default: max zoom with tile pixel close to data pixel,\n'+\
+                             'min zoom with the whole data in one tile')
+    parser.add_argument('--tile-size', dest='tile_size', type=int, default=256,\
+                        help='number of pixels of tile in each direction, default: 256')
+    parser.add_argument('--memory', dest='max_memory', type=float, default=1.0,\
+                        help='maximum memory to use in GB, default: 1')
+
+    inps = parser.parse_args()
+    return inps
+
+
+############################################################
+def main(argv):
+    inps = cmdLineParse()
+    save_mbtiles(inps.file, inps.outfile, inps.velocity_file, inps.zoom_range, inps.tile_size, inps.max_memory)
+    return
+
+
+############################################################
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
@@ -17,6 +17,7 @@ import numpy as np
 
 import pysar._readfile as readfile
 import pysar.info as info
+import pysar._writefile as writefile
 
 
 ################################################################
@@ -118,6 +119,7 @@ def main(argv):
     pysar_meta_dict = readfile.read_attribute(inps.timeseries)
     k = pysar_meta_dict['FILE_TYPE']
     h5_timeseries = h5py.File(inps.timeseries,'r')
+    readfile.check_stack_layout(h5_timeseries, k)
     dateList = sorted(h5_timeseries[k].keys())
     unavco_meta_dict = metadata_pysar2unavco(pysar_meta_dict, dateList)
     print '## UNAVCO Metadata:'
@@ -153,7 +155,7 @@ def main(argv):
     for date in dateList:
         print date
         data = h5_timeseries[k].get(date)[:,:]
-        dset = grid.create_dataset(date, data=data, compression='gzip')
+        dset = writefile.create_dataset(grid, date, data=data)
         dset.attrs['Title'] = 'Time series displacement'
         dset.attrs['MissingValue'] = FLOAT_ZERO
         dset.attrs['Units'] = 'meters'
@@ -163,7 +165,7 @@ def main(argv):
     if os.path.isfile(inps.incidence_angle):
         print inps.incidence_angle
         inc_angle, inc_angle_meta = readfile.read(inps.incidence_angle)
-        dset = grid.create_dataset('incidence_angle', data=inc_angle, compression='gzip')
+        dset = writefile.create_dataset(grid, 'incidence_angle', data=inc_angle)
         dset.attrs['Title'] = 'Incidence angle'
         dset.attrs['MissingValue'] = FLOAT_ZERO
         dset.attrs['Units'] = 'degrees'
@@ -173,7 +175,7 @@ def main(argv):
     if os.path.isfile(inps.dem):
         print inps.dem
         dem, dem_meta = readfile.read(inps.dem)
-        dset = grid.create_dataset('dem', data=dem, compression='gzip')
+        dset = writefile.create_dataset(grid, 'dem', data=dem)
         dset.attrs['Title'] = 'Digital elevatino model'
         dset.attrs['MissingValue'] = INT_ZERO
         dset.attrs['Units'] = 'meters'
@@ -183,7 +185,7 @@ def main(argv):
     if os.path.isfile(inps.coherence):
         print inps.coherence
         coherence, coherence_meta = readfile.read(inps.coherence)
-        dset = grid.create_dataset('coherence', data=coherence, compression='gzip')
+        dset = writefile.create_dataset(grid, 'coherence', data=coherence)
         dset.attrs['Title'] = 'Temporal Coherence'
         dset.attrs['MissingValue'] = FLOAT_ZERO
         dset.attrs['Units'] = 'None'
@@ -193,7 +195,7 @@ def main(argv):
     if os.path.isfile(inps.mask):
         print inps.mask
         mask, mask_meta = readfile.read(inps.mask)
-        dset = grid.create_dataset('mask', data=mask, compression='gzip')
+        dset = writefile.create_dataset(grid, 'mask', data=mask)
         dset.attrs['Title'] = 'Mask'
         dset.attrs['MissingValue'] = INT_ZERO
         dset.attrs['Units'] = 'None'
@@ -115,6 +115,7 @@ def main(argv):
 
     elif k in ['interferograms','coherence','wrapped']:
         ## Check input
+        readfile.check_stack_layout(h5file, k)
         igramList=h5file[k].keys()
         try:
             d = sys.argv[2]
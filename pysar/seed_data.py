@@ -9,13 +9,13 @@
 # Yunjun, Apr 2016: Add maskFile input option
 # Yunjun, Jun 2016: Add seed_attributes(), support to all file types
 #                   Add reference file option
+# Yunjun, Feb 2017: use process.map_file(), seed block by block
 
 
 import os
 import sys
 import argparse
 
-import h5py
 import matplotlib.pyplot as plt
 import numpy as np
 import random
@@ -23,8 +23,8 @@ import multiprocessing
 from joblib import Parallel, delayed
 
 import pysar._readfile as readfile
-import pysar._writefile as writefile
 import pysar._pysar_utilities as ut
+import pysar._process as process
 import pysar.subset as subset
 from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file, single_dataset_hdf5_file
 
@@ -43,7 +43,13 @@ def nearest(x, tbase,xstep):
 
 
 ###############################################################
-def seed_file_reference_value(File, outName, refList, ref_y='', ref_x=''):
+def seed_block(data, epoch, box, refDict):
+    '''Seed one block of epoch with its reference value, for process.map_file()'''
+    data -= refDict[epoch]
+    return data
+
+
+def seed_file_reference_value(File, outName, refList, ref_y='', ref_x='', parallel=1):
     ## Seed Input File with reference value in refList
     print 'Reference value: '
     print refList
@@ -54,10 +60,8 @@ def seed_file_reference_value(File, outName, refList, ref_y='', ref_x=''):
     print 'file type: '+k
 
     ##### Multiple Dataset File
-    if k in ['timeseries','interferograms','wrapped','coherence']:
-        ##### Input File Info
-        h5file = h5py.File(File,'r')
-        epochList = sorted(h5file[k].keys())
+    if k in multi_group_hdf5_file+multi_dataset_hdf5_file:
+        epochList = readfile.get_reader(File).epochList
         epochNum  = len(epochList)
         print 'number of epochs: '+str(epochNum)
         
@@ -68,56 +72,14 @@ def seed_file_reference_value(File, outName, refList, ref_y='', ref_x=''):
             print 'Reference List epoch number: '+str(refList)
             print 'Input file     epoch number: '+str(epochNum)
             sys.exit(1)
-  
-        ##### Output File Info
-        h5out = h5py.File(outName,'w')
-        group = h5out.create_group(k)
-        print 'writing >>> '+outName
-
-    ## Loop
-    if k == 'timeseries':
-        for i in range(epochNum):
-            epoch = epochList[i]
-            print epoch
-            data = h5file[k].get(epoch)[:]
-            
-            data -= refList[i]
-  
-            dset = group.create_dataset(epoch, data=data, compression='gzip')
-
-        atr  = seed_attributes(atr,ref_x,ref_y)
-        for key,value in atr.iteritems():   group.attrs[key] = value
-
-    elif k in ['interferograms','wrapped','coherence']:
-        for i in range(epochNum):
-            epoch = epochList[i]
-            #print epoch
-            data = h5file[k][epoch].get(epoch)[:]
-            atr  = h5file[k][epoch].attrs
+        refDict = dict(zip(epochList, refList))
 
-            data -= refList[i]
-            atr  = seed_attributes(atr,ref_x,ref_y)
-
-            gg = group.create_group(epoch)
-            dset = gg.create_dataset(epoch, data=data, compression='gzip')
-            for key, value in atr.iteritems():    gg.attrs[key] = value
-
-            ut.print_progress(i+1,epochNum,'seeding:',epoch)
-  
     ##### Single Dataset File
     else:
-        print 'writing >>> '+outName
-        data,atr = readfile.read(File)
-        data -= refList
-        atr  = seed_attributes(atr,ref_x,ref_y)
-        writefile.write(data,atr,outName)
-  
-    ##### End & Cleaning
-    try:
-        h5file.close()
-        h5out.close()
-    except: pass
+        refDict = {'': np.array(refList).flatten()[0]}
 
+    process.map_file(File, seed_block, outName, args=(refDict,), atr_func=lambda atr: seed_attributes(atr,ref_x,ref_y),\
+                     by_block=True, parallel=parallel)
     return outName
 
 
@@ -128,6 +90,8 @@ def seed_file_inps(File, inps=None, outFile=None):
     # Optional inputs
     if not outFile:  outFile = 'Seeded_'+os.path.basename(File)
     if not inps:  inps = cmdLineParse([''])
+    try:    parallel = inps.num_worker
+    except: parallel = 1
     print '----------------------------------------------------'
     print 'seeding file: '+File
     
@@ -156,7 +120,7 @@ def seed_file_inps(File, inps=None, outFile=None):
         meanList = ut.spatial_average(File, mask, box)
         inps.ref_y = ''
         inps.ref_x = ''
-        outFile = seed_file_reference_value(File, outFile, meanList, inps.ref_y, inps.ref_x)
+        outFile = seed_file_reference_value(File, outFile, meanList, inps.ref_y, inps.ref_x, parallel)
         return outFile
     
     # 2. Reference using specific pixel
@@ -177,7 +141,7 @@ def seed_file_inps(File, inps=None, outFile=None):
             print 'Referencing input file to pixel in y/x: (%d, %d)'%(inps.ref_y, inps.ref_x)
             box = (inps.ref_x, inps.ref_y, inps.ref_x+1, inps.ref_y+1)
             refList = ut.spatial_average(File, mask, box)
-            outFile = seed_file_reference_value(File, outFile, refList, inps.ref_y, inps.ref_x)
+            outFile = seed_file_reference_value(File, outFile, refList, inps.ref_y, inps.ref_x, parallel)
         else:
             print '\nInput reference y/x has NaN value in file stacking, skip seeding.'
             return None
@@ -414,7 +378,7 @@ def cmdLineParse():
     parser.add_argument('-m','--mask', dest='mask_file', help='mask file')
     parser.add_argument('-o', '--outfile', help='output file name, disabled when more than 1 input files.')
     parser.add_argument('--no-parallel', dest='parallel', action='store_false',\
-                        help='Disable parallel processing. Diabled auto for 1 input file.\n')
+                        help='Disable parallel processing, over files, or over blocks for 1 input file.\n')
     
     coord_group = parser.add_argument_group('input coordinates')
     coord_group.add_argument('-y','--row', dest='ref_y', type=int, help='row/azimuth  number of reference pixel')
@@ -459,9 +423,11 @@ def main(argv):
     # check outfile and parallel option
     if len(inps.file) > 1:
         inps.outfile = None
-    elif len(inps.file) == 1 and inps.parallel:
+    inps.num_worker = 1
+    if len(inps.file) == 1 and inps.parallel:
         inps.parallel =  False
-        print 'parallel processing is diabled for one input file'
+        inps.num_worker = multiprocessing.cpu_count()
+        print 'parallel processing over blocks for one input file'
 
     ##### Check Input Coordinates
     # Read ref_y/x/lat/lon from reference/template
@@ -518,9 +484,9 @@ def main(argv):
         else: 
             inps.coherence_file = None
     
-    if inps.method == 'manual':
+    if inps.method == 'manual' and inps.parallel:
         inps.parallel = False
-        print 'Parallel processing is disabled for manual seeding method.'
+        print 'Parallel processing over files is disabled for manual seeding method.'
 
     ##### Seeding file by file
     if inps.parallel:
@@ -529,7 +495,7 @@ def main(argv):
         Parallel(n_jobs=num_cores)(delayed(seed_file_inps)(file, inps) for file in inps.file)
     else:
         for file in inps.file:
-            seed_file_inps(inps.file[0], inps, inps.outfile)
+            seed_file_inps(file, inps, inps.outfile)
 
     print 'Done.'
     return
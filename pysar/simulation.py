@@ -16,6 +16,9 @@ import getopt
 import random
 import matplotlib.pyplot as plt
 
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+
 
 def usage():
     print '''
@@ -61,6 +64,7 @@ def main(argv):
     vset=h5vel[kv[0]].get(kv[0])
     rate=vset[0:vset.shape[0],0:vset.shape[1]]
     #####################################################
+    readfile.check_stack_layout(h5file, 'interferograms')
     igramList=h5file['interferograms'].keys()
     km=h5mask.keys()
     mset=h5mask[km[0]].get(km[0])
@@ -107,7 +111,7 @@ def main(argv):
             unw=unw+unwrapError
   
         
-        dset = group.create_dataset(igram, data=unw[ysub[0]:ysub[1],xsub[0]:xsub[1]], compression='gzip')
+        dset = writefile.create_dataset(group, igram, data=unw[ysub[0]:ysub[1],xsub[0]:xsub[1]])
         for key, value in h5file['interferograms'][igram].attrs.iteritems():
             group.attrs[key] = value
         if igram in unw_err_list:
@@ -123,10 +127,10 @@ def main(argv):
         
     h5MASKSim=h5py.File('simulatedMask.h5','w')
     ggg=h5MASKSim.create_group('mask')
-    ggg.create_dataset('mask',data=MASK[ysub[0]:ysub[1],xsub[0]:xsub[1]])
+    writefile.create_dataset(ggg, 'mask',data=MASK[ysub[0]:ysub[1],xsub[0]:xsub[1]])
    
     gm=h5simulate.create_group('mask')
-    gm.create_dataset('mask',data=MASK[ysub[0]:ysub[1],xsub[0]:xsub[1]])
+    writefile.create_dataset(gm, 'mask',data=MASK[ysub[0]:ysub[1],xsub[0]:xsub[1]])
   
     h5file.close()
     h5MASKSim.close()
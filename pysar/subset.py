@@ -21,13 +21,13 @@
 #                   add outlier fill option
 # Yunjun, Aug 2016: add coord_geo2radar()
 # Yunjun, Dec 2016: add cmdLineParse(), --footprint option
+# Yunjun, Feb 2017: use process.map_file()
 
 
 import os
 import sys
 import argparse
 
-import h5py
 import numpy as np
 import multiprocessing
 from joblib import Parallel, delayed
@@ -35,7 +35,7 @@ from joblib import Parallel, delayed
 import pysar._readfile as readfile
 import pysar._writefile as writefile
 import pysar._pysar_utilities as ut
-from pysar._readfile import multi_group_hdf5_file, multi_dataset_hdf5_file, single_dataset_hdf5_file
+import pysar._process as process
 
 
 ################################################################
@@ -418,7 +418,18 @@ def box_geo2pixel(geo_box, meta_dict):
 
 
 ################################################################
-def subset_file(File, subset_dict, outFile=None):
+def subset_block(data_overlap, epoch, box, pix_box, pix_box4subset, fill_value):
+    '''Fill data overlap with subset into matrix of subset, for process.map_file()'''
+    dtype = data_overlap.dtype
+    if not np.can_cast(np.min_scalar_type(fill_value), dtype):
+        dtype = np.float32
+    data = np.empty((pix_box[3]-pix_box[1], pix_box[2]-pix_box[0]), dtype)
+    data.fill(fill_value)
+    data[pix_box4subset[1]:pix_box4subset[3], pix_box4subset[0]:pix_box4subset[2]] = data_overlap
+    return data
+
+
+def subset_file(File, subset_dict, outFile=None, parallel=1):
     '''Subset file with
     Inputs:
         File        : str, path/name of file
@@ -430,6 +441,7 @@ def subset_file(File, subset_dict, outFile=None):
                       subset_lon : list of 2 float, subset in lon direction, default=None
                       fill_value : float, optional. filled value for area outside of data coverage. default=None
                                    None/not-existed to subset within data coverage only.
+        parallel    : int, number of processes over epochs
     Outputs:
         outFile :  str, path/name of output file; 
                    outFile = 'subset_'+File, if File is in current directory;
@@ -483,57 +495,8 @@ def subset_file(File, subset_dict, outFile=None):
             outFile = os.path.basename(File)
     print 'writing >>> '+outFile
 
-    ##### Multiple Dataset File
-    if k in ['timeseries','interferograms','wrapped','coherence']:
-        ##### Open Input File 
-        h5file = h5py.File(File,'r')
-        epochList = sorted(h5file[k].keys())
-        epochNum = len(epochList)
-        if k in multi_dataset_hdf5_file:
-            print 'number of acquisitions: '+str(epochNum)
-        else:
-            print 'number of interferograms: '+str(epochNum)
-
-        ##### Open Output File
-        h5out = h5py.File(outFile)
-        group = h5out.create_group(k)
-
-    ## Loop
-    if k == 'timeseries':
-        for i in range(epochNum):
-            epoch = epochList[i]
-            ut.print_progress(i+1, epochNum, prefix='', suffix=epoch)
-            
-            dset = h5file[k].get(epoch)
-            data_overlap = dset[pix_box4data[1]:pix_box4data[3],pix_box4data[0]:pix_box4data[2]]
-
-            data = np.ones((pix_box[3]-pix_box[1], pix_box[2]-pix_box[0]))*subset_dict['fill_value']
-            data[pix_box4subset[1]:pix_box4subset[3], pix_box4subset[0]:pix_box4subset[2]] = data_overlap
-
-            dset = group.create_dataset(epoch, data=data, compression='gzip')
-
-        atr_dict  = subset_attribute(atr_dict, pix_box)
-        for key,value in atr_dict.iteritems():   group.attrs[key] = value
-
-    elif k in ['interferograms','wrapped','coherence']:
-        for i in range(epochNum):
-            epoch = epochList[i]
-            ut.print_progress(i+1, epochNum, prefix='', suffix=epoch)
-            
-            dset = h5file[k][epoch].get(epoch)
-            atr_dict  = h5file[k][epoch].attrs
-            data_overlap = dset[pix_box4data[1]:pix_box4data[3],pix_box4data[0]:pix_box4data[2]]
-
-            data = np.ones((pix_box[3]-pix_box[1], pix_box[2]-pix_box[0]))*subset_dict['fill_value']
-            data[pix_box4subset[1]:pix_box4subset[3], pix_box4subset[0]:pix_box4subset[2]] = data_overlap
-
-            atr_dict  = subset_attribute(atr_dict, pix_box)
-            gg = group.create_group(epoch)
-            dset = gg.create_dataset(epoch, data=data, compression='gzip')
-            for key, value in atr_dict.iteritems():    gg.attrs[key] = value
-
-    ##### Single Dataset File
-    elif k in ['.jpeg','.jpg','.png','.ras','.bmp']:
+    ##### Image and .trans File
+    if k in ['.jpeg','.jpg','.png','.ras','.bmp']:
         data, atr_dict = readfile.read(File, pix_box)
         atr_dict = subset_attribute(atr_dict, pix_box)
         writefile.write(data,atr_dict,outFile)
@@ -549,21 +512,13 @@ def subset_file(File, subset_dict, outFile=None):
 
         atr_dict = subset_attribute(atr_dict, pix_box)
         writefile.write(rg,az,atr_dict,outFile)
-    else:
-        data_overlap,atr_dict = readfile.read(File, pix_box4data)
 
-        data = np.ones((pix_box[3]-pix_box[1], pix_box[2]-pix_box[0]))*subset_dict['fill_value']
-        data[pix_box4subset[1]:pix_box4subset[3], pix_box4subset[0]:pix_box4subset[2]] = data_overlap
-
-        atr_dict = subset_attribute(atr_dict, pix_box)
-        writefile.write(data, atr_dict, outFile)
+    ##### Multiple/Single Dataset File
+    else:
+        process.map_file(File, subset_block, outFile, args=(pix_box, pix_box4subset, subset_dict['fill_value']),\
+                         atr_func=lambda atr: subset_attribute(atr, pix_box), box=pix_box4data, parallel=parallel,\
+                         print_msg=False)
 
-    ##### End Cleaning
-    try:
-        h5file.close()
-        h5out.close()
-    except: pass
-    
     return outFile
 
 
@@ -572,19 +527,16 @@ def subset_file_list(fileList, inps):
     # check outfile and parallel option
     if len(fileList) > 1:
         inps.outfile = None
-    elif len(fileList) == 1 and inps.parallel:
-        inps.parallel =  False
-        print 'parallel processing is diabled for one input file'
 
-    ##### Subset files
-    if inps.parallel:
+    ##### Subset files, in parallel over files, or over epochs of one file
+    if inps.parallel and len(fileList) > 1:
         num_cores = min(multiprocessing.cpu_count(), len(fileList))
         print 'parallel processing using %d cores ...'%(num_cores)
         Parallel(n_jobs=num_cores)(delayed(subset_file)(file, vars(inps)) for file in fileList)
     else:
         for File in fileList:
             print '----------------------------------------------------'
-            subset_file(File, vars(inps), inps.outfile)
+            subset_file(File, vars(inps), inps.outfile, parallel=multiprocessing.cpu_count() if inps.parallel else 1)
     return
 
 
@@ -630,7 +582,7 @@ def cmdLineParse():
                              "np.nan, 0, 1000, ... \n"
                              "By default, it's None for no-outfill.")
     parser.add_argument('--no-parallel',dest='parallel',action='store_false',default=True,\
-                        help='Disable parallel processing. Diabled auto for 1 input file.\n\n')
+                        help='Disable parallel processing, over files, or over epochs for 1 input file.\n\n')
 
     parser.add_argument('-o','--output', dest='outfile',\
                         help='output file name\n'+\
@@ -16,6 +16,7 @@ import h5py
 import numpy as np
 
 import pysar._readfile as readfile
+import pysar._writefile as writefile
 
 
 #####################################################################
@@ -54,6 +55,7 @@ def main(argv):
     k = atr['FILE_TYPE']
     print "Loading time series: " + timeSeriesFile
     h5timeseries=h5py.File(timeSeriesFile)
+    readfile.check_stack_layout(h5timeseries, 'timeseries')
     dateList = sorted(h5timeseries['timeseries'].keys())
 
     dateIndex={}
@@ -92,7 +94,7 @@ def main(argv):
     for date in dateList:
         print date
         d = np.reshape(sumD[dateIndex[date]][:],[length,width])
-        dset = group.create_dataset(date, data=d, compression='gzip')
+        dset = writefile.create_dataset(group, date, data=d)
 
     for key,value in atr.iteritems():
         group.attrs[key] = value
@@ -4,30 +4,30 @@
 # Copyright(c) 2013, Heresh Fattahi                        #
 # Author:  Heresh Fattahi                                  #
 ############################################################
-#
+# Yunjun, Oct 2016: Calculate block by block of rows in complex64, with --parallel option
 #
 
 
 import sys
-import os
-import getopt
 import time
 import datetime
+import argparse
 
 import h5py
 import numpy as np
-import matplotlib.pyplot as plt
+from joblib import Parallel, delayed
 
 import pysar._readfile as readfile
 import pysar._pysar_utilities as ut
+import pysar._writefile as writefile
 
 
 ######################################################################################################
 def date_list(h5file): 
     dateList = []
     tbase    = []
-    for ifgram in h5file['interferograms'].keys():
-        dates = h5file['interferograms'][ifgram].attrs['DATE12'].split('-')
+    for date12 in readfile.read_epoch_attribute(h5file, 'interferograms', 'DATE12'):
+        dates = date12.split('-')
         if dates[0][0] == '9':  dates[0] = '19'+dates[0]
         else:                   dates[0] = '20'+dates[0]
         if dates[1][0] == '9':  dates[1] = '19'+dates[1]
@@ -49,9 +49,9 @@ def date_list(h5file):
 def design_matrix(h5file):
     '''Make the design matrix for the inversion.  '''
     tbase,dateList,dateDict = date_list(h5file)
-    ifgramList = h5file['interferograms'].keys()
+    date12List = readfile.read_epoch_attribute(h5file, 'interferograms', 'DATE12')
     numDates   = len(dateDict)
-    numIfgrams = len(ifgramList)
+    numIfgrams = len(date12List)
     A = np.zeros((numIfgrams,numDates))
     B = np.zeros(np.shape(A))
     daysList = []
@@ -60,7 +60,7 @@ def design_matrix(h5file):
     tbase = np.array(tbase)
     t = np.zeros((numIfgrams,2))
     for ni in range(numIfgrams):
-        date = h5file['interferograms'][ifgramList[ni]].attrs['DATE12'].split('-')
+        date = date12List[ni].split('-')
         if date[0][0] == '9':  date[0] = '19'+date[0]
         else:                  date[0] = '20'+date[0]
         if date[1][0] == '9':  date[1] = '19'+date[1]
@@ -77,116 +77,113 @@ def design_matrix(h5file):
 
 
 ######################################################################################################
-def usage():
-    print '''
-***************************************************************************************
-  Generates a parameter called temporal coherence for every pixel.
-
-  Usage:
-      temporal_coherence.py inteferograms_file timeseries_file [output_name]
-
-  Example:
-      temporal_coherence.py Seeded_unwrapIfgram.h5 timeseries.h5
-      temporal_coherence.py Seeded_unwrapIfgram.h5 timeseries.h5 temporal_coherence.h5
-
-  Reference:
-      Tizzani, P., P. Berardino, F. Casu, P. Euillades, M. Manzo, G. P. Ricciardi, G. Zeni,
-      and R. Lanari (2007), Surface deformation of Long Valley Caldera and Mono Basin, 
-      California, investigated with the SBAS-InSAR approach, Remote Sens. Environ., 108(3),
-      277-289, doi:10.1016/j.rse.2006.11.015.
-
-      Gourmelen, N., F. Amelung, and R. Lanari (2010), Interferometric synthetic aperture
-      radar-GPS integration: Interseismic strain accumulation across the Hunter Mountain 
-      fault in the eastern California shear zone, J. Geophys. Res., 115, B09408, 
-      doi:10.1029/2009JB007064.
+EXAMPLE='''example:
+  temporal_coherence.py Seeded_unwrapIfgram.h5 timeseries.h5
+  temporal_coherence.py Seeded_unwrapIfgram.h5 timeseries.h5 temporal_coherence.h5
+  temporal_coherence.py Seeded_unwrapIfgram.h5 timeseries.h5 --memory 2 --parallel 4
+'''
+
+REFERENCE='''reference:
+  Tizzani, P., P. Berardino, F. Casu, P. Euillades, M. Manzo, G. P. Ricciardi, G. Zeni,
+  and R. Lanari (2007), Surface deformation of Long Valley Caldera and Mono Basin, 
+  California, investigated with the SBAS-InSAR approach, Remote Sens. Environ., 108(3),
+  277-289, doi:10.1016/j.rse.2006.11.015.
+
+  Gourmelen, N., F. Amelung, and R. Lanari (2010), Interferometric synthetic aperture
+  radar-GPS integration: Interseismic strain accumulation across the Hunter Mountain 
+  fault in the eastern California shear zone, J. Geophys. Res., 115, B09408, 
+  doi:10.1029/2009JB007064.
+'''
+
+def cmdLineParse():
+    parser = argparse.ArgumentParser(description='Generates a parameter called temporal coherence for every pixel.',\
+                                     formatter_class=argparse.RawTextHelpFormatter,\
+                                     epilog=REFERENCE+'\n'+EXAMPLE)
+
+    parser.add_argument('ifgram_file', help='interferograms file')
+    parser.add_argument('timeseries_file', help='timeseries file')
+    parser.add_argument('outfile', nargs='?', default='temporal_coherence.h5',\
+                        help='output file name, default: temporal_coherence.h5')
+    parser.add_argument('--memory', dest='max_memory', type=float, default=4.0,\
+                        help='maximum memory to use in GB, default: 4.\n'+\
+                             'Interferograms and time series are read in row blocks within this limit.')
+    parser.add_argument('--parallel', dest='num_worker', type=int, default=1,\
+                        help='number of processes to calculate row blocks in parallel, default: 1.')
+
+    inps = parser.parse_args()
+    return inps
+
+
+def temporal_coherence_box(igramsFile, timeSeriesFile, ifgramList, dateList, box, Ap, range2phase):
+    '''Calculate temporal coherence for pixels within box, reading data from files.'''
+    h5timeseries = h5py.File(timeSeriesFile,'r')
+    timeseries = ut.read_timeseries_box(h5timeseries, dateList, box) * range2phase
+    h5timeseries.close()
 
-***************************************************************************************
-    '''
+    h5igrams = h5py.File(igramsFile,'r')
+    data = ut.read_ifgram_box(h5igrams, ifgramList, box)
+    h5igrams.close()
+    return ut.temporal_coherence(Ap, timeseries, data)
 
 
 ######################################
 def main(argv):
-    try:
-        igramsFile     = argv[0]
-        timeSeriesFile = argv[1]
-    except:
-        usage() ; sys.exit(1)
-
-    try:    tempCohFile = argv[2]
-    except: tempCohFile = 'temporal_coherence.h5'
+    inps = cmdLineParse()
 
     ########################################################
     #print '\n********** Temporal Coherence ****************'
-    print "load time series: "+timeSeriesFile
-    atr_ts = readfile.read_attribute(timeSeriesFile)
-    h5timeseries = h5py.File(timeSeriesFile)
-    dateList = h5timeseries['timeseries'].keys()
+    print "time series: "+inps.timeseries_file
+    atr_ts = readfile.read_attribute(inps.timeseries_file)
+    h5timeseries = h5py.File(inps.timeseries_file,'r')
+    dateList = readfile.get_epoch_list(h5timeseries, 'timeseries')
+    h5timeseries.close()
     numDates = len(dateList)
-
     print 'number of epoch: '+str(numDates)
-    dateIndex={}
-    for ni in range(numDates):
-        dateIndex[dateList[ni]]=ni 
-
-    dset = h5timeseries['timeseries'].get(h5timeseries['timeseries'].keys()[0])
-    nrows,ncols=np.shape(dset)
-    timeseries = np.zeros((len(h5timeseries['timeseries'].keys()),np.shape(dset)[0]*np.shape(dset)[1]),np.float32)
-
-    for i in range(numDates):
-        date = dateList[i]
-        dset = h5timeseries['timeseries'].get(date)
-        d = dset[0:dset.shape[0],0:dset.shape[1]]
-        timeseries[dateIndex[date]][:]=d.flatten(0)
-        ut.print_progress(i+1,numDates,'loading:',date)
-    del d
-    h5timeseries.close()
 
-    lt,numpixels=np.shape(timeseries)
+    nrows = int(atr_ts['FILE_LENGTH'])
+    ncols = int(atr_ts['WIDTH'])
     range2phase = -4*np.pi/float(atr_ts['WAVELENGTH'])
-    timeseries = range2phase*timeseries
 
     ######################################################
-    print "load interferograms: " + igramsFile
-    h5igrams   = h5py.File(igramsFile)  
-    ifgramList = h5igrams['interferograms'].keys()
+    print "interferograms: " + inps.ifgram_file
+    h5igrams   = h5py.File(inps.ifgram_file,'r')
+    ifgramList = readfile.get_epoch_list(h5igrams, 'interferograms')
     numIfgrams = len(ifgramList)
-    print 'number of epochs: '+str(numIfgrams)
+    print 'number of interferograms: '+str(numIfgrams)
     A,B = design_matrix(h5igrams)
+    h5igrams.close()
     p   = -1*np.ones([A.shape[0],1])
     Ap  = np.hstack((p,A))
 
-    print 'calculating temporal coherence ...'
-    #data = np.zeros((numIfgrams,numpixels),np.float32)
-    qq = np.zeros(numpixels)+0j
-    for ni in range(numIfgrams):
-        ## read interferogram
-        igram = ifgramList[ni]
-        data = h5igrams['interferograms'][igram].get(igram)[:].flatten(0)
-
-        ## calculate difference between observed and estimated data
-        ## interferogram by interferogram, less memory, Yunjun - 2016.06.10
-        dataEst  = np.dot(Ap[ni,:], timeseries)
-        dataDiff = data - dataEst
-        qq += np.exp(1j*dataDiff)
-
-        ## progress bar
-        ut.print_progress(ni+1,numIfgrams,'calculating:',igram)
-    del timeseries, data, dataEst, dataDiff
-    h5igrams.close()
-
-    #qq=np.absolute(np.sum(np.exp(1j*dataDiff),0))/numIfgrams
-    qq = np.absolute(qq)/numIfgrams
-    Temp_Coh=np.reshape(qq,[nrows,ncols])
-
-    ##### write temporal coherence file ####################
-    print 'writing >>> '+tempCohFile
-    h5TempCoh = h5py.File(tempCohFile,'w')
-    group=h5TempCoh.create_group('temporal_coherence')
-    dset = group.create_dataset(os.path.basename('temporal_coherence'), data=Temp_Coh, compression='gzip')
+    ##### Output file, pre-allocated and written block by block
+    print 'writing >>> '+inps.outfile
+    h5TempCoh = h5py.File(inps.outfile,'w')
+    group = h5TempCoh.create_group('temporal_coherence')
+    dset = writefile.create_dataset(group, 'temporal_coherence', shape=(nrows,ncols), dtype=np.float32)
     for key , value in atr_ts.iteritems():
         group.attrs[key]=value
     group.attrs['UNIT'] = '1'
+
+    print 'calculating temporal coherence ...'
+    parallel = max(inps.num_worker, 1)
+    # memory per pixel: time series, interferograms, their difference and its complex exponential
+    num_layer = numDates + 4*numIfgrams
+    box_list = ut.split_row_boxes(nrows, ncols, num_layer, inps.max_memory/parallel, min_box_num=parallel)
+    if parallel > 1:
+        print 'parallel processing using %d cores ...' % (parallel)
+    start_time = time.time()
+    with Parallel(n_jobs=parallel) as pool:
+        for i in range(0, len(box_list), parallel):
+            boxes = box_list[i:i+parallel]
+            tcohList = pool(delayed(temporal_coherence_box)(inps.ifgram_file, inps.timeseries_file, ifgramList,\
+                                                            dateList, box, Ap, range2phase)\
+                            for box in boxes)
+            for box, tcoh in zip(boxes, tcohList):
+                dset[box[1]:box[3],box[0]:box[2]] = tcoh.reshape(box[3]-box[1], box[2]-box[0])
+            ut.print_progress(i+len(boxes), len(box_list), prefix='calculating:',\
+                              suffix='rows %d-%d'%(boxes[0][1],boxes[-1][3]), elapsed_time=time.time()-start_time)
     h5TempCoh.close()
+    return inps.outfile
 
 
 ######################################################################################################
@@ -15,6 +15,10 @@ import datetime
 import h5py
 from numpy import sum,remainder,zeros,dot,reshape, float32, array, hstack, vstack, linalg, eye, ones
 from scipy.stats import nanstd, nanmean
+
+import pysar._readfile as readfile
+import pysar._writefile as writefile
+
 ######################################
 ######################################
 def usage():
@@ -42,6 +46,7 @@ def main(argv):
     print '\n************ Temporal Derivative **************'
     print "Loading time series: " + timeSeriesFile
     h5timeseries = h5py.File(timeSeriesFile)
+    readfile.check_stack_layout(h5timeseries, 'timeseries')
     dateList = h5timeseries['timeseries'].keys()
   
     tbase=[]
@@ -100,14 +105,14 @@ def main(argv):
     for i in range(lt-1):
         date=dateList[i+1]
         print date
-        dset = group1.create_dataset(date, data=reshape(timeseries_1st[i][:],[nrows,ncols]), compression='gzip')
+        dset = writefile.create_dataset(group1, date, data=reshape(timeseries_1st[i][:],[nrows,ncols]))
     for key,value in h5timeseries['timeseries'].attrs.iteritems():
         group1.attrs[key] = value
     print 'writing second_derivative.h5'
     for i in range(lt-2):
         date=dateList[i+2]
         print date
-        dset = group2.create_dataset(date, data=reshape(timeseries_2nd[i][:],[nrows,ncols]), compression='gzip')
+        dset = writefile.create_dataset(group2, date, data=reshape(timeseries_2nd[i][:],[nrows,ncols]))
     for key,value in h5timeseries['timeseries'].attrs.iteritems():
         group2.attrs[key] = value
   
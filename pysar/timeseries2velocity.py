@@ -7,6 +7,7 @@
 # Yunjun, Aug 2015: Add -m/M/d option
 # Yunjun, Jun 2016: Add -t option
 # Yunjun, Aug 2015: Support drop_date txt file input
+# Yunjun, Oct 2016: Invert block by block of rows with --memory option
 
 
 import os
@@ -49,6 +50,7 @@ EXAMPLE='''example:
   timeseries2velocity.py  timeseries.h5 -m 20080201 -M 20100508
   timeseries2velocity.py  timeseries.h5 -E 20040502,20060708,20090103
   timeseries2velocity.py  timeseries.h5 -E drop_date.txt
+  timeseries2velocity.py  timeseries.h5 --memory 2
 '''
 
 TEMPLATE='''
@@ -77,6 +79,9 @@ def cmdLineParse():
     parser.add_argument('-t','--template', dest='template_file',\
                         help='template file with the following items:'+TEMPLATE)
     parser.add_argument('-o','--output', dest='outfile', help='output file name')
+    parser.add_argument('--memory', dest='max_memory', type=float, default=4.0,\
+                        help='maximum memory to use in GB, default: 4.0\n'+\
+                             'time series is read and inverted block by block of rows within this limit.')
     
     inps = parser.parse_args()
     if not inps.ex_date:  inps.ex_date = []
@@ -94,11 +99,11 @@ def main(argv):
     print 'input '+k+' file: '+inps.timeseries_file
     if not k == 'timeseries':
         sys.exit('ERROR: input file is not timeseries!') 
-    h5file = h5py.File(inps.timeseries_file)
+    h5file = h5py.File(inps.timeseries_file,'r')
   
     #####################################
     ## Date Info
-    dateListAll = sorted(h5file[k].keys())
+    dateListAll = readfile.get_epoch_list(h5file, k)
     dateListAll = ptime.yyyymmdd(dateListAll)
     yyListAll = ptime.yyyymmdd2years(dateListAll)
     print '--------------------------------------------'
@@ -167,41 +172,6 @@ def main(argv):
     B1 = np.dot(np.linalg.inv(np.dot(B.T,B)),B.T)
     B1 = np.array(B1,np.float32)
     
-    # Loading timeseries
-    print "Loading time series file: "+inps.timeseries_file+' ...'
-    width = int(atr['WIDTH'])
-    length = int(atr['FILE_LENGTH'])
-    dateNum = len(dateList)
-    timeseries = np.zeros([dateNum,length*width],np.float32)
-    start_time = time.time()
-    for i in range(dateNum):
-        date = dateList[i]
-        ut.print_progress(i+1, dateNum, prefix='loading:', suffix=date, elapsed_time=time.time()-start_time)
-        timeseries[i,:] = h5file[k].get(date)[:].flatten()
-    h5file.close()
-
-    # Velocity Inversion
-    print 'Calculating velocity ...'
-    x = np.dot(B1,timeseries)
-    velocity = np.reshape(x[0,:],[length,width])
-    
-    print 'Calculating rmse ...'
-    timeseries_linear = np.dot(B,x)
-    rmse = np.reshape(np.sqrt((np.sum((timeseries_linear-timeseries)**2,0))/dateNum),[length,width])
-    
-    print 'Calculating the standard deviation of the estimated velocity ...'
-    residual = timeseries_linear - timeseries
-    s1 = np.sqrt(np.sum(residual**2,0)/(dateNum-2))
-    s2 = np.sqrt(np.sum((datevector-np.mean(datevector))**2))
-    std = np.reshape(s1/s2,[length,width])
-     
-    # SSt=np.sum((timeseries-np.mean(timeseries,0))**2,0)
-    # SSres=np.sum(residual**2,0)
-    # SS_REG=SSt-SSres
-    # Rsquared=np.reshape(SS_REG/SSt,[length,width])
-    ######################################################  
-    # covariance of the velocities
-
     #####################################
     # Output file name
     if not inps.outfile:
@@ -214,23 +184,50 @@ def main(argv):
     inps.outfile_r2 = 'R2_'+inps.outfile
     
     # Attributes
+    width = int(atr['WIDTH'])
+    length = int(atr['FILE_LENGTH'])
+    dateNum = len(dateList)
     atr['date1'] = datevector[0]
     atr['date2'] = datevector[dateNum-1]
     
-    # File Writing
-    print '--------------------------------------'
-    atr['FILE_TYPE'] = 'velocity'
-    print 'writing >>> '+inps.outfile
-    writefile.write(velocity, atr, inps.outfile)
-    
-    atr['FILE_TYPE'] = 'rmse'
-    print 'writing >>> '+inps.outfile_rmse
-    writefile.write(rmse, atr, inps.outfile_rmse)
-    
-    atr['FILE_TYPE'] = 'rmse'
-    print 'writing >>> '+inps.outfile_std
-    writefile.write(std, atr, inps.outfile_std)
-    
+    # Pre-allocate output files
+    dsetDict = dict()
+    h5outList = []
+    for fname, ftype in [(inps.outfile, 'velocity'), (inps.outfile_rmse, 'rmse'), (inps.outfile_std, 'rmse')]:
+        print 'writing >>> '+fname
+        atr['FILE_TYPE'] = ftype
+        h5out = h5py.File(fname, 'w')
+        group = h5out.create_group(ftype)
+        dsetDict[fname] = writefile.create_dataset(group, ftype, shape=(length,width), dtype=np.float32)
+        for key, value in atr.iteritems():
+            group.attrs[key] = value
+        h5outList.append(h5out)
+
+    # Velocity Inversion block by block
+    # memory per pixel: time series + its linear fit/residual
+    s2 = np.sqrt(np.sum((datevector-np.mean(datevector))**2))
+    box_list = ut.split_row_boxes(length, width, 2*dateNum+3, inps.max_memory)
+    start_time = time.time()
+    for i in range(len(box_list)):
+        box = box_list[i]
+        boxShape = (box[3]-box[1], box[2]-box[0])
+        residual = ut.read_timeseries_box(h5file, dateList, box)
+        x = np.dot(B1, residual)
+
+        # residual = timeseries - linear fit, computed in place
+        residual -= np.dot(B, x)
+        ssr = np.sum(residual**2, axis=0)
+        del residual
+
+        dsetDict[inps.outfile][box[1]:box[3],box[0]:box[2]] = x[0,:].reshape(boxShape)
+        dsetDict[inps.outfile_rmse][box[1]:box[3],box[0]:box[2]] = np.sqrt(ssr/dateNum).reshape(boxShape)
+        dsetDict[inps.outfile_std][box[1]:box[3],box[0]:box[2]] = (np.sqrt(ssr/(dateNum-2))/s2).reshape(boxShape)
+        ut.print_progress(i+1, len(box_list), prefix='calculating:', suffix='rows %d-%d'%(box[1],box[3]),\
+                          elapsed_time=time.time()-start_time)
+    h5file.close()
+    for h5out in h5outList:
+        h5out.close()
+
     print 'Done.'
     return inps.outfile
 
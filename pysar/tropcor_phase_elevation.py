@@ -17,6 +17,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 import pysar._readfile as readfile
+import pysar._writefile as writefile
 
 
 ######################################
@@ -142,6 +143,7 @@ def main(argv):
     ###################################################
     print 'Estimating the tropospheric effect using the differences of the subsequent epochs and DEM'
     
+    readfile.check_stack_layout(h5timeseries, 'timeseries')
     dateList = sorted(h5timeseries['timeseries'].keys())
     nrows,ncols=np.shape(h5timeseries['timeseries'].get(dateList[0]))
     PAR_EPOCH_DICT_2={} 
@@ -238,7 +240,7 @@ def main(argv):
     print 'writing >>> '+outName
     h5tropCor = h5py.File(outName,'w')
     group = h5tropCor.create_group('timeseries')
-    dset = group.create_dataset(dateList[0], data=h5timeseries['timeseries'].get(dateList[0]), compression='gzip')
+    dset = writefile.create_dataset(group, dateList[0], data=h5timeseries['timeseries'].get(dateList[0]))
     for date in dateList:
         if not date in h5tropCor['timeseries']:
             print date
@@ -248,7 +250,7 @@ def main(argv):
    
             tropo_effect = np.reshape(np.dot(B,par),[dset.shape[1],dset.shape[0]]).T
             tropo_effect -= tropo_effect[yref,xref]
-            dset = group.create_dataset(date, data=data-tropo_effect, compression='gzip')
+            dset = writefile.create_dataset(group, date, data=data-tropo_effect)
 
     for key,value in h5timeseries['timeseries'].attrs.iteritems():
         group.attrs[key] = value
@@ -256,7 +258,7 @@ def main(argv):
     try: 
         dset1 = h5timeseries['mask'].get('mask')
         group=h5tropCor.create_group('mask')
-        dset = group.create_dataset('mask', data=dset1, compression='gzip')
+        dset = writefile.create_dataset(group, 'mask', data=dset1)
     except: pass
 
     h5tropCor.close()
@@ -20,6 +20,7 @@ import numpy as np
 
 import pysar._pysar_utilities as ut
 import pysar._readfile as readfile
+import pysar._writefile as writefile
 
 
 ###############################################################
@@ -149,6 +150,7 @@ def main(argv):
     ## Loop to download 
     inps.grib_file_list = []
     h5timeseries = h5py.File(inps.timeseries_file, 'r')
+    readfile.check_stack_layout(h5timeseries, 'timeseries')
     dateList = sorted(h5timeseries['timeseries'].keys())
     for d in dateList:
         print [d]
@@ -219,8 +221,8 @@ def main(argv):
         # Write dataset
         print 'writing hdf5 file ...'
         data = h5timeseries['timeseries'].get(dateList[i])[:]
-        dset  = group_tropCor.create_dataset(dateList[i], data=data+phs, compression='gzip')
-        dset  = group_trop.create_dataset(dateList[i], data=phs, compression='gzip')
+        dset  = writefile.create_dataset(group_tropCor, dateList[i], data=data+phs)
+        dset  = writefile.create_dataset(group_trop, dateList[i], data=phs)
     
     ## Write Attributes
     for key,value in atr.iteritems():
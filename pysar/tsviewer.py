@@ -14,6 +14,8 @@
 #                   Support Zoom in for figure 1
 #                   Support lalo input
 # Yunjun, Dec 2016: Add read_dis_lalo()
+# Yunjun, Feb 2017: Use pysar._point for reading point time-series
+#                   Read map from overviews if available
 
 
 import sys
@@ -33,6 +35,7 @@ import matplotlib.pyplot as plt
 
 import pysar._readfile as readfile
 import pysar._datetime as ptime
+import pysar._point as pt
 import pysar.subset as subset
 import pysar.view as view
 
@@ -54,6 +57,7 @@ def check_yx(xsub,ysub,radius,ax,rectColor='black'):
 
 ################################################################
 def read_dis_xy(xsub,ysub,dateList,h5file,unit='cm'):
+    ## h5file: h5py.File object or path of timeseries file
     global ref_date
 
     ## Unit and Scale
@@ -63,27 +67,16 @@ def read_dis_xy(xsub,ysub,dateList,h5file,unit='cm'):
     else:unit =  'cm';  unitFac=100.0   # cm by default
 
     ## read displacement
-    try:
-        ref_date
-        dis_ref = h5file['timeseries'].get(ref_date)[ysub[0]:ysub[1]+1,xsub[0]:xsub[1]+1]
+    ref = None
+    try:    ref = ref_date
     except: pass
+    if isinstance(h5file, basestring):  File = h5file
+    else:                               File = h5file.filename
+    dis = pt.read_point_data(File, [ysub[0:2]], [xsub[0:2]], epochList=dateList, ref_date=ref)
+    dis = dis[0]*unitFac
 
-    dis=[]
-    for date in dateList:
-        dis0 = h5file['timeseries'].get(date)[ysub[0]:ysub[1]+1,xsub[0]:xsub[1]+1]
-        try: dis0 -= dis_ref
-        except: pass
-        dis.append(dis0)
-    dis=np.array(dis)*unitFac;
-    dis=np.reshape(dis,(len(dateList),-1))
-
-    ## calculate mean
-    dis_mean=np.nanmean(dis,1)
-    ## calculate standard deviation
-    if (xsub[1]-xsub[0])*(ysub[1]-ysub[0]) == 1:
-        dis_std = np.array([0]*len(dateList))
-    else:
-        dis_std = np.nanstd(dis,1)
+    ## calculate mean and standard deviation
+    dis_mean, dis_std = pt.point_statistics(dis)
 
     ## display
     print 'spatial averaged displacement ['+unit+']:'
@@ -105,17 +98,12 @@ def read_dis_xy(xsub,ysub,dateList,h5file,unit='cm'):
 ################################################################
 def read_dis_lalo(lat,lon,dateList,timeseriesFile,radius=0,unit='cm'):
     atr = readfile.read_attribute(timeseriesFile)
-    h5 = h5py.File(timeseriesFile,'r')
-
-    x = subset.coord_geo2radar(lon,atr,'longitude');
-    y = subset.coord_geo2radar(lat,atr,'latitude');
+    y, x = pt.coord_geo2yx(lat, lon, atr)
     if radius == 0:  radius = 3
     xsub = [x-radius,x+radius]
     ysub = [y-radius,y+radius]
 
-    dis,dis_mean,dis_std = read_dis_xy(xsub,ysub,dateList,h5,unit)[0:3]
-    h5.close()
- 
+    dis,dis_mean,dis_std = read_dis_xy(xsub,ysub,dateList,timeseriesFile,unit)[0:3]
     return dis,dis_mean,dis_std
     
 ################################################################
@@ -343,7 +331,7 @@ def main(argv):
         sys.exit(1)
 
     atr = readfile.read_attribute(timeSeriesFile)
-    dateList1 = sorted(h5timeseries['timeseries'].keys())
+    dateList1 = readfile.get_epoch_list(h5timeseries, 'timeseries')
     dates1,datevector1 = ptime.date_list2vector(dateList1)
     print '\n************ Time Series Display - Point *************'
 
@@ -465,15 +453,27 @@ def main(argv):
 
     try:
         velocityFile
-        try:    vel, vel_atr = readfile.read(velocityFile)
-        except: vel, vel_atr = readfile.read(timeSeriesFile,velocityFile)
+        if os.path.isfile(velocityFile):  vel_file = velocityFile;    vel_epoch = ''
+        else:                             vel_file = timeSeriesFile;  vel_epoch = velocityFile
         ax.set_title(velocityFile)
         print 'display: ' + velocityFile
-    except:
-        vel, vel_atr = readfile.read(timeSeriesFile,dateList1[-1])
+    except NameError:
+        vel_file = timeSeriesFile;  vel_epoch = dateList1[-1]
         ax.set_title('epoch: '+dateList1[-1])
         print 'display last epoch'
 
+    ## read from overviews (built by add_overviews.py) with the coarsest level finer than figure pixel
+    fig_pixel_num = np.max(fig.get_size_inches()*fig.dpi)
+    vel_looks = readfile.get_overview_looks(vel_file, int(max(win_box[2]-win_box[0], win_box[3]-win_box[1])/fig_pixel_num))
+    vel_atr = readfile.read_attribute(vel_file, vel_epoch)
+    if vel_looks > 1:
+        print 'read from overviews with '+str(vel_looks)+' looks'
+        vel = readfile.read_overview(vel_file, vel_looks, epoch=vel_epoch)
+        vel_extent = (-0.5, vel.shape[1]*vel_looks-0.5, vel.shape[0]*vel_looks-0.5, -0.5)
+    else:
+        vel = readfile.read(vel_file, epoch=vel_epoch)[0]
+        vel_extent = None
+
     ##### show displacement instead of phase
     if vel_atr['FILE_TYPE'] in ['interferograms','.unw'] and dispDisplacement == 'yes':
         print 'show displacement'
@@ -514,7 +514,7 @@ def main(argv):
         col = int(x+0.5)
         row = int(y+0.5)
         if col>=0 and col<=width and row>=0 and row<=length:
-            z = vel[row,col]
+            z = vel[min(row/vel_looks, vel.shape[0]-1), min(col/vel_looks, vel.shape[1]-1)]
             try:
                 lon = ullon + x*lon_step
                 lat = ullat + y*lat_step
@@ -531,8 +531,8 @@ def main(argv):
         vel_alpha = 0.8
     except: print 'No DEM file'
 
-    try:     img=ax.imshow(vel,vmin=vmin,vmax=vmax, alpha=vel_alpha)
-    except:  img=ax.imshow(vel,alpha=vel_alpha)
+    try:     img=ax.imshow(vel,vmin=vmin,vmax=vmax, alpha=vel_alpha, extent=vel_extent)
+    except:  img=ax.imshow(vel,alpha=vel_alpha, extent=vel_extent)
     plt.colorbar(img)
 
     ## Zoom In (subset)
@@ -554,7 +554,7 @@ def main(argv):
     try:
         timeSeriesFile_2
         h5timeseries_2=h5py.File(timeSeriesFile_2)
-        dateList_2 = sorted(h5timeseries_2['timeseries'].keys())
+        dateList_2 = readfile.get_epoch_list(h5timeseries_2, 'timeseries')
         dates_2,datevector_2 = ptime.date_list2vector(dateList_2)
         datevector_all += list(set(datevector_2) - set(datevector_all))
         datevector_all = sorted(datevector_all)
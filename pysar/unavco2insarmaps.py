@@ -1,10 +1,11 @@
 #! /usr/bin/env python
 
 import json
+import subprocess
+import sqlite3
 import h5py
 import numpy as np
 from datetime import date
-import math
 import time
 import os
 import sys
@@ -24,6 +25,9 @@ import argparse
 dbUsername = "INSERT"
 dbPassword = "INSERT"
 dbHost = "INSERT"
+dbFile = None
+# number of points per json chunk
+CHUNK_SIZE = 20000
 # returns a dictionary of datasets that are stored in memory to speed up h5 read process
 def get_date(date_string): 
     year = int(date_string[0:4])
@@ -51,6 +55,61 @@ needed_attributes = {
     "X_FIRST", "atmos_correct_method", "last_date", "first_frame", "Y_STEP", "history",
     "scene_footprint", "downloadUnavcoUrl", "referencePdfUrl", "areaName", "referenceText"    
 }
+# ---------------------------------------------------------------------------------------
+# generator of json point objects of valid pixels, in chunks of chunk_size points
+# datasets are read block by block of rows, either 2d arrays or h5py datasets, and the
+# slope of linear regression of displacement vs time is calculated for all points at once
+def get_point_chunks(attributes, decimal_dates, timeseries_datasets, dataset_keys, chunk_size=CHUNK_SIZE, max_memory=1.0):
+    x_step = float(attributes["X_STEP"])
+    y_step = float(attributes["Y_STEP"])
+    x_first = float(attributes["X_FIRST"])
+    y_first = float(attributes["Y_FIRST"])
+    num_columns = int(attributes["WIDTH"])
+    num_rows = int(attributes["FILE_LENGTH"])
+
+    # y = mx + c -> m = sum((x - mean(x)) * y) / sum((x - mean(x))^2), same as least squares
+    # centered decimal dates keep the regression well conditioned
+    x = np.array(decimal_dates, np.float64)
+    x -= np.mean(x)
+    slope_weight = x / np.sum(x**2)
+
+    # number of rows read at once, for all dates in float64
+    row_step = max(int(max_memory * 1024**3 / (num_columns * len(dataset_keys) * 8)), 1)
+
+    siu_man = []
+    point_num = 0
+    for row0 in range(0, num_rows, row_step):
+        row1 = min(row0 + row_step, num_rows)
+        # points with displacement of the first date not equal to naN
+        data = np.asarray(timeseries_datasets[dataset_keys[0]][row0:row1])
+        rows, cols = np.where(~np.isnan(data))
+        if rows.size == 0:
+            continue
+        displacements = np.zeros((rows.size, len(dataset_keys)), np.float32)
+        displacements[:, 0] = data[rows, cols]
+        del data
+        for i in range(1, len(dataset_keys)):
+            displacements[:, i] = np.asarray(timeseries_datasets[dataset_keys[i]][row0:row1])[rows, cols]
+        slopes = np.dot(displacements, slope_weight).tolist()
+        longitudes = (x_first + cols * x_step).tolist()
+        latitudes = (y_first + (rows + row0) * y_step).tolist()
+        displacements = displacements.tolist()
+
+        for i in range(len(slopes)):
+            siu_man.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [longitudes[i], latitudes[i]]},
+            "properties": {"d": displacements[i], "m": slopes[i], "p": point_num}
+            })
+            point_num += 1
+            if len(siu_man) == chunk_size:
+                yield siu_man
+                siu_man = []
+
+    # the last chunk that might be smaller than chunk_size
+    if siu_man:
+        yield siu_man
+
 # ---------------------------------------------------------------------------------------
 def convert_data(attributes, decimal_dates, timeseries_datasets, dataset_keys, json_path, folder_name, region_file_name):
 
@@ -67,61 +126,16 @@ def convert_data(attributes, decimal_dates, timeseries_datasets, dataset_keys, j
     num_rows = int(attributes["FILE_LENGTH"])
     print "columns: %d" % num_columns
     print "rows: %d" % num_rows
-    # create a siu_man array to store json point objects
-    siu_man = []
-    displacement_values = []
-    displacements = '{'
-    # np array of decimal dates, x parameter in linear regression equation
-    x = decimal_dates
-    A = np.vstack([x, np.ones(len(x))]).T
-    y = []
-    chunk_num = 1
-    point_num = 0
-    CHUNK_SIZE = 20000
-
-    # outer loop increments row = longitude, inner loop increments column = latitude
-    for (row, col), value in np.ndenumerate(timeseries_datasets[dataset_keys[0]]):
-        longitude = x_first + (col * x_step)
-        latitude = y_first + (row * y_step) 
-        displacement = float(value) 
-        # if value is not equal to naN, create a new json point object and append to siu_man array
-        if not math.isnan(displacement):
-            # get displacement values for all the dates into array for json and string for pgsql
-            for key in dataset_keys:
-                displacement = timeseries_datasets[key][row][col]
-                displacements += (str(displacement) + ",")
-                displacement_values.append(float(displacement))
-            displacements = displacements[:len(displacements) - 1] + '}'
-
-            # np array of displacement values, y parameter in linear regression equation
-            y = displacement_values
-
-            # y = mx + c -> we want m = slope of the linear regression line 
-            m, c = np.linalg.lstsq(A, y)[0]
-
-            data = {
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [longitude, latitude]},    
-            "properties": {"d": displacement_values, "m": m, "p": point_num}
-            }   
-            # allocate memory space for siu_man array in beginning 
-            siu_man.append(data)
-
-            # clear displacement array for json and the other string for dictionary, for next point
-            displacement_values = []
-            displacements = '{'
-            point_num += 1
-            # break;    # for testing purposes convert only 1 point
 
-            # if chunk_size limit is reached, write chunk into a json file
-            # then increment chunk number and clear siu_man array
-            if len(siu_man) == CHUNK_SIZE:
-                make_json_file(chunk_num, siu_man, dataset_keys, json_path, folder_name)
-                chunk_num += 1
-                siu_man = []
-
-    # write the last chunk that might be smaller than chunk_size
-    make_json_file(chunk_num, siu_man, dataset_keys, json_path, folder_name)
+    # write chunk into json file while the previous one is being inserted to database
+    chunk_num = 0
+    process = None
+    for points in get_point_chunks(attributes, decimal_dates, timeseries_datasets, dataset_keys):
+        chunk_num += 1
+        chunk_path = make_json_file(chunk_num, points, dataset_keys, json_path, folder_name)
+        wait_insert_process(process, chunk_num-1)
+        process = insert_json_file(chunk_path, folder_name)
+    wait_insert_process(process, chunk_num)
 
     # calculate mid lat and long of dataset - then use google python lib to get country
     mid_long = x_first + ((num_columns/2) * x_step)
@@ -136,15 +150,8 @@ def convert_data(attributes, decimal_dates, timeseries_datasets, dataset_keys, j
     area = folder_name
 
     # for some reason pgsql only takes {} not [] - format date arrays and attributes to be inserted to pgsql
-    string_dates_sql = '{'
-    for k in dataset_keys:
-        string_dates_sql += (str(k) + ",")
-    string_dates_sql = string_dates_sql[:len(string_dates_sql) - 1] + '}'
-
-    decimal_dates_sql = '{'
-    for d in decimal_dates:
-        decimal_dates_sql += (str(d) + ",")
-    decimal_dates_sql = decimal_dates_sql[:len(decimal_dates_sql) - 1] + '}'
+    string_dates_sql = '{' + ','.join([str(k) for k in dataset_keys]) + '}'
+    decimal_dates_sql = '{' + ','.join([str(d) for d in decimal_dates]) + '}'
 
     # scene_footprint attribute uses a wkt geometry type with format that confuses postgresql database
     # thus we have to add "Polygon(coordinates, coordinates, coordinates, coordinates)" as string
@@ -159,6 +166,13 @@ def convert_data(attributes, decimal_dates, timeseries_datasets, dataset_keys, j
     attribute_keys = attribute_keys[:len(attribute_keys)-1] + '}'
     attribute_values = attribute_values[:len(attribute_values)-1] + '}'
 
+    if dbFile:
+        area_values = [area, project_name, mid_long, mid_lat, str(country), region, chunk_num,\
+                       attribute_keys, attribute_values, string_dates_sql, decimal_dates_sql]
+        extra_attributes = [(k, str(attributes[k])) for k in attributes if k in needed_attributes]
+        insert_area_sqlite(dbFile, area, area_values, extra_attributes)
+        return
+
     try:    # connect to databse
         con = psycopg2.connect("dbname='pgis' user='" + dbUsername + "' host='" + dbHost + "' password='" + dbPassword + "'")
         cur = con.cursor()
@@ -202,7 +216,7 @@ def convert_data(attributes, decimal_dates, timeseries_datasets, dataset_keys, j
     print "Done creating index"
     
 # ---------------------------------------------------------------------------------------
-# create a json file out of siu man array
+# create a json file out of siu man array, in compact format without indentation
 # then put json file into directory named after the h5 file
 def make_json_file(chunk_num, points, dataset_keys, json_path, folder_name):
 
@@ -213,15 +227,32 @@ def make_json_file(chunk_num, points, dataset_keys, json_path, folder_name):
     }
 
     chunk = "chunk_" + str(chunk_num) + ".json"
-    json_file = open(json_path + "/" + chunk, "w")
-    string_json = json.dumps(data, indent=4, separators=(',',':'))
-    json_file.write("%s" % string_json)
+    chunk_path = json_path + "/" + chunk
+    json_file = open(chunk_path, "w")
+    json.dump(data, json_file, separators=(',',':'))
     json_file.close()
+    return chunk_path
 
-    # insert json file to pgsql using ogr2ogr - folder_name = area name
-    command = 'ogr2ogr -append -f "PostgreSQL" PG:"dbname=pgis host=' + dbHost + ' user=' + dbUsername + ' password=' + dbPassword + '" --config PG_USE_COPY YES -nln "' + folder_name + '" '
-    chunk_path = './mbtiles/' + folder_name + '/' + chunk
-    res = os.system(command + ' ' + chunk_path)
+# ---------------------------------------------------------------------------------------
+# insert json file to pgsql (or to the sqlite file given by --db-file) using ogr2ogr
+# in the background - folder_name = area name; returns the ogr2ogr process
+def insert_json_file(chunk_path, folder_name):
+    if dbFile:
+        command = ['ogr2ogr', '-f', 'SQLite', dbFile]
+        if os.path.isfile(dbFile):
+            command.insert(1, '-append')
+    else:
+        command = ['ogr2ogr', '-append', '-f', 'PostgreSQL',\
+                   'PG:dbname=pgis host=' + dbHost + ' user=' + dbUsername + ' password=' + dbPassword,\
+                   '--config', 'PG_USE_COPY', 'YES']
+    command += ['-nln', folder_name, chunk_path]
+    return subprocess.Popen(command)
+
+# wait for the ogr2ogr process of the previous chunk to finish
+def wait_insert_process(process, chunk_num):
+    if process is None:
+        return
+    res = process.wait()
 
     if res != 0:
         print "Error inserting into the database. This is most often due to running out of Memory (RAM), or incorrect database credentials... quitting"
@@ -229,6 +260,23 @@ def make_json_file(chunk_num, points, dataset_keys, json_path, folder_name):
 
     print "inserted chunk " + str(chunk_num) + " to db"
 
+# ---------------------------------------------------------------------------------------
+# put dataset into area table and its attributes into extra_attributes table of the sqlite file
+# used as a file-based stand-in of the insarmaps database, i.e. for testing without postgresql
+def insert_area_sqlite(db_file, area, area_values, extra_attributes):
+    con = sqlite3.connect(db_file)
+    cur = con.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS area ( id integer primary key, unavco_name varchar, project_name varchar, longitude double precision, latitude double precision, country varchar, region varchar, numchunks integer, attributekeys varchar, attributevalues varchar, stringdates varchar, decimaldates varchar );")
+    cur.execute("INSERT INTO area VALUES (NULL,?,?,?,?,?,?,?,?,?,?,?)", area_values)
+    area_id = cur.lastrowid
+    cur.execute("CREATE TABLE IF NOT EXISTS extra_attributes (area_id integer, attributekey varchar, attributevalue varchar);")
+    cur.executemany("INSERT INTO extra_attributes VALUES (?,?,?)", [(area_id, k, v) for k, v in extra_attributes])
+    print "Creating index"
+    cur.execute('CREATE INDEX IF NOT EXISTS "' + area + '_p_idx" ON "' + area + '" (p);')
+    con.commit()
+    con.close()
+    print "Done creating index"
+
 # ---------------------------------------------------------------------------------------
 # START OF EXECUTABLE
 # ---------------------------------------------------------------------------------------
@@ -241,9 +289,10 @@ def build_parser():
     parser = argparse.ArgumentParser(description='Convert a Unavco format H5 file for ingestion into insarmaps.')
     required = parser.add_argument_group("required arguments")
     required.add_argument("-f", "--file", help="unavco file to ingest", required=True)
-    required.add_argument("-u", "--user", help="username for the insarmaps database", required=True)
-    required.add_argument("-p", "--password", help="password for the insarmaps database", required=True)
-    required.add_argument("--host", default=dbHost, help="postgres DB URL for insarmaps database", required=True)
+    required.add_argument("-u", "--user", help="username for the insarmaps database, not needed with --db-file")
+    required.add_argument("-p", "--password", help="password for the insarmaps database, not needed with --db-file")
+    required.add_argument("--host", default=dbHost, help="postgres DB URL for insarmaps database, i.e. localhost for local postgis container")
+    parser.add_argument("--db-file", dest="db_file", help="sqlite file to ingest into instead of the postgres database, for testing")
 
     return parser
 
@@ -252,10 +301,13 @@ def main():
     parseArgs = parser.parse_args()
 
     file_name = parseArgs.file
-    global dbUsername, dbPassword, dbHost
+    global dbUsername, dbPassword, dbHost, dbFile
     dbUsername = parseArgs.user
     dbPassword = parseArgs.password
     dbHost = parseArgs.host
+    dbFile = parseArgs.db_file
+    if not dbFile and not (dbUsername and dbPassword):
+        parser.error("argument -u/--user and -p/--password are required without --db-file")
 
     path_name_and_extension = os.path.basename(file_name).split(".")
     path_name = path_name_and_extension[0]
@@ -266,7 +318,7 @@ def main():
     start_time = time.clock()
 
 # use h5py to open specified group(s) in the h5 file 
-# then read datasets from h5 file into memory for faster reading of data
+# datasets are read block by block while converting, to keep memory usage low
 # depending on UNAVCO format, the main key to access groups might be '/GEOCODE'
     file = h5py.File(file_name,  "r")
     group = file['timeseries']  # assuming there is only one main key called 'GEOCODE'
@@ -285,17 +337,14 @@ def main():
 # array that stores dates from dataset_keys that have been converted to decimal
     decimal_dates = []
 
-# read datasets in the group into a dictionary of 2d arrays and intialize decimal dates
+# get datasets in the group into a dictionary of h5py datasets and intialize decimal dates
     timeseries_datasets = {}
     for key in dataset_keys:
-        timeseries_datasets[key] = group["GRIDS"][key][:]
+        timeseries_datasets[key] = group["GRIDS"][key]
         d = get_date(key)
         decimal = get_decimal_date(d)
         decimal_dates.append(decimal)
 
-# set number of points per json chunk - then close h5 file
-    file.close()
-
 # connect to postgresql database
 # also create folder named after h5 file to store json files in mbtiles folder
     con = None
@@ -318,6 +367,7 @@ def main():
 
 # read and convert the datasets, then write them into json files and insert into database
     convert_data(attributes, decimal_dates, timeseries_datasets, dataset_keys, json_path, folder_name, region_file_name)
+    file.close()
 
 # run tippecanoe command to get mbtiles file and then delete the json files to save space
     os.chdir(os.path.abspath(json_path))
@@ -6,15 +6,20 @@
 ############################################################
 # Yunjun, Jan 2016: add bonding points correction
 # Yunjun, Jul 2016: add ramp removal step
+# Yunjun, Feb 2017: add unwrap_error_closure(), tile-wise phase closure correction in parallel,
+#                   with pixels grouped by closure pattern
 
 
 import sys
 import os
 import getopt
+import time
 
 import h5py
 import numpy as np
 from scipy.linalg import pinv
+from joblib import Parallel, delayed
+import multiprocessing
 
 import pysar._pysar_utilities as ut
 import pysar._readfile as readfile
@@ -42,6 +47,125 @@ def phase_bonding(data,mask,x,y):
   
     return data
 
+####################################################################################################
+def closure_correction_matrix(C, constrained, reg=0.25):
+    '''Matrix to estimate integer cycles of unwrapping error from phase closure, for one pattern
+    Solve [-2*pi*C; D; reg*I] * N = [C*dU; 0; 0] in least squares, with Tikhonov regularization,
+    where D constrains interferograms involved in closed triangles only (no unwrapping error) to zero.
+    Inputs:
+        C           - 2D np.array in size of (numTriangle, numIfgram), triangle-interferogram matrix
+        constrained - 1D np.array of bool in size of (numIfgram,), interferograms to constrain to zero
+        reg         - float, Tikhonov regularization factor
+    Output:
+        P - 2D np.array in size of (numIfgram, numTriangle), N = P * (C * dU)
+    '''
+    numTri, numIfgram = C.shape
+    D = np.eye(numIfgram)[constrained]
+    G = np.vstack((-2*np.pi*C, D, reg*np.eye(numIfgram)))
+    return pinv(G)[:, 0:numTri]
+
+
+def unwrap_error_closure_box(File, ifgramList, box, C, mask, thr=0.5):
+    '''Correct unwrapping errors of interferograms within box with phase closure
+    Pixels are grouped by the pattern of interferograms constrained by closed triangles, so that
+    the regularized system of each pattern is factorized once and applied to all its pixels.
+    Inputs:
+        File       - string, interferograms file
+        ifgramList - list of string, interferograms in the same order as columns of C
+        box        - 4-tuple of int, area to correct, defined in (x0, y0, x1, y1)
+        C          - 2D np.array, triangle-interferogram matrix, from ut.get_triangles()
+        mask       - 2D np.array in size of box, pixels with value of 1 are corrected
+        thr        - float, threshold of phase closure in radian, triangle with absolute
+                     closure >= thr is considered as having unwrapping error
+    Output:
+        data - 2D np.array in float32 in size of (numIfgram, numPixel), corrected interferograms
+    '''
+    h5 = h5py.File(File, 'r')
+    data = ut.read_ifgram_box(h5, ifgramList, box)
+    h5.close()
+
+    pixIdx = np.nonzero(mask.flatten() == 1)[0]
+    if pixIdx.size == 0:
+        return data
+    curl = np.dot(C, data[:,pixIdx])
+
+    # interferograms involved in closed triangles only, of each pixel
+    with np.errstate(invalid='ignore'):
+        unclosed = np.dot(np.abs(C).T, np.abs(curl) >= thr) > 0
+        closed   = np.dot(np.abs(C).T, np.abs(curl) <  thr) > 0
+    constrained = np.multiply(closed, ~unclosed)
+
+    for groupIdx in ut.group_pixel_by_pattern(constrained):
+        P = closure_correction_matrix(C, constrained[:,groupIdx[0]])
+        idx = pixIdx[groupIdx]
+        data[:,idx] += np.round(np.dot(P, curl[:,groupIdx])) * 2.0*np.pi
+    return data
+
+
+def unwrap_error_closure(File, mask, outFile=None, thr=0.5, max_memory=4.0, parallel=1):
+    '''Correct unwrapping errors of interferograms file based on triangular consistency (phase closure)
+    Interferograms are read, corrected and written tile by tile in rows, in parallel.
+    Inputs:
+        File    - string, interferograms file
+        mask    - 2D np.array, pixels with value of 1 are corrected
+        outFile - string, output file name
+        thr     - float, threshold of phase closure in radian
+        max_memory - float, maximum memory to use in GB
+        parallel   - int, number of processes
+    Output:
+        outFile - string
+    '''
+    total = time.time()
+    if not outFile:
+        outFile = os.path.splitext(File)[0]+'_unwCor.h5'
+    atr = readfile.read_attribute(File)
+    length = int(atr['FILE_LENGTH'])
+    width = int(atr['WIDTH'])
+
+    h5 = h5py.File(File, 'r')
+    ifgramList = readfile.get_epoch_list(h5, 'interferograms')
+    curls, Triangles, C = ut.get_triangles(h5)
+    print 'Number of all triangles: '+str(C.shape[0])
+    print 'Number of interferograms: '+str(len(ifgramList))
+
+    # Output file, with the same structure of input file
+    print 'writing >>> '+outFile
+    h5out = h5py.File(outFile, 'w')
+    gg = h5out.create_group('interferograms')
+    dsetList = []
+    for ifgram in ifgramList:
+        group = gg.create_group(ifgram)
+        dsetList.append(writefile.create_dataset(group, ifgram, shape=(length,width), dtype=np.float32))
+        for key, value in readfile.read_h5_attribute(h5, 'interferograms', ifgram, raw=True).iteritems():
+            group.attrs[key] = value
+    if 'mask' in h5.keys():
+        h5.copy('mask', h5out)
+    h5.close()
+
+    # Correct tile by tile
+    parallel = max(int(parallel), 1)
+    num_layer = 2*len(ifgramList) + 2*C.shape[0]
+    box_list = ut.split_row_boxes(length, width, num_layer, float(max_memory)/parallel, min_box_num=parallel)
+    if parallel > 1:
+        print 'parallel processing using %d cores ...' % (parallel)
+    with Parallel(n_jobs=parallel) as pool:
+        for i in range(0, len(box_list), parallel):
+            boxes = box_list[i:i+parallel]
+            dataList = pool(delayed(unwrap_error_closure_box)(File, ifgramList, box, C,\
+                                                              mask[box[1]:box[3],box[0]:box[2]], thr)\
+                            for box in boxes)
+            for box, data in zip(boxes, dataList):
+                boxShape = (box[3]-box[1], box[2]-box[0])
+                for j in range(len(ifgramList)):
+                    dsetList[j][box[1]:box[3],box[0]:box[2]] = data[j].reshape(boxShape)
+            del dataList
+            ut.print_progress(i+len(boxes), len(box_list), prefix='correcting:',\
+                              suffix='rows %d-%d'%(boxes[0][1],boxes[-1][3]), elapsed_time=time.time()-total)
+    h5out.close()
+    print 'Unwrapping error correction took '+str(time.time()-total)+' secs'
+    return outFile
+
+
 ####################################################################################################
 def usage():
     print '''
@@ -67,11 +191,13 @@ def usage():
       -f : unwrapped interferograms, i.e. Seeded_LoadedData.h5
       -m : mask file to specify those pixels which user wants to correct for unwrapping errors.
       -o : output file name [default is interferogram_file_unwCor.h5]
+      --parallel : correct tiles in parallel using all cores
 
   Examples:
       unwrap_error.py Seeded_unwrapIfgram.h5 mask.h5
       unwrap_error.py -f Seeded_unwrapIfgram.h5 -m mask.h5
       unwrap_error.py Seeded_unwrapIfgram.h5
+      unwrap_error.py -f Seeded_unwrapIfgram.h5 -m mask.h5 --parallel
 
 
   -------------------------------------------------------------------
@@ -131,10 +257,11 @@ def main(argv):
     ramp_type = 'plane'
     save_rampCor = 'yes'
     plot_bonding_points = 'yes'
+    num_cores = 1
   
     ##### Check Inputs
     if len(sys.argv)>2:
-        try: opts, args = getopt.getopt(argv,'h:f:m:x:y:o:t:',['ramp=','no-ramp-save'])
+        try: opts, args = getopt.getopt(argv,'h:f:m:x:y:o:t:',['ramp=','no-ramp-save','parallel'])
         except getopt.GetoptError:  print 'Error while getting args';  usage(); sys.exit(1)
   
         for opt,arg in opts:
@@ -147,6 +274,7 @@ def main(argv):
             elif opt in '-t':    templateFile = arg
             elif opt in '--ramp'         :  ramp_type    = arg.lower()
             elif opt in '--no-ramp-save' :  save_rampCor = 'no'
+            elif opt in '--parallel'     :  num_cores    = multiprocessing.cpu_count()
   
     elif len(sys.argv)==2:
         if argv[0] in ['-h','--help']:    usage();  sys.exit()
@@ -191,136 +319,7 @@ def main(argv):
     ####################  Triangular Consistency (Phase Closure)  ####################
     if method == 'triangular_consistency':
         print 'Phase unwrapping error correction using Triangular Consistency / Phase Closure'
-  
-        h5file=h5py.File(File)
-        ifgramList = h5file['interferograms'].keys()
-        sx = int(h5file['interferograms'][ifgramList[0]].attrs['WIDTH'])
-        sy = int(h5file['interferograms'][ifgramList[0]].attrs['FILE_LENGTH'])
-        curls,Triangles,C=ut.get_triangles(h5file)
-        A,B = ut.design_matrix(h5file)   
-        ligram,lv=np.shape(B)
-        lcurls=np.shape(curls)[0]
-        print 'Number of all triangles: '+  str(lcurls)
-        print 'Number of interferograms: '+ str(ligram)
-        #print curls
-  
-        curlfile='curls.h5'
-        if not os.path.isfile(curlfile):
-            ut.generate_curls(curlfile,h5file,Triangles,curls)
-         
-        thr=0.50
-        curls=np.array(curls);   n1=curls[:,0];   n2=curls[:,1];   n3=curls[:,2]
-  
-        numPixels=sy*sx
-        print 'reading interferograms...'   
-        data = np.zeros((ligram,numPixels),np.float32)
-        for ni in range(ligram):
-            dset=h5file['interferograms'][ifgramList[ni]].get(ifgramList[ni])
-            d = dset[0:dset.shape[0],0:dset.shape[1]]
-            data[ni] = d.flatten(1)   
-  
-        print np.shape(data)
-        print 'reading curls ...' 
-        h5curl=h5py.File(curlfile)
-        curlList=h5curl['interferograms'].keys()
-        curlData = np.zeros((lcurls,numPixels),np.float32)
-        for ni in range(lcurls):
-            dset=h5curl['interferograms'][curlList[ni]].get(curlList[ni])
-            d = dset[0:dset.shape[0],0:dset.shape[1]]
-            curlData[ni] = d.flatten(1)
-        pi=np.pi
-        EstUnwrap=np.zeros((ligram,numPixels),np.float32)
-  
-        #try:
-        #    maskFile=argv[1]
-        #    h5Mask=h5py.File(maskFile)
-        #    dset = h5Mask['mask'].get('mask')
-        #    Mask=dset[0:dset.shape[0],0:dset.shape[1]]
-        #except:
-        #    dset = h5file['mask'].get('mask')
-        #    Mask=dset[0:dset.shape[0],0:dset.shape[1]]
-        
-        Mask=Mask.flatten(1)
-
-        for ni in range(numPixels):
-            #dU = np.zeros([ligram,1])
-            #print np.shape(dU)
-            #print np.shape(data[:,ni])
-  
-            if Mask[ni]==1:
-                dU = data[:,ni]
-                #nan_ndx = dataPoint == 0.
-                unwCurl = np.array(curlData[:,ni])
-                #print unwCurl
-  
-                ind  = np.abs(unwCurl)>=thr;      N1 =n1[ind];      N2 =n2[ind];      N3 =n3[ind]
-                indC = np.abs(unwCurl)< thr;      Nc1=n1[indC];     Nc2=n2[indC];     Nc3=n3[indC]
-  
-                N =np.hstack([N1, N2, N3]);       UniN =np.unique(N)
-                Nc=np.hstack([Nc1,Nc2,Nc3]);      UniNc=np.unique(Nc)
-  
-                inter=list(set(UniNc) & set(UniN)) # intersetion
-                UniNc= list(UniNc)
-                for x in inter:
-                    UniNc.remove(x)
-  
-                D=np.zeros([len(UniNc),ligram])
-                for i in range(len(UniNc)):
-                    D[i,UniNc[i]]=1
-  
-                AAA=np.vstack([-2*pi*C,D])
-                #AAA1=np.hstack([AAA,np.zeros([AAA.shape[0],lv])])
-                #AAA2=np.hstack([-2*pi*np.eye(ligram),B]) 
-                #AAAA=np.vstack([AAA1,AAA2])
-                AAAA=np.vstack([AAA,0.25*np.eye(ligram)])
-  
-                #print '************************'
-                #print np.linalg.matrix_rank(C)
-                #print np.linalg.matrix_rank(AAA) 
-                #print np.linalg.matrix_rank(AAAA)
-                #print '************************'
-  
-                #LLL=list(np.dot(C,dU)) + list(np.zeros(np.shape(UniNc)[0]))# + list(dU)
-                #ind=np.isnan(AAA)
-                #M1=pinv(AAA)      
-                #M=np.dot(M1,LLL)
-                #EstUnwrap[:,ni]=np.round(M[0:ligram])*2.0*np.pi
-  
-                ##########
-                # with Tikhonov regularization:
-                AAAA=np.vstack([AAA,0.25*np.eye(ligram)])
-                LLL=list(np.dot(C,dU)) + list(np.zeros(np.shape(UniNc)[0])) + list(np.zeros(ligram))
-                ind=np.isnan(AAAA)
-                M1=pinv(AAAA)
-                M=np.dot(M1,LLL)
-                EstUnwrap[:,ni]=np.round(M[0:ligram])*2.0*np.pi
-                #print M[0:ligram]
-                #print np.round(M[0:ligram])
-  
-            else:
-                EstUnwrap[:,ni]=np.zeros([ligram])
-                if not np.remainder(ni,10000): print 'Processing point: %7d of %7d ' % (ni,numPixels)
-
-        ##### Output
-        dataCor = data+EstUnwrap
-        unwCorFile=File.replace('.h5','')+'_unwCor.h5';  print 'writing >>> '+unwCorFile
-        h5unwCor=h5py.File(unwCorFile,'w') 
-        gg = h5unwCor.create_group('interferograms') 
-        for i in range(ligram):
-            group = gg.create_group(ifgramList[i])
-            dset = group.create_dataset(ifgramList[i], data=np.reshape(dataCor[i,:],[sx,sy]).T, compression='gzip')
-            for key, value in h5file['interferograms'][ifgramList[i]].attrs.iteritems():
-                group.attrs[key] = value
-  
-        try:
-            MASK=h5file['mask'].get('mask')
-            gm = h5unwCor.create_group('mask')
-            dset = gm.create_dataset('mask', data=MASK, compression='gzip')
-        except: pass
-  
-        h5unwCor.close()
-        h5file.close()
-        h5curl.close() 
+        unwrap_error_closure(File, Mask, outName, parallel=num_cores)
 
 
     ####################  Bonding Points (Spatial Continuity)  ####################
@@ -380,6 +379,7 @@ def main(argv):
             k=h5file.keys()
             if 'interferograms' in k: k[0] = 'interferograms';  print 'Input file is '+k[0]
             else: print 'Input file - '+File+' - is not interferograms.';  usage();  sys.exit(1)
+            readfile.check_stack_layout(h5file, k[0])
             igramList = sorted(h5file[k[0]].keys())
   
             #### Write
@@ -394,30 +394,31 @@ def main(argv):
   
             ##### Loop
             print 'Number of interferograms: '+str(len(igramList))
+            ramp_factor = rm.surface_factor(ramp_mask, ramp_type)
             for igram in igramList:
                 print igram
                 data = h5file[k[0]][igram].get(igram)[:]
   
-                data_ramp,ramp = rm.remove_data_surface(data,ramp_mask,ramp_type)
+                data_ramp,ramp = rm.remove_data_surface(data,ramp_mask,ramp_type,ramp_factor)
                 #ramp = data_ramp - data
                 data_rampCor = phase_bonding(data_ramp,Mask,x,y)
                 dataCor = data_rampCor - ramp
   
                 group = gg.create_group(igram)
-                dset = group.create_dataset(igram, data=dataCor, compression='gzip')
+                writefile.create_dataset(group, igram, data=dataCor)
                 for key, value in h5file[k[0]][igram].attrs.iteritems():
                     group.attrs[key]=value
   
                 if save_rampCor == 'yes':
                     group_ramp = gg_ramp.create_group(igram)
-                    dset = group_ramp.create_dataset(igram, data=data_rampCor, compression='gzip')
+                    writefile.create_dataset(group_ramp, igram, data=data_rampCor)
                     for key, value in h5file[k[0]][igram].attrs.iteritems():
                         group_ramp.attrs[key]=value
   
             try:
                 mask = h5file['mask'].get('mask');
                 gm = h5out.create_group('mask')
-                dset = gm.create_dataset('mask', data=mask[0:mask.shape[0],0:mask.shape[1]], compression='gzip')
+                writefile.create_dataset(gm, 'mask', data=mask[0:mask.shape[0],0:mask.shape[1]])
             except: print 'no mask group found.'
   
             h5file.close()
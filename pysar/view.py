@@ -37,17 +37,22 @@
 #                   update_plot_inps_with_meta_dict() and update_matrix_with_plot_inps()
 #                   introduce plot_matrxi() for easy external call
 #                   add scalebar
+# Yunjun, Feb 2017: read from overviews by add_overviews.py for multilooked multiple display
+#                   add --parallel option for batch rendering of multiple figures
 
 
 import os
 import sys
 import argparse
+import multiprocessing
+import tempfile
+import shutil
 from datetime import datetime as dt
 
-import h5py
 import numpy as np
 import numpy.matlib as matlib
 import scipy.ndimage as ndimage
+from joblib import Parallel, delayed
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap, LightSource
 from matplotlib.offsetbox import AnchoredText
@@ -532,13 +537,14 @@ def update_plot_inps_with_meta_dict(inps, meta_dict):
 
 
 ##################################################################################################
-def update_matrix_with_plot_inps(data, meta_dict, inps):
+def update_matrix_with_plot_inps(data, meta_dict, inps, data_looks=1):
+    # data_looks: number of looks of input data, i.e. data read from overview
     
     # Seed Point
     # If value of new seed point is not nan, re-seed the data and update inps.seed_yx/lalo
     # Otherwise, try to read seed info from atrributes into inps.seed_yx/lalo
     if inps.seed_yx and not inps.seed_yx == [int(meta_dict['ref_y']), int(meta_dict['ref_x'])]:
-        inps.seed_value = data[inps.seed_yx[0]-inps.pix_box[1], inps.seed_yx[1]-inps.pix_box[0]]
+        inps.seed_value = data[(inps.seed_yx[0]-inps.pix_box[1])/data_looks, (inps.seed_yx[1]-inps.pix_box[0])/data_looks]
         if not np.isnan(inps.seed_value):
             data -= inps.seed_value
             print 'set reference point to: '+str(inps.seed_yx)
@@ -557,8 +563,8 @@ def update_matrix_with_plot_inps(data, meta_dict, inps):
         except: inps.seed_lalo = None
 
     # Multilook
-    if inps.multilook:
-        data = multilook_matrix(data, inps.multilook_num, inps.multilook_num)
+    if inps.multilook and inps.multilook_num/data_looks > 1:
+        data = multilook_matrix(data, inps.multilook_num/data_looks, inps.multilook_num/data_looks)
 
     # Convert data to display unit
     if not inps.disp_unit:
@@ -844,6 +850,7 @@ EXAMPLE='''example:
   view.py velocity.h5 --save
   view.py velocity.h5 -o velocity.pdf
   view.py velocity.h5 --nodisplay
+  view.py unwrapIfgram.h5 --nodisplay --parallel
 '''
 
 PLOT_TEMPLATE='''Plot Setting:
@@ -880,6 +887,10 @@ def cmdLineParse(argv):
                                 help='save the figure')
     outfile_parser.add_argument('--nodisplay', dest='disp_fig', action='store_false',\
                                 help='save and do not display the figure')
+    outfile_parser.add_argument('--parallel', action='store_true',\
+                                help='render and save figures in parallel using all cores, with --nodisplay.\n'
+                                     'Data of all figures are read in a pre-pass, and their range is used as\n'
+                                     'the shared color limits if -m/-M are not set.')
     outfile_parser.add_argument('-o','--outfile',\
                                 help="save the figure with assigned filename.\n"
                                      "By default, it's calculated based on the input file name.")
@@ -999,6 +1010,143 @@ def cmdLineParse(argv):
     return inps
 
 
+##################################################################################################
+def read_subplot_data(File, epoch, atr, inps, data_looks=1, ref_data=None, msk=None):
+    '''Read data of epoch and update it with plot inps for subplot display
+    Inputs:
+        data_looks - int, number of looks of overview to read data from, 1 for full resolution
+        ref_data   - 2D np.array, data of reference date to subtract, for timeseries
+        msk        - 2D np.array, mask in the same resolution of data read
+    '''
+    if data_looks > 1:
+        data = readfile.read_overview(File, data_looks, inps.pix_box, epoch)
+    else:
+        data = readfile.get_reader(File).read(epoch, inps.pix_box)
+    if atr['FILE_TYPE'] in multi_dataset_hdf5_file and ref_data is not None:
+        data -= ref_data
+    # mask
+    if msk is not None:
+        data = mask.mask_matrix(data, msk)
+    # Update data with plot inps
+    data, inps = update_matrix_with_plot_inps(data, atr, inps, data_looks)
+    return data, inps
+
+
+def get_subplot_title(File, epoch, inps):
+    '''Subplot title of epoch: date for timeseries, order number (and date12) for interferograms'''
+    reader = readfile.get_reader(File)
+    if reader.k in multi_dataset_hdf5_file:
+        return dt.strptime(epoch, '%Y%m%d').isoformat()[0:10]
+    elif reader.k in multi_group_hdf5_file:
+        if inps.fig_row_num*inps.fig_col_num > 100:
+            return str(reader.epochList.index(epoch)+1)
+        else:
+            return str(reader.epochList.index(epoch)+1)+'\n'+reader.attribute(epoch)['DATE12']
+    return epoch
+
+
+def plot_subplot(ax, data, subplot_title, inps, dem_hillshade=None, dem_contour=None, contour_sequence=None):
+    '''Plot data in one subplot of multiple display'''
+    # Plot DEM
+    if inps.dem_file and inps.disp_dem_shade:
+        ax.imshow(dem_hillshade, cmap='gray', interpolation='nearest')
+    if inps.dem_file and inps.disp_dem_contour:
+        ax.contour(dem_contour, contour_sequence, origin='lower',colors='black',alpha=0.5)
+
+    # Plot Data
+    try:     im = ax.imshow(data, cmap=inps.colormap, vmin=inps.disp_min, vmax=inps.disp_max,\
+                            alpha=inps.transparency, interpolation='nearest')
+    except:  im = ax.imshow(data, cmap=inps.colormap, interpolation='nearest')
+
+    ###### Subplot Setting
+    # Tick and Label
+    ax.set_yticklabels([])
+    ax.set_xticklabels([])
+    ax.set_xticks([])
+    ax.set_yticks([])
+    # Title
+    if inps.disp_title:
+        if not inps.fig_title_in:
+            ax.set_title(subplot_title, fontsize=inps.font_size)
+        else:
+            add_inner_title(ax, subplot_title, loc=1)   
+    # Flip Left-Right / Up-Down
+    if inps.flip_lr:        ax.invert_xaxis()
+    if inps.flip_ud:        ax.invert_yaxis()
+    # Turn off axis
+    if not inps.disp_axis:  ax.axis('off')
+    return im
+
+
+def add_figure_colorbar(fig, im, inps, fig_data_min, fig_data_max):
+    '''Add colorbar shared by all subplots of figure, if display range is set'''
+    if not inps.disp_min and not inps.disp_max:
+        print 'Note: different color scale for EACH subplot!'
+        return fig
+    if   inps.disp_min <= fig_data_min and inps.disp_max >= fig_data_max: cb_extend='neither'
+    elif inps.disp_min >  fig_data_min and inps.disp_max >= fig_data_max: cb_extend='min'
+    elif inps.disp_min <= fig_data_min and inps.disp_max <  fig_data_max: cb_extend='max'
+    else:  cb_extend='both'
+    print 'show colorbar'
+    #fig.subplots_adjust(wspace=inps.fig_wid_space, hspace=inps.fig_hei_space, right=0.965)
+    fig.subplots_adjust(right=0.95)
+    cax = fig.add_axes([0.955, 0.25, 0.015, 0.5])
+    cbar = fig.colorbar(im, cax=cax, extend=cb_extend)
+    cbar.set_label(inps.disp_unit)
+    return fig
+
+
+def save_figure_data(File, epochList, atr, inps, dataFile, data_looks=1, ref_data=None, msk=None):
+    '''Read data of subplots of one figure into dataFile (.npy), run in worker process for the pre-pass of
+    batch rendering, so that the data range of all figures is known before rendering without reading data twice.
+    Output:
+        fig_data_min/max - float, min/max of data of all subplots
+        inps             - Namespace, updated with data
+    '''
+    dataList = []
+    for epoch in epochList:
+        data, inps = read_subplot_data(File, epoch, atr, inps, data_looks, ref_data, msk)
+        dataList.append(data)
+    readfile.get_reader(File).close()
+    data = np.array(dataList)
+    del dataList
+    np.save(dataFile, data)
+    return np.nanmin(data), np.nanmax(data), inps
+
+
+def plot_figure(fig_num, File, epochList, atr, inps, outfile, data_looks=1, ref_data=None, msk=None,\
+                dem_hillshade=None, dem_contour=None, contour_sequence=None, dataFile=None):
+    '''Read and plot subplots of one figure and save it with Agg backend, run in worker process for batch rendering
+    Data is read from dataFile saved by save_figure_data() if given.
+    Output:
+        fig_data_min/max - float, min/max of data of all subplots
+    '''
+    plt.switch_backend('Agg')
+    fig = plt.figure(fig_num, figsize=inps.fig_size)
+    if dataFile:
+        dataStack = np.load(dataFile, mmap_mode='r')
+    minList = []
+    maxList = []
+    for i in range(len(epochList)):
+        if dataFile:
+            data = np.array(dataStack[i])
+        else:
+            data, inps = read_subplot_data(File, epochList[i], atr, inps, data_looks, ref_data, msk)
+        subplot_title = get_subplot_title(File, epochList[i], inps)
+        minList.append(np.nanmin(data))
+        maxList.append(np.nanmax(data))
+        ax = fig.add_subplot(inps.fig_row_num, inps.fig_col_num, i+1)
+        im = plot_subplot(ax, data, subplot_title, inps, dem_hillshade, dem_contour, contour_sequence)
+    readfile.get_reader(File).close()
+    fig.tight_layout()
+    fig_data_min = np.nanmin(minList)
+    fig_data_max = np.nanmax(maxList)
+    add_figure_colorbar(fig, im, inps, fig_data_min, fig_data_max)
+    fig.savefig(outfile, bbox_inches='tight', transparent=True, dpi=inps.fig_dpi)
+    plt.close(fig)
+    return fig_data_min, fig_data_max
+
+
 #########################################  Main Function  ########################################
 def main(argv):
     inps = cmdLineParse(argv)
@@ -1020,9 +1168,7 @@ def main(argv):
     # Read "epoch list to display' and 'reference date' for multi-dataset files
     if k in multi_group_hdf5_file+multi_dataset_hdf5_file:
         # Read Epoch List
-        h5file = h5py.File(inps.file,'r')
-        epochList = sorted(h5file[k].keys())
-        h5file.close()
+        epochList = readfile.get_reader(inps.file).epochList
 
         # Epochs to display
         inps.epoch = get_epoch_full_list_from_input(epochList, inps.epoch, inps.epoch_num)[0]
@@ -1173,6 +1319,9 @@ def main(argv):
                 ref_data = readfile.read(inps.file, inps.pix_box, inps.ref_date)[0]
 
         # Read DEM
+        dem_hillshade = None
+        dem_contour = None
+        contour_sequence = None
         if inps.dem_file:
             print 'reading DEM: '+os.path.basename(inps.dem_file)+' ...'
             dem, dem_meta_dict = readfile.read(inps.dem_file, inps.pix_box)
@@ -1195,118 +1344,119 @@ def main(argv):
         all_data_min=0
         all_data_max=0
 
+        # Read from overviews (built by add_overviews.py) with looks dividing multilook_num and aligned
+        # with subset, and multilook the rest, instead of reading the full resolution data
+        ovr_looks = 1
+        if inps.multilook and inps.multilook_num > 1:
+            ovr_looks = readfile.get_overview_looks(inps.file, inps.multilook_num, inps.pix_box, divide=True)
+        if ovr_looks > 1:
+            print 'read data from overviews with '+str(ovr_looks)+' looks'
+            if inps.mask:
+                msk = multilook_matrix(msk, ovr_looks, ovr_looks, method='nansum')
+            if k == 'timeseries' and inps.ref_date:
+                ref_data = readfile.read_overview(inps.file, ovr_looks, inps.pix_box, inps.ref_date)
+
+        # Reference data and mask for subplots
+        if not (k == 'timeseries' and inps.ref_date):
+            ref_data = None
+        if not inps.mask:
+            msk = None
+
+        ##### Batch rendering - if display range is not set, read data of each figure into temporary file in a
+        # pre-pass with a pool of processes, and use the data range of all figures as the shared color limits;
+        # then render and save figures in parallel, with data read once for each epoch
+        if inps.parallel and inps.save_fig and not inps.disp_fig and inps.fig_num > 1:
+            num_cores = min(multiprocessing.cpu_count(), inps.fig_num)
+            subplot_num = inps.fig_row_num*inps.fig_col_num
+            epochLists = [inps.epoch[(j-1)*subplot_num:j*subplot_num] for j in range(1, inps.fig_num+1)]
+            outfileList = [inps.outfile_base+'_'+str(j)+inps.fig_ext for j in range(1, inps.fig_num+1)]
+            print 'render '+str(inps.fig_num)+' figures in parallel using '+str(num_cores)+' cores ...'
+            readfile.get_reader(inps.file).close()
+            dataFileList = [None] * inps.fig_num
+            tmpDir = None
+            try:
+                with Parallel(n_jobs=num_cores) as pool:
+                    # Pre-pass: read data of each figure, shared color limits from min/max of each figure
+                    if not inps.disp_min and not inps.disp_max:
+                        tmpDir = tempfile.mkdtemp(prefix='view_', dir=os.path.dirname(os.path.abspath(outfileList[0])))
+                        dataFileList = [os.path.join(tmpDir, 'fig_'+str(j)+'.npy') for j in range(1, inps.fig_num+1)]
+                        outList = pool([delayed(save_figure_data)(inps.file, epochLists[j], atr, inps, dataFileList[j],\
+                                                                  ovr_looks, ref_data, msk) for j in range(inps.fig_num)])
+                        inps = outList[0][2]
+                        inps.disp_min = np.nanmin([i[0] for i in outList])
+                        inps.disp_max = np.nanmax([i[1] for i in outList])
+                        del outList
+
+                    # Render figures, each worker reads its own epochs, or data of pre-pass
+                    rangeList = pool([delayed(plot_figure)(j, inps.file, epochLists[j-1], atr, inps, outfileList[j-1],\
+                                                           ovr_looks, ref_data, msk, dem_hillshade, dem_contour,\
+                                                           contour_sequence, dataFileList[j-1])\
+                                      for j in range(1, inps.fig_num+1)])
+                    all_data_min = np.nanmin([i[0] for i in rangeList])
+                    all_data_max = np.nanmax([i[1] for i in rangeList])
+            finally:
+                if tmpDir:
+                    shutil.rmtree(tmpDir)
+            for outfile in outfileList:
+                print 'saved figure to '+outfile
+
         ##### Loop 1 - Figures
-        for j in range(1, inps.fig_num+1):
-            # Output file name for current figure
-            if inps.fig_num > 1:
-                inps.outfile = inps.outfile_base+'_'+str(j)+inps.fig_ext
-            else:
-                inps.outfile = inps.outfile_base+inps.fig_ext
-            fig_title = 'Figure '+str(j)+' - '+inps.outfile_base
-            print '----------------------------------------'
-            print fig_title
-            # Open a new figure object
-            fig = plt.figure(j, figsize=inps.fig_size)
-            fig.canvas.set_window_title(fig_title)
-
-            fig_data_min=0
-            fig_data_max=0
-            i_start = (j-1)*inps.fig_row_num*inps.fig_col_num
-            i_end   = min([epochNum, i_start+inps.fig_row_num*inps.fig_col_num])
-            ##### Loop 2 - Subplots
-            for i in range(i_start, i_end):
-                epoch = inps.epoch[i]
-                ax = fig.add_subplot(inps.fig_row_num, inps.fig_col_num, i-i_start+1)
-                ut.print_progress(i-i_start+1, i_end-i_start, prefix='loading', suffix=epoch)
-
-                # Read Data
-                h5file = h5py.File(inps.file, 'r')
-                if k in multi_dataset_hdf5_file:
-                    dset = h5file[k].get(epoch)
-                    data = dset[inps.pix_box[1]:inps.pix_box[3], inps.pix_box[0]:inps.pix_box[2]]
-                    if inps.ref_date:
-                        data -= ref_data
-                    subplot_title = dt.strptime(epoch, '%Y%m%d').isoformat()[0:10]
-                elif k in multi_group_hdf5_file:
-                    if   inps.fig_row_num*inps.fig_col_num > 100:
-                        subplot_title = str(epochList.index(epoch)+1)
-                    else:
-                        subplot_title = str(epochList.index(epoch)+1)+'\n'+h5file[k][epoch].attrs['DATE12']
-                    dset = h5file[k][epoch].get(epoch)
-                    data = dset[inps.pix_box[1]:inps.pix_box[3], inps.pix_box[0]:inps.pix_box[2]]
-                # mask
-                if inps.mask:
-                    data = mask.mask_matrix(data, msk)
-
-                # Update data with plot inps
-                data, inps = update_matrix_with_plot_inps(data, atr, inps)
-
-                # Data Min/Max
-                fig_data_min = np.nanmin([fig_data_min, np.nanmin(data)])
-                fig_data_max = np.nanmax([fig_data_min, np.nanmax(data)])
-
-                # Plot DEM
-                if inps.dem_file and inps.disp_dem_shade:
-                    ax.imshow(dem_hillshade, cmap='gray', interpolation='nearest')
-                if inps.dem_file and inps.disp_dem_contour:
-                    ax.contour(dem_contour, contour_sequence, origin='lower',colors='black',alpha=0.5)
-
-                # Plot Data
-                try:     im = ax.imshow(data, cmap=inps.colormap, vmin=inps.disp_min, vmax=inps.disp_max,\
-                                        alpha=inps.transparency, interpolation='nearest')
-                except:  im = ax.imshow(data, cmap=inps.colormap, interpolation='nearest')
-
-                ###### Subplot Setting
-                # Tick and Label
-                ax.set_yticklabels([])
-                ax.set_xticklabels([])
-                ax.set_xticks([])
-                ax.set_yticks([])
-                # Title
-                if inps.disp_title:
-                    if not inps.fig_title_in:
-                        ax.set_title(subplot_title, fontsize=inps.font_size)
-                    else:
-                        add_inner_title(ax, subplot_title, loc=1)   
-                # Flip Left-Right / Up-Down
-                if inps.flip_lr:        ax.invert_xaxis()
-                if inps.flip_ud:        ax.invert_yaxis()
-                # Turn off axis
-                if not inps.disp_axis:  ax.axis('off')
-
-            ##### Figure Setting - End of Loop 2
-            fig.tight_layout()
-            # Min and Max for this figure
-            all_data_min = np.nanmin([all_data_min, fig_data_min])
-            all_data_max = np.nanmax([all_data_max, fig_data_max])
-            print 'data    range: '+str(fig_data_min)+' - '+str(fig_data_max)
-            try:  print 'display range: '+str(disp_min)+' - '+str(disp_max)
-            except: pass
-
-            # Colorbar
-            if not inps.disp_min and not inps.disp_max:
-                print 'Note: different color scale for EACH subplot!'
-            else:
-                if   inps.disp_min <= fig_data_min and inps.disp_max >= fig_data_max: cb_extend='neither'
-                elif inps.disp_min >  fig_data_min and inps.disp_max >= fig_data_max: cb_extend='min'
-                elif inps.disp_min <= fig_data_min and inps.disp_max <  fig_data_max: cb_extend='max'
-                else:  cb_extend='both'
-                print 'show colorbar'
-                #fig.subplots_adjust(wspace=inps.fig_wid_space, hspace=inps.fig_hei_space, right=0.965)
-                fig.subplots_adjust(right=0.95)
-                cax = fig.add_axes([0.955, 0.25, 0.015, 0.5])
-                cbar = fig.colorbar(im, cax=cax, extend=cb_extend)
-                cbar.set_label(inps.disp_unit)
-
-            # Save Figure
-            if inps.save_fig:
-                fig.savefig(inps.outfile, bbox_inches='tight', transparent=True, dpi=inps.fig_dpi)
-                print 'saved figure to '+inps.outfile
-                if not inps.disp_fig:
-                    fig.clf()
-
-        ##### End of Loop 1
-        h5file.close()
+        else:
+            # open file once for all subplots
+            h5reader = readfile.get_reader(inps.file).open()
+            for j in range(1, inps.fig_num+1):
+                # Output file name for current figure
+                if inps.fig_num > 1:
+                    inps.outfile = inps.outfile_base+'_'+str(j)+inps.fig_ext
+                else:
+                    inps.outfile = inps.outfile_base+inps.fig_ext
+                fig_title = 'Figure '+str(j)+' - '+inps.outfile_base
+                print '----------------------------------------'
+                print fig_title
+                # Open a new figure object
+                fig = plt.figure(j, figsize=inps.fig_size)
+                fig.canvas.set_window_title(fig_title)
+
+                fig_data_min=0
+                fig_data_max=0
+                i_start = (j-1)*inps.fig_row_num*inps.fig_col_num
+                i_end   = min([epochNum, i_start+inps.fig_row_num*inps.fig_col_num])
+                ##### Loop 2 - Subplots
+                for i in range(i_start, i_end):
+                    epoch = inps.epoch[i]
+                    ax = fig.add_subplot(inps.fig_row_num, inps.fig_col_num, i-i_start+1)
+                    ut.print_progress(i-i_start+1, i_end-i_start, prefix='loading', suffix=epoch)
+
+                    # Read Data
+                    data, inps = read_subplot_data(inps.file, epoch, atr, inps, ovr_looks, ref_data, msk)
+                    subplot_title = get_subplot_title(inps.file, epoch, inps)
+
+                    # Data Min/Max
+                    fig_data_min = np.nanmin([fig_data_min, np.nanmin(data)])
+                    fig_data_max = np.nanmax([fig_data_max, np.nanmax(data)])
+
+                    # Plot Data
+                    im = plot_subplot(ax, data, subplot_title, inps, dem_hillshade, dem_contour, contour_sequence)
+
+                ##### Figure Setting - End of Loop 2
+                fig.tight_layout()
+                # Min and Max for this figure
+                all_data_min = np.nanmin([all_data_min, fig_data_min])
+                all_data_max = np.nanmax([all_data_max, fig_data_max])
+                print 'data    range: '+str(fig_data_min)+' - '+str(fig_data_max)
+
+                # Colorbar
+                add_figure_colorbar(fig, im, inps, fig_data_min, fig_data_max)
+
+                # Save Figure
+                if inps.save_fig:
+                    fig.savefig(inps.outfile, bbox_inches='tight', transparent=True, dpi=inps.fig_dpi)
+                    print 'saved figure to '+inps.outfile
+                    if not inps.disp_fig:
+                        fig.clf()
+
+            ##### End of Loop 1
+            h5reader.close()
         print '----------------------------------------'
         print 'all data range: '+str(all_data_min)+' - '+str(all_data_max)
         if inps.disp_min and inps.disp_max:
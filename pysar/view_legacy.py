@@ -709,6 +709,7 @@ def main(argv):
     ##### Input File and Date List  -  One / Multiple Display
     if k in ['interferograms','coherence','wrapped','timeseries']:
         h5file = h5py.File(File,'r')
+        readfile.check_stack_layout(h5file, k)
         epochList = h5file[k].keys()
         epochList = sorted(epochList)
   